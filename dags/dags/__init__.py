@@ -1,29 +1,86 @@
+import gzip
 import os
 from typing import Union, Any
 
 import pendulum
 from dagster import (
-    AssetSelection,
     Definitions,
     define_asset_job,
     load_assets_from_modules,
     OutputContext,
     InputContext,
     build_schedule_from_partitioned_job,
+    UPathIOManager,
 )
-from dagster._utils.backoff import backoff
-from dagster_gcp import GCSResource, ConfigurablePickledObjectGCSIOManager  # type: ignore[import]
-from dagster_gcp.gcs import PickledObjectGCSIOManager  # type: ignore[import]
-from google.api_core.exceptions import Forbidden, ServiceUnavailable, TooManyRequests
+from dagster_duckdb import DuckDBResource
 from pydantic import BaseModel
 from upath import UPath
 
-from . import assets
-from .assets import feed_type_hour_partition_def
-from .common import SERIALIZERS
+from . import (
+    assets,
+    bundles,
+    compaction,
+    headways,
+    hourly,
+    incremental,
+    local_warehouse,
+    manifests,
+)
+from .assets import (
+    feed_type_hour_partition_def,
+    load_parse_outcomes,
+    save_parse_outcomes,
+)
+from .common import parse_outcomes_path
+from .resources.profiling import ProfilingResource
+from .storage import ObjectNotFound, get_storage
+from .tracing import configure_tracing
+
+
+class StorageIOManager(UPathIOManager):
+    """
+    Stores outputs as objects in a bucket of the configured storage backend; subclasses
+    decide how outputs are serialized.
+    """
+
+    def __init__(self, bucket: str, prefix: str = ""):
+        self.bucket = bucket
+        self.storage = get_storage()
+        super().__init__(base_path=UPath(prefix))
+
+    def path_exists(self, path: UPath) -> bool:
+        return self.storage.exists(self.bucket, str(path))
+
+    def unlink(self, path: UPath) -> None:
+        try:
+            self.storage.delete(self.bucket, str(path))
+        except ObjectNotFound:
+            pass
 
+    def make_directory(self, path: UPath) -> None:
+        # object storage has no directories
+        return None
 
-class HivePartitionedPydanticGCSIOManager(PickledObjectGCSIOManager):
+    def get_op_output_relative_path(
+        self, context: Union[InputContext, OutputContext]
+    ) -> UPath:
+        parts = context.get_identifier()
+        run_id = parts[0]
+        output_parts = parts[1:]
+        return UPath("storage", run_id, "files", *output_parts)
+
+    def get_loading_input_log_message(self, path: UPath) -> str:
+        return f"Loading object from: {self.bucket}/{path}"
+
+    def get_writing_output_log_message(self, path: UPath) -> str:
+        return f"Writing object at: {self.bucket}/{path}"
+
+    def write(self, path: UPath, contents: Union[bytes, str], **kwargs) -> None:
+        # retries and throttling are handled by the storage layer
+        self.storage.write_bytes(self.bucket, str(path), contents, **kwargs)
+
+
+class HivePartitionedPydanticGCSIOManager(StorageIOManager):
     def get_path_for_partition(
         self, context: Union[InputContext, OutputContext], path: UPath, partition: str
     ) -> "UPath":
@@ -44,60 +101,110 @@ class HivePartitionedPydanticGCSIOManager(PickledObjectGCSIOManager):
         """
         feed_type, hour = partition.split("/")
         parsed_hour = pendulum.from_format(hour, "YYYY-MM-DD-HH:mm")
-        return path / "/".join(
-            [
-                f"feed_type={feed_type}",
-                f"dt={SERIALIZERS[pendulum.Date](parsed_hour.date())}",
-                f"{SERIALIZERS[pendulum.DateTime](parsed_hour)}.jsonl",
-            ]
-        )
+        return path / parse_outcomes_path(feed_type, parsed_hour)
 
     def load_from_path(self, context: InputContext, path: UPath) -> Any:
-        raise NotImplementedError(
-            "HivePartitionedGCSIOManager cannot be used to load data"
-        )
+        """
+        Returns a lazy iterator of ParseOutcome; set "fields" in the input's metadata,
+        e.g. AssetIn(metadata={"fields": ["success", "file.ts"]}), to load only those.
+        """
+        fields = (context.metadata or {}).get("fields")
+        return load_parse_outcomes(self.bucket, str(path), fields=fields)
 
     def dump_to_path(self, context: OutputContext, obj: Any, path: UPath) -> None:
         assert isinstance(obj, list)
+        assert not obj or isinstance(obj[0], BaseModel)
+
+        if not save_parse_outcomes(self.bucket, str(path), obj):
+            context.log.info(f"GCS key {path} is unchanged, not rewriting it")
+        elif not obj:
+            context.log.warning(f"Removed existing GCS key: {path}")
+
+
+class GzippedPydanticGCSIOManager(StorageIOManager):
+    """
+    Stores a single pydantic model as gzipped JSON, and loads it back as the type the
+    consuming asset annotates its input with.
+    """
+
+    extension = ".json.gz"
+
+    def load_from_path(self, context: InputContext, path: UPath) -> Any:
+        start = pendulum.now()
+        # ObjectNotFound is a FileNotFoundError, which UPathIOManager expects
+        contents = self.storage.read_bytes(self.bucket, str(path))
+        obj = context.dagster_type.typing_type.parse_raw(gzip.decompress(contents))
+        context.add_input_metadata(
+            {
+                "stored_bytes": len(contents),
+                "load_seconds": start.diff().total_seconds(),
+            }
+        )
+        return obj
 
-        if self.path_exists(path):
-            context.log.warning(f"Removing existing GCS key: {path}")
-            self.unlink(path)
+    def dump_to_path(self, context: OutputContext, obj: Any, path: UPath) -> None:
+        assert isinstance(obj, BaseModel)
 
-        if obj:
-            assert isinstance(obj[0], BaseModel)
+        contents = gzip.compress(obj.json().encode("utf-8"))
+        self.write(path, contents, content_type="application/gzip")
+        context.add_output_metadata({"stored_bytes": len(contents)})
 
-            jsonl_str = "\n".join(item.json() for item in obj)
 
-            backoff(
-                self.bucket_obj.blob(str(path)).upload_from_string,
-                args=[jsonl_str],
-                retry_on=(TooManyRequests, Forbidden, ServiceUnavailable),
-            )
+configure_tracing(get_storage)
 
+parse_job = define_asset_job(
+    "parse_job",
+    selection=[assets.raw_files_list, assets.parsed_and_grouped_files],
+    partitions_def=feed_type_hour_partition_def,
+)
 
 defs = Definitions(
-    assets=load_assets_from_modules([assets]),
+    assets=load_assets_from_modules(
+        [assets, bundles, compaction, headways, local_warehouse]
+    ),
+    jobs=[
+        parse_job,
+        hourly.parse_hour_job,
+        incremental.incremental_parse_job,
+        manifests.reconcile_manifests_job,
+        local_warehouse.duckdb_job,
+        compaction.compaction_job,
+        bundles.raw_bundle_job,
+        headways.stop_headways_job,
+    ],
     schedules=[
-        # see https://github.com/dagster-io/dagster/pull/13071
-        build_schedule_from_partitioned_job(
-            define_asset_job(
-                "parse_job",
-                selection=AssetSelection.all(),
-                partitions_def=feed_type_hour_partition_def,
-            ),
+        (
+            hourly.parse_hour_schedule
+            if hourly.PARSE_MODE in ("hourly", "incremental")
+            # see https://github.com/dagster-io/dagster/pull/13071
+            else build_schedule_from_partitioned_job(parse_job)
+        ),
+        *(
+            [incremental.incremental_parse_schedule]
+            if hourly.PARSE_MODE == "incremental"
+            else []
+        ),
+        manifests.reconcile_manifests_schedule,
+        *(
+            [local_warehouse.duckdb_schedule, headways.stop_headways_schedule]
+            if local_warehouse.DUCKDB_SCHEDULED
+            else []
         ),
+        compaction.compaction_schedule,
+        bundles.raw_bundle_schedule,
     ],
+    sensors=[compaction.recompaction_sensor],
     resources={
-        "gcs_io_manager": ConfigurablePickledObjectGCSIOManager(
-            gcs=GCSResource(project="transit-data-analytics-demo"),
-            gcs_bucket=os.environ["PARSED_BUCKET"].removeprefix("gs://"),
-            gcs_prefix="",
+        "compact_gcs_io_manager": GzippedPydanticGCSIOManager(
+            bucket=os.environ["PARSED_BUCKET"],
+            prefix="",
         ),
         "pydantic_gcs_io_manager": HivePartitionedPydanticGCSIOManager(
-            client=GCSResource(project="transit-data-analytics-demo").get_client(),
-            bucket=os.environ["PARSED_BUCKET"].removeprefix("gs://"),
+            bucket=os.environ["PARSED_BUCKET"],
             prefix="",  # no prefix; tables are the first partition right now
         ),
+        "duckdb": DuckDBResource(database=local_warehouse.DUCKDB_DATABASE),
+        # set memray: true in a run's config to profile its parse steps
+        "profiling": ProfilingResource.configure_at_launch(),
     },
 )
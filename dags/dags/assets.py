@@ -2,17 +2,29 @@ import csv
 import gzip
 import hashlib
 import io
+import itertools
 import json
-import os
+import time
 import zipfile
 from collections import defaultdict, namedtuple
 from io import BytesIO
-from typing import Optional, List, DefaultDict, Iterable, Union, Dict
+from typing import (
+    Any,
+    Optional,
+    List,
+    DefaultDict,
+    Iterable,
+    Iterator,
+    Union,
+    Dict,
+    Tuple,
+)
 
 import humanize
 import pendulum
 import requests
 from dagster import (
+    Config,
     asset,
     get_dagster_logger,
     AssetExecutionContext,
@@ -22,7 +34,6 @@ from dagster import (
     AssetIn,
     MetadataValue,
 )
-from google.cloud import storage  # type: ignore
 from google.protobuf.json_format import MessageToDict
 from google.protobuf.message import DecodeError
 from google.transit import gtfs_realtime_pb2  # type: ignore
@@ -32,7 +43,9 @@ from tqdm import tqdm
 
 from .common import (
     SERIALIZERS,
+    DayAgg,
     HourAgg,
+    MicroBatchAgg,
     RawFetchedFile,
     FeedType,
     FEED_TYPES,
@@ -41,12 +54,46 @@ from .common import (
     ListOfDicts,
     ParseOutcome,
     ParsedRecord,
+    ParsedFileFormat,
+    PARSED_OUTPUT_FORMATS,
+    PARSER_VERSIONS,
+    ParseMemo,
+    RawFileRef,
+    RawFilesList,
+    RawHourManifest,
+    RawManifestEntry,
+)
+from .metrics import (
+    PARSE_BLOBS_LISTED,
+    PARSE_DOWNLOADED_BYTES,
+    PARSE_DURATION_SECONDS,
+    PARSE_FAILURES,
+    PARSE_LAG_SECONDS,
+    PARSE_RECORDS,
+    PARSE_UPLOAD_DURATION_SECONDS,
+    pushed_metrics,
 )
+from .compaction import compacted_before, mark_pending
+from .parquet import records_to_parquet
+from .resources.profiling import ProfilingResource
+from .sidecars import INDEXED_FIELDS, PARSED_SIDECAR_INDEXES, build_index, save_index
+from .storage import ObjectNotFound, StorageObject, get_storage
+from .tracing import TraceContext, export_span, span
 
 HourKey = namedtuple("HourKey", ["feed_type", "hour", "base64url"])
 
 
-def hour_key(blob: storage.Blob) -> HourKey:
+def raw_hour_prefix(feed_type: str, hour: pendulum.DateTime) -> str:
+    return "/".join(
+        [
+            feed_type,
+            f"dt={SERIALIZERS[pendulum.Date](hour.date())}",
+            f"hour={SERIALIZERS[pendulum.DateTime](hour)}",
+        ]
+    )
+
+
+def hour_key(blob: Union[StorageObject, RawFileRef]) -> HourKey:
     (
         feed_type,
         dtequals,
@@ -60,6 +107,12 @@ def hour_key(blob: storage.Blob) -> HourKey:
     return HourKey(feed_type, hour, base64url)
 
 
+def fetched_ts(blob: Union[StorageObject, RawFileRef]) -> pendulum.DateTime:
+    tsequals = next(part for part in blob.name.split("/") if part.startswith("ts="))
+    _, ts = tsequals.split("=", maxsplit=1)
+    return pendulum.parse(ts).in_tz("UTC")  # type: ignore[union-attr]
+
+
 class ParsedFile(BaseModel):
     feed_type: Union[FeedType, GtfsScheduleFileType]
     hash: bytes
@@ -110,191 +163,517 @@ def file_to_records(
         raise
 
 
+def serialize_hour_agg(
+    agg: Union[HourAgg, MicroBatchAgg], records: List[ParsedRecord]
+) -> bytes:
+    if agg.format == ParsedFileFormat.parquet:
+        return records_to_parquet(agg.table, records)
+    return gzip.compress(
+        "\n".join([record.json() for record in records]).encode("utf-8")
+    )
+
+
 def save_hour_agg(
-    agg: HourAgg,
+    agg: Union[HourAgg, MicroBatchAgg],
     records: List[ParsedRecord],
     pbar=None,
-    client: Optional[storage.Client] = None,
     timeout: int = 300,
 ) -> int:
     logger = get_dagster_logger()
     if records:
-        client = client or storage.Client()
         # TODO: add asserts to check all same hour/url/etc.
-        contents = gzip.compress(
-            "\n".join([record.json() for record in records]).encode("utf-8")
-        )
+        contents = serialize_hour_agg(agg, records)
         content_size = humanize.naturalsize(len(contents))
         agg_path = f"{agg.bucket}/{agg.gcs_key}"
 
         logger.info(f"Saving {len(records)} records ({content_size}) to {agg_path}")
         start = pendulum.now()
-        blob = client.bucket(agg.bucket.removeprefix("gs://")).blob(agg.gcs_key)
-        blob.upload_from_string(contents, timeout=timeout, client=client)
+        saved = get_storage().write_bytes(
+            agg.bucket, agg.gcs_key, contents, timeout=timeout
+        )
+        PARSE_UPLOAD_DURATION_SECONDS.labels(
+            table=agg.table.value, format=agg.format.value
+        ).observe(start.diff().total_seconds())
         logger.info(
             f"Took {humanize.naturaldelta(start.diff().total_seconds())} to save {content_size} to {agg_path}"
         )
+        if PARSED_SIDECAR_INDEXES and agg.table in INDEXED_FIELDS:
+            save_index(
+                agg.bucket,
+                build_index(
+                    agg.table,
+                    agg.gcs_key,
+                    saved.generation,
+                    (record.record for record in records),
+                ),
+            )
+        if (
+            isinstance(agg, HourAgg)
+            and agg.format == ParsedFileFormat.jsonl_gz
+            and agg.hour < compacted_before()
+        ):
+            # readers prefer these rows to a compacted day's, but the day still needs
+            # compacting again to fold them in
+            day = DayAgg(table=agg.table, base64url=agg.base64url, dt=agg.hour.date())
+            if get_storage().exists(day.bucket, day.gcs_key):
+                logger.info(f"{day.gcs_key} is compacted; marking it for recompaction")
+                mark_pending(agg.table, agg.hour, agg.base64url)
         return len(contents)
 
     logger.warning(f"WARNING: no records found for aggregation {agg}")
     return 0
 
 
+def serialize_parse_outcomes(outcomes: Iterable[ParseOutcome]) -> bytes:
+    """
+    Gzipped JSONL, compressed line by line rather than joined into one string first.
+    The gzip header carries no timestamp, so identical outcomes serialize identically.
+    """
+    buffer = BytesIO()
+    with gzip.GzipFile(fileobj=buffer, mode="wb", mtime=0) as f:
+        for outcome in outcomes:
+            f.write(outcome.json().encode("utf-8"))
+            f.write(b"\n")
+    return buffer.getvalue()
+
+
+def project(obj: Dict[str, Any], fields: Iterable[str]) -> Dict[str, Any]:
+    """
+    Keeps only the given fields of obj; dotted fields such as "file.ts" select within
+    nested objects.
+    """
+    projected: Dict[str, Any] = {}
+    for field in fields:
+        head, _, rest = field.partition(".")
+        if head not in obj:
+            continue
+        if rest and isinstance(obj[head], dict):
+            projected.setdefault(head, {}).update(project(obj[head], [rest]))
+        else:
+            projected[head] = obj[head]
+    return projected
+
+
+def iter_parse_outcomes(
+    contents: bytes, fields: Optional[Iterable[str]] = None
+) -> Iterator[ParseOutcome]:
+    """
+    Lazily parses serialized outcomes. With fields, outcomes are built from just those
+    fields and without validation, so the rest of each model keeps its default.
+    """
+    fields = list(fields) if fields is not None else None
+    # outcomes written before they were compressed are plain JSONL
+    if contents[:2] == b"\x1f\x8b":
+        lines: Iterable[bytes] = gzip.GzipFile(fileobj=BytesIO(contents))
+    else:
+        lines = BytesIO(contents)
+    for line in lines:
+        if not line.strip():
+            continue
+        if fields is None:
+            yield ParseOutcome.parse_raw(line)
+        else:
+            yield ParseOutcome.construct(**project(json.loads(line), fields))
+
+
+def legacy_parse_outcomes_key(key: str) -> str:
+    return key.removesuffix(".gz")
+
+
+def load_parse_outcomes(
+    bucket: str, key: str, fields: Optional[Iterable[str]] = None
+) -> Iterator[ParseOutcome]:
+    """
+    Reads an hour's parse outcomes, falling back to the uncompressed key they were
+    written to previously; only parsing is deferred until iteration, so a missing
+    object raises ObjectNotFound immediately.
+    """
+    storage = get_storage()
+    try:
+        contents = storage.read_bytes(bucket, key)
+    except ObjectNotFound:
+        contents = storage.read_bytes(bucket, legacy_parse_outcomes_key(key))
+    # not a bare generator, which UPathIOManager would mistake for a coroutine
+    return itertools.chain(iter_parse_outcomes(contents, fields=fields))
+
+
+def save_parse_outcomes(bucket: str, key: str, outcomes: List[ParseOutcome]) -> bool:
+    """
+    Writes an hour's parse outcomes, or removes them if there are none; returns False
+    if the stored outcomes were already identical and nothing was written.
+    """
+    storage = get_storage()
+    # only one of the compressed and legacy objects should exist at a time, since
+    # the warehouse reads every object beneath parsed_and_grouped_files
+    try:
+        storage.delete(bucket, legacy_parse_outcomes_key(key))
+    except ObjectNotFound:
+        pass
+
+    try:
+        existing: Optional[bytes] = storage.read_bytes(bucket, key)
+    except ObjectNotFound:
+        existing = None
+
+    if not outcomes:
+        if existing is None:
+            return False
+        storage.delete(bucket, key)
+        return True
+
+    contents = serialize_parse_outcomes(outcomes)
+    # memoized reruns usually produce identical outcomes
+    if contents == existing:
+        return False
+    storage.write_bytes(bucket, key, contents, content_type="application/gzip")
+    return True
+
+
 # mostly exists so we can call directly to debug
-def download_blob(blob: storage.Blob, client: storage.Client) -> RawFetchedFile:
+def download_blob(file: RawFileRef) -> RawFetchedFile:
     logger = get_dagster_logger()
-    bio = BytesIO()
     start = pendulum.now()
-    logger.info(f"fetching {blob.name}")
-    client.download_blob_to_file(blob, file_obj=bio)
-    bio.seek(0)
+    logger.info(f"fetching {file.name}")
+    if file.bundle is not None:
+        assert file.offset is not None and file.size is not None
+        contents = get_storage().read_range(
+            RawFetchedFile.bucket, file.bundle, file.offset, file.size
+        )
+    else:
+        contents = get_storage().read_bytes(
+            RawFetchedFile.bucket, file.name, generation=file.generation
+        )
+    PARSE_DOWNLOADED_BYTES.labels(feed_type=hour_key(file).feed_type).inc(len(contents))
     delta = humanize.naturaldelta(start.diff().total_seconds())
-    size = humanize.naturalsize(bio.getbuffer().nbytes)
-    logger.info(f"Took {delta} to read {size} from {blob.name}")
-    return RawFetchedFile(**json.load(bio))
+    size = humanize.naturalsize(len(contents))
+    logger.info(f"Took {delta} to read {size} from {file.name}")
+    return RawFetchedFile(**json.loads(contents))
 
 
-def handle_hour(
-    key: HourKey,
-    blobs: List[storage.Blob],
-    pbar: Optional[tqdm] = None,
-    timeout: int = 60,
-) -> List[ParseOutcome]:
+RecordsByTable = Dict[Union[FeedType, GtfsScheduleFileType], List[ParsedRecord]]
+
+
+def parse_blobs(
+    files: List[RawFileRef],
+) -> Tuple[RecordsByTable, List[ParseOutcome]]:
     logger = get_dagster_logger()
-    logger.info(f"Handling {len(blobs)=} for {key}")
-    client = storage.Client()
     outcomes = []
     aggs: DefaultDict[Union[FeedType, GtfsScheduleFileType], List[ParsedRecord]] = (
         defaultdict(list)
     )
 
     # we could do this streaming, but data should be small enough
-    for blob in blobs:
+    for raw_file in files:
         blob_hash = hashlib.md5()
-        file = download_blob(blob=blob, client=client)
-        for parsed_file in file_to_records(file):
-            blob_hash.update(parsed_file.hash)
-            start = pendulum.now()
-            parsed_records = [
-                ParsedRecord(
-                    record=record,
-                    metadata=dict(
-                        line_number=idx,
-                    ),
-                )
-                for idx, record in enumerate(parsed_file.records)
-            ]
-            delta = humanize.naturaldelta(start.diff().total_seconds())
-            logger.info(
-                f"took {delta} to get {len(parsed_records)} records for {parsed_file.feed_type}"
-            )
-            aggs[parsed_file.feed_type].extend(parsed_records)
-            del parsed_file
+        num_records = 0
+        download_start = pendulum.now(tz="UTC")
+        file = download_blob(raw_file)
+        if raw_file.list_started and raw_file.listed:
+            export_span(file.trace, "list", raw_file.list_started, raw_file.listed)
+        export_span(
+            file.trace,
+            "download",
+            download_start,
+            pendulum.now(tz="UTC"),
+            bundled=raw_file.bundle is not None,
+        )
+        feed_type = file.config.feed_type.value
+        parse_start = time.monotonic()
+        with span(file.trace, "parse") as parse_attributes:
+            try:
+                for parsed_file in file_to_records(file):
+                    blob_hash.update(parsed_file.hash)
+                    start = pendulum.now()
+                    parsed_records = [
+                        ParsedRecord(
+                            record=record,
+                            metadata=dict(
+                                line_number=idx,
+                            ),
+                        )
+                        for idx, record in enumerate(parsed_file.records)
+                    ]
+                    delta = humanize.naturaldelta(start.diff().total_seconds())
+                    logger.info(
+                        f"took {delta} to get {len(parsed_records)} records for {parsed_file.feed_type}"
+                    )
+                    aggs[parsed_file.feed_type].extend(parsed_records)
+                    num_records += len(parsed_records)
+                    PARSE_RECORDS.labels(
+                        feed_type=feed_type, table=parsed_file.feed_type.value
+                    ).inc(len(parsed_records))
+                    del parsed_file
+            except Exception as e:
+                PARSE_FAILURES.labels(
+                    feed_type=feed_type, exc_type=type(e).__name__
+                ).inc()
+                raise
+            parse_attributes["records"] = num_records
+        PARSE_DURATION_SECONDS.labels(feed_type=feed_type).observe(
+            time.monotonic() - parse_start
+        )
         outcomes.append(
             ParseOutcome(
                 file=file.dict(exclude={"contents"}),
                 metadata=dict(
                     hash=blob_hash.hexdigest(),
+                    records=num_records,
                 ),
                 success=True,
             )
         )
         del file
 
+    return aggs, outcomes
+
+
+def handle_hour(
+    key: HourKey,
+    files: List[RawFileRef],
+    pbar: Optional[tqdm] = None,
+    timeout: int = 60,
+) -> List[ParseOutcome]:
+    logger = get_dagster_logger()
+    logger.info(f"Handling {len(files)=} for {key}")
+    aggs, outcomes = parse_blobs(files=files)
+
+    save_start = pendulum.now(tz="UTC")
     for feed_type, records in aggs.items():
-        save_hour_agg(
-            agg=HourAgg(
-                table=feed_type,
-                **key._asdict(),
-            ),
-            records=records,
-        )
+        for fmt in PARSED_OUTPUT_FORMATS:
+            save_hour_agg(
+                agg=HourAgg(
+                    table=feed_type,
+                    format=fmt,
+                    **key._asdict(),
+                ),
+                records=records,
+            )
+    save_end = pendulum.now(tz="UTC")
+    # every file's records went into the same outputs, so they share the save
+    for outcome in outcomes:
+        if outcome.file.get("trace"):
+            export_span(
+                TraceContext.parse_obj(outcome.file["trace"]),
+                "save",
+                save_start,
+                save_end,
+                files=len(files),
+            )
 
     return outcomes
 
 
+def parse_fingerprint(feed_type: FeedType, files: List[RawFileRef]) -> Optional[str]:
+    """
+    Identifies the inputs of a (feed_type, hour, base64url) group along with everything
+    else that determines its outputs; returns None if any file has neither a generation
+    nor a hash, since we then can't tell whether it has changed.
+    """
+    if any(file.generation is None and file.md5_hash is None for file in files):
+        return None
+    fingerprint = hashlib.sha256()
+    fingerprint.update(f"parser={PARSER_VERSIONS[feed_type]}\n".encode("utf-8"))
+    fingerprint.update(
+        f"formats={','.join(sorted(PARSED_OUTPUT_FORMATS))}\n".encode("utf-8")
+    )
+    for file in sorted(files, key=lambda file: file.name):
+        fingerprint.update(
+            f"{file.name}:{file.generation or file.md5_hash}\n".encode("utf-8")
+        )
+    return fingerprint.hexdigest()
+
+
+def load_parse_memo(memo: ParseMemo) -> Optional[ParseMemo]:
+    try:
+        return ParseMemo.parse_raw(get_storage().read_bytes(memo.bucket, memo.gcs_key))
+    except ObjectNotFound:
+        return None
+
+
+def save_parse_memo(memo: ParseMemo) -> None:
+    get_storage().write_bytes(
+        memo.bucket, memo.gcs_key, memo.json(), content_type="application/json"
+    )
+
+
+def parse_group(
+    key: HourKey,
+    files: List[RawFileRef],
+    force: bool = False,
+) -> Tuple[List[ParseOutcome], bool]:
+    """
+    Parses and saves one (feed_type, hour, base64url) group unless its inputs are
+    unchanged since the last time it was parsed; the second element is True if the
+    group was skipped and its previously recorded outcomes returned instead.
+    """
+    logger = get_dagster_logger()
+    fingerprint = parse_fingerprint(FeedType(key.feed_type), files)
+    memo = ParseMemo(
+        fingerprint=fingerprint or "",
+        **key._asdict(),
+    )
+    previous = load_parse_memo(memo) if fingerprint and not force else None
+    if previous and previous.fingerprint == fingerprint:
+        logger.info(f"Skipping {key}; inputs are unchanged since the last parse")
+        return previous.outcomes, True
+
+    outcomes = handle_hour(key=key, files=files)
+    if fingerprint:
+        memo.outcomes = outcomes
+        save_parse_memo(memo)
+    PARSE_LAG_SECONDS.labels(feed_type=FeedType(key.feed_type).value).set(
+        time.time() - pendulum.instance(key.hour).add(hours=1).timestamp()
+    )
+    return outcomes, False
+
+
+def load_raw_manifest(
+    feed_type: str, hour: pendulum.DateTime
+) -> Optional[List[RawManifestEntry]]:
+    manifest = RawHourManifest(feed_type=feed_type, hour=hour)
+    try:
+        contents = get_storage().read_text(manifest.bucket, manifest.gcs_key)
+    except ObjectNotFound:
+        return None
+    return [RawManifestEntry.parse_raw(line) for line in contents.splitlines() if line]
+
+
+def list_raw_hour(
+    feed_type: str, hour: pendulum.DateTime
+) -> Tuple[List[RawFileRef], str]:
+    """
+    Returns an hour's raw files, preferring the manifest written by the fetcher over
+    listing the bucket; the second element says which source was used.
+    """
+    logger = get_dagster_logger()
+    start = pendulum.now(tz="UTC")
+    manifest = load_raw_manifest(feed_type=feed_type, hour=hour)
+    if manifest is not None:
+        PARSE_BLOBS_LISTED.labels(feed_type=feed_type, source="manifest").inc(
+            len(manifest)
+        )
+        listed = pendulum.now(tz="UTC")
+        return [
+            RawFileRef(
+                name=entry.key,
+                size=entry.size,
+                md5_hash=entry.md5_hash,
+                generation=entry.generation,
+                bundle=entry.bundle,
+                offset=entry.offset,
+                list_started=start,
+                listed=listed,
+            )
+            for entry in manifest
+        ], "manifest"
+
+    prefix = raw_hour_prefix(feed_type, hour)
+    logger.info(
+        f"No manifest found, listing items in {RawFetchedFile.bucket}/{prefix}..."
+    )
+    objects = list(get_storage().list(RawFetchedFile.bucket, prefix=prefix))
+    listed = pendulum.now(tz="UTC")
+    files = [
+        RawFileRef.from_object(obj).copy(
+            update={"list_started": start, "listed": listed}
+        )
+        for obj in objects
+    ]
+    PARSE_BLOBS_LISTED.labels(feed_type=feed_type, source="listing").inc(len(files))
+    return files, "listing"
+
+
+def ping_healthcheck(found_files: bool) -> None:
+    logger = get_dagster_logger()
+    healthcheck_base_url = (
+        "https://healthchecks.jarv.us/ping/7de2acff-4ae3-491c-ac66-6668b210a9ea"
+    )
+    try:
+        if found_files:
+            response = requests.get(healthcheck_base_url, timeout=10)
+            logger.info(
+                f"Healthcheck ping sent successfully (status: {response.status_code})"
+            )
+        else:
+            response = requests.get(f"{healthcheck_base_url}/fail", timeout=10)
+            logger.info(f"Healthcheck fail ping sent (status: {response.status_code})")
+    except Exception as e:
+        logger.warning(f"Failed to send healthcheck ping: {e}")
+
+
+def group_by_url(files: List[RawFileRef]) -> RawFilesList:
+    aggs: Dict[str, List[RawFileRef]] = defaultdict(list)
+    for file in files:
+        aggs[hour_key(file).base64url].append(file)
+    return RawFilesList(files=aggs)
+
+
+hour_partition_def = HourlyPartitionsDefinition(start_date="2023-07-05-00:00")
+
 feed_type_hour_partition_def = MultiPartitionsDefinition(
     {
         "feed_type": StaticPartitionsDefinition(list(FeedType.__members__.keys())),
-        "hour": HourlyPartitionsDefinition(start_date="2023-07-05-00:00"),
+        "hour": hour_partition_def,
     }
 )
 
 
 @asset(
     partitions_def=feed_type_hour_partition_def,
-    io_manager_key="gcs_io_manager",
+    io_manager_key="compact_gcs_io_manager",
 )
 def raw_files_list(
     context: AssetExecutionContext,
-) -> Dict[str, List[storage.Blob]]:
+    profiling: ProfilingResource,
+) -> RawFilesList:
     logger = get_dagster_logger()
     keys: Dict = context.partition_key.keys_by_dimension  # type: ignore[attr-defined]
     logger.info(f"handling {keys}")
     feed_type: str = keys["feed_type"]
     hour = pendulum.from_format(keys["hour"], "YYYY-MM-DD-HH:mm")
 
-    prefix = "/".join(
-        [
-            feed_type,
-            f"dt={SERIALIZERS[pendulum.Date](hour.date())}",
-            f"hour={SERIALIZERS[pendulum.DateTime](hour)}",
-        ]
-    )
+    with (
+        profiling.step(context) as metrics,
+        pushed_metrics("raw_files_list", feed_type),
+    ):
+        files, source = list_raw_hour(feed_type=feed_type, hour=hour)
+        raw_files = group_by_url(files)
+        metrics.records = len(files)
 
-    bucket = os.environ["RAW_BUCKET"]
-    client = storage.Client()
-    logger.info(f"Listing items in {bucket}/{prefix}...")
-    blobs: List[storage.Blob] = list(
-        client.list_blobs(bucket.removeprefix("gs://"), prefix=prefix)
+    logger.info(
+        f"Found {len(files)=} grouped into {len(raw_files.files)=} from {source}."
     )
-
-    # remove client from blob
-    for blob in blobs:
-        blob.bucket._client = None
-
-    aggs: Dict[str, List[storage.Blob]] = defaultdict(list)
-
-    for blob in blobs:
-        aggs[hour_key(blob).base64url].append(blob)
-
-    logger.info(f"Found {len(blobs)=} grouped into {len(aggs)=}.")
     context.add_output_metadata(
         metadata={
-            "num_aggs": len(aggs),
-            "num_blobs": len(blobs),
+            "num_aggs": len(raw_files.files),
+            "num_blobs": len(files),
+            "raw_bytes": sum(file.size or 0 for file in files),
+            "source": source,
         }
     )
 
-    # Send healthcheck ping
-    healthcheck_base_url = (
-        "https://healthchecks.jarv.us/ping/7de2acff-4ae3-491c-ac66-6668b210a9ea"
-    )
-    try:
-        if len(blobs) > 0:
-            response = requests.get(healthcheck_base_url, timeout=10)
-            logger.info(
-                f"Healthcheck ping sent successfully (status: {response.status_code})"
-            )
-        else:
-            response = requests.get(f"{healthcheck_base_url}/fail", timeout=10)
-            logger.info(f"Healthcheck fail ping sent (status: {response.status_code})")
-    except Exception as e:
-        logger.warning(f"Failed to send healthcheck ping: {e}")
+    ping_healthcheck(found_files=len(files) > 0)
+
+    return raw_files
+
 
-    return aggs
+class ParsedAndGroupedFilesConfig(Config):
+    # re-parse every group, even those whose inputs are unchanged since the last parse
+    force: bool = False
 
 
 @asset(
     partitions_def=feed_type_hour_partition_def,
     ins={
-        "raw_files_list": AssetIn(input_manager_key="gcs_io_manager"),
+        "raw_files_list": AssetIn(input_manager_key="compact_gcs_io_manager"),
     },
     io_manager_key="pydantic_gcs_io_manager",
 )
 def parsed_and_grouped_files(
     context: AssetExecutionContext,
-    raw_files_list: Dict[str, List[storage.Blob]],
+    config: ParsedAndGroupedFilesConfig,
+    profiling: ProfilingResource,
+    raw_files_list: RawFilesList,
 ) -> List[ParseOutcome]:
     logger = get_dagster_logger()
     keys: Dict = context.partition_key.keys_by_dimension  # type: ignore[attr-defined]
@@ -302,17 +681,28 @@ def parsed_and_grouped_files(
     feed_type: str = keys["feed_type"]
     hour = pendulum.from_format(keys["hour"], "YYYY-MM-DD-HH:mm")
 
+    skipped = 0
     url_to_outcomes: Dict[str, List[ParseOutcome]] = defaultdict(list)
-    for base64url, blobs in raw_files_list.items():
-        outcomes = handle_hour(
-            key=HourKey(
-                feed_type=feed_type,
-                hour=hour,
-                base64url=base64url,
-            ),
-            blobs=blobs,
-        )
-        url_to_outcomes[base64url].extend(outcomes)
+    with (
+        profiling.step(context) as metrics,
+        pushed_metrics("parsed_and_grouped_files", feed_type),
+    ):
+        for base64url, files in raw_files_list.files.items():
+            outcomes, was_skipped = parse_group(
+                key=HourKey(
+                    feed_type=feed_type,
+                    hour=hour,
+                    base64url=base64url,
+                ),
+                files=files,
+                force=config.force,
+            )
+            url_to_outcomes[base64url].extend(outcomes)
+            skipped += was_skipped
+            if not was_skipped:
+                metrics.records += sum(
+                    outcome.metadata.get("records", 0) for outcome in outcomes
+                )
 
     blobs_table = []
     all_outcomes = []
@@ -330,6 +720,11 @@ def parsed_and_grouped_files(
     context.add_output_metadata(
         metadata={
             "blobs": MetadataValue.md(tabulate(blobs_table, tablefmt="simple")),
+            "skipped_aggs": skipped,
+            **{
+                f"storage_{key}": value
+                for key, value in get_storage().limiter.stats().items()
+            },
         }
     )
 
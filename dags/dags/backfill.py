@@ -0,0 +1,252 @@
+"""
+Standalone backfill of parsed_and_grouped_files for a range of hours.
+
+Runs the same listing and parsing code as the raw_files_list and parsed_and_grouped_files
+assets across a process pool, without paying Dagster's per-partition run overhead, and
+writes both assets' outputs to the same keys their IO managers would. Completed
+(feed_type, hour) partitions are appended to a JSONL ledger so an interrupted backfill
+can be resumed, and can optionally be reported to the Dagster instance as
+materializations afterward.
+
+    python -m dags.backfill 2023-07-05T00:00:00Z 2023-08-01T00:00:00Z \
+        --feed-type gtfs_rt__vehicle_positions --workers 8
+"""
+
+import gzip
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import List, Optional, Set, Tuple
+
+import humanize
+import pendulum
+import typer
+from dagster import AssetMaterialization, DagsterInstance, MultiPartitionKey
+from pydantic import BaseModel
+from tqdm import tqdm
+
+from .assets import (
+    HourKey,
+    group_by_url,
+    list_raw_hour,
+    parse_group,
+    save_parse_outcomes,
+)
+from .common import PARSED_BUCKET, FeedType, parse_outcomes_path
+from .incremental import PARSE_OUTCOMES_ASSET
+from .storage import get_storage
+
+RAW_FILES_LIST_ASSET = "raw_files_list"
+PARTITION_HOUR_FORMAT = "YYYY-MM-DD-HH:mm"
+
+
+class PartitionResult(BaseModel):
+    feed_type: FeedType
+    hour: pendulum.DateTime
+    success: bool
+    files: int = 0
+    bytes: int = 0
+    groups: int = 0
+    skipped_groups: int = 0
+    seconds: float = 0
+    error: Optional[str] = None
+
+    class Config:
+        json_encoders = {
+            pendulum.DateTime: lambda ts: ts.to_iso8601_string(),
+        }
+
+    @property
+    def partition_key(self) -> MultiPartitionKey:
+        return MultiPartitionKey(
+            {
+                "feed_type": self.feed_type.value,
+                "hour": self.hour.format(PARTITION_HOUR_FORMAT),
+            }
+        )
+
+
+def raw_files_list_path(feed_type: FeedType, hour: pendulum.DateTime) -> str:
+    return f"{RAW_FILES_LIST_ASSET}/{feed_type.value}/{hour.format(PARTITION_HOUR_FORMAT)}.json.gz"
+
+
+def parse_partition(
+    feed_type: FeedType,
+    hour: pendulum.DateTime,
+    force: bool = False,
+) -> PartitionResult:
+    """
+    Does the work of materializing both raw_files_list and parsed_and_grouped_files
+    for one (feed_type, hour) partition; failures are returned rather than raised.
+    """
+    storage = get_storage()
+    start = time.monotonic()
+    try:
+        files, _ = list_raw_hour(feed_type=feed_type, hour=hour)
+        raw_files = group_by_url(files)
+        storage.write_bytes(
+            PARSED_BUCKET,
+            raw_files_list_path(feed_type, hour),
+            gzip.compress(raw_files.json().encode("utf-8")),
+            content_type="application/gzip",
+        )
+
+        skipped = 0
+        outcomes = []
+        for base64url, group in raw_files.files.items():
+            group_outcomes, was_skipped = parse_group(
+                key=HourKey(feed_type=feed_type, hour=hour, base64url=base64url),
+                files=group,
+                force=force,
+            )
+            outcomes.extend(group_outcomes)
+            skipped += was_skipped
+
+        save_parse_outcomes(
+            PARSED_BUCKET,
+            f"{PARSE_OUTCOMES_ASSET}/{parse_outcomes_path(feed_type, hour)}",
+            outcomes,
+        )
+    except Exception as e:
+        return PartitionResult(
+            feed_type=feed_type,
+            hour=hour,
+            success=False,
+            seconds=time.monotonic() - start,
+            error=f"{type(e).__name__}: {e}",
+        )
+
+    return PartitionResult(
+        feed_type=feed_type,
+        hour=hour,
+        success=True,
+        files=len(files),
+        bytes=sum(file.size or 0 for file in files),
+        groups=len(raw_files.files),
+        skipped_groups=skipped,
+        seconds=time.monotonic() - start,
+    )
+
+
+def load_ledger(ledger: Path) -> Set[Tuple[FeedType, pendulum.DateTime]]:
+    """
+    Returns the partitions a previous run of this backfill already completed.
+    """
+    if not ledger.exists():
+        return set()
+    with ledger.open() as f:
+        results = [PartitionResult.parse_raw(line) for line in f if line.strip()]
+    return {(result.feed_type, result.hour) for result in results if result.success}
+
+
+def partition_materializations(
+    result: PartitionResult, **metadata
+) -> List[AssetMaterialization]:
+    return [
+        AssetMaterialization(
+            asset_key=asset_key,
+            partition=result.partition_key,
+            metadata={
+                "num_aggs": result.groups,
+                "num_blobs": result.files,
+                "skipped_aggs": result.skipped_groups,
+                **metadata,
+            },
+        )
+        for asset_key in (RAW_FILES_LIST_ASSET, PARSE_OUTCOMES_ASSET)
+    ]
+
+
+def report_materializations(results: List[PartitionResult]) -> None:
+    instance = DagsterInstance.get()
+    for result in results:
+        for materialization in partition_materializations(result, backfilled=True):
+            instance.report_runless_asset_event(materialization)
+
+
+def main(
+    start: str = typer.Argument(..., help="First hour to backfill, inclusive."),
+    end: str = typer.Argument(..., help="Last hour to backfill, exclusive."),
+    feed_type: List[FeedType] = typer.Option(
+        [], help="Feed types to backfill; defaults to all of them."
+    ),
+    workers: int = typer.Option(os.cpu_count() or 1),
+    ledger: Path = typer.Option(Path("backfill-ledger.jsonl")),
+    force: bool = typer.Option(
+        False, help="Re-parse groups even if their inputs are unchanged."
+    ),
+    report: bool = typer.Option(
+        False, help="Report materializations to the Dagster instance in DAGSTER_HOME."
+    ),
+):
+    feed_types = feed_type or list(FeedType)
+    start_hour = pendulum.parse(start).in_tz("UTC").start_of("hour")  # type: ignore[union-attr]
+    end_hour = pendulum.parse(end).in_tz("UTC")  # type: ignore[union-attr]
+    done = load_ledger(ledger)
+    partitions = [
+        (ft, hour)
+        for hour in pendulum.period(start_hour, end_hour).range("hours")
+        if hour < end_hour
+        for ft in feed_types
+        if (ft, hour) not in done
+    ]
+    typer.secho(
+        f"Backfilling {len(partitions)} partitions with {workers} workers; "
+        f"{len(done)} already completed according to {ledger}",
+        fg=typer.colors.MAGENTA,
+    )
+
+    started = time.monotonic()
+    completed: List[PartitionResult] = []
+    failures = 0
+    with (
+        ProcessPoolExecutor(max_workers=workers) as pool,
+        ledger.open("a") as ledger_file,
+        tqdm(total=len(partitions)) as pbar,
+    ):
+        futures = [
+            pool.submit(parse_partition, ft, hour, force) for ft, hour in partitions
+        ]
+        for future in as_completed(futures):
+            result = future.result()
+            ledger_file.write(result.json() + "\n")
+            ledger_file.flush()
+            if result.success:
+                completed.append(result)
+            else:
+                failures += 1
+                tqdm.write(f"Failed {result.feed_type} {result.hour}: {result.error}")
+            elapsed = time.monotonic() - started
+            pbar.set_postfix(
+                files_per_s=f"{sum(r.files for r in completed) / elapsed:.1f}",
+                mb_per_s=f"{sum(r.bytes for r in completed) / elapsed / 1e6:.2f}",
+                failed=failures,
+            )
+            pbar.update()
+
+    elapsed = time.monotonic() - started
+    files = sum(result.files for result in completed)
+    size = sum(result.bytes for result in completed)
+    typer.secho(
+        f"Backfilled {len(completed)} partitions ({files} files, "
+        f"{humanize.naturalsize(size)}) in {humanize.naturaldelta(elapsed)}: "
+        f"{files / max(elapsed, 1e-9):.1f} files/s, "
+        f"{humanize.naturalsize(size / max(elapsed, 1e-9))}/s; "
+        f"skipped {sum(result.skipped_groups for result in completed)} unchanged groups",
+        fg=typer.colors.GREEN,
+    )
+
+    if report and completed:
+        report_materializations(completed)
+        typer.secho(f"Reported {len(completed)} partitions to Dagster")
+
+    if failures:
+        typer.secho(
+            f"{failures} partitions failed; re-run to retry them", fg=typer.colors.RED
+        )
+        raise typer.Exit(1)
+
+
+if __name__ == "__main__":
+    typer.run(main)
@@ -0,0 +1,780 @@
+"""
+Benchmarks of the parse pipeline, stage by stage, for every feed type.
+
+Each feed type gets an hour of generated raw files (or recorded ones, with
+--fixtures) saved to a temporary LocalStorage, which then go through the same steps
+as handle_hour, timed separately:
+
+    download      reading the raw objects
+    decode        the RawFetchedFile envelope and file_to_records' feed parsing
+    record_build  wrapping every record in a ParsedRecord
+    serialize     JSON lines (and records_to_parquet, if Parquet output is enabled)
+    compress      gzip
+    upload        writing the HourAggs
+
+followed by handle_hour itself, end to end. Every stage reports records/s, bytes/s
+and the peak RSS of the process while it ran. Each feed type runs in its own process
+so peak RSS isn't inherited from the previous one. Results are written as JSON, and
+--baseline compares them with an earlier run's.
+
+    python -m dags.benchmark --output benchmark.json
+    python -m dags.benchmark --feed-type gtfs_schedule --scale 0.1
+    python -m dags.benchmark --baseline benchmark.json --max-regression 0.2
+"""
+
+import csv
+import gzip
+import io
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import zipfile
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, DefaultDict, Dict, Iterator, List, Optional, Tuple
+
+import pendulum
+import typer
+from google.protobuf.json_format import ParseDict
+from google.transit import gtfs_realtime_pb2  # type: ignore[import]
+from pydantic import BaseModel
+from tabulate import tabulate
+
+from .assets import HourKey, file_to_records, handle_hour
+from .common import (
+    PARSED_OUTPUT_FORMATS,
+    FeedConfig,
+    FeedType,
+    GtfsScheduleFileType,
+    HourAgg,
+    ParsedFileFormat,
+    ParsedRecord,
+    RawFetchedFile,
+    RawFileRef,
+)
+from .parquet import records_to_parquet
+from .resources.profiling import PeakRss
+from .storage import Storage, get_storage
+
+BENCHMARK_HOUR = pendulum.datetime(2023, 7, 5, 12)
+RSS_SAMPLE_SECONDS = 0.005
+
+STAGES = [
+    "download",
+    "decode",
+    "record_build",
+    "serialize",
+    "compress",
+    "upload",
+    "handle_hour",
+]
+
+
+class StageResult(BaseModel):
+    seconds: float
+    records: int
+    bytes: int
+    records_per_second: float
+    bytes_per_second: float
+    peak_rss_bytes: int
+
+
+class FeedTypeResult(BaseModel):
+    feed_type: FeedType
+    files: int
+    raw_bytes: int
+    records: int
+    stages: Dict[str, StageResult]
+
+
+class BenchmarkReport(BaseModel):
+    created_at: str
+    commit: Optional[str]
+    python: str
+    platform: str
+    scale: float
+    output_formats: List[ParsedFileFormat]
+    results: List[FeedTypeResult]
+
+
+class Stage:
+    """
+    Times one stage, while a thread samples the process's RSS for its peak.
+    """
+
+    def __init__(self) -> None:
+        self.records = 0
+        self.bytes = 0
+        self.peak_rss = 0
+        self.seconds = 0.0
+        self._rss = PeakRss(interval=RSS_SAMPLE_SECONDS)
+
+    def __enter__(self) -> "Stage":
+        self._rss.__enter__()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.seconds = time.perf_counter() - self._start
+        self._rss.__exit__(*exc)
+        self.peak_rss = self._rss.peak
+
+    def result(self) -> StageResult:
+        seconds = max(self.seconds, 1e-9)
+        return StageResult(
+            seconds=round(self.seconds, 6),
+            records=self.records,
+            bytes=self.bytes,
+            records_per_second=round(self.records / seconds, 2),
+            bytes_per_second=round(self.bytes / seconds, 2),
+            peak_rss_bytes=self.peak_rss,
+        )
+
+
+# fixtures
+
+
+def scaled(n: int, scale: float) -> int:
+    return max(1, round(n * scale))
+
+
+def gtfs_schedule_zip(rng: random.Random, scale: float) -> bytes:
+    """
+    A feed with the shape of a large agency's: many trips, each with many stops.
+    """
+    stops = scaled(8_000, scale)
+    routes = scaled(150, scale)
+    trips = scaled(10_000, scale)
+    stops_per_trip = 40
+
+    def table(rows: List[Dict[str, Any]]) -> str:
+        out = io.StringIO()
+        writer = csv.DictWriter(out, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+        return out.getvalue()
+
+    files: Dict[GtfsScheduleFileType, List[Dict[str, Any]]] = {
+        GtfsScheduleFileType.agency_txt: [
+            {
+                "agency_id": "SEPTA",
+                "agency_name": "SEPTA",
+                "agency_url": "https://www.septa.org",
+                "agency_timezone": "America/New_York",
+            }
+        ],
+        GtfsScheduleFileType.stops_txt: [
+            {
+                "stop_id": str(i),
+                "stop_name": f"Stop {i}",
+                "stop_lat": round(39.9 + rng.uniform(-0.2, 0.2), 6),
+                "stop_lon": round(-75.1 + rng.uniform(-0.2, 0.2), 6),
+            }
+            for i in range(stops)
+        ],
+        GtfsScheduleFileType.routes_txt: [
+            {
+                "route_id": str(i),
+                "agency_id": "SEPTA",
+                "route_short_name": str(i),
+                "route_type": 3,
+            }
+            for i in range(routes)
+        ],
+        GtfsScheduleFileType.calendar_txt: [
+            {
+                "service_id": "weekday",
+                **{
+                    day: 1
+                    for day in ["monday", "tuesday", "wednesday", "thursday", "friday"]
+                },
+                "saturday": 0,
+                "sunday": 0,
+                "start_date": "20230701",
+                "end_date": "20231231",
+            }
+        ],
+        GtfsScheduleFileType.trips_txt: [
+            {
+                "route_id": str(i % routes),
+                "service_id": "weekday",
+                "trip_id": str(i),
+                "direction_id": i % 2,
+                "shape_id": str(i % routes),
+            }
+            for i in range(trips)
+        ],
+        GtfsScheduleFileType.stop_times_txt: [
+            {
+                "trip_id": str(trip),
+                "arrival_time": f"{(6 + trip % 16):02d}:{seq % 60:02d}:00",
+                "departure_time": f"{(6 + trip % 16):02d}:{seq % 60:02d}:30",
+                "stop_id": str((trip * 7 + seq) % stops),
+                "stop_sequence": seq,
+            }
+            for trip in range(trips)
+            for seq in range(stops_per_trip)
+        ],
+    }
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", compression=zipfile.ZIP_DEFLATED) as zipf:
+        for file_type, rows in files.items():
+            zipf.writestr(file_type.value, table(rows))
+    return buffer.getvalue()
+
+
+def gtfs_rt_feed(entities: List[Dict[str, Any]], ts: pendulum.DateTime) -> bytes:
+    feed = ParseDict(
+        {
+            "header": {"gtfsRealtimeVersion": "2.0", "timestamp": ts.int_timestamp},
+            "entity": entities,
+        },
+        gtfs_realtime_pb2.FeedMessage(),
+    )
+    return feed.SerializeToString()
+
+
+def vehicle_positions(rng: random.Random, scale: float, ts: pendulum.DateTime) -> bytes:
+    return gtfs_rt_feed(
+        [
+            {
+                "id": str(i),
+                "vehicle": {
+                    "trip": {
+                        "tripId": str(rng.randrange(10_000)),
+                        "routeId": str(i % 150),
+                    },
+                    "vehicle": {"id": str(i), "label": str(i)},
+                    "position": {
+                        "latitude": 39.9 + rng.uniform(-0.2, 0.2),
+                        "longitude": -75.1 + rng.uniform(-0.2, 0.2),
+                        "bearing": rng.uniform(0, 360),
+                        "speed": rng.uniform(0, 20),
+                    },
+                    "currentStopSequence": rng.randrange(40),
+                    "stopId": str(rng.randrange(8_000)),
+                    "currentStatus": "IN_TRANSIT_TO",
+                    "timestamp": str(ts.int_timestamp - rng.randrange(60)),
+                },
+            }
+            for i in range(scaled(1_500, scale))
+        ],
+        ts,
+    )
+
+
+def trip_updates(rng: random.Random, scale: float, ts: pendulum.DateTime) -> bytes:
+    return gtfs_rt_feed(
+        [
+            {
+                "id": str(i),
+                "tripUpdate": {
+                    "trip": {"tripId": str(i), "routeId": str(i % 150)},
+                    "vehicle": {"id": str(i)},
+                    "stopTimeUpdate": [
+                        {
+                            "stopSequence": seq,
+                            "stopId": str(rng.randrange(8_000)),
+                            "arrival": {
+                                "delay": rng.randrange(-60, 600),
+                                "time": str(ts.int_timestamp + seq * 90),
+                            },
+                        }
+                        for seq in range(20)
+                    ],
+                    "timestamp": str(ts.int_timestamp),
+                },
+            }
+            for i in range(scaled(400, scale))
+        ],
+        ts,
+    )
+
+
+def service_alerts(rng: random.Random, scale: float, ts: pendulum.DateTime) -> bytes:
+    return gtfs_rt_feed(
+        [
+            {
+                "id": str(i),
+                "alert": {
+                    "activePeriod": [{"start": str(ts.int_timestamp - 3600)}],
+                    "informedEntity": [{"routeId": str(i % 150)}],
+                    "headerText": {"translation": [{"text": f"Detour on route {i}"}]},
+                    "descriptionText": {
+                        "translation": [{"text": "Buses are detoured. " * 10}]
+                    },
+                },
+            }
+            for i in range(scaled(60, scale))
+        ],
+        ts,
+    )
+
+
+def septa_vehicle(rng: random.Random, i: int) -> Dict[str, Any]:
+    return {
+        "lat": str(39.9 + rng.uniform(-0.2, 0.2)),
+        "lng": str(-75.1 + rng.uniform(-0.2, 0.2)),
+        "label": str(i),
+        "VehicleID": str(i),
+        "BlockID": str(rng.randrange(1_000)),
+        "Direction": rng.choice(["NorthBound", "SouthBound"]),
+        "destination": f"Stop {rng.randrange(8_000)}",
+        "Offset": str(rng.randrange(10)),
+        "heading": rng.randrange(360),
+        "late": rng.randrange(-5, 20),
+        "trip": str(rng.randrange(10_000)),
+    }
+
+
+def septa_json(
+    feed_type: FeedType, rng: random.Random, scale: float, ts: pendulum.DateTime
+) -> bytes:
+    contents: Any
+    if feed_type == FeedType.septa__arrivals:
+        contents = {
+            f"Station {station} Departures: {ts.to_datetime_string()}": [
+                {
+                    direction: [
+                        {
+                            "direction": direction,
+                            "path": "R5S",
+                            "train_id": str(rng.randrange(9_999)),
+                            "origin": "Doylestown",
+                            "destination": "Center City Philadelphia",
+                            "status": f"{rng.randrange(10)} min",
+                            "service_type": "LOCAL",
+                            "next_station": None,
+                            "sched_time": ts.to_datetime_string(),
+                            "depart_time": ts.to_datetime_string(),
+                            "track": str(rng.randrange(10)),
+                            "track_change": None,
+                            "platform": "",
+                            "platform_change": None,
+                        }
+                        for _ in range(5)
+                    ]
+                }
+                for direction in ("Northbound", "Southbound")
+            ]
+            for station in range(scaled(150, scale))
+        }
+    elif feed_type == FeedType.septa__train_view:
+        contents = [septa_vehicle(rng, i) for i in range(scaled(200, scale))]
+    elif feed_type == FeedType.septa__transit_view_all:
+        contents = {
+            "routes": [
+                {
+                    str(route): [septa_vehicle(rng, route * 100 + i) for i in range(10)]
+                    for route in range(scaled(150, scale))
+                }
+            ]
+        }
+    elif feed_type == FeedType.septa__bus_detours:
+        contents = [
+            {
+                "route_id": str(route),
+                "route_info": [
+                    {
+                        "route_direction": "NB",
+                        "reason": "Construction",
+                        "start_location": f"Stop {rng.randrange(8_000)}",
+                        "start_date_time": ts.to_datetime_string(),
+                        "end_date_time": ts.add(days=7).to_datetime_string(),
+                        "current_message": "Buses are detoured. " * 5,
+                    }
+                ],
+            }
+            for route in range(scaled(60, scale))
+        ]
+    elif feed_type in (FeedType.septa__alerts, FeedType.septa__alerts_without_message):
+        contents = [
+            {
+                "route_id": f"bus_route_{route}",
+                "route_name": str(route),
+                "current_message": (
+                    ""
+                    if feed_type == FeedType.septa__alerts_without_message
+                    else "Delays. " * 20
+                ),
+                "advisory_message": "",
+                "detour_message": "",
+                "detour_start_location": "",
+                "detour_start_date_time": "",
+                "detour_end_date_time": "",
+                "detour_reason": "",
+                "last_updated": ts.to_datetime_string(),
+                "isSnow": "N",
+            }
+            for route in range(scaled(180, scale))
+        ]
+    elif feed_type == FeedType.septa__elevator_outages:
+        contents = {
+            "meta": {
+                "elevators_out": scaled(20, scale),
+                "updated": ts.to_datetime_string(),
+            },
+            "results": [
+                {
+                    "line": "Market-Frankford Line",
+                    "station": f"Station {i}",
+                    "elevator": "Street to Concourse",
+                    "message": "No access to/from station",
+                    "alternate_url": "https://www.septa.org/",
+                }
+                for i in range(scaled(20, scale))
+            ],
+        }
+    else:
+        raise ValueError(f"No fixture for {feed_type}")
+    return json.dumps(contents).encode("utf-8")
+
+
+# files per hour at scale 1; realtime feeds are fetched every 20 seconds or so
+FILES_PER_HOUR: Dict[FeedType, int] = {
+    FeedType.gtfs_schedule: 1,
+    FeedType.gtfs_rt__vehicle_positions: 180,
+    FeedType.gtfs_rt__trip_updates: 180,
+    FeedType.gtfs_rt__service_alerts: 60,
+}
+
+
+def generate_contents(
+    feed_type: FeedType, rng: random.Random, scale: float, ts: pendulum.DateTime
+) -> bytes:
+    if feed_type == FeedType.gtfs_schedule:
+        return gtfs_schedule_zip(rng, scale)
+    if feed_type == FeedType.gtfs_rt__vehicle_positions:
+        return vehicle_positions(rng, scale, ts)
+    if feed_type == FeedType.gtfs_rt__trip_updates:
+        return trip_updates(rng, scale, ts)
+    if feed_type == FeedType.gtfs_rt__service_alerts:
+        return service_alerts(rng, scale, ts)
+    return septa_json(feed_type, rng, scale, ts)
+
+
+def generate_fixtures(
+    feed_type: FeedType, scale: float, seed: int = 0
+) -> Iterator[RawFetchedFile]:
+    """
+    An hour of raw files of a feed type, the same for the same scale and seed.
+    """
+    rng = random.Random(f"{seed}-{feed_type.value}")
+    config = FeedConfig(
+        name=f"benchmark {feed_type.value}",
+        url=f"https://example.com/{feed_type.value}",
+        feed_type=feed_type,
+    )
+    files = scaled(FILES_PER_HOUR.get(feed_type, 60), scale)
+    for i in range(files):
+        ts = BENCHMARK_HOUR.add(seconds=i * 3600 // files)
+        yield RawFetchedFile(
+            ts=ts,
+            config=config,
+            response_code=200,
+            response_headers={},
+            contents=generate_contents(feed_type, rng, scale, ts),
+        )
+
+
+def load_fixtures(directory: Path, feed_type: FeedType) -> Iterator[RawFetchedFile]:
+    """
+    Recorded raw files of a feed type, e.g. copied from the raw bucket; they are
+    moved to the benchmark hour so that they all land in a single HourAgg.
+    """
+    for path in sorted(directory.rglob("*.json")):
+        raw = RawFetchedFile.parse_raw(path.read_bytes())
+        if raw.config.feed_type == feed_type:
+            yield raw.copy(
+                update={
+                    "ts": BENCHMARK_HOUR.add(seconds=raw.ts.minute * 60 + raw.ts.second)
+                }
+            )
+
+
+# stages
+
+
+@contextmanager
+def local_storage(root: Path) -> Iterator[Storage]:
+    """
+    Points get_storage, and so the whole pipeline, at a LocalStorage under root.
+    """
+    config = {"STORAGE_BACKEND": "local", "LOCAL_STORAGE_ROOT": str(root)}
+    previous = {name: os.environ.get(name) for name in config}
+    os.environ.update(config)
+    try:
+        yield get_storage()
+    finally:
+        for name, value in previous.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+
+def benchmark_feed_type(
+    feed_type: FeedType,
+    scale: float = 1.0,
+    fixtures: Optional[Path] = None,
+    seed: int = 0,
+) -> FeedTypeResult:
+    logging.getLogger("dagster").setLevel(logging.WARNING)
+    with tempfile.TemporaryDirectory() as tmp, local_storage(Path(tmp)) as storage:
+        raw_files = list(
+            load_fixtures(fixtures, feed_type)
+            if fixtures
+            else generate_fixtures(feed_type, scale, seed)
+        )
+        if not raw_files:
+            raise ValueError(f"No fixtures for {feed_type}")
+        refs = []
+        for raw in raw_files:
+            obj = storage.write_bytes(raw.bucket, raw.gcs_key, raw.json())
+            refs.append(RawFileRef.from_object(obj))
+        key = HourKey(
+            feed_type=feed_type.value,
+            hour=raw_files[0].hour,
+            base64url=raw_files[0].base64url,
+        )
+        del raw_files
+
+        stages: Dict[str, Stage] = {name: Stage() for name in STAGES}
+
+        with stages["download"] as stage:
+            contents = [
+                storage.read_bytes(
+                    RawFetchedFile.bucket, ref.name, generation=ref.generation
+                )
+                for ref in refs
+            ]
+            stage.bytes = sum(map(len, contents))
+        raw_bytes = stages["download"].bytes
+
+        with stages["decode"] as stage:
+            parsed: List[Tuple[Any, List[Any]]] = []
+            for content in contents:
+                file = RawFetchedFile(**json.loads(content))
+                stage.bytes += len(file.contents)
+                parsed.extend(
+                    (parsed_file.feed_type, list(parsed_file.records))
+                    for parsed_file in file_to_records(file)
+                )
+            stage.records = sum(len(records) for _, records in parsed)
+        del contents
+        # only known once decoded
+        stages["download"].records = stages["decode"].records
+
+        with stages["record_build"] as stage:
+            aggs: DefaultDict[Any, List[ParsedRecord]] = defaultdict(list)
+            for table, file_records in parsed:
+                aggs[table].extend(
+                    ParsedRecord(record=record, metadata=dict(line_number=idx))
+                    for idx, record in enumerate(file_records)
+                )
+            stage.records = sum(map(len, aggs.values()))
+            stage.bytes = stages["decode"].bytes
+        del parsed
+        records = stages["record_build"].records
+
+        outputs: List[Tuple[HourAgg, bytes]] = []
+        serialized: List[Tuple[HourAgg, bytes]] = []
+        with stages["serialize"] as stage:
+            for table, table_records in aggs.items():
+                for fmt in PARSED_OUTPUT_FORMATS:
+                    agg = HourAgg(table=table, format=fmt, **key._asdict())
+                    if fmt == ParsedFileFormat.parquet:
+                        outputs.append((agg, records_to_parquet(table, table_records)))
+                        stage.bytes += len(outputs[-1][1])
+                    else:
+                        data = "\n".join(
+                            record.json() for record in table_records
+                        ).encode("utf-8")
+                        serialized.append((agg, data))
+                        stage.bytes += len(data)
+                stage.records += len(table_records)
+        del aggs
+
+        with stages["compress"] as stage:
+            for agg, data in serialized:
+                stage.bytes += len(data)
+                outputs.append((agg, gzip.compress(data)))
+            stage.records = records
+        del serialized
+
+        with stages["upload"] as stage:
+            for agg, data in outputs:
+                storage.write_bytes(agg.bucket, agg.gcs_key, data, timeout=300)
+                stage.bytes += len(data)
+            stage.records = records
+        del outputs
+
+        with stages["handle_hour"] as stage:
+            handle_hour(key=key, files=refs)
+            stage.records = records
+            stage.bytes = raw_bytes
+
+    return FeedTypeResult(
+        feed_type=feed_type,
+        files=len(refs),
+        raw_bytes=raw_bytes,
+        records=records,
+        stages={name: stage.result() for name, stage in stages.items()},
+    )
+
+
+def run_isolated(fn: Callable[..., FeedTypeResult], *args, **kwargs) -> FeedTypeResult:
+    """
+    Runs fn in a fresh process, so that its peak RSS is its own.
+    """
+    with ProcessPoolExecutor(
+        max_workers=1, mp_context=multiprocessing.get_context("spawn")
+    ) as pool:
+        return pool.submit(fn, *args, **kwargs).result()
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True,
+            check=True,
+            text=True,
+            cwd=Path(__file__).parent,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(
+    feed_types: List[FeedType],
+    scale: float = 1.0,
+    fixtures: Optional[Path] = None,
+    seed: int = 0,
+    isolate: bool = True,
+) -> BenchmarkReport:
+    results = []
+    for feed_type in feed_types:
+        typer.secho(f"Benchmarking {feed_type.value}...", err=True)
+        args = (benchmark_feed_type, feed_type, scale, fixtures, seed)
+        results.append(run_isolated(*args) if isolate else args[0](*args[1:]))
+    return BenchmarkReport(
+        created_at=pendulum.now(tz="UTC").to_iso8601_string(),
+        commit=git_commit(),
+        python=platform.python_version(),
+        platform=platform.platform(),
+        scale=scale,
+        output_formats=PARSED_OUTPUT_FORMATS,
+        results=results,
+    )
+
+
+def regressions(
+    report: BenchmarkReport, baseline: BenchmarkReport, max_regression: float
+) -> List[Dict[str, Any]]:
+    """
+    Stages whose records/s fell by more than max_regression (a fraction) from the
+    baseline.
+    """
+    previous = {
+        (result.feed_type, stage): stats
+        for result in baseline.results
+        for stage, stats in result.stages.items()
+    }
+    found = []
+    for result in report.results:
+        for stage, stats in result.stages.items():
+            before = previous.get((result.feed_type, stage))
+            if not before or not before.records_per_second:
+                continue
+            change = stats.records_per_second / before.records_per_second - 1
+            if change < -max_regression:
+                found.append(
+                    {
+                        "feed_type": result.feed_type.value,
+                        "stage": stage,
+                        "baseline_records_per_second": before.records_per_second,
+                        "records_per_second": stats.records_per_second,
+                        "change": f"{change:.1%}",
+                    }
+                )
+    return found
+
+
+def summary_table(report: BenchmarkReport) -> str:
+    return tabulate(
+        [
+            {
+                "feed_type": result.feed_type.value,
+                "stage": stage,
+                "seconds": stats.seconds,
+                "records/s": f"{stats.records_per_second:,.0f}",
+                "MB/s": f"{stats.bytes_per_second / 1e6:,.1f}",
+                "peak RSS MB": f"{stats.peak_rss_bytes / 1e6:,.0f}",
+            }
+            for result in report.results
+            for stage, stats in result.stages.items()
+        ],
+        headers="keys",
+    )
+
+
+def main(
+    feed_type: List[FeedType] = typer.Option(
+        [], help="Feed types to benchmark; defaults to all of them."
+    ),
+    scale: float = typer.Option(
+        1.0, help="Multiplies the number of generated files and records."
+    ),
+    fixtures: Optional[Path] = typer.Option(
+        None, help="A directory of recorded raw files to use instead of generated ones."
+    ),
+    seed: int = typer.Option(0),
+    output: Optional[Path] = typer.Option(
+        None, help="Where to write the results as JSON; defaults to stdout."
+    ),
+    baseline: Optional[Path] = typer.Option(
+        None, help="Earlier results to compare records/s with."
+    ),
+    max_regression: float = typer.Option(
+        0.2, help="Exits non-zero if any stage's records/s fell by more than this."
+    ),
+    isolate: bool = typer.Option(True, help="Run each feed type in its own process."),
+):
+    report = run_benchmarks(
+        feed_types=feed_type or list(FeedType),
+        scale=scale,
+        fixtures=fixtures,
+        seed=seed,
+        isolate=isolate,
+    )
+    typer.echo(summary_table(report), err=True)
+    if output:
+        output.write_text(report.json(indent=2))
+        typer.secho(f"Wrote results to {output}", fg=typer.colors.GREEN, err=True)
+    else:
+        typer.echo(report.json(indent=2))
+
+    if baseline:
+        found = regressions(
+            report, BenchmarkReport.parse_file(baseline), max_regression
+        )
+        if found:
+            typer.secho(tabulate(found, headers="keys"), fg=typer.colors.RED, err=True)
+            sys.exit(1)
+        typer.secho(
+            f"No regressions against {baseline}", fg=typer.colors.GREEN, err=True
+        )
+
+
+if __name__ == "__main__":
+    typer.run(main)
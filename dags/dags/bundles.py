@@ -0,0 +1,269 @@
+"""
+Bundling of a closed day's raw objects, which otherwise stay one object per fetch.
+
+Each (feed_type, day, base64url)'s raw objects are concatenated, unchanged, into one or
+more bundles of at most RAW_BUNDLE_MAX_BYTES under <feed_type>__bundles/dt=.../, each
+ending with an index of its members and a fixed-size footer pointing at the index.
+Every member's entry in its hour's raw manifest then records the bundle and offset,
+so list_raw_hour and download_blob read it back with a range request, and the
+original objects are deleted. Entries keep the original generation, so parse
+fingerprints (and so skipping of unchanged groups) are unaffected.
+
+Bundles are never rewritten; objects that show up after a day was bundled, or that
+survived an interrupted run, go into an additional bundle the next time around.
+"""
+
+import json
+import os
+import struct
+import uuid
+from collections import defaultdict
+from io import BytesIO
+from typing import DefaultDict, Dict, List, NamedTuple, Optional, Tuple
+
+import pendulum
+from dagster import (
+    AssetExecutionContext,
+    Config,
+    MetadataValue,
+    asset,
+    build_schedule_from_partitioned_job,
+    define_asset_job,
+    get_dagster_logger,
+)
+from tabulate import tabulate
+
+from .assets import fetched_ts, hour_key, load_raw_manifest
+from .common import (
+    SERIALIZERS,
+    FeedType,
+    RawFetchedFile,
+    RawHourManifest,
+    RawManifestEntry,
+)
+from .compaction import COMPACTION_GROUP, day_partition_def
+from .storage import ObjectNotFound, PreconditionFailed, StorageObject, get_storage
+
+RAW_BUNDLE_MAX_BYTES = int(os.getenv("RAW_BUNDLE_MAX_BYTES", 512 * 1024 * 1024))
+
+BUNDLE_MAGIC = b"RAWBNDL1"
+# the magic followed by the index's offset, as an unsigned big-endian 64-bit integer
+BUNDLE_FOOTER = struct.Struct(">8sQ")
+
+
+class BundleMember(NamedTuple):
+    key: str
+    offset: int
+    size: int
+    md5_hash: Optional[str]
+    generation: Optional[int]
+
+
+def pack_bundle(
+    members: List[Tuple[StorageObject, bytes]],
+) -> Tuple[bytes, List[BundleMember]]:
+    buffer = BytesIO()
+    index = []
+    for obj, contents in members:
+        index.append(
+            BundleMember(
+                key=obj.name,
+                offset=buffer.tell(),
+                size=len(contents),
+                md5_hash=obj.md5_hash,
+                generation=obj.generation,
+            )
+        )
+        buffer.write(contents)
+    index_offset = buffer.tell()
+    buffer.write(
+        "\n".join(json.dumps(member._asdict()) for member in index).encode("utf-8")
+    )
+    buffer.write(BUNDLE_FOOTER.pack(BUNDLE_MAGIC, index_offset))
+    return buffer.getvalue(), index
+
+
+def read_bundle_index(bucket: str, key: str, size: int) -> List[BundleMember]:
+    """
+    Reads just a bundle's index, given the bundle's size (e.g. from a listing).
+    """
+    storage = get_storage()
+    magic, index_offset = BUNDLE_FOOTER.unpack(
+        storage.read_range(bucket, key, size - BUNDLE_FOOTER.size, BUNDLE_FOOTER.size)
+    )
+    if magic != BUNDLE_MAGIC:
+        raise ValueError(f"{bucket}/{key} is not a raw bundle")
+    index = storage.read_range(
+        bucket, key, index_offset, size - BUNDLE_FOOTER.size - index_offset
+    )
+    return [BundleMember(**json.loads(line)) for line in index.splitlines() if line]
+
+
+def bundle_prefix(feed_type: FeedType, day: pendulum.Date) -> str:
+    return f"{feed_type.value}__bundles/dt={SERIALIZERS[pendulum.Date](day)}"
+
+
+def bundle_url_day(
+    feed_type: FeedType,
+    day: pendulum.Date,
+    base64url: str,
+    objects: List[StorageObject],
+) -> Dict[str, Tuple[str, BundleMember]]:
+    """
+    Packs one URL's loose raw objects for a day into bundles; returns each packed
+    object's bundle and index entry by key.
+    """
+    logger = get_dagster_logger()
+    storage = get_storage()
+    # bundles are never rewritten, so every bundle gets a new, time-ordered name
+    run = pendulum.now(tz="UTC").format("YYYYMMDDTHHmmss")
+
+    located: Dict[str, Tuple[str, BundleMember]] = {}
+    chunk: List[Tuple[StorageObject, bytes]] = []
+    chunk_size = 0
+
+    def flush() -> None:
+        nonlocal chunk, chunk_size
+        if not chunk:
+            return
+        key = f"{bundle_prefix(feed_type, day)}/{base64url}/{run}-{uuid.uuid4().hex[:12]}.bundle"
+        contents, index = pack_bundle(chunk)
+        storage.write_bytes(
+            RawFetchedFile.bucket,
+            key,
+            contents,
+            content_type="application/octet-stream",
+            if_generation_match=0,
+        )
+        logger.info(
+            f"Packed {len(index)} raw objects into {key} ({len(contents)} bytes)"
+        )
+        located.update({member.key: (key, member) for member in index})
+        chunk, chunk_size = [], 0
+
+    for obj in sorted(objects, key=lambda obj: obj.name):
+        contents = storage.read_bytes(obj.bucket, obj.name, generation=obj.generation)
+        if chunk_size + len(contents) > RAW_BUNDLE_MAX_BYTES:
+            flush()
+        chunk.append((obj, contents))
+        chunk_size += len(contents)
+    flush()
+    return located
+
+
+def update_hour_manifest(
+    feed_type: FeedType,
+    hour: pendulum.DateTime,
+    objects: List[StorageObject],
+    located: Dict[str, Tuple[str, BundleMember]],
+) -> None:
+    entries = {
+        entry.key: entry
+        for entry in load_raw_manifest(feed_type=feed_type, hour=hour) or []
+    }
+    for obj in objects:
+        bundle, member = located[obj.name]
+        previous = entries.get(obj.name)
+        entries[obj.name] = RawManifestEntry(
+            key=obj.name,
+            size=member.size,
+            md5_hash=obj.md5_hash,
+            generation=obj.generation,
+            tick=previous.tick if previous else fetched_ts(obj),
+            bundle=bundle,
+            offset=member.offset,
+            trace_id=previous.trace_id if previous else None,
+        )
+    manifest = RawHourManifest(feed_type=feed_type, hour=hour)
+    get_storage().write_bytes(
+        manifest.bucket,
+        manifest.gcs_key,
+        "\n".join(
+            entry.json() for entry in sorted(entries.values(), key=lambda e: e.key)
+        ),
+        content_type="application/x-ndjson",
+    )
+
+
+def bundle_day(feed_type: FeedType, day: pendulum.Date) -> Dict[str, int]:
+    """
+    Bundles every loose raw object of a feed type's day, then points the day's hourly
+    manifests at the bundles, and only then deletes the loose objects.
+    """
+    logger = get_dagster_logger()
+    storage = get_storage()
+    objects = list(
+        storage.list(
+            RawFetchedFile.bucket,
+            prefix=f"{feed_type.value}/dt={SERIALIZERS[pendulum.Date](day)}/",
+        )
+    )
+
+    by_url: DefaultDict[str, List[StorageObject]] = defaultdict(list)
+    for obj in objects:
+        by_url[hour_key(obj).base64url].append(obj)
+    located: Dict[str, Tuple[str, BundleMember]] = {}
+    for base64url, url_objects in by_url.items():
+        located.update(bundle_url_day(feed_type, day, base64url, url_objects))
+
+    by_hour: DefaultDict[pendulum.DateTime, List[StorageObject]] = defaultdict(list)
+    for obj in objects:
+        hour = pendulum.parse(hour_key(obj).hour)
+        assert isinstance(hour, pendulum.DateTime)
+        by_hour[hour].append(obj)
+    for hour, hour_objects in by_hour.items():
+        update_hour_manifest(feed_type, hour, hour_objects, located)
+
+    for obj in objects:
+        try:
+            storage.delete(obj.bucket, obj.name, if_generation_match=obj.generation)
+        except PreconditionFailed:
+            # rewritten since it was bundled; the next run bundles the new version
+            logger.warning(f"{obj.name} changed while bundling")
+        except ObjectNotFound:
+            pass
+
+    return {
+        "objects": len(objects),
+        "bundles": len({bundle for bundle, _ in located.values()}),
+        "bytes": sum(member.size for _, member in located.values()),
+    }
+
+
+class RawBundlesConfig(Config):
+    feed_types: List[str] = [feed_type.value for feed_type in FeedType]
+
+
+@asset(
+    partitions_def=day_partition_def,
+    group_name=COMPACTION_GROUP,
+)
+def raw_bundles(context: AssetExecutionContext, config: RawBundlesConfig) -> None:
+    day = pendulum.from_format(context.partition_key, "YYYY-MM-DD").date()
+
+    summary = []
+    for feed_type in map(FeedType, config.feed_types):
+        stats = bundle_day(feed_type, day)
+        if stats["objects"]:
+            summary.append({"feed_type": feed_type.value, **stats})
+
+    context.add_output_metadata(
+        {
+            "objects": sum(row["objects"] for row in summary),
+            "bundles": sum(row["bundles"] for row in summary),
+            "feed_types": MetadataValue.md(
+                tabulate(summary, headers="keys", tablefmt="github")
+            ),
+        }
+    )
+
+
+raw_bundle_job = define_asset_job(
+    "raw_bundle_job",
+    selection=[raw_bundles],
+    partitions_def=day_partition_def,
+)
+
+raw_bundle_schedule = build_schedule_from_partitioned_job(
+    raw_bundle_job, hour_of_day=4, minute_of_hour=0
+)
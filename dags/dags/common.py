@@ -21,11 +21,13 @@ import pendulum
 import requests
 import typer.colors
 import yaml
-from google.cloud import storage  # type: ignore
 from pydantic import BaseModel, HttpUrl, validator, root_validator, Extra, parse_obj_as
 from pydantic.dataclasses import dataclass
 from slugify import slugify
 
+from .storage import StorageObject, get_storage
+from .tracing import TraceContext
+
 
 RAW_BUCKET = os.environ["RAW_BUCKET"]
 PARSED_BUCKET = os.environ["PARSED_BUCKET"]
@@ -79,6 +81,18 @@ class GtfsScheduleFileType(StrEnum):
     attributions_txt = "attributions.txt"
 
 
+class ParsedFileFormat(StrEnum):
+    jsonl_gz = "jsonl.gz"
+    parquet = "parquet"
+
+
+# comma-separated; e.g. "jsonl.gz,parquet" to write typed Parquet alongside the JSONL
+PARSED_OUTPUT_FORMATS: List[ParsedFileFormat] = [
+    ParsedFileFormat(fmt)
+    for fmt in os.getenv("PARSED_OUTPUT_FORMATS", ParsedFileFormat.jsonl_gz).split(",")
+]
+
+
 class KeyValues(BaseModel):
     key: str
     values: List[str]
@@ -126,6 +140,8 @@ class RawFetchedFile(BaseModel):
     response_headers: Mapping
     contents: bytes
     exception: Optional[Exception] = None
+    # the trace this fetch belongs to, see tracing.py
+    trace: Optional[TraceContext] = None
 
     class Config:
         arbitrary_types_allowed = True
@@ -195,11 +211,120 @@ class RawFetchedFile(BaseModel):
         return base64.b64decode(v) if isinstance(v, str) else v
 
 
+class RawManifestEntry(BaseModel):
+    """
+    A compact record of one successfully saved RawFetchedFile.
+    """
+
+    key: str
+    size: int
+    md5_hash: Optional[str]
+    generation: Optional[int]
+    tick: pendulum.DateTime
+    # set once the object has been packed into a raw bundle and removed
+    bundle: Optional[str] = None
+    offset: Optional[int] = None
+    # the trace of the fetch that saved the object, see tracing.py
+    trace_id: Optional[str] = None
+
+    class Config:
+        json_encoders = {
+            pendulum.DateTime: lambda ts: ts.to_iso8601_string(),
+        }
+
+
+class RawHourManifest(BaseModel):
+    bucket: ClassVar[str] = RAW_BUCKET
+    partitions: ClassVar[List[str]] = ["dt", "hour"]
+    feed_type: FeedType
+    hour: pendulum.DateTime
+
+    @validator("hour")
+    def convert_hour(cls, v) -> pendulum.DateTime:
+        assert isinstance(v, datetime.datetime)
+        return pendulum.instance(v).in_tz("UTC")
+
+    @property
+    def table(self) -> str:
+        return f"{self.feed_type.value}__manifests"
+
+    @property
+    def dt(self) -> pendulum.Date:
+        return self.hour.date()
+
+    @property
+    def filename(self) -> str:
+        return "manifest.jsonl"
+
+    @property
+    def gcs_key(self) -> str:
+        hive_str = "/".join(
+            [
+                f"{key}={SERIALIZERS[type(getattr(self, key))](getattr(self, key))}"
+                for key in self.partitions
+            ]
+        )
+        return f"{self.table}/{hive_str}/{self.filename}"
+
+
+class RawFileRef(BaseModel):
+    """
+    Just enough of a raw object to hand between assets and download it later.
+    """
+
+    name: str
+    size: Optional[int]
+    md5_hash: Optional[str]
+    generation: Optional[int]
+    # where the object lives if it has been packed into a raw bundle
+    bundle: Optional[str] = None
+    offset: Optional[int] = None
+    # when the listing that found the object ran, for tracing
+    list_started: Optional[pendulum.DateTime] = None
+    listed: Optional[pendulum.DateTime] = None
+
+    @classmethod
+    def from_object(cls, obj: StorageObject) -> "RawFileRef":
+        return cls(
+            name=obj.name,
+            size=obj.size,
+            md5_hash=obj.md5_hash,
+            generation=obj.generation,
+        )
+
+
+class RawFilesList(BaseModel):
+    # raw files of a single feed_type/hour partition, grouped by base64url
+    files: Dict[str, List[RawFileRef]]
+
+    @property
+    def num_files(self) -> int:
+        return sum(len(refs) for refs in self.files.values())
+
+    @property
+    def total_size(self) -> int:
+        return sum(ref.size or 0 for refs in self.files.values() for ref in refs)
+
+
 class ParsedRecord(BaseModel):
     record: Dict[str, Any]
     metadata: Dict[str, Any]
 
 
+def hive_table(
+    table: Union[FeedType, GtfsScheduleFileType], format: ParsedFileFormat
+) -> str:
+    name = (
+        f"gtfs_schedule__{slugify(table, separator='_')}"
+        if isinstance(table, GtfsScheduleFileType)
+        else table
+    )
+    # parquet lives in its own table prefix so the JSON external tables don't pick it up
+    if format == ParsedFileFormat.parquet:
+        name = f"{name}__parquet"
+    return name
+
+
 # TODO: dedupe this with above, and maybe __root__ should be List[FetchedRecord]?
 # this is a dataclass so we can use it as a dictionary key
 @dataclass(eq=True, frozen=True)
@@ -209,6 +334,7 @@ class HourAgg(BaseModel):
     partitions: ClassVar[List[str]] = ["dt", "hour"]
     base64url: str
     hour: pendulum.DateTime
+    format: ParsedFileFormat
 
     @validator("hour")
     def convert_hour(cls, v) -> pendulum.DateTime:
@@ -221,7 +347,7 @@ class HourAgg(BaseModel):
 
     @property
     def filename(self):
-        return f"{self.base64url}.jsonl.gz"
+        return f"{self.base64url}.{self.format.value}"
 
     @property
     def gcs_key(self) -> str:
@@ -231,16 +357,89 @@ class HourAgg(BaseModel):
                 for key in self.partitions
             ]
         )
-        hive_table = (
-            f"gtfs_schedule__{slugify(self.table, separator='_')}"
-            if isinstance(self.table, GtfsScheduleFileType)
-            else self.table
+        return f"{hive_table(self.table, self.format)}/{hive_str}/{self.filename}"
+
+
+# a day of one URL's hourly files, merged by compaction.py under the day's first hour;
+# each row keeps its own hour in metadata.hour, and the .day. in the name keeps parsing
+# from ever writing to it
+class DayAgg(BaseModel):
+    bucket: ClassVar[str] = PARSED_BUCKET
+    table: Union[FeedType, GtfsScheduleFileType]
+    base64url: str
+    dt: pendulum.Date
+    format: ParsedFileFormat = ParsedFileFormat.jsonl_gz
+
+    @validator("dt")
+    def convert_dt(cls, v) -> pendulum.Date:
+        assert isinstance(v, datetime.date)
+        return pendulum.date(v.year, v.month, v.day)
+
+    @property
+    def hour(self) -> pendulum.DateTime:
+        return pendulum.datetime(self.dt.year, self.dt.month, self.dt.day)
+
+    @property
+    def filename(self):
+        return f"{self.base64url}.day.{self.format.value}"
+
+    @property
+    def gcs_key(self) -> str:
+        return (
+            f"{hive_table(self.table, self.format)}/dt={SERIALIZERS[pendulum.Date](self.dt)}"
+            f"/hour={SERIALIZERS[pendulum.DateTime](self.hour)}/{self.filename}"
+        )
+
+    @property
+    def pending_key(self) -> str:
+        """
+        Written when an hour of an already compacted day is parsed again, so that the
+        day is compacted again; outside the table's prefix, like the archive.
+        """
+        return (
+            f"{hive_table(self.table, self.format)}__compaction"
+            f"/dt={SERIALIZERS[pendulum.Date](self.dt)}/{self.base64url}"
         )
-        return f"{hive_table}/{hive_str}/{self.filename}"
+
+
+# a slice of an hour parsed ahead of the hour closing; compacted into an HourAgg later
+@dataclass(eq=True, frozen=True)
+class MicroBatchAgg(BaseModel):
+    bucket: ClassVar[str] = PARSED_BUCKET
+    table: Union[FeedType, GtfsScheduleFileType]
+    partitions: ClassVar[List[str]] = ["dt", "hour", "batch"]
+    base64url: str
+    hour: pendulum.DateTime
+    batch: pendulum.DateTime
+    format: ParsedFileFormat
+
+    @validator("hour", "batch")
+    def convert_hour(cls, v) -> pendulum.DateTime:
+        assert isinstance(v, datetime.datetime)
+        return pendulum.instance(v).in_tz("UTC")
+
+    @property
+    def dt(self):
+        return self.hour.date()
+
+    @property
+    def filename(self):
+        return f"{self.base64url}.{self.format.value}"
+
+    @property
+    def gcs_key(self) -> str:
+        hive_str = "/".join(
+            [
+                f"{key}={SERIALIZERS[type(getattr(self, key))](getattr(self, key))}"
+                for key in self.partitions
+            ]
+        )
+        return f"{hive_table(self.table, self.format)}__microbatches/{hive_str}/{self.filename}"
 
 
 class ParseOutcomeMetadata(BaseModel):
     hash: str
+    records: Optional[int] = None
 
 
 class ParseOutcome(BaseModel):
@@ -256,6 +455,126 @@ class ParseOutcome(BaseModel):
             pendulum.DateTime: lambda ts: ts.to_iso8601_string(),
         }
 
+    # exceptions are serialized as strings
+    @validator("exception", pre=True)
+    def parse_exception(cls, v):
+        return Exception(v) if isinstance(v, str) else v
+
+
+def parse_outcomes_path(feed_type: str, hour: pendulum.DateTime) -> str:
+    """
+    The path of an hour's parse outcomes beneath the parsed_and_grouped_files asset.
+    """
+    return "/".join(
+        [
+            f"feed_type={feed_type}",
+            f"dt={SERIALIZERS[pendulum.Date](hour.date())}",
+            f"{SERIALIZERS[pendulum.DateTime](hour)}.jsonl.gz",
+        ]
+    )
+
+
+class IncrementalParseCheckpoint(BaseModel):
+    bucket: ClassVar[str] = PARSED_BUCKET
+    partitions: ClassVar[List[str]] = ["dt"]
+    feed_type: FeedType
+    hour: pendulum.DateTime
+    # latest fetch ts that has been listed and parsed
+    watermark: Optional[pendulum.DateTime] = None
+    # base64url -> raw blob names already parsed into a micro-batch
+    processed: Dict[str, List[str]] = {}
+    microbatches: List[MicroBatchAgg] = []
+    outcomes: List[ParseOutcome] = []
+    compacted: bool = False
+
+    class Config:
+        json_encoders = {
+            Exception: str,
+            pendulum.DateTime: lambda ts: ts.to_iso8601_string(),
+        }
+
+    @validator("hour", "watermark")
+    def convert_hour(cls, v) -> Optional[pendulum.DateTime]:
+        if v is None:
+            return v
+        assert isinstance(v, datetime.datetime)
+        return pendulum.instance(v).in_tz("UTC")
+
+    @property
+    def table(self) -> str:
+        return f"{self.feed_type.value}__parse_checkpoints"
+
+    @property
+    def dt(self) -> pendulum.Date:
+        return self.hour.date()
+
+    @property
+    def filename(self):
+        return f"{self.hour.to_iso8601_string()}.json"
+
+    @property
+    def gcs_key(self) -> str:
+        hive_str = "/".join(
+            [
+                f"{key}={SERIALIZERS[type(getattr(self, key))](getattr(self, key))}"
+                for key in self.partitions
+            ]
+        )
+        return f"{self.table}/{hive_str}/{self.filename}"
+
+
+# bump a feed type's version whenever its parsing changes, so memoized
+# parsed_and_grouped_files groups get re-parsed rather than skipped
+PARSER_VERSIONS: Dict[FeedType, int] = {feed_type: 1 for feed_type in FeedType}
+
+
+class ParseMemo(BaseModel):
+    """
+    The fingerprint of the inputs of one successfully parsed and saved
+    (feed_type, hour, base64url) group, along with the outcomes it produced.
+    """
+
+    bucket: ClassVar[str] = PARSED_BUCKET
+    partitions: ClassVar[List[str]] = ["dt", "hour"]
+    feed_type: FeedType
+    hour: pendulum.DateTime
+    base64url: str
+    fingerprint: str
+    outcomes: List[ParseOutcome] = []
+
+    class Config:
+        json_encoders = {
+            Exception: str,
+            pendulum.DateTime: lambda ts: ts.to_iso8601_string(),
+        }
+
+    @validator("hour")
+    def convert_hour(cls, v) -> pendulum.DateTime:
+        assert isinstance(v, datetime.datetime)
+        return pendulum.instance(v).in_tz("UTC")
+
+    @property
+    def table(self) -> str:
+        return f"{self.feed_type.value}__parse_memos"
+
+    @property
+    def dt(self) -> pendulum.Date:
+        return self.hour.date()
+
+    @property
+    def filename(self):
+        return f"{self.base64url}.json"
+
+    @property
+    def gcs_key(self) -> str:
+        hive_str = "/".join(
+            [
+                f"{key}={SERIALIZERS[type(getattr(self, key))](getattr(self, key))}"
+                for key in self.partitions
+            ]
+        )
+        return f"{self.table}/{hive_str}/{self.filename}"
+
 
 class FeedTypeHourParseOutcomes(BaseModel):
     bucket: ClassVar[str] = PARSED_BUCKET
@@ -428,10 +747,7 @@ if __name__ == "__main__":
                 response_headers=response.headers,
                 contents=response.content,
             )
-            client = storage.Client()
             typer.secho(
                 f"Saving to {raw.bucket}/{raw.gcs_key}", fg=typer.colors.MAGENTA
             )
-            client.bucket(raw.bucket.removeprefix("gs://")).blob(
-                raw.gcs_key
-            ).upload_from_string(raw.json(), client=client)
+            get_storage().write_bytes(raw.bucket, raw.gcs_key, raw.json())
@@ -0,0 +1,363 @@
+"""
+Daily compaction of the hourly parsed JSONL files.
+
+Each (table, hour, base64url) gets its own small object, and BigQuery's external tables
+pay a per-file overhead on every one of them. Once a day has settled, compaction merges
+each (table, base64url)'s hourly files for the day into a single DayAgg, named
+<base64url>.day.jsonl.gz under the day's first hour, which parsing never writes to.
+Each row keeps its original hour in `metadata.hour`, which readers (reader.py,
+local_warehouse.py, sidecars.py and the staging models' select_parsed_rows macro) give
+back to it in place of the hive partition's, and rows stay in hour and then line order.
+Only realtime tables are compacted; a schedule has a single file per fetch anyway, and
+the warehouse's ASOF joins on schedule hours rely on them staying where they were.
+
+Readers prefer an hourly file's rows to a day's rows for the same URL and hour, so the
+window between writing the day and deleting the hourly files never shows rows twice,
+and neither does an hour parsed again after compaction. The originals are copied to
+<table>__archive with the same layout first; the day is written with a generation
+precondition, and only then are the hourly files deleted, each with its own
+precondition, along with their sidecar indexes (see sidecars.py); the day gets a
+sidecar of its own, and the table a single index of the whole day's sidecars.
+
+Parsing an hour of an already compacted day writes a marker under
+<table>__compaction/dt=.../ (see DayAgg.pending_key), as does compaction itself when
+an hourly file changes under it; recompaction_sensor compacts those days again, which
+folds the new hourly files into the day, and deletes the markers.
+"""
+
+import gzip
+import itertools
+import json
+import os
+from collections import defaultdict
+from io import BytesIO
+from typing import DefaultDict, Dict, Iterator, List, Optional, Tuple, Union
+
+import pendulum
+from dagster import (
+    AssetExecutionContext,
+    Config,
+    DailyPartitionsDefinition,
+    MetadataValue,
+    RunRequest,
+    SensorEvaluationContext,
+    SkipReason,
+    asset,
+    build_schedule_from_partitioned_job,
+    define_asset_job,
+    get_dagster_logger,
+    sensor,
+)
+from tabulate import tabulate
+
+from .common import (
+    SERIALIZERS,
+    DayAgg,
+    FeedType,
+    GtfsScheduleFileType,
+    ParsedFileFormat,
+    hive_table,
+)
+from .reader import ParsedObject, list_parsed_objects
+from .sidecars import (
+    INDEXED_FIELDS,
+    PARSED_SIDECAR_INDEXES,
+    build_index,
+    delete_index,
+    save_day_index,
+    save_index,
+)
+from .storage import ObjectNotFound, PreconditionFailed, StorageObject, get_storage
+
+COMPACTION_GROUP = "compaction"
+# days are compacted this many days after they end, to leave time for re-parsing
+COMPACTION_DELAY_DAYS = int(os.getenv("COMPACTION_DELAY_DAYS", 1))
+
+DEFAULT_COMPACTION_TABLES = [
+    feed_type.value for feed_type in FeedType if feed_type != FeedType.gtfs_schedule
+]
+
+day_partition_def = DailyPartitionsDefinition(
+    start_date="2023-07-05", end_offset=-COMPACTION_DELAY_DAYS
+)
+
+
+def compacted_before() -> pendulum.DateTime:
+    """
+    Days before this may have been compacted already.
+    """
+    return pendulum.now("UTC").start_of("day").subtract(days=COMPACTION_DELAY_DAYS)
+
+
+def archive_key(key: str) -> str:
+    table, _, rest = key.partition("/")
+    return f"{table}__archive/{rest}"
+
+
+def hour_lines(contents: bytes, hour: str) -> Iterator[bytes]:
+    """
+    Yields the lines of an hourly file with the hour recorded in each row's metadata.
+    """
+    with gzip.GzipFile(fileobj=BytesIO(contents)) as lines:
+        for line in lines:
+            if not line.strip():
+                continue
+            row = json.loads(line)
+            row["metadata"] = {**row.get("metadata", {}), "hour": hour}
+            yield json.dumps(row).encode("utf-8")
+
+
+def compacted_hours(contents: bytes) -> Iterator[Tuple[str, List[bytes]]]:
+    """
+    Groups the lines of a compacted day by the hour in their metadata.
+    """
+    with gzip.GzipFile(fileobj=BytesIO(contents)) as lines:
+        rows = (
+            (json.loads(line)["metadata"]["hour"], line.rstrip(b"\n"))
+            for line in lines
+            if line.strip()
+        )
+        for hour, group in itertools.groupby(rows, key=lambda row: row[0]):
+            yield hour, [line for _, line in group]
+
+
+def mark_pending(
+    table: Union[FeedType, GtfsScheduleFileType],
+    hour: pendulum.DateTime,
+    base64url: str,
+) -> None:
+    """
+    Marks an hour's day to be compacted again, e.g. after the hour was parsed again.
+    """
+    target = DayAgg(table=table, base64url=base64url, dt=hour.in_tz("UTC").date())
+    get_storage().write_bytes(target.bucket, target.pending_key, b"")
+
+
+def pending_markers(
+    table: Union[FeedType, GtfsScheduleFileType], day: Optional[pendulum.Date] = None
+) -> List[StorageObject]:
+    prefix = f"{hive_table(table, ParsedFileFormat.jsonl_gz)}__compaction/"
+    if day:
+        prefix += f"dt={SERIALIZERS[pendulum.Date](day)}/"
+    return list(get_storage().list(DayAgg.bucket, prefix=prefix))
+
+
+def compact_url_day(
+    table: Union[FeedType, GtfsScheduleFileType],
+    day: pendulum.Date,
+    base64url: str,
+    hourly: Dict[pendulum.DateTime, ParsedObject],
+    compacted: Optional[ParsedObject] = None,
+) -> int:
+    """
+    Merges one URL's hourly files for a day into its DayAgg, replacing any hours the
+    DayAgg already has; returns the number of files merged, or 0 if there was nothing
+    to do.
+    """
+    logger = get_dagster_logger()
+    storage = get_storage()
+    target = DayAgg(table=table, base64url=base64url, dt=day)
+    if not hourly:
+        return 0
+
+    contents = {
+        hour: storage.read_bytes(
+            parsed.object.bucket,
+            parsed.object.name,
+            generation=parsed.object.generation,
+        )
+        for hour, parsed in hourly.items()
+    }
+    # rows of an earlier compaction, by hour; any hourly file present replaces its hour
+    previous: Dict[str, List[bytes]] = {}
+    if compacted:
+        previous = dict(
+            compacted_hours(
+                storage.read_bytes(
+                    compacted.object.bucket,
+                    compacted.object.name,
+                    generation=compacted.object.generation,
+                )
+            )
+        )
+
+    for hour, parsed in hourly.items():
+        storage.write_bytes(
+            parsed.object.bucket,
+            archive_key(parsed.object.name),
+            contents[hour],
+            content_type="application/gzip",
+        )
+
+    fresh = {SERIALIZERS[pendulum.DateTime](hour): hour for hour in contents}
+    buffer = BytesIO()
+    with gzip.GzipFile(fileobj=buffer, mode="wb", mtime=0) as f:
+        for hour_str in sorted(set(previous) | set(fresh)):
+            lines = (
+                hour_lines(contents[fresh[hour_str]], hour_str)
+                if hour_str in fresh
+                else previous[hour_str]
+            )
+            for line in lines:
+                f.write(line)
+                f.write(b"\n")
+
+    saved = storage.write_bytes(
+        target.bucket,
+        target.gcs_key,
+        buffer.getvalue(),
+        content_type="application/gzip",
+        if_generation_match=compacted.object.generation if compacted else 0,
+    )
+    if PARSED_SIDECAR_INDEXES and table in INDEXED_FIELDS:
+        with gzip.GzipFile(fileobj=BytesIO(buffer.getvalue())) as lines:
+            save_index(
+                target.bucket,
+                build_index(
+                    table,
+                    target.gcs_key,
+                    saved.generation,
+                    (json.loads(line)["record"] for line in lines if line.strip()),
+                ),
+            )
+    for hour, parsed in hourly.items():
+        try:
+            storage.delete(
+                parsed.object.bucket,
+                parsed.object.name,
+                if_generation_match=parsed.object.generation,
+            )
+            if PARSED_SIDECAR_INDEXES:
+                delete_index(parsed.object.bucket, parsed.object.name)
+        except PreconditionFailed:
+            # parsed again since we read it; readers prefer it to the day's rows until
+            # the day is compacted again
+            logger.warning(f"{parsed.object.name} changed during compaction")
+            mark_pending(table, hour, base64url)
+        except ObjectNotFound:
+            pass
+
+    logger.info(
+        f"Compacted {len(contents)} hourly files into {target.gcs_key} "
+        f"({len(buffer.getvalue())} bytes)"
+    )
+    return len(contents)
+
+
+def compact_day(
+    table: Union[FeedType, GtfsScheduleFileType], day: pendulum.Date
+) -> Dict[str, int]:
+    storage = get_storage()
+    # listed first, so that a marker written while compacting outlives it
+    markers = pending_markers(table, day)
+
+    start = pendulum.datetime(day.year, day.month, day.day)
+    hourly: DefaultDict[str, Dict[pendulum.DateTime, ParsedObject]] = defaultdict(dict)
+    compacted: Dict[str, ParsedObject] = {}
+    for parsed in list_parsed_objects(table, start, start.add(days=1)):
+        if parsed.compacted:
+            compacted[parsed.base64url] = parsed
+        else:
+            hourly[parsed.base64url][parsed.hour] = parsed
+
+    merged = [
+        compact_url_day(
+            table, day, base64url, hourly[base64url], compacted.get(base64url)
+        )
+        for base64url in set(hourly) | set(compacted)
+    ]
+
+    if PARSED_SIDECAR_INDEXES and table in INDEXED_FIELDS:
+        save_day_index(table, day)
+
+    for marker in markers:
+        try:
+            storage.delete(
+                marker.bucket, marker.name, if_generation_match=marker.generation
+            )
+        except (PreconditionFailed, ObjectNotFound):
+            pass
+
+    return {
+        "urls": len(merged),
+        "compacted_urls": len([files for files in merged if files]),
+        "merged_files": sum(merged),
+    }
+
+
+def table_from_value(value: str) -> Union[FeedType, GtfsScheduleFileType]:
+    try:
+        return FeedType(value)
+    except ValueError:
+        return GtfsScheduleFileType(value)
+
+
+class CompactParsedFilesConfig(Config):
+    tables: List[str] = DEFAULT_COMPACTION_TABLES
+
+
+@asset(
+    partitions_def=day_partition_def,
+    group_name=COMPACTION_GROUP,
+)
+def compacted_parsed_files(
+    context: AssetExecutionContext, config: CompactParsedFilesConfig
+) -> None:
+    day = pendulum.from_format(context.partition_key, "YYYY-MM-DD").date()
+
+    summary = []
+    for table in map(table_from_value, config.tables):
+        stats = compact_day(table, day)
+        if stats["urls"]:
+            summary.append(
+                {"table": hive_table(table, ParsedFileFormat.jsonl_gz), **stats}
+            )
+
+    context.add_output_metadata(
+        {
+            "merged_files": sum(row["merged_files"] for row in summary),
+            "tables": MetadataValue.md(
+                tabulate(summary, headers="keys", tablefmt="github")
+            ),
+        }
+    )
+
+
+compaction_job = define_asset_job(
+    "compaction_job",
+    selection=[compacted_parsed_files],
+    partitions_def=day_partition_def,
+)
+
+compaction_schedule = build_schedule_from_partitioned_job(
+    compaction_job, hour_of_day=3, minute_of_hour=0
+)
+
+
+@sensor(job=compaction_job, minimum_interval_seconds=15 * 60)
+def recompaction_sensor(context: SensorEvaluationContext):
+    """
+    Compacts again the days with pending markers, i.e. days an hour of which was parsed
+    again after they were compacted; the schedule only ever compacts the newest day.
+    """
+    partition_keys = set(day_partition_def.get_partition_keys())
+    by_day: DefaultDict[str, List[StorageObject]] = defaultdict(list)
+    for table in map(table_from_value, DEFAULT_COMPACTION_TABLES):
+        for marker in pending_markers(table):
+            # <table>__compaction/dt=<day>/<base64url>
+            by_day[marker.name.split("/")[1].removeprefix("dt=")].append(marker)
+
+    requests = [
+        RunRequest(
+            partition_key=day,
+            # a marker written again gets a new generation, and so a new run
+            run_key="|".join(
+                sorted(f"{marker.name}#{marker.generation}" for marker in markers)
+            ),
+        )
+        for day, markers in sorted(by_day.items())
+        if day in partition_keys
+    ]
+    if not requests:
+        return SkipReason("No days to compact again")
+    return requests
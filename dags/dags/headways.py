@@ -0,0 +1,621 @@
+"""
+Stop-level headways and bunching, computed with NumPy from the local DuckDB warehouse.
+
+A replacement for deriving headways with window functions over fct_observed_stop_times.
+For each service date, the positions in fct_observed_shape_times are streamed one
+route and direction at a time, sorted by trip and timestamp. Each scheduled stop of an
+observed trip is placed along the trip's shape with shapes.project, and the vehicle's
+arrival is interpolated between the pings either side of it, as in the dbt mart. Unlike
+the mart, a ping that moves backwards along the shape (GPS jitter, or a vehicle that
+laid over) doesn't count as progress, so each stop gets a single arrival: the first
+time the vehicle passes it.
+
+Arrivals at each (route, direction, stop) are then ordered by time. A headway is the
+gap to the previous observed arrival, and the scheduled headway is the gap between the
+trip's scheduled arrival and that of the previous scheduled trip among the ones that
+were observed. An arrival is bunched when its headway is less than
+HEADWAY_BUNCHING_RATIO of its scheduled headway.
+"""
+
+import datetime
+import os
+import time
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+import pendulum
+import pyarrow as pa  # type: ignore[import]
+from dagster import (
+    AssetExecutionContext,
+    DailyPartitionsDefinition,
+    Failure,
+    asset,
+    build_schedule_from_partitioned_job,
+    define_asset_job,
+    in_process_executor,
+)
+from dagster_duckdb import DuckDBResource
+
+from .common import GtfsScheduleFileType
+from .local_warehouse import (
+    ScheduleSnapshots,
+    duckdb__fct_observed_shape_times,
+    duckdb_table_name,
+    shape_points,
+)
+from .shapes import build_shape_segments, project
+
+HEADWAYS_GROUP = "headways"
+HEADWAY_BUNCHING_RATIO = float(os.getenv("HEADWAY_BUNCHING_RATIO", 0.25))
+SERVICE_TIMEZONE = "America/New_York"
+# as in fct_observed_stop_times, by the hour of the scheduled arrival
+HOUR_TYPES = ["am_peak", "pm_peak", "off_peak"]
+
+service_day_partition_def = DailyPartitionsDefinition(
+    start_date="2023-07-05", timezone=SERVICE_TIMEZONE
+)
+
+
+def observed_arrivals(
+    ping_trip: np.ndarray,
+    ping_time: np.ndarray,
+    ping_fraction: np.ndarray,
+    stop_trip: np.ndarray,
+    stop_fraction: np.ndarray,
+) -> np.ndarray:
+    """
+    The time each stop was passed, or NaN. Pings are ordered by trip and then time,
+    with their fraction of the trip's shape; stops may be in any order.
+    """
+    ping_trip = np.asarray(ping_trip, dtype=np.int64)
+    ping_time = np.asarray(ping_time, dtype=np.float64)
+    ping_fraction = np.asarray(ping_fraction, dtype=np.float64)
+    stop_trip = np.asarray(stop_trip, dtype=np.int64)
+    stop_fraction = np.asarray(stop_fraction, dtype=np.float64)
+    valid = ~np.isnan(ping_fraction)
+    ping_trip, ping_time = ping_trip[valid], ping_time[valid]
+    arrivals = np.full(len(stop_trip), np.nan)
+    if not len(ping_trip):
+        return arrivals
+
+    # fractions are within [0, 1], so offsetting each trip by 2 keeps the running
+    # maximum of every trip separate and the whole array sorted
+    progress = np.maximum.accumulate(ping_trip * 2.0 + ping_fraction[valid])
+    target = stop_trip * 2.0 + stop_fraction
+    after = np.searchsorted(progress, target, side="left")
+    # the stop is passed between the ping before and the first ping at or beyond it
+    passed = (after > 0) & (after < len(progress)) & ~np.isnan(stop_fraction)
+    after = np.where(passed, after, 1)
+    passed &= (ping_trip[after] == stop_trip) & (ping_trip[after - 1] == stop_trip)
+
+    before = after[passed] - 1
+    share = (target[passed] - progress[before]) / (
+        progress[after[passed]] - progress[before]
+    )
+    arrivals[passed] = ping_time[before] + share * (
+        ping_time[after[passed]] - ping_time[before]
+    )
+    return arrivals
+
+
+def previous_in_group(group: np.ndarray, order_by: np.ndarray) -> np.ndarray:
+    """
+    The index of the previous row of the same group, ordered by order_by, or -1.
+    """
+    order = np.lexsort((order_by, group))
+    previous = np.full(len(group), -1, dtype=np.int64)
+    same = group[order[1:]] == group[order[:-1]]
+    previous[order[1:][same]] = order[:-1][same]
+    return previous
+
+
+class Headways(NamedTuple):
+    # the previous arrival at the same stop, or -1
+    previous: np.ndarray
+    # seconds; NaN for the first arrival at a stop
+    headway: np.ndarray
+    scheduled_headway: np.ndarray
+    bunched: np.ndarray
+
+
+def headways(
+    group: np.ndarray,
+    arrival: np.ndarray,
+    scheduled_arrival: np.ndarray,
+    bunching_ratio: float = HEADWAY_BUNCHING_RATIO,
+) -> Headways:
+    """
+    Headways of observed arrivals, grouped by stop.
+    """
+    group = np.asarray(group, dtype=np.int64)
+    arrival = np.asarray(arrival, dtype=np.float64)
+    scheduled_arrival = np.asarray(scheduled_arrival, dtype=np.float64)
+
+    previous = previous_in_group(group, arrival)
+    headway = np.where(previous >= 0, arrival - arrival[previous], np.nan)
+    scheduled_previous = previous_in_group(group, scheduled_arrival)
+    scheduled_headway = np.where(
+        scheduled_previous >= 0,
+        scheduled_arrival - scheduled_arrival[scheduled_previous],
+        np.nan,
+    )
+    with np.errstate(invalid="ignore"):
+        bunched = headway < bunching_ratio * scheduled_headway
+    return Headways(
+        previous=previous,
+        headway=headway,
+        scheduled_headway=scheduled_headway,
+        bunched=bunched,
+    )
+
+
+class HeadwayStats(NamedTuple):
+    observations: np.ndarray
+    mean: np.ndarray
+    std: np.ndarray
+    # coefficient of variation, std / mean
+    cv: np.ndarray
+    scheduled_mean: np.ndarray
+    bunched: np.ndarray
+
+
+def headway_stats(
+    group: np.ndarray,
+    headway: np.ndarray,
+    scheduled_headway: np.ndarray,
+    bunched: np.ndarray,
+    num_groups: int,
+) -> HeadwayStats:
+    """
+    Per group statistics of the headways that aren't NaN.
+    """
+    group = np.asarray(group, dtype=np.int64)
+    valid = ~np.isnan(headway)
+    observations = np.bincount(group[valid], minlength=num_groups)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = (
+            np.bincount(group[valid], weights=headway[valid], minlength=num_groups)
+            / observations
+        )
+        deviation = headway[valid] - mean[group[valid]]
+        std = np.sqrt(
+            np.bincount(group[valid], weights=deviation**2, minlength=num_groups)
+            / observations
+        )
+        cv = np.where(mean > 0, std / mean, np.nan)
+        scheduled = valid & ~np.isnan(scheduled_headway)
+        scheduled_mean = np.bincount(
+            group[scheduled],
+            weights=scheduled_headway[scheduled],
+            minlength=num_groups,
+        ) / np.bincount(group[scheduled], minlength=num_groups)
+    return HeadwayStats(
+        observations=observations,
+        mean=mean,
+        std=std,
+        cv=cv,
+        scheduled_mean=scheduled_mean,
+        bunched=np.bincount(group[bunched], minlength=num_groups),
+    )
+
+
+ARRIVALS_SCHEMA = pa.schema(
+    [
+        pa.field("_stop_row", pa.int64()),
+        pa.field("arrival", pa.float64()),
+        pa.field("headway", pa.float64()),
+        pa.field("scheduled_headway", pa.float64()),
+        pa.field("_previous_row", pa.int64()),
+        pa.field("is_bunched", pa.bool_()),
+    ]
+)
+METRICS_SCHEMA = pa.schema(
+    [
+        pa.field("_stop_row", pa.int64()),
+        pa.field("ct_observations", pa.int64()),
+        pa.field("avg_headway_sec", pa.float64()),
+        pa.field("stddev_headway_sec", pa.float64()),
+        pa.field("headway_cv", pa.float64()),
+        pa.field("avg_scheduled_headway_sec", pa.float64()),
+        pa.field("ct_bunching", pa.int64()),
+    ]
+)
+
+
+STOPS_SCHEMA = pa.schema(
+    [
+        pa.field("_stop_row", pa.int64()),
+        pa.field("trip_index", pa.int64()),
+        pa.field("shape_index", pa.int64()),
+        pa.field("stop_id", pa.string()),
+        pa.field("stop_name", pa.string()),
+        pa.field("stop_lat", pa.float64()),
+        pa.field("stop_lon", pa.float64()),
+        pa.field("scheduled", pa.float64()),
+        pa.field("hour_type", pa.int64()),
+    ]
+)
+
+
+def nullable(values: np.ndarray) -> pa.Array:
+    return pa.array(values, from_pandas=True)
+
+
+def scheduled_stops(
+    snapshots: ScheduleSnapshots,
+    trip_keys: List[Tuple[int, str, datetime.datetime, str, Optional[str]]],
+    shape_indexes: Dict[Tuple[str, datetime.datetime, Optional[str]], int],
+    midnight: int,
+) -> pa.Table:
+    """
+    The scheduled stops of each (trip_index, base64url, hour, trip_id, shape_id) trip
+    key, from its schedule's snapshot, numbered by trip_index and then stop_sequence.
+    scheduled is the arrival in epoch seconds, or null where the schedule has none.
+    """
+    columns: Dict[str, List[np.ndarray]] = {
+        name: [] for name in STOPS_SCHEMA.names if name != "_stop_row"
+    }
+    for trip_index, base64url, hour, trip_id, shape_id in trip_keys:
+        snapshot = snapshots.get(base64url, hour)
+        if snapshot is None:
+            continue
+        rows = snapshot.stop_times(trip_id)
+        stops = np.asarray(snapshot.st_stop[rows])
+        arrival = np.asarray(snapshot.st_arrival[rows], dtype=np.float64)
+        arrival, stops = arrival[stops >= 0], stops[stops >= 0]
+        arrival[arrival < 0] = np.nan
+        # as in fct_observed_stop_times
+        hour_of_day = (arrival // 3600) % 24
+        columns["trip_index"].append(np.full(len(stops), trip_index))
+        columns["shape_index"].append(
+            np.full(len(stops), shape_indexes.get((base64url, hour, shape_id), -1))
+        )
+        columns["stop_id"].append(snapshot.stop_ids[stops])
+        columns["stop_name"].append(snapshot.stop_names[stops])
+        columns["stop_lat"].append(snapshot.stop_lat[stops])
+        columns["stop_lon"].append(snapshot.stop_lon[stops])
+        columns["scheduled"].append(midnight + arrival)
+        columns["hour_type"].append(
+            np.select(
+                [np.isin(hour_of_day, [6, 7, 8]), np.isin(hour_of_day, [16, 17, 18])],
+                [0, 1],
+                2,
+            )
+        )
+    if not columns["trip_index"]:
+        return STOPS_SCHEMA.empty_table()
+    arrays = {name: np.concatenate(values) for name, values in columns.items()}
+    return pa.table(
+        {
+            "_stop_row": np.arange(len(arrays["trip_index"])),
+            **{
+                name: nullable(values) if values.dtype.kind == "f" else values
+                for name, values in arrays.items()
+            },
+        },
+        schema=STOPS_SCHEMA,
+    )
+
+
+@asset(
+    partitions_def=service_day_partition_def,
+    group_name=HEADWAYS_GROUP,
+    compute_kind="duckdb",
+    deps=[duckdb__fct_observed_shape_times],
+)
+def duckdb__stop_headways(
+    context: AssetExecutionContext, duckdb: DuckDBResource
+) -> None:
+    """
+    Replaces the service date's rows of fct_stop_headways, one row per observed stop
+    arrival with its headway and whether it was bunched, and of metric_stop_headways,
+    per route, direction, stop and hour type. Fails, leaving them as they are, if the
+    date has no observed positions.
+    """
+    day = pendulum.from_format(context.partition_key, "YYYY-MM-DD").date()
+    midnight = pendulum.datetime(
+        day.year, day.month, day.day, tz=SERVICE_TIMEZONE
+    ).int_timestamp
+    trips = duckdb_table_name(GtfsScheduleFileType.trips_txt)
+    snapshots = ScheduleSnapshots()
+
+    with duckdb.get_connection() as conn:
+        # the same trip rows as fct_observed_shape_times matched
+        conn.execute(
+            f"""
+            CREATE OR REPLACE TEMP TABLE _day AS
+            SELECT
+                shape_times.schedule_b64_url,
+                trips.hour AS schedule_hour,
+                shape_times.trip_id,
+                shape_times.vehicle_id,
+                trips.route_id,
+                coalesce(trips.direction_id, -1) AS direction_id,
+                trips.shape_id,
+                epoch(shape_times.vehicle_timestamp) AS ts,
+                shape_times.shape_closest_point_to_vehicle_position_as_pct AS fraction
+            FROM fct_observed_shape_times AS shape_times
+            ASOF INNER JOIN {trips} AS trips
+                ON shape_times.schedule_b64_url = trips.base64url
+                AND shape_times.trip_id = trips.trip_id
+                AND shape_times.vehicle_timestamp >= trips.hour
+            WHERE shape_times.service_date = ?
+                AND shape_times.shape_closest_point_to_vehicle_position_as_pct IS NOT NULL
+            """,
+            [day],
+        )
+        (pings,) = conn.execute("SELECT count(*) FROM _day").fetchone()
+        if not pings:
+            # e.g. a day older than DUCKDB_LOOKBACK_DAYS, whose positions are no longer
+            # loaded; its existing rows are kept rather than replaced with nothing
+            raise Failure(
+                description=f"No observed positions for {day} in fct_observed_shape_times"
+            )
+        # trips are numbered so each route and direction's are contiguous
+        conn.execute(
+            """
+            CREATE OR REPLACE TEMP TABLE _trip_keys AS
+            SELECT
+                *,
+                row_number() OVER (
+                    ORDER BY route_id, direction_id, schedule_b64_url, schedule_hour, trip_id
+                ) - 1 AS trip_index
+            FROM (
+                SELECT
+                    schedule_b64_url,
+                    schedule_hour,
+                    trip_id,
+                    route_id,
+                    direction_id,
+                    shape_id,
+                    max(vehicle_id) AS vehicle_id
+                FROM _day
+                GROUP BY ALL
+            )
+            """
+        )
+        conn.execute(
+            """
+            CREATE OR REPLACE TEMP TABLE _pings AS
+            SELECT keys.trip_index, day.ts, day.fraction
+            FROM _day AS day
+            INNER JOIN _trip_keys AS keys
+                USING (schedule_b64_url, schedule_hour, trip_id)
+            ORDER BY keys.trip_index, day.ts
+            """
+        )
+        trip_keys = conn.execute(
+            """
+            SELECT trip_index, schedule_b64_url, schedule_hour, trip_id, shape_id
+            FROM _trip_keys
+            ORDER BY trip_index
+            """
+        ).fetchall()
+        shape_indexes = {
+            key: i
+            for i, key in enumerate(
+                sorted(
+                    {
+                        (base64url, hour, shape_id)
+                        for _, base64url, hour, _, shape_id in trip_keys
+                        if shape_id is not None
+                    }
+                )
+            )
+        }
+        stops = scheduled_stops(snapshots, trip_keys, shape_indexes, midnight)
+        conn.register("_stops", stops)
+        route_directions = conn.execute(
+            """
+            SELECT min(trip_index), max(trip_index) + 1
+            FROM _trip_keys
+            GROUP BY route_id, direction_id
+            ORDER BY 1
+            """
+        ).fetchall()
+
+        start = time.monotonic()
+        stop_trip = stops["trip_index"].to_numpy()
+        stop_fraction = project(
+            build_shape_segments(
+                *shape_points(
+                    snapshots,
+                    [(i, *key) for key, i in shape_indexes.items()],
+                ),
+                len(shape_indexes),
+            ),
+            stops["shape_index"].to_numpy(),
+            stops["stop_lat"].to_numpy(),
+            stops["stop_lon"].to_numpy(),
+        ).fraction
+        scheduled = stops["scheduled"].to_numpy(zero_copy_only=False)
+        stop_ids = stops["stop_id"].to_numpy(zero_copy_only=False)
+        hour_type = stops["hour_type"].to_numpy()
+
+        arrival_rows: List[pa.Table] = []
+        metric_rows: List[pa.Table] = []
+        for first_trip, end_trip in route_directions:
+            pings = conn.execute(
+                "SELECT trip_index, ts, fraction FROM _pings WHERE trip_index >= ? AND trip_index < ?",
+                [first_trip, end_trip],
+            ).fetchnumpy()
+            rows = np.arange(
+                np.searchsorted(stop_trip, first_trip),
+                np.searchsorted(stop_trip, end_trip),
+            )
+            arrivals = observed_arrivals(
+                pings["trip_index"],
+                pings["ts"],
+                np.ma.filled(pings["fraction"].astype(np.float64), np.nan),
+                stop_trip[rows],
+                stop_fraction[rows],
+            )
+            observed = ~np.isnan(arrivals)
+            rows, arrivals = rows[observed], arrivals[observed]
+            if not len(rows):
+                continue
+
+            _, stop_group = np.unique(stop_ids[rows], return_inverse=True)
+            result = headways(stop_group, arrivals, scheduled[rows])
+            arrival_rows.append(
+                pa.table(
+                    {
+                        "_stop_row": rows,
+                        "arrival": arrivals,
+                        "headway": nullable(result.headway),
+                        "scheduled_headway": nullable(result.scheduled_headway),
+                        "_previous_row": pa.array(
+                            rows[result.previous], mask=result.previous < 0
+                        ),
+                        "is_bunched": result.bunched,
+                    },
+                    schema=ARRIVALS_SCHEMA,
+                )
+            )
+
+            metric_group = stop_group * len(HOUR_TYPES) + hour_type[rows]
+            groups, first_rows, metric_group = np.unique(
+                metric_group, return_index=True, return_inverse=True
+            )
+            stats = headway_stats(
+                metric_group,
+                result.headway,
+                result.scheduled_headway,
+                result.bunched,
+                len(groups),
+            )
+            metric_rows.append(
+                pa.table(
+                    {
+                        "_stop_row": rows[first_rows],
+                        "ct_observations": stats.observations,
+                        "avg_headway_sec": nullable(stats.mean),
+                        "stddev_headway_sec": nullable(stats.std),
+                        "headway_cv": nullable(stats.cv),
+                        "avg_scheduled_headway_sec": nullable(stats.scheduled_mean),
+                        "ct_bunching": stats.bunched,
+                    },
+                    schema=METRICS_SCHEMA,
+                )
+            )
+        seconds = time.monotonic() - start
+
+        conn.register(
+            "_arrivals",
+            (
+                pa.concat_tables(arrival_rows)
+                if arrival_rows
+                else ARRIVALS_SCHEMA.empty_table()
+            ),
+        )
+        conn.register(
+            "_metrics",
+            (
+                pa.concat_tables(metric_rows)
+                if metric_rows
+                else METRICS_SCHEMA.empty_table()
+            ),
+        )
+        conn.execute(
+            """
+            CREATE OR REPLACE TEMP TABLE _fct_stop_headways AS
+            SELECT
+                CAST(? AS DATE) AS service_date,
+                keys.schedule_b64_url,
+                keys.route_id,
+                keys.direction_id,
+                stops.stop_id,
+                stops.stop_name,
+                keys.trip_id,
+                keys.vehicle_id,
+                keys.shape_id,
+                list_extract(?, stops.hour_type + 1) AS hour_type,
+                to_timestamp(stops.scheduled) AS scheduled_arrival_time,
+                to_timestamp(arrivals.arrival) AS observed_stop_arrival,
+                arrivals.headway AS headway_sec,
+                arrivals.scheduled_headway AS scheduled_headway_sec,
+                previous_keys.trip_id AS previous_trip_id,
+                previous_keys.vehicle_id AS previous_vehicle_id,
+                arrivals.is_bunched
+            FROM _arrivals AS arrivals
+            INNER JOIN _stops AS stops
+                USING (_stop_row)
+            INNER JOIN _trip_keys AS keys
+                ON stops.trip_index = keys.trip_index
+            LEFT JOIN _stops AS previous_stops
+                ON arrivals._previous_row = previous_stops._stop_row
+            LEFT JOIN _trip_keys AS previous_keys
+                ON previous_stops.trip_index = previous_keys.trip_index
+            ORDER BY keys.route_id, keys.direction_id, stops.stop_id, arrivals.arrival
+            """,
+            [day, HOUR_TYPES],
+        )
+        conn.execute(
+            """
+            CREATE OR REPLACE TEMP TABLE _metric_stop_headways AS
+            SELECT
+                CAST(? AS DATE) AS service_date,
+                keys.schedule_b64_url,
+                keys.route_id,
+                keys.direction_id,
+                stops.stop_id,
+                stops.stop_name,
+                list_extract(?, stops.hour_type + 1) AS hour_type,
+                metrics.ct_observations,
+                metrics.avg_headway_sec,
+                metrics.stddev_headway_sec,
+                metrics.headway_cv,
+                metrics.avg_scheduled_headway_sec,
+                metrics.ct_bunching,
+                round(metrics.ct_bunching / nullif(metrics.ct_observations, 0) * 100, 2)
+                    AS pct_bunching
+            FROM _metrics AS metrics
+            INNER JOIN _stops AS stops
+                USING (_stop_row)
+            INNER JOIN _trip_keys AS keys
+                ON stops.trip_index = keys.trip_index
+            ORDER BY keys.route_id, keys.direction_id, stops.stop_id, stops.hour_type
+            """,
+            [day, HOUR_TYPES],
+        )
+        conn.unregister("_arrivals")
+        conn.unregister("_metrics")
+        conn.unregister("_stops")
+
+        for table in ("fct_stop_headways", "metric_stop_headways"):
+            conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {table} AS SELECT * FROM _{table} LIMIT 0"
+            )
+        conn.begin()
+        for table in ("fct_stop_headways", "metric_stop_headways"):
+            conn.execute(f"DELETE FROM {table} WHERE service_date = ?", [day])
+            conn.execute(f"INSERT INTO {table} SELECT * FROM _{table}")
+        conn.commit()
+
+    num_arrivals = sum(table.num_rows for table in arrival_rows)
+    context.add_output_metadata(
+        {
+            "route_directions": len(route_directions),
+            "arrivals": num_arrivals,
+            "bunching_incidents": sum(
+                int(table.column("is_bunched").to_numpy().sum())
+                for table in arrival_rows
+            ),
+            "stops": sum(table.num_rows for table in metric_rows),
+            "missing_schedules": snapshots.missing,
+            "compute_seconds": round(seconds, 3),
+        }
+    )
+
+
+stop_headways_job = define_asset_job(
+    "stop_headways_job",
+    selection=[duckdb__stop_headways],
+    partitions_def=service_day_partition_def,
+    # writes to the same DuckDB database as duckdb_job
+    executor_def=in_process_executor,
+)
+
+stop_headways_schedule = build_schedule_from_partitioned_job(
+    stop_headways_job, hour_of_day=5, minute_of_hour=0
+)
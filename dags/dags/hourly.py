@@ -0,0 +1,120 @@
+"""
+Hourly parsing of every feed type in a single run.
+
+parse_job fans out into one run per (feed_type, hour) partition, most of which have
+little to do, so run launch overhead dominates. parse_hour_job instead handles all feed
+types for an hour in one run, sharing a thread pool and storage connections between
+them, and reports materializations for each feed type's raw_files_list and
+parsed_and_grouped_files partitions just as parse_job would.
+
+PARSE_MODE selects which of the two is scheduled, or "incremental" for
+incremental_parse_job (see incremental.py) along with parse_hour_job, which then skips
+the feed types whose hour already has an incremental checkpoint; that leaves it the
+feed types incremental parsing leaves out, and the hours it missed.
+"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+import pendulum
+from dagster import (
+    Config,
+    Failure,
+    MetadataValue,
+    OpExecutionContext,
+    build_schedule_from_partitioned_job,
+    job,
+    op,
+)
+from tabulate import tabulate
+
+from .assets import hour_partition_def, ping_healthcheck
+from .backfill import PARTITION_HOUR_FORMAT, parse_partition, partition_materializations
+from .common import FeedType
+from .incremental import load_checkpoint
+from .metrics import pushed_metrics
+from .storage import get_storage
+
+# "partitioned" schedules parse_job; "hourly" schedules parse_hour_job; "incremental"
+# schedules incremental_parse_job, and parse_hour_job for the hours it didn't checkpoint
+PARSE_MODE = os.getenv("PARSE_MODE", "partitioned")
+PARSE_MODES = ["partitioned", "hourly", "incremental"]
+if PARSE_MODE not in PARSE_MODES:
+    raise ValueError(f"PARSE_MODE must be one of {PARSE_MODES}, not {PARSE_MODE}")
+
+
+class ParseHourConfig(Config):
+    feed_types: List[str] = [feed_type.value for feed_type in FeedType]
+    # should not exceed GCS_MAX_CONNECTIONS
+    max_workers: int = 8
+    force: bool = False
+
+
+@op
+def parse_hour(context: OpExecutionContext, config: ParseHourConfig) -> None:
+    hour = pendulum.from_format(context.partition_key, PARTITION_HOUR_FORMAT)
+    feed_types = list(map(FeedType, config.feed_types))
+    if PARSE_MODE == "incremental" and not config.force:
+        # left to incremental_parse, which compacts every hour it has a checkpoint for
+        checkpointed = [
+            feed_type for feed_type in feed_types if load_checkpoint(feed_type, hour)[1]
+        ]
+        context.log.info(f"Skipping incrementally parsed {checkpointed}")
+        feed_types = [
+            feed_type for feed_type in feed_types if feed_type not in checkpointed
+        ]
+
+    with (
+        pushed_metrics("parse_hour"),
+        ThreadPoolExecutor(max_workers=config.max_workers) as pool,
+    ):
+        results = list(
+            pool.map(
+                lambda feed_type: parse_partition(
+                    feed_type=feed_type, hour=hour, force=config.force
+                ),
+                feed_types,
+            )
+        )
+
+    ping_healthcheck(found_files=any(result.files for result in results))
+
+    for result in results:
+        if result.success:
+            for materialization in partition_materializations(result):
+                context.log_event(materialization)
+
+    summary = tabulate(
+        [
+            {
+                "feed_type": result.feed_type.value,
+                "files": result.files,
+                "aggs": result.groups,
+                "skipped_aggs": result.skipped_groups,
+                "seconds": round(result.seconds, 1),
+                "error": result.error or "",
+            }
+            for result in results
+        ],
+        headers="keys",
+        tablefmt="github",
+    )
+    context.log.info(
+        f"Parsed {hour}:\n{summary}\nStorage limiter: {get_storage().limiter.stats()}"
+    )
+
+    failures = [result for result in results if not result.success]
+    if failures:
+        raise Failure(
+            description=f"Failed to parse {len(failures)} feed types for {hour}",
+            metadata={"summary": MetadataValue.md(summary)},
+        )
+
+
+@job(partitions_def=hour_partition_def)
+def parse_hour_job():
+    parse_hour()
+
+
+parse_hour_schedule = build_schedule_from_partitioned_job(parse_hour_job)
@@ -0,0 +1,348 @@
+"""
+Sub-hourly incremental parsing.
+
+Every few minutes we list the current hour's raw files, parse those the stored
+checkpoint hasn't seen into small micro-batch files, and once the hour has closed
+compact the micro-batches into the same HourAgg outputs and parse outcomes that
+parsed_and_grouped_files would have produced for that partition. Until then, reader.py
+and the DuckDB tables read the hour from its micro-batches, and the RT staging models
+from their __microbatches external tables.
+
+The whole hour is listed every time, rather than starting from the watermark, since
+fetches finish out of order and a raw file may land behind one already parsed; the
+checkpoint's processed names say what's left. The checkpoint is also the source of
+truth for which micro-batches exist; micro-batch files written by a run that failed
+before saving its checkpoint are ignored by readers and cleaned up at compaction time,
+and their raw files are parsed again by the next run.
+
+A pending marker is written alongside each new checkpoint and deleted once its hour is
+compacted, so every run compacts all closed hours left uncompacted, however long ago,
+without listing every checkpoint. Hours that never got a checkpoint, e.g. because the
+schedule was off, are parsed by parse_hour_job instead.
+
+Only scheduled with PARSE_MODE=incremental; see hourly.py.
+"""
+
+import gzip
+import os
+from collections import defaultdict
+from typing import DefaultDict, Dict, List, Tuple, Union
+
+import pendulum
+from dagster import (
+    AssetMaterialization,
+    Config,
+    MultiPartitionKey,
+    OpExecutionContext,
+    ScheduleDefinition,
+    get_dagster_logger,
+    job,
+    op,
+)
+
+from .assets import (
+    HourKey,
+    fetched_ts,
+    hour_key,
+    parse_blobs,
+    raw_hour_prefix,
+    save_hour_agg,
+    save_parse_outcomes,
+)
+from .common import (
+    PARSED_OUTPUT_FORMATS,
+    SERIALIZERS,
+    FeedType,
+    GtfsScheduleFileType,
+    HourAgg,
+    IncrementalParseCheckpoint,
+    MicroBatchAgg,
+    ParsedFileFormat,
+    ParsedRecord,
+    RawFetchedFile,
+    RawFileRef,
+    hive_table,
+    parse_outcomes_path,
+)
+from .metrics import PARSE_BLOBS_LISTED, PARSE_LAG_SECONDS, pushed_metrics
+from .storage import ObjectNotFound, get_storage
+
+# raw files younger than this may still be uploading, so leave them for the next run
+INCREMENTAL_SETTLE_SECONDS = int(os.getenv("INCREMENTAL_SETTLE_SECONDS", 120))
+INCREMENTAL_PARSE_CRON = os.getenv("INCREMENTAL_PARSE_CRON", "*/5 * * * *")
+
+# gtfs_schedule is fetched daily, so there is nothing to gain from parsing it incrementally
+DEFAULT_INCREMENTAL_FEED_TYPES = [
+    feed_type.value for feed_type in FeedType if feed_type != FeedType.gtfs_schedule
+]
+
+PARSE_OUTCOMES_ASSET = "parsed_and_grouped_files"
+
+
+def load_checkpoint(
+    feed_type: FeedType, hour: pendulum.DateTime
+) -> Tuple[IncrementalParseCheckpoint, int]:
+    """
+    Returns the checkpoint and its generation; a generation of 0 means no checkpoint
+    exists yet, which doubles as an "object must not exist" precondition when saving.
+    """
+    checkpoint = IncrementalParseCheckpoint(feed_type=feed_type, hour=hour)
+    # list rather than read, since a read doesn't tell us the generation
+    for obj in get_storage().list(checkpoint.bucket, prefix=checkpoint.gcs_key):
+        if obj.name == checkpoint.gcs_key:
+            break
+    else:
+        return checkpoint, 0
+    try:
+        contents = get_storage().read_bytes(
+            checkpoint.bucket, checkpoint.gcs_key, generation=obj.generation
+        )
+    except ObjectNotFound:
+        return checkpoint, 0
+    assert obj.generation is not None
+    return IncrementalParseCheckpoint.parse_raw(contents), obj.generation
+
+
+def pending_prefix(feed_type: FeedType) -> str:
+    return f"{feed_type.value}__parse_checkpoints__pending/"
+
+
+def pending_key(checkpoint: IncrementalParseCheckpoint) -> str:
+    return f"{pending_prefix(checkpoint.feed_type)}{checkpoint.filename}"
+
+
+def delete_pending(checkpoint: IncrementalParseCheckpoint) -> None:
+    try:
+        get_storage().delete(checkpoint.bucket, pending_key(checkpoint))
+    except ObjectNotFound:
+        pass
+
+
+def pending_hours(feed_type: FeedType) -> List[pendulum.DateTime]:
+    """
+    The hours whose checkpoints haven't been compacted yet, by their pending markers.
+    """
+    prefix = pending_prefix(feed_type)
+    hours = []
+    for obj in get_storage().list(IncrementalParseCheckpoint.bucket, prefix=prefix):
+        hour = pendulum.parse(obj.name.removeprefix(prefix).removesuffix(".json"))
+        assert isinstance(hour, pendulum.DateTime)
+        hours.append(hour.in_tz("UTC"))
+    return sorted(hours)
+
+
+def save_checkpoint(checkpoint: IncrementalParseCheckpoint, generation: int) -> int:
+    if not generation:
+        # written first, so that a checkpoint never exists without its marker
+        get_storage().write_bytes(checkpoint.bucket, pending_key(checkpoint), b"")
+    # the generation precondition stops overlapping runs from clobbering each other
+    saved = get_storage().write_bytes(
+        checkpoint.bucket,
+        checkpoint.gcs_key,
+        checkpoint.json(),
+        content_type="application/json",
+        if_generation_match=generation,
+    )
+    assert saved.generation is not None
+    return saved.generation
+
+
+def microbatch_hour_prefix(
+    table: Union[FeedType, GtfsScheduleFileType], hour: pendulum.DateTime
+) -> str:
+    return "/".join(
+        [
+            f"{hive_table(table, ParsedFileFormat.jsonl_gz)}__microbatches",
+            f"dt={SERIALIZERS[pendulum.Date](hour.date())}",
+            f"hour={SERIALIZERS[pendulum.DateTime](hour)}",
+        ]
+    )
+
+
+def parse_microbatch(
+    checkpoint: IncrementalParseCheckpoint,
+    generation: int,
+    now: pendulum.DateTime,
+) -> int:
+    """
+    Parses the hour's settled raw files that the checkpoint hasn't processed into
+    micro-batches, updating the checkpoint in place; returns the checkpoint's new
+    generation.
+    """
+    logger = get_dagster_logger()
+    feed_type, hour = checkpoint.feed_type, checkpoint.hour
+    limit = now.subtract(seconds=INCREMENTAL_SETTLE_SECONDS)
+    processed = {name for names in checkpoint.processed.values() for name in names}
+    blobs = [
+        RawFileRef.from_object(obj)
+        for obj in get_storage().list(
+            RawFetchedFile.bucket, prefix=raw_hour_prefix(feed_type, hour)
+        )
+        if obj.name not in processed and fetched_ts(obj) <= limit
+    ]
+    PARSE_BLOBS_LISTED.labels(feed_type=feed_type.value, source="incremental").inc(
+        len(blobs)
+    )
+    logger.info(
+        f"Found {len(blobs)} new raw files for {feed_type} {hour} ({len(processed)} already parsed)"
+    )
+    if not blobs:
+        return generation
+
+    by_url: DefaultDict[str, List[RawFileRef]] = defaultdict(list)
+    for blob in blobs:
+        by_url[hour_key(blob).base64url].append(blob)
+
+    for base64url, url_blobs in by_url.items():
+        aggs, outcomes = parse_blobs(files=url_blobs)
+        for table, records in aggs.items():
+            microbatch = MicroBatchAgg(
+                table=table,
+                base64url=base64url,
+                hour=hour,
+                batch=now,
+                format=ParsedFileFormat.jsonl_gz,
+            )
+            if save_hour_agg(agg=microbatch, records=records):
+                checkpoint.microbatches.append(microbatch)
+        checkpoint.processed.setdefault(base64url, []).extend(
+            blob.name for blob in url_blobs
+        )
+        checkpoint.outcomes.extend(outcomes)
+
+    checkpoint.watermark = max(
+        [fetched_ts(blob) for blob in blobs]
+        + ([checkpoint.watermark] if checkpoint.watermark else [])
+    )
+    PARSE_LAG_SECONDS.labels(feed_type=feed_type.value).set(
+        (pendulum.now(tz="UTC") - checkpoint.watermark).total_seconds()
+    )
+    return save_checkpoint(checkpoint, generation)
+
+
+def load_microbatch(microbatch: MicroBatchAgg) -> List[ParsedRecord]:
+    contents = get_storage().read_bytes(microbatch.bucket, microbatch.gcs_key)
+    return [
+        ParsedRecord.parse_raw(line)
+        for line in gzip.decompress(contents).decode("utf-8").splitlines()
+        if line
+    ]
+
+
+def compact_hour(
+    checkpoint: IncrementalParseCheckpoint,
+    generation: int,
+    now: pendulum.DateTime,
+) -> int:
+    """
+    Parses any stragglers for a closed hour and merges its micro-batches into the
+    canonical hourly outputs and parse outcomes; returns the checkpoint's new generation.
+    A generation of 0, for a pending marker whose checkpoint was never saved, parses
+    the whole hour.
+    """
+    logger = get_dagster_logger()
+    feed_type, hour = checkpoint.feed_type, checkpoint.hour
+    generation = parse_microbatch(checkpoint, generation, now)
+
+    records: DefaultDict[Tuple, List[ParsedRecord]] = defaultdict(list)
+    for microbatch in checkpoint.microbatches:
+        records[(microbatch.table, microbatch.base64url)].extend(
+            load_microbatch(microbatch)
+        )
+
+    for (table, base64url), table_records in records.items():
+        for fmt in PARSED_OUTPUT_FORMATS:
+            save_hour_agg(
+                agg=HourAgg(
+                    table=table,
+                    format=fmt,
+                    **HourKey(
+                        feed_type=feed_type, hour=hour, base64url=base64url
+                    )._asdict(),
+                ),
+                records=table_records,
+            )
+
+    save_parse_outcomes(
+        checkpoint.bucket,
+        f"{PARSE_OUTCOMES_ASSET}/{parse_outcomes_path(feed_type, hour)}",
+        checkpoint.outcomes,
+    )
+
+    checkpoint.compacted = True
+    generation = save_checkpoint(checkpoint, generation)
+
+    delete_pending(checkpoint)
+
+    storage = get_storage()
+    # also removes orphans from runs that failed before saving their checkpoint
+    for table in {microbatch.table for microbatch in checkpoint.microbatches}:
+        for obj in list(
+            storage.list(checkpoint.bucket, prefix=microbatch_hour_prefix(table, hour))
+        ):
+            storage.delete(obj.bucket, obj.name)
+
+    logger.info(
+        f"Compacted {len(checkpoint.microbatches)} micro-batches into {len(records)} hourly outputs for {feed_type} {hour}"
+    )
+    return generation
+
+
+class IncrementalParseConfig(Config):
+    feed_types: List[str] = DEFAULT_INCREMENTAL_FEED_TYPES
+
+
+@op
+def incremental_parse(
+    context: OpExecutionContext, config: IncrementalParseConfig
+) -> None:
+    now = pendulum.now(tz="UTC")
+    current_hour = now.start_of("hour")
+
+    summary: Dict[str, Dict] = {}
+    with pushed_metrics("incremental_parse"):
+        for feed_type in map(FeedType, config.feed_types):
+            for hour in pending_hours(feed_type):
+                if now < hour.add(hours=1, seconds=INCREMENTAL_SETTLE_SECONDS):
+                    continue
+                checkpoint, generation = load_checkpoint(feed_type, hour)
+                if checkpoint.compacted:
+                    # compacted by a run that failed before deleting the marker
+                    delete_pending(checkpoint)
+                else:
+                    compact_hour(checkpoint, generation, now)
+                    context.log_event(
+                        AssetMaterialization(
+                            asset_key=PARSE_OUTCOMES_ASSET,
+                            partition=MultiPartitionKey(
+                                {
+                                    "feed_type": feed_type.value,
+                                    "hour": hour.format("YYYY-MM-DD-HH:mm"),
+                                }
+                            ),
+                            metadata={
+                                "microbatches": len(checkpoint.microbatches),
+                                "outcomes": len(checkpoint.outcomes),
+                            },
+                        )
+                    )
+
+            checkpoint, generation = load_checkpoint(feed_type, current_hour)
+            parse_microbatch(checkpoint, generation, now)
+            summary[feed_type.value] = {
+                "watermark": str(checkpoint.watermark),
+                "microbatches": len(checkpoint.microbatches),
+            }
+
+    context.log.info(f"Incremental parse checkpoints: {summary}")
+
+
+@job
+def incremental_parse_job():
+    incremental_parse()
+
+
+incremental_parse_schedule = ScheduleDefinition(
+    job=incremental_parse_job,
+    cron_schedule=INCREMENTAL_PARSE_CRON,
+)
@@ -0,0 +1,550 @@
+"""
+A local DuckDB copy of the most-used parsed tables, for fast queries without BigQuery.
+
+Each table asset loads the closed hours of its parsed table that are new, or whose
+objects have changed since they were loaded, within the last DUCKDB_LOOKBACK_DAYS,
+and drops hours whose objects are gone. Hours that incremental.py has yet to compact
+are loaded from their micro-batches, and loaded again once they're compacted. An hour
+is replaced as a whole inside a transaction, as is a whole day once any of it has been
+compacted (see compaction.py), and the hours and days loaded so far are tracked in the
+_loaded_hours table. Rows carry their dt, hour and base64url partition values and the
+typed columns from parquet.TABLE_SPECS. Mart assets rebuild DuckDB
+equivalents of the dbt marts from those tables.
+"""
+
+import datetime
+import gzip
+import hashlib
+import os
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, DefaultDict, Dict, List, Optional, Tuple, Union
+
+import numpy as np
+import pendulum
+import pyarrow as pa  # type: ignore[import]
+from dagster import (
+    AssetExecutionContext,
+    AssetSelection,
+    AssetsDefinition,
+    ScheduleDefinition,
+    asset,
+    define_asset_job,
+    in_process_executor,
+)
+from dagster_duckdb import DuckDBResource
+
+from .common import (
+    FeedType,
+    GtfsScheduleFileType,
+    ParsedFileFormat,
+    ParsedRecord,
+    hive_table,
+)
+from .parquet import DEFAULT_SPEC, TABLE_SPECS, records_to_arrow
+from .reader import (
+    ParsedObject,
+    compacted_hour_filter,
+    hourly_keys,
+    list_parsed_objects,
+    parse_hour,
+)
+from .schedules import ScheduleSnapshot, load_schedule_snapshot
+from .shapes import build_shape_segments, project
+from .storage import get_storage
+
+DUCKDB_DATABASE = os.getenv("DUCKDB_DATABASE", "transit_data.duckdb")
+# the default is relative to each run's working directory, which a run pod throws away,
+# so duckdb_schedule is only registered for a database set explicitly, e.g. on a volume
+DUCKDB_SCHEDULED = "DUCKDB_DATABASE" in os.environ
+DUCKDB_LOOKBACK_DAYS = int(os.getenv("DUCKDB_LOOKBACK_DAYS", 7))
+DUCKDB_CRON = os.getenv("DUCKDB_CRON", "20 * * * *")
+DUCKDB_GROUP = "duckdb"
+
+DUCKDB_TABLES: List[Union[FeedType, GtfsScheduleFileType]] = [
+    FeedType.gtfs_rt__vehicle_positions,
+    FeedType.gtfs_rt__trip_updates,
+    GtfsScheduleFileType.stops_txt,
+    GtfsScheduleFileType.trips_txt,
+    GtfsScheduleFileType.stop_times_txt,
+    GtfsScheduleFileType.shapes_txt,
+]
+
+# the dbt seed; the warehouse sits next to the dags package both here and in the image
+FEED_MAP_CSV = os.getenv(
+    "FEED_MAP_CSV",
+    str(
+        next(
+            (
+                path
+                for path in (
+                    Path(__file__).parents[1] / "warehouse/seeds/feed_map.csv",
+                    Path(__file__).parents[2] / "warehouse/seeds/feed_map.csv",
+                )
+                if path.exists()
+            ),
+            "feed_map.csv",
+        )
+    ),
+)
+
+PARTITION_FIELDS = [
+    pa.field("dt", pa.date32()),
+    pa.field("hour", pa.timestamp("s", tz="UTC")),
+    pa.field("base64url", pa.string()),
+]
+
+
+def duckdb_table_name(table: Union[FeedType, GtfsScheduleFileType]) -> str:
+    return hive_table(table, ParsedFileFormat.jsonl_gz)
+
+
+def duckdb_schema(table: Union[FeedType, GtfsScheduleFileType]) -> pa.Schema:
+    spec = TABLE_SPECS.get(table, DEFAULT_SPEC)
+    fields = [field for field in spec.schema]
+    # the raw JSON is only worth keeping for tables without typed columns
+    if spec.columns:
+        fields = [field for field in fields if field.name not in ("record", "metadata")]
+    return pa.schema(PARTITION_FIELDS + fields)
+
+
+def hour_fingerprint(objects: List[ParsedObject]) -> str:
+    fingerprint = hashlib.sha256(
+        "\n".join(
+            sorted(f"{obj.object.name}#{obj.object.generation}" for obj in objects)
+        ).encode("utf-8")
+    ).hexdigest()
+    return (
+        f"day:{fingerprint}" if any(obj.compacted for obj in objects) else fingerprint
+    )
+
+
+def load_units(
+    objects: List[ParsedObject],
+) -> Dict[pendulum.DateTime, List[ParsedObject]]:
+    """
+    Groups objects into the units that are loaded and replaced together: an hour, or
+    a whole day once any of it has been compacted, keyed by the day's first hour.
+    """
+    compacted_days = {parsed.hour for parsed in objects if parsed.compacted}
+    units: DefaultDict[pendulum.DateTime, List[ParsedObject]] = defaultdict(list)
+    for parsed in objects:
+        day = parsed.hour.start_of("day")
+        units[day if day in compacted_days else parsed.hour].append(parsed)
+    return units
+
+
+def unit_range(
+    key: pendulum.DateTime,
+    fingerprint: str,
+    start: pendulum.DateTime,
+    end: pendulum.DateTime,
+) -> Tuple[pendulum.DateTime, pendulum.DateTime]:
+    """
+    The hours [from, to) of a load unit, by its key and fingerprint; a day is cut to
+    the hours being loaded.
+    """
+    if fingerprint.startswith("day:"):
+        return max(key, start), min(key.add(days=1), end)
+    return key, key.add(hours=1)
+
+
+def load_object(
+    table: Union[FeedType, GtfsScheduleFileType],
+    parsed: ParsedObject,
+    keep_hour: Optional[Callable[[str], bool]] = None,
+) -> pa.Table:
+    """
+    With keep_hour, parsed is a compacted day: rows get back the hour in their
+    metadata, and those whose hour isn't kept are skipped.
+    """
+    contents = get_storage().read_bytes(
+        parsed.object.bucket, parsed.object.name, generation=parsed.object.generation
+    )
+    records = [
+        ParsedRecord.parse_raw(line)
+        for line in gzip.decompress(contents).splitlines()
+        if line.strip()
+    ]
+    if keep_hour:
+        records = [record for record in records if keep_hour(record.metadata["hour"])]
+        hours = [parse_hour(record.metadata["hour"]) for record in records]
+    else:
+        hours = [parsed.hour] * len(records)
+    arrow_table = records_to_arrow(table, records)
+    return pa.Table.from_pydict(
+        {
+            "dt": [parsed.hour.date()] * len(records),
+            "hour": hours,
+            "base64url": [parsed.base64url] * len(records),
+            **{name: arrow_table[name] for name in arrow_table.column_names},
+        },
+        schema=duckdb_schema(table),
+    )
+
+
+def load_new_hours(
+    context: AssetExecutionContext,
+    duckdb: DuckDBResource,
+    table: Union[FeedType, GtfsScheduleFileType],
+) -> None:
+    name = duckdb_table_name(table)
+    end = pendulum.now(tz="UTC").start_of("hour")
+    start = end.subtract(days=DUCKDB_LOOKBACK_DAYS)
+
+    objects = list_parsed_objects(table, start, end, microbatches=True)
+    units = load_units(objects)
+    hourly = hourly_keys(objects)
+
+    def load(parsed: ParsedObject) -> pa.Table:
+        return load_object(
+            table,
+            parsed,
+            (
+                compacted_hour_filter(parsed, hourly, start, end)
+                if parsed.compacted
+                else None
+            ),
+        )
+
+    def replace(conn, key: pendulum.DateTime, fingerprint: str) -> None:
+        """
+        Deletes a unit's rows and its entry in _loaded_hours, inside the caller's
+        transaction.
+        """
+        hour_from, hour_to = unit_range(key, fingerprint, start, end)
+        conn.execute(
+            f"DELETE FROM {name} WHERE hour >= ? AND hour < ?", [hour_from, hour_to]
+        )
+        conn.execute(
+            "DELETE FROM _loaded_hours WHERE table_name = ? AND hour = ?",
+            [name, key],
+        )
+
+    with duckdb.get_connection() as conn:
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS _loaded_hours"
+            " (table_name VARCHAR, hour TIMESTAMPTZ, fingerprint VARCHAR, loaded_at TIMESTAMPTZ)"
+        )
+        conn.register("empty", duckdb_schema(table).empty_table())
+        conn.execute(f"CREATE TABLE IF NOT EXISTS {name} AS SELECT * FROM empty")
+        conn.unregister("empty")
+        loaded: Dict[pendulum.DateTime, str] = {
+            pendulum.instance(hour).in_tz("UTC"): fingerprint
+            for hour, fingerprint in conn.execute(
+                "SELECT hour, fingerprint FROM _loaded_hours WHERE table_name = ?",
+                [name],
+            ).fetchall()
+        }
+        # e.g. hours merged into their day by compaction
+        vanished = [key for key in loaded if start <= key < end and key not in units]
+        for key in vanished:
+            conn.begin()
+            replace(conn, key, loaded[key])
+            conn.commit()
+
+    new_units = sorted(
+        key for key, unit in units.items() if loaded.get(key) != hour_fingerprint(unit)
+    )
+    context.log.info(
+        f"Loading {len(new_units)} new or changed hours or days of {name} out of {len(units)}"
+    )
+
+    rows = 0
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        for key in new_units:
+            unit = units[key]
+            fingerprint = hour_fingerprint(unit)
+            # downloaded before connecting, so the database is only held while writing
+            batches = list(pool.map(load, unit))
+            with duckdb.get_connection() as conn:
+                conn.begin()
+                replace(conn, key, fingerprint)
+                # a unit that was a day, and is now an hour, leaves its other hours to
+                # their own units
+                if loaded.get(key, "").startswith("day:"):
+                    replace(conn, key, loaded[key])
+                for batch in batches:
+                    conn.register("batch", batch)
+                    conn.execute(f"INSERT INTO {name} SELECT * FROM batch")
+                    conn.unregister("batch")
+                    rows += batch.num_rows
+                conn.execute(
+                    "INSERT INTO _loaded_hours VALUES (?, ?, ?, now())",
+                    [name, key, fingerprint],
+                )
+                conn.commit()
+
+    with duckdb.get_connection() as conn:
+        total = conn.execute(f"SELECT count(*) FROM {name}").fetchone()
+
+    context.add_output_metadata(
+        {
+            "hours_loaded": len(new_units),
+            "hours_removed": len(vanished),
+            "rows_loaded": rows,
+            "total_rows": total[0] if total else 0,
+        }
+    )
+
+
+def build_duckdb_table_asset(
+    table: Union[FeedType, GtfsScheduleFileType],
+) -> AssetsDefinition:
+    @asset(
+        name=f"duckdb__{duckdb_table_name(table)}",
+        group_name=DUCKDB_GROUP,
+        compute_kind="duckdb",
+    )
+    def duckdb_table(context: AssetExecutionContext, duckdb: DuckDBResource) -> None:
+        load_new_hours(context, duckdb, table)
+
+    return duckdb_table
+
+
+duckdb_table_assets = [build_duckdb_table_asset(table) for table in DUCKDB_TABLES]
+
+
+class ScheduleSnapshots:
+    """
+    The snapshots of the schedules a query refers to by their parsed tables'
+    base64url and hour, each loaded once; None for a schedule whose raw file is gone.
+    """
+
+    def __init__(self) -> None:
+        self.snapshots: Dict[
+            Tuple[str, pendulum.DateTime], Optional[ScheduleSnapshot]
+        ] = {}
+
+    def get(
+        self, base64url: str, hour: datetime.datetime
+    ) -> Optional[ScheduleSnapshot]:
+        key = (base64url, pendulum.instance(hour).in_tz("UTC"))
+        if key not in self.snapshots:
+            self.snapshots[key] = load_schedule_snapshot(*key)
+        return self.snapshots[key]
+
+    @property
+    def missing(self) -> int:
+        return sum(snapshot is None for snapshot in self.snapshots.values())
+
+
+def shape_points(
+    snapshots: ScheduleSnapshots,
+    shape_keys: List[Tuple[int, str, datetime.datetime, str]],
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    The shape_index, lat and lon of the points of each (shape_index, base64url, hour,
+    shape_id) key's shape, ordered by shape_index and then sequence as
+    build_shape_segments expects; points without coordinates are skipped.
+    """
+    indexes, lats, lons = [np.empty(0, dtype=np.int64)], [np.empty(0)], [np.empty(0)]
+    for shape_index, base64url, hour, shape_id in sorted(shape_keys):
+        snapshot = snapshots.get(base64url, hour)
+        if snapshot is None:
+            continue
+        points = snapshot.shape_points(shape_id)
+        lat, lon = snapshot.shape_pt_lat[points], snapshot.shape_pt_lon[points]
+        valid = ~np.isnan(lat) & ~np.isnan(lon)
+        indexes.append(np.full(np.count_nonzero(valid), shape_index, dtype=np.int64))
+        lats.append(lat[valid])
+        lons.append(lon[valid])
+    return np.concatenate(indexes), np.concatenate(lats), np.concatenate(lons)
+
+
+@asset(
+    group_name=DUCKDB_GROUP,
+    compute_kind="duckdb",
+    deps=[f"duckdb__{duckdb_table_name(FeedType.gtfs_rt__vehicle_positions)}"],
+)
+def duckdb__fct_vehicle_positions(
+    context: AssetExecutionContext, duckdb: DuckDBResource
+) -> None:
+    """
+    The equivalent of the fct_vehicle_positions dbt mart, over every loaded date.
+    """
+    with duckdb.get_connection() as conn:
+        conn.execute(
+            f"""
+            CREATE OR REPLACE TABLE fct_vehicle_positions AS
+            SELECT DISTINCT
+                base64url AS _b64_url,
+                dt,
+                -- matches the dbt mart, including its early-morning service caveat
+                CAST(
+                    timezone('America/New_York', vehicle_timestamp - INTERVAL 3 HOUR)
+                    AS DATE
+                ) AS service_date,
+                vehicle_timestamp,
+                latitude,
+                longitude,
+                current_stop_sequence,
+                trip_id,
+                stop_id,
+                current_status,
+                trip_route_id,
+                vehicle_id,
+                trip_schedule_relationship
+            FROM {duckdb_table_name(FeedType.gtfs_rt__vehicle_positions)}
+            """
+        )
+        rows = conn.execute("SELECT count(*) FROM fct_vehicle_positions").fetchone()
+    context.add_output_metadata({"rows": rows[0] if rows else 0})
+
+
+@asset(
+    group_name=DUCKDB_GROUP,
+    compute_kind="duckdb",
+    deps=[
+        duckdb__fct_vehicle_positions,
+        f"duckdb__{duckdb_table_name(GtfsScheduleFileType.trips_txt)}",
+    ],
+)
+def duckdb__fct_observed_shape_times(
+    context: AssetExecutionContext, duckdb: DuckDBResource
+) -> None:
+    """
+    The equivalent of the fct_observed_shape_times dbt mart, with the geography
+    functions replaced by the NumPy projection in shapes.py. Without the calendar,
+    each position's trip (and so its shape) comes from the latest schedule loaded
+    before the position, rather than from the trip's service date. Shapes are read
+    from that schedule's snapshot (see schedules.py).
+    """
+    trips = duckdb_table_name(GtfsScheduleFileType.trips_txt)
+    snapshots = ScheduleSnapshots()
+    with duckdb.get_connection() as conn:
+        conn.execute(
+            f"CREATE OR REPLACE TEMP TABLE _feed_map AS SELECT * FROM read_csv('{FEED_MAP_CSV}', header = true)"
+        )
+        conn.execute(
+            f"""
+            CREATE OR REPLACE TEMP TABLE _observed AS
+            SELECT
+                row_number() OVER () AS _row,
+                positions.*,
+                feed_map.schedule_b64_url,
+                trips.hour AS schedule_hour,
+                trips.shape_id,
+                trips.route_id AS trip_route_id
+            FROM fct_vehicle_positions AS positions
+            LEFT JOIN _feed_map AS feed_map
+                ON positions._b64_url = feed_map.rt_b64_url
+            ASOF LEFT JOIN {trips} AS trips
+                ON feed_map.schedule_b64_url = trips.base64url
+                AND positions.trip_id = trips.trip_id
+                AND positions.vehicle_timestamp >= trips.hour
+            WHERE positions.trip_id IS NOT NULL
+            """
+        )
+        conn.execute(
+            """
+            CREATE OR REPLACE TEMP TABLE _shape_keys AS
+            SELECT
+                *,
+                row_number() OVER (ORDER BY base64url, hour, shape_id) - 1 AS shape_index
+            FROM (
+                SELECT DISTINCT
+                    schedule_b64_url AS base64url,
+                    schedule_hour AS hour,
+                    shape_id
+                FROM _observed
+                WHERE shape_id IS NOT NULL
+            )
+            """
+        )
+        shape_keys = conn.execute(
+            "SELECT shape_index, base64url, hour, shape_id FROM _shape_keys"
+        ).fetchall()
+        positions = conn.execute(
+            """
+            SELECT
+                observed._row,
+                coalesce(keys.shape_index, -1) AS shape_index,
+                observed.latitude,
+                observed.longitude
+            FROM _observed AS observed
+            LEFT JOIN _shape_keys AS keys
+                ON observed.schedule_b64_url = keys.base64url
+                AND observed.schedule_hour = keys.hour
+                AND observed.shape_id = keys.shape_id
+            ORDER BY observed._row
+            """
+        ).fetchnumpy()
+
+        points = shape_points(snapshots, shape_keys)
+        start = time.monotonic()
+        segments = build_shape_segments(*points, len(shape_keys))
+        projection = project(
+            segments,
+            positions["shape_index"],
+            np.ma.filled(positions["latitude"].astype(np.float64), np.nan),
+            np.ma.filled(positions["longitude"].astype(np.float64), np.nan),
+        )
+        seconds = time.monotonic() - start
+
+        conn.register(
+            "_projection",
+            pa.table(
+                {
+                    "_row": positions["_row"],
+                    "lat": pa.array(projection.lat, from_pandas=True),
+                    "lon": pa.array(projection.lon, from_pandas=True),
+                    "fraction": pa.array(projection.fraction, from_pandas=True),
+                }
+            ),
+        )
+        conn.execute(
+            """
+            CREATE OR REPLACE TABLE fct_observed_shape_times AS
+            SELECT
+                observed._b64_url,
+                observed.schedule_b64_url,
+                observed.dt,
+                observed.service_date,
+                observed.vehicle_timestamp,
+                observed.latitude,
+                observed.longitude,
+                observed.current_stop_sequence,
+                observed.trip_id,
+                observed.vehicle_id,
+                observed.trip_schedule_relationship,
+                observed.shape_id,
+                observed.trip_route_id,
+                CASE WHEN projection.lat IS NOT NULL
+                    THEN printf('POINT(%s %s)', projection.lon::VARCHAR, projection.lat::VARCHAR)
+                END AS shape_closest_point_to_vehicle_position,
+                projection.fraction AS shape_closest_point_to_vehicle_position_as_pct
+            FROM _observed AS observed
+            INNER JOIN _projection AS projection
+                USING (_row)
+            ORDER BY observed._row
+            """
+        )
+        conn.unregister("_projection")
+
+    projected = int(np.count_nonzero(~np.isnan(projection.fraction)))
+    context.add_output_metadata(
+        {
+            "rows": len(projection.fraction),
+            "projected_rows": projected,
+            "shapes": segments.num_shapes,
+            "missing_schedules": snapshots.missing,
+            "projection_seconds": round(seconds, 3),
+        }
+    )
+
+
+# a DuckDB database takes a single writing process, so the group's assets run one at a
+# time in the run's own process
+duckdb_job = define_asset_job(
+    "duckdb_job",
+    selection=AssetSelection.groups(DUCKDB_GROUP),
+    executor_def=in_process_executor,
+)
+
+duckdb_schedule = ScheduleDefinition(
+    job=duckdb_job,
+    cron_schedule=DUCKDB_CRON,
+)
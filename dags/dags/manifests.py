@@ -0,0 +1,149 @@
+"""
+Reconciliation of the fetcher-written hourly raw manifests against the raw bucket.
+
+raw_files_list trusts a manifest when one exists, so a fetch that saved its file but
+failed to append to the manifest would silently go unparsed; this job lists the bucket
+for recent closed hours and reports (and optionally repairs) any disagreement.
+"""
+
+import os
+from typing import List
+
+import pendulum
+from dagster import (
+    Config,
+    Failure,
+    MetadataValue,
+    OpExecutionContext,
+    ScheduleDefinition,
+    job,
+    op,
+)
+from pydantic import BaseModel
+from tabulate import tabulate
+
+from .assets import fetched_ts, load_raw_manifest, raw_hour_prefix
+from .common import FeedType, RawFetchedFile, RawHourManifest, RawManifestEntry
+from .storage import get_storage
+
+RECONCILE_MANIFESTS_CRON = os.getenv("RECONCILE_MANIFESTS_CRON", "30 1 * * *")
+
+
+class ManifestReconciliation(BaseModel):
+    feed_type: FeedType
+    hour: pendulum.DateTime
+    manifest_exists: bool
+    listed: List[RawManifestEntry]
+    bundled: List[RawManifestEntry] = []
+    missing_from_manifest: List[str]
+    missing_from_bucket: List[str]
+
+    @property
+    def ok(self) -> bool:
+        # an hour with no fetches at all legitimately has no manifest
+        if not self.manifest_exists:
+            return not self.listed
+        return not self.missing_from_manifest and not self.missing_from_bucket
+
+
+def reconcile_manifest(
+    feed_type: FeedType, hour: pendulum.DateTime
+) -> ManifestReconciliation:
+    manifest = load_raw_manifest(feed_type=feed_type, hour=hour)
+    listed = [
+        RawManifestEntry(
+            key=obj.name,
+            size=obj.size,
+            md5_hash=obj.md5_hash,
+            generation=obj.generation,
+            tick=fetched_ts(obj),
+        )
+        for obj in get_storage().list(
+            RawFetchedFile.bucket, prefix=raw_hour_prefix(feed_type, hour)
+        )
+    ]
+    listed_keys = {entry.key for entry in listed}
+    # bundled objects are deliberately gone from the listing
+    bundled = [entry for entry in manifest or [] if entry.bundle]
+    manifest_keys = {entry.key for entry in manifest or [] if not entry.bundle}
+    return ManifestReconciliation(
+        feed_type=feed_type,
+        hour=hour,
+        manifest_exists=manifest is not None,
+        listed=listed,
+        bundled=bundled,
+        missing_from_manifest=sorted(listed_keys - manifest_keys),
+        missing_from_bucket=sorted(manifest_keys - listed_keys),
+    )
+
+
+def repair_manifest(reconciliation: ManifestReconciliation) -> None:
+    manifest = RawHourManifest(
+        feed_type=reconciliation.feed_type, hour=reconciliation.hour
+    )
+    get_storage().write_bytes(
+        manifest.bucket,
+        manifest.gcs_key,
+        "\n".join(
+            entry.json() for entry in reconciliation.bundled + reconciliation.listed
+        ),
+        content_type="application/x-ndjson",
+    )
+
+
+class ReconcileManifestsConfig(Config):
+    feed_types: List[str] = [feed_type.value for feed_type in FeedType]
+    # closed hours to check, counting back from the most recent one
+    hours: int = 24
+    # rewrite disagreeing manifests from the bucket listing
+    repair: bool = False
+
+
+@op
+def reconcile_manifests(
+    context: OpExecutionContext, config: ReconcileManifestsConfig
+) -> None:
+    current_hour = pendulum.now(tz="UTC").start_of("hour")
+
+    gaps = []
+    for hours_ago in range(config.hours, 0, -1):
+        hour = current_hour.subtract(hours=hours_ago)
+        for feed_type in map(FeedType, config.feed_types):
+            reconciliation = reconcile_manifest(feed_type, hour)
+            if reconciliation.ok:
+                continue
+            gaps.append(
+                {
+                    "feed_type": feed_type.value,
+                    "hour": hour.to_iso8601_string(),
+                    "manifest_exists": reconciliation.manifest_exists,
+                    "missing_from_manifest": len(reconciliation.missing_from_manifest),
+                    "missing_from_bucket": len(reconciliation.missing_from_bucket),
+                }
+            )
+            if config.repair:
+                context.log.warning(f"Repairing manifest for {feed_type} {hour}")
+                repair_manifest(reconciliation)
+
+    if not gaps:
+        context.log.info(f"All manifests for the last {config.hours} hours match")
+        return
+
+    table = tabulate(gaps, headers="keys", tablefmt="github")
+    context.log.warning(f"Found {len(gaps)} manifest gaps:\n{table}")
+    if not config.repair:
+        raise Failure(
+            description=f"Found {len(gaps)} raw manifest gaps",
+            metadata={"gaps": MetadataValue.md(table)},
+        )
+
+
+@job
+def reconcile_manifests_job():
+    reconcile_manifests()
+
+
+reconcile_manifests_schedule = ScheduleDefinition(
+    job=reconcile_manifests_job,
+    cron_schedule=RECONCILE_MANIFESTS_CRON,
+)
@@ -0,0 +1,141 @@
+"""
+Prometheus metrics for parsing.
+
+Dagster runs are short-lived processes that Prometheus can't scrape, so each parse step
+pushes its metrics when it finishes: to the Pushgateway at PROMETHEUS_PUSHGATEWAY,
+and/or to the file at PROMETHEUS_TEXTFILE (e.g. for node_exporter's textfile
+collector, or just to look at locally). Neither is set by default, and then nothing is
+pushed.
+
+Pushes are grouped by step and feed type, and replace that group's previous values;
+the counters and histograms therefore describe the latest run of each step, and
+Prometheus' increase() and rate() treat every new run as a counter reset.
+"""
+
+import os
+from contextlib import contextmanager
+from typing import Callable, Iterator
+
+from dagster import get_dagster_logger
+from prometheus_client import (
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    pushadd_to_gateway,
+    write_to_textfile,
+)
+
+from .storage import get_storage
+
+PROMETHEUS_PUSHGATEWAY = os.getenv("PROMETHEUS_PUSHGATEWAY")
+PROMETHEUS_TEXTFILE = os.getenv("PROMETHEUS_TEXTFILE")
+PROMETHEUS_JOB = os.getenv("PROMETHEUS_JOB", "dags")
+
+# kept apart from the default registry, so pushes don't carry process metrics
+REGISTRY = CollectorRegistry()
+
+# parsing a single raw file takes from milliseconds up to minutes for GTFS schedules
+DURATION_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+PARSE_BLOBS_LISTED = Counter(
+    name="parse_blobs_listed",
+    documentation="Raw files listed for parsing, by where the listing came from.",
+    labelnames=("feed_type", "source"),
+    registry=REGISTRY,
+)
+
+PARSE_DOWNLOADED_BYTES = Counter(
+    name="parse_downloaded_bytes",
+    documentation="Bytes of raw files downloaded for parsing.",
+    labelnames=("feed_type",),
+    registry=REGISTRY,
+)
+
+PARSE_DURATION_SECONDS = Histogram(
+    name="parse_duration_seconds",
+    documentation="Duration of parsing a single raw file into records.",
+    labelnames=("feed_type",),
+    buckets=DURATION_BUCKETS,
+    registry=REGISTRY,
+)
+
+PARSE_RECORDS = Counter(
+    name="parse_records",
+    documentation="Records emitted by parsing, by feed type and output table.",
+    labelnames=("feed_type", "table"),
+    registry=REGISTRY,
+)
+
+PARSE_FAILURES = Counter(
+    name="parse_failures",
+    documentation="Raw files that failed to parse.",
+    labelnames=("feed_type", "exc_type"),
+    registry=REGISTRY,
+)
+
+PARSE_UPLOAD_DURATION_SECONDS = Histogram(
+    name="parse_upload_duration_seconds",
+    documentation="Duration of uploading a single parsed file.",
+    labelnames=("table", "format"),
+    buckets=DURATION_BUCKETS,
+    registry=REGISTRY,
+)
+
+PARSE_LAG_SECONDS = Gauge(
+    name="parse_lag_seconds",
+    documentation="Age of the newest raw data when it was parsed; the end of the hour for hourly parses, the watermark for incremental ones.",
+    labelnames=("feed_type",),
+    registry=REGISTRY,
+)
+
+# the storage limiter keeps its own counts, so these are read when pushed
+STORAGE_LIMITER_STATS = Gauge(
+    name="storage_limiter",
+    documentation="Adaptive storage concurrency limiter state; throttles and latency_spikes are cumulative.",
+    labelnames=("stat",),
+    registry=REGISTRY,
+)
+
+
+def storage_limiter_stat(stat: str) -> Callable[[], float]:
+    def read() -> float:
+        return get_storage().limiter.stats()[stat]
+
+    return read
+
+
+for _stat in ("limit", "in_flight", "throttles", "latency_spikes"):
+    STORAGE_LIMITER_STATS.labels(stat=_stat).set_function(storage_limiter_stat(_stat))
+
+
+def push_metrics(step: str, feed_type: str = "all") -> None:
+    """
+    Pushes everything recorded by this process so far; failing to push is logged
+    rather than failing the step.
+    """
+    logger = get_dagster_logger()
+    grouping_key = {"step": step, "feed_type": feed_type}
+    if PROMETHEUS_PUSHGATEWAY:
+        try:
+            pushadd_to_gateway(
+                PROMETHEUS_PUSHGATEWAY,
+                job=PROMETHEUS_JOB,
+                registry=REGISTRY,
+                grouping_key=grouping_key,
+            )
+        except OSError as e:
+            logger.warning(f"Failed to push metrics to {PROMETHEUS_PUSHGATEWAY}: {e}")
+    if PROMETHEUS_TEXTFILE:
+        write_to_textfile(PROMETHEUS_TEXTFILE, REGISTRY)
+
+
+@contextmanager
+def pushed_metrics(step: str, feed_type: str = "all") -> Iterator[None]:
+    """
+    Pushes metrics once the with block is done, whether or not it succeeded.
+    """
+    try:
+        yield
+    finally:
+        push_metrics(step, feed_type)
@@ -0,0 +1,405 @@
+"""
+Typed Parquet serialization of parsed hour aggregations.
+
+The hot tables (GTFS-RT vehicle positions/trip updates and schedule stop_times) get
+explicit schemas with flattened columns so BigQuery can prune columns instead of
+JSON-parsing every row; every table also keeps the raw `record` and `metadata` as JSON
+strings so the existing JSON_VALUE-based staging logic still applies.
+"""
+
+import io
+import json
+from typing import Any, Callable, Dict, List, Optional, Sequence, Union
+
+import pyarrow as pa  # type: ignore[import]
+import pyarrow.parquet as pq  # type: ignore[import]
+from pydantic.dataclasses import dataclass
+
+from .common import FeedType, GtfsScheduleFileType, ParsedRecord
+
+Getter = Callable[[Dict[str, Any]], Any]
+
+PARQUET_COMPRESSION = "zstd"
+
+
+def _path(*keys: str, cast: Optional[Callable[[Any], Any]] = None) -> Getter:
+    def getter(record: Dict[str, Any]) -> Any:
+        value: Any = record
+        for key in keys:
+            if not isinstance(value, dict):
+                return None
+            value = value.get(key)
+        if value is None or value == "":
+            return None
+        return cast(value) if cast else value
+
+    return getter
+
+
+def _gtfs_time_to_seconds(value: str) -> int:
+    # GTFS times may exceed 24:00:00 for trips running past midnight
+    hours, minutes, seconds = value.split(":")
+    return int(hours) * 3600 + int(minutes) * 60 + int(seconds)
+
+
+@dataclass(frozen=True)
+class ParquetColumn:
+    name: str
+    type: Any  # pa.DataType, but pydantic can't validate it
+    getter: Callable
+
+
+@dataclass(frozen=True)
+class ParquetTableSpec:
+    columns: List[ParquetColumn]
+    sort_by: List[str]
+
+    @property
+    def schema(self) -> pa.Schema:
+        return pa.schema(
+            [(column.name, column.type) for column in self.columns]
+            + [("record", pa.string()), ("metadata", pa.string())]
+        )
+
+
+UTC_SECONDS = pa.timestamp("s", tz="UTC")
+
+GTFS_RT_HEADER_COLUMNS = [
+    ParquetColumn(
+        name="gtfs_realtime_version",
+        type=pa.string(),
+        getter=_path("header", "gtfsRealtimeVersion"),
+    ),
+    ParquetColumn(
+        name="incrementality",
+        type=pa.string(),
+        getter=_path("header", "incrementality"),
+    ),
+    ParquetColumn(
+        name="gtfs_rt_message_timestamp",
+        type=UTC_SECONDS,
+        getter=_path("header", "timestamp", cast=int),
+    ),
+    ParquetColumn(name="entity_id", type=pa.string(), getter=_path("entity", "id")),
+]
+
+
+def gtfs_rt_descriptor_columns(parent: str) -> List[ParquetColumn]:
+    return [
+        ParquetColumn(
+            name="trip_id",
+            type=pa.string(),
+            getter=_path("entity", parent, "trip", "tripId"),
+        ),
+        ParquetColumn(
+            name="trip_route_id",
+            type=pa.string(),
+            getter=_path("entity", parent, "trip", "routeId"),
+        ),
+        ParquetColumn(
+            name="trip_direction_id",
+            type=pa.int32(),
+            getter=_path("entity", parent, "trip", "directionId", cast=int),
+        ),
+        ParquetColumn(
+            name="trip_start_date",
+            type=pa.string(),
+            getter=_path("entity", parent, "trip", "startDate"),
+        ),
+        ParquetColumn(
+            name="trip_start_time",
+            type=pa.string(),
+            getter=_path("entity", parent, "trip", "startTime"),
+        ),
+        ParquetColumn(
+            name="trip_schedule_relationship",
+            type=pa.string(),
+            getter=_path("entity", parent, "trip", "scheduleRelationship"),
+        ),
+        ParquetColumn(
+            name="vehicle_id",
+            type=pa.string(),
+            getter=_path("entity", parent, "vehicle", "id"),
+        ),
+        ParquetColumn(
+            name="vehicle_label",
+            type=pa.string(),
+            getter=_path("entity", parent, "vehicle", "label"),
+        ),
+    ]
+
+
+def _stop_time_event(event: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    if not event:
+        return None
+    return {
+        "time": int(event["time"]) if "time" in event else None,
+        "delay": int(event["delay"]) if "delay" in event else None,
+        "uncertainty": int(event["uncertainty"]) if "uncertainty" in event else None,
+    }
+
+
+def _stop_time_updates(record: Dict[str, Any]) -> List[Dict[str, Any]]:
+    updates = _path("entity", "tripUpdate", "stopTimeUpdate")(record) or []
+    return [
+        {
+            "stop_sequence": update.get("stopSequence"),
+            "stop_id": update.get("stopId"),
+            "arrival": _stop_time_event(update.get("arrival")),
+            "departure": _stop_time_event(update.get("departure")),
+            "schedule_relationship": update.get("scheduleRelationship"),
+        }
+        for update in updates
+    ]
+
+
+STOP_TIME_EVENT = pa.struct(
+    [
+        ("time", UTC_SECONDS),
+        ("delay", pa.int32()),
+        ("uncertainty", pa.int32()),
+    ]
+)
+
+TABLE_SPECS: Dict[Union[FeedType, GtfsScheduleFileType], ParquetTableSpec] = {
+    FeedType.gtfs_rt__vehicle_positions: ParquetTableSpec(
+        columns=[
+            *GTFS_RT_HEADER_COLUMNS,
+            *gtfs_rt_descriptor_columns("vehicle"),
+            ParquetColumn(
+                name="latitude",
+                type=pa.float64(),
+                getter=_path("entity", "vehicle", "position", "latitude", cast=float),
+            ),
+            ParquetColumn(
+                name="longitude",
+                type=pa.float64(),
+                getter=_path("entity", "vehicle", "position", "longitude", cast=float),
+            ),
+            ParquetColumn(
+                name="bearing",
+                type=pa.float32(),
+                getter=_path("entity", "vehicle", "position", "bearing", cast=float),
+            ),
+            ParquetColumn(
+                name="odometer",
+                type=pa.float64(),
+                getter=_path("entity", "vehicle", "position", "odometer", cast=float),
+            ),
+            ParquetColumn(
+                name="speed",
+                type=pa.float32(),
+                getter=_path("entity", "vehicle", "position", "speed", cast=float),
+            ),
+            ParquetColumn(
+                name="stop_id",
+                type=pa.string(),
+                getter=_path("entity", "vehicle", "stopId"),
+            ),
+            ParquetColumn(
+                name="current_stop_sequence",
+                type=pa.int32(),
+                getter=_path("entity", "vehicle", "currentStopSequence", cast=int),
+            ),
+            ParquetColumn(
+                name="current_status",
+                type=pa.string(),
+                getter=_path("entity", "vehicle", "currentStatus"),
+            ),
+            ParquetColumn(
+                name="vehicle_timestamp",
+                type=UTC_SECONDS,
+                getter=_path("entity", "vehicle", "timestamp", cast=int),
+            ),
+        ],
+        sort_by=["vehicle_id", "vehicle_timestamp"],
+    ),
+    FeedType.gtfs_rt__trip_updates: ParquetTableSpec(
+        columns=[
+            *GTFS_RT_HEADER_COLUMNS,
+            *gtfs_rt_descriptor_columns("tripUpdate"),
+            ParquetColumn(
+                name="trip_update_timestamp",
+                type=UTC_SECONDS,
+                getter=_path("entity", "tripUpdate", "timestamp", cast=int),
+            ),
+            ParquetColumn(
+                name="delay",
+                type=pa.int32(),
+                getter=_path("entity", "tripUpdate", "delay", cast=int),
+            ),
+            ParquetColumn(
+                name="stop_time_updates",
+                type=pa.list_(
+                    pa.struct(
+                        [
+                            ("stop_sequence", pa.int32()),
+                            ("stop_id", pa.string()),
+                            ("arrival", STOP_TIME_EVENT),
+                            ("departure", STOP_TIME_EVENT),
+                            ("schedule_relationship", pa.string()),
+                        ]
+                    )
+                ),
+                getter=_stop_time_updates,
+            ),
+        ],
+        sort_by=["trip_id", "trip_update_timestamp"],
+    ),
+    GtfsScheduleFileType.stop_times_txt: ParquetTableSpec(
+        columns=[
+            ParquetColumn(name="trip_id", type=pa.string(), getter=_path("trip_id")),
+            ParquetColumn(
+                name="arrival_time", type=pa.string(), getter=_path("arrival_time")
+            ),
+            ParquetColumn(
+                name="arrival_time_seconds",
+                type=pa.int32(),
+                getter=_path("arrival_time", cast=_gtfs_time_to_seconds),
+            ),
+            ParquetColumn(
+                name="departure_time", type=pa.string(), getter=_path("departure_time")
+            ),
+            ParquetColumn(
+                name="departure_time_seconds",
+                type=pa.int32(),
+                getter=_path("departure_time", cast=_gtfs_time_to_seconds),
+            ),
+            ParquetColumn(name="stop_id", type=pa.string(), getter=_path("stop_id")),
+            ParquetColumn(
+                name="stop_sequence",
+                type=pa.int32(),
+                getter=_path("stop_sequence", cast=int),
+            ),
+            ParquetColumn(
+                name="stop_headsign", type=pa.string(), getter=_path("stop_headsign")
+            ),
+            ParquetColumn(
+                name="pickup_type",
+                type=pa.int32(),
+                getter=_path("pickup_type", cast=int),
+            ),
+            ParquetColumn(
+                name="drop_off_type",
+                type=pa.int32(),
+                getter=_path("drop_off_type", cast=int),
+            ),
+            ParquetColumn(
+                name="shape_dist_traveled",
+                type=pa.float64(),
+                getter=_path("shape_dist_traveled", cast=float),
+            ),
+            ParquetColumn(
+                name="timepoint",
+                type=pa.int32(),
+                getter=_path("timepoint", cast=int),
+            ),
+        ],
+        sort_by=["trip_id", "stop_sequence"],
+    ),
+    GtfsScheduleFileType.shapes_txt: ParquetTableSpec(
+        columns=[
+            ParquetColumn(name="shape_id", type=pa.string(), getter=_path("shape_id")),
+            ParquetColumn(
+                name="shape_pt_lat",
+                type=pa.float64(),
+                getter=_path("shape_pt_lat", cast=float),
+            ),
+            ParquetColumn(
+                name="shape_pt_lon",
+                type=pa.float64(),
+                getter=_path("shape_pt_lon", cast=float),
+            ),
+            ParquetColumn(
+                name="shape_pt_sequence",
+                type=pa.int32(),
+                getter=_path("shape_pt_sequence", cast=int),
+            ),
+            ParquetColumn(
+                name="shape_dist_traveled",
+                type=pa.float64(),
+                getter=_path("shape_dist_traveled", cast=float),
+            ),
+        ],
+        sort_by=["shape_id", "shape_pt_sequence"],
+    ),
+    GtfsScheduleFileType.stops_txt: ParquetTableSpec(
+        columns=[
+            ParquetColumn(name="stop_id", type=pa.string(), getter=_path("stop_id")),
+            ParquetColumn(
+                name="stop_lat",
+                type=pa.float64(),
+                getter=_path("stop_lat", cast=float),
+            ),
+            ParquetColumn(
+                name="stop_lon",
+                type=pa.float64(),
+                getter=_path("stop_lon", cast=float),
+            ),
+            ParquetColumn(
+                name="stop_name",
+                type=pa.string(),
+                getter=_path("stop_name", cast=str.strip),
+            ),
+        ],
+        sort_by=["stop_id"],
+    ),
+    GtfsScheduleFileType.trips_txt: ParquetTableSpec(
+        columns=[
+            ParquetColumn(name="route_id", type=pa.string(), getter=_path("route_id")),
+            ParquetColumn(name="trip_id", type=pa.string(), getter=_path("trip_id")),
+            ParquetColumn(
+                name="service_id", type=pa.string(), getter=_path("service_id")
+            ),
+            ParquetColumn(
+                name="trip_headsign", type=pa.string(), getter=_path("trip_headsign")
+            ),
+            ParquetColumn(
+                name="trip_short_name",
+                type=pa.string(),
+                getter=_path("trip_short_name"),
+            ),
+            ParquetColumn(
+                name="direction_id",
+                type=pa.int32(),
+                getter=_path("direction_id", cast=int),
+            ),
+            ParquetColumn(name="block_id", type=pa.string(), getter=_path("block_id")),
+            ParquetColumn(name="shape_id", type=pa.string(), getter=_path("shape_id")),
+        ],
+        sort_by=["trip_id"],
+    ),
+}
+
+# everything else is stored untyped, but still columnar
+DEFAULT_SPEC = ParquetTableSpec(columns=[], sort_by=[])
+
+
+def records_to_arrow(
+    table: Union[FeedType, GtfsScheduleFileType],
+    records: Sequence[ParsedRecord],
+) -> pa.Table:
+    spec = TABLE_SPECS.get(table, DEFAULT_SPEC)
+    columns: Dict[str, List[Any]] = {
+        column.name: [column.getter(record.record) for record in records]
+        for column in spec.columns
+    }
+    columns["record"] = [json.dumps(record.record) for record in records]
+    columns["metadata"] = [json.dumps(record.metadata) for record in records]
+    arrow_table = pa.Table.from_pydict(columns, schema=spec.schema)
+    if spec.sort_by:
+        arrow_table = arrow_table.sort_by([(key, "ascending") for key in spec.sort_by])
+    return arrow_table
+
+
+def records_to_parquet(
+    table: Union[FeedType, GtfsScheduleFileType],
+    records: Sequence[ParsedRecord],
+) -> bytes:
+    buf = io.BytesIO()
+    pq.write_table(
+        records_to_arrow(table, records),
+        buf,
+        compression=PARQUET_COMPRESSION,
+    )
+    return buf.getvalue()
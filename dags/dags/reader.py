@@ -0,0 +1,452 @@
+"""
+Reading parsed tables back out of the parsed bucket, e.g. from notebooks or assets.
+
+Objects are selected by their hive partitions (dt= and hour=) and optionally their
+base64url before anything is downloaded, then downloaded concurrently and decoded as
+they arrive into Arrow tables or pandas DataFrames of at most batch_size rows.
+
+A day compacted by compaction.py is a single <base64url>.day.jsonl.gz under the day's
+first hour, whose rows keep their own hour in metadata.hour; those rows are given back
+their hour, and an hourly file of the same URL and hour (e.g. an hour parsed again
+after compaction, or one compaction has yet to delete) takes precedence over them.
+
+JSONL reads also include the micro-batches of hours that incremental.py hasn't
+compacted yet, but only those listed in the hour's checkpoint, so that the files of a
+run that failed before saving it aren't read twice; an hourly file of the same URL and
+hour takes precedence over them too.
+
+    from dags.common import FeedType
+    from dags.reader import read_parsed_pandas
+
+    for df in read_parsed_pandas(
+        FeedType.gtfs_rt__vehicle_positions,
+        start=pendulum.datetime(2023, 7, 5),
+        end=pendulum.datetime(2023, 7, 12),
+        columns=["record.entity.vehicle.vehicle.id", "record.entity.vehicle.position"],
+    ):
+        ...
+"""
+
+import gzip
+import io
+import json
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import (
+    Any,
+    Callable,
+    Deque,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    Union,
+)
+
+import pandas as pd
+import pendulum
+import pyarrow as pa  # type: ignore[import]
+import pyarrow.parquet as pq  # type: ignore[import]
+
+from .common import (
+    SERIALIZERS,
+    FeedType,
+    GtfsScheduleFileType,
+    HourAgg,
+    IncrementalParseCheckpoint,
+    ParsedFileFormat,
+    hive_table,
+)
+from .storage import ObjectNotFound, StorageObject, get_storage
+
+# the columns of a JSONL table; parquet tables have their own, see parquet.py
+DEFAULT_JSONL_COLUMNS = ["file", "record", "metadata"]
+COMPACTED_HOUR = "metadata.hour"
+
+
+class ParsedObject(NamedTuple):
+    object: StorageObject
+    hour: pendulum.DateTime
+    base64url: str
+    # a DayAgg, holding rows of every hour of its day
+    compacted: bool = False
+    # a MicroBatchAgg of an hour incremental.py has yet to compact
+    microbatch: bool = False
+
+    @property
+    def end(self) -> pendulum.DateTime:
+        return self.hour.add(days=1) if self.compacted else self.hour.add(hours=1)
+
+
+def parse_parsed_key(key: str) -> Optional[Tuple[pendulum.DateTime, str, bool]]:
+    """
+    Returns the hour, base64url and whether it is a compacted day of a
+    <table>/dt=.../hour=.../<base64url>[.day].<format> key, or None for anything else
+    beneath the table.
+    """
+    parts = key.split("/")
+    if len(parts) != 4 or not parts[2].startswith("hour="):
+        return None
+    hour = pendulum.parse(parts[2].removeprefix("hour="))
+    assert isinstance(hour, pendulum.DateTime)
+    base64url, _, extension = parts[3].partition(".")
+    return hour.in_tz("UTC"), base64url, extension.startswith("day.")
+
+
+def parse_microbatch_key(key: str) -> Optional[Tuple[pendulum.DateTime, str]]:
+    """
+    Returns the hour and base64url of a
+    <table>__microbatches/dt=.../hour=.../batch=.../<base64url>.<format> key, or None
+    for anything else beneath the table.
+    """
+    parts = key.split("/")
+    if len(parts) != 5 or not parts[2].startswith("hour="):
+        return None
+    hour = pendulum.parse(parts[2].removeprefix("hour="))
+    assert isinstance(hour, pendulum.DateTime)
+    return hour.in_tz("UTC"), parts[4].partition(".")[0]
+
+
+def checkpointed_microbatches(
+    table: Union[FeedType, GtfsScheduleFileType], hour: pendulum.DateTime
+) -> Set[str]:
+    """
+    The keys of an hour's micro-batches listed in its checkpoint, or none once the
+    hour has been compacted.
+    """
+    checkpoint = IncrementalParseCheckpoint(
+        feed_type=table if isinstance(table, FeedType) else FeedType.gtfs_schedule,
+        hour=hour,
+    )
+    try:
+        checkpoint = IncrementalParseCheckpoint.parse_raw(
+            get_storage().read_bytes(checkpoint.bucket, checkpoint.gcs_key)
+        )
+    except ObjectNotFound:
+        return set()
+    if checkpoint.compacted:
+        return set()
+    return {
+        microbatch.gcs_key
+        for microbatch in checkpoint.microbatches
+        if microbatch.table == table
+    }
+
+
+def hourly_keys(objects: Iterable[ParsedObject]) -> Set[Tuple[str, str]]:
+    """
+    The (base64url, serialized hour) of each hourly object, whose rows take precedence
+    over those of the same hour in a compacted day.
+    """
+    return {
+        (parsed.base64url, SERIALIZERS[pendulum.DateTime](parsed.hour))
+        for parsed in objects
+        if not parsed.compacted
+    }
+
+
+def compacted_hour_filter(
+    parsed: ParsedObject,
+    hourly: Set[Tuple[str, str]],
+    start: pendulum.DateTime,
+    end: pendulum.DateTime,
+) -> Callable[[str], bool]:
+    """
+    Whether a row of a compacted day, by its metadata.hour, is in [start, end) and not
+    superseded by an hourly object.
+    """
+    start_str = SERIALIZERS[pendulum.DateTime](start.in_tz("UTC").start_of("hour"))
+    end_str = SERIALIZERS[pendulum.DateTime](end.in_tz("UTC"))
+
+    # serialized hours sort in time order
+    def keep(hour: str) -> bool:
+        return start_str <= hour < end_str and (parsed.base64url, hour) not in hourly
+
+    return keep
+
+
+def list_parsed_objects(
+    table: Union[FeedType, GtfsScheduleFileType],
+    start: pendulum.DateTime,
+    end: pendulum.DateTime,
+    base64urls: Optional[Iterable[str]] = None,
+    format: ParsedFileFormat = ParsedFileFormat.jsonl_gz,
+    max_workers: int = 16,
+    microbatches: bool = False,
+) -> List[ParsedObject]:
+    """
+    Lists the objects of a table for hours in [start, end), listing each day's dt=
+    prefix separately (and concurrently) so that only those days are listed at all.
+    Compacted days are listed if any of their hours are in range.
+
+    With microbatches, a JSONL table's checkpointed micro-batches are listed too, for
+    the URLs and hours without an hourly object.
+    """
+    start, end = start.in_tz("UTC"), end.in_tz("UTC")
+    urls = set(base64urls) if base64urls is not None else None
+    days = [
+        SERIALIZERS[pendulum.Date](day)
+        for day in pendulum.period(start.date(), end.date()).range("days")
+    ]
+    prefixes = [f"{hive_table(table, format)}/dt={day}/" for day in days]
+
+    def list_prefix(prefix: str) -> List[ParsedObject]:
+        objects = []
+        for obj in get_storage().list(HourAgg.bucket, prefix=prefix):
+            parsed = parse_parsed_key(obj.name)
+            if not parsed or not obj.name.endswith(f".{format.value}"):
+                continue
+            hour, base64url, compacted = parsed
+            candidate = ParsedObject(obj, hour, base64url, compacted)
+            in_range = (
+                hour < end and candidate.end > start
+                if compacted
+                else start <= hour < end
+            )
+            if in_range and (urls is None or base64url in urls):
+                objects.append(candidate)
+        return objects
+
+    def list_microbatches(prefix: str) -> List[ParsedObject]:
+        by_hour: Dict[pendulum.DateTime, List[ParsedObject]] = {}
+        for obj in get_storage().list(HourAgg.bucket, prefix=prefix):
+            parsed = parse_microbatch_key(obj.name)
+            if not parsed or not obj.name.endswith(f".{format.value}"):
+                continue
+            hour, base64url = parsed
+            if start <= hour < end and (urls is None or base64url in urls):
+                by_hour.setdefault(hour, []).append(
+                    ParsedObject(obj, hour, base64url, microbatch=True)
+                )
+        objects: List[ParsedObject] = []
+        for hour, hour_objects in by_hour.items():
+            keys = checkpointed_microbatches(table, hour)
+            objects.extend(
+                parsed for parsed in hour_objects if parsed.object.name in keys
+            )
+        return objects
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        objects = [obj for found in pool.map(list_prefix, prefixes) for obj in found]
+        if not microbatches or format != ParsedFileFormat.jsonl_gz:
+            return objects
+        hourly = hourly_keys(objects)
+        return objects + [
+            parsed
+            for found in pool.map(
+                list_microbatches,
+                [
+                    f"{hive_table(table, format)}__microbatches/dt={day}/"
+                    for day in days
+                ],
+            )
+            for parsed in found
+            if (parsed.base64url, SERIALIZERS[pendulum.DateTime](parsed.hour))
+            not in hourly
+        ]
+
+
+def parse_hour(value: str) -> pendulum.DateTime:
+    hour = pendulum.parse(value)
+    assert isinstance(hour, pendulum.DateTime)
+    return hour.in_tz("UTC")
+
+
+def _get(value: Any, path: str) -> Any:
+    for key in path.split("."):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(key)
+    return value
+
+
+def _jsonl_batches(
+    contents: bytes,
+    columns: Sequence[str],
+    batch_size: int,
+    keep_hour: Optional[Callable[[str], bool]] = None,
+) -> Iterator[Dict[str, List[Any]]]:
+    """
+    With keep_hour, the contents are a compacted day: each batch also holds the rows'
+    hours under COMPACTED_HOUR, and rows whose hour isn't kept are skipped.
+    """
+    batch: Dict[str, List[Any]] = {column: [] for column in columns}
+    if keep_hour:
+        batch[COMPACTED_HOUR] = []
+    rows = 0
+    with gzip.GzipFile(fileobj=io.BytesIO(contents)) as lines:
+        for line in lines:
+            if not line.strip():
+                continue
+            row = json.loads(line)
+            if keep_hour:
+                hour = row["metadata"]["hour"]
+                if not keep_hour(hour):
+                    continue
+                batch[COMPACTED_HOUR].append(hour)
+            for column in columns:
+                value = _get(row, column)
+                # nested values are kept as JSON, as in the parquet tables
+                batch[column].append(
+                    json.dumps(value) if isinstance(value, (dict, list)) else value
+                )
+            rows += 1
+            if rows == batch_size:
+                yield batch
+                batch = {column: [] for column in batch}
+                rows = 0
+    if rows:
+        yield batch
+
+
+def _decode(
+    parsed: ParsedObject,
+    contents: bytes,
+    format: ParsedFileFormat,
+    columns: Optional[Sequence[str]],
+    batch_size: int,
+    keep_hour: Optional[Callable[[str], bool]] = None,
+) -> Iterator[pa.Table]:
+    if keep_hour:
+        hours: Dict[str, pendulum.DateTime] = {}
+        for batch in _jsonl_batches(
+            contents, columns or DEFAULT_JSONL_COLUMNS, batch_size, keep_hour
+        ):
+            row_hours = [
+                hours.setdefault(hour, parse_hour(hour))
+                for hour in batch.pop(COMPACTED_HOUR)
+            ]
+            yield (
+                pa.Table.from_pydict(batch)
+                .append_column(
+                    "dt", pa.array([parsed.hour.date()] * len(row_hours), pa.date32())
+                )
+                .append_column("hour", pa.array(row_hours, pa.timestamp("s", tz="UTC")))
+                .append_column(
+                    "base64url", pa.array([parsed.base64url] * len(row_hours))
+                )
+            )
+        return
+    if format == ParsedFileFormat.parquet:
+        tables: Iterable[pa.Table] = (
+            pa.Table.from_batches([batch])
+            for batch in pq.read_table(
+                io.BytesIO(contents), columns=columns
+            ).to_batches(max_chunksize=batch_size)
+        )
+    else:
+        tables = (
+            pa.Table.from_pydict(batch)
+            for batch in _jsonl_batches(
+                contents, columns or DEFAULT_JSONL_COLUMNS, batch_size
+            )
+        )
+    for table in tables:
+        yield (
+            table.append_column(
+                "dt", pa.array([parsed.hour.date()] * table.num_rows, pa.date32())
+            )
+            .append_column(
+                "hour",
+                pa.array([parsed.hour] * table.num_rows, pa.timestamp("s", tz="UTC")),
+            )
+            .append_column("base64url", pa.array([parsed.base64url] * table.num_rows))
+        )
+
+
+def download_ahead(
+    objects: Iterable[ParsedObject], max_workers: int = 16
+) -> Iterator[Tuple[ParsedObject, bytes]]:
+    """
+    Yields each object with its contents, in order, downloading at most max_workers
+    objects ahead of the one being consumed so that memory stays bounded however
+    slowly the caller decodes them.
+    """
+    storage = get_storage()
+
+    def download(parsed: ParsedObject) -> bytes:
+        return storage.read_bytes(
+            parsed.object.bucket,
+            parsed.object.name,
+            generation=parsed.object.generation,
+        )
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        pending: Deque[Tuple[ParsedObject, Future]] = deque()
+        remaining = iter(objects)
+        for parsed in remaining:
+            pending.append((parsed, pool.submit(download, parsed)))
+            if len(pending) == max_workers:
+                break
+        while pending:
+            parsed, future = pending.popleft()
+            contents = future.result()
+            for parsed_next in remaining:
+                pending.append((parsed_next, pool.submit(download, parsed_next)))
+                break
+            yield parsed, contents
+
+
+def read_parsed(
+    table: Union[FeedType, GtfsScheduleFileType],
+    start: pendulum.DateTime,
+    end: pendulum.DateTime,
+    base64urls: Optional[Iterable[str]] = None,
+    columns: Optional[Sequence[str]] = None,
+    format: ParsedFileFormat = ParsedFileFormat.jsonl_gz,
+    batch_size: int = 100_000,
+    max_workers: int = 16,
+) -> Iterator[pa.Table]:
+    """
+    Yields Arrow tables of a parsed table's rows for hours in [start, end), in key
+    order, followed by those of any micro-batches not compacted yet (see
+    list_parsed_objects). A batch never spans objects, so each has a single dt and
+    base64url, and a single hour unless it comes from a compacted day; they are
+    appended as columns.
+
+    For JSONL, columns are dotted paths into each ParsedRecord, e.g.
+    "record.entity.vehicle.position.latitude", and nested values are returned as JSON
+    strings; for parquet they are the column names of the table's schema. At most
+    max_workers objects are downloaded ahead of the one being decoded.
+    """
+    objects = list_parsed_objects(
+        table,
+        start,
+        end,
+        base64urls=base64urls,
+        format=format,
+        max_workers=max_workers,
+        microbatches=True,
+    )
+    hourly = hourly_keys(objects)
+    for parsed, contents in download_ahead(objects, max_workers):
+        yield from _decode(
+            parsed,
+            contents,
+            format,
+            columns,
+            batch_size,
+            (
+                compacted_hour_filter(parsed, hourly, start, end)
+                if parsed.compacted
+                else None
+            ),
+        )
+
+
+def read_parsed_pandas(
+    table: Union[FeedType, GtfsScheduleFileType],
+    start: pendulum.DateTime,
+    end: pendulum.DateTime,
+    **kwargs,
+) -> Iterator[pd.DataFrame]:
+    """
+    read_parsed, but yielding pandas DataFrames.
+    """
+    for batch in read_parsed(table, start, end, **kwargs):
+        yield batch.to_pandas()
@@ -0,0 +1,179 @@
+"""
+Per-step resource metrics, and opt-in memray profiling, for the parse assets.
+
+Every run of an asset that uses the profiling resource records its peak RSS, CPU time,
+bytes read from and written to storage, and records processed in its output metadata.
+CPU time and bytes are the step's own: they count the thread running the step (and,
+for bytes, threads run in a copy of its context), not other steps running concurrently
+in the same process, e.g. under parse_hour's thread pool. Peak RSS can only be measured
+for the whole process, so concurrent steps share it.
+Launching a run with
+
+    resources:
+      profiling:
+        config:
+          memray: true
+
+additionally tracks the asset's allocations with memray, and uploads the capture (and a
+flame graph of it, rendered with memray's own CLI) to the profiles bucket, linked from
+the same metadata. Open the capture with e.g. `memray summary` or `memray table`.
+"""
+
+import os
+import re
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator
+
+from dagster import (
+    AssetExecutionContext,
+    ConfigurableResource,
+    MetadataValue,
+    get_dagster_logger,
+)
+
+from ..storage import get_storage
+
+PROFILES_BUCKET = os.getenv("PROFILES_BUCKET", os.getenv("PARSED_BUCKET", ""))
+RSS_SAMPLE_SECONDS = float(os.getenv("RSS_SAMPLE_SECONDS", 0.01))
+
+
+def current_rss() -> int:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        # no procfs (e.g. macOS); the lifetime peak, in bytes there
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+class PeakRss:
+    """
+    Samples the process's RSS on a thread while entered, keeping the peak.
+    """
+
+    def __init__(self, interval: float = RSS_SAMPLE_SECONDS) -> None:
+        self.interval = interval
+        self.peak = 0
+        self._done = threading.Event()
+
+    def _sample(self) -> None:
+        while not self._done.wait(self.interval):
+            self.peak = max(self.peak, current_rss())
+
+    def __enter__(self) -> "PeakRss":
+        self.peak = current_rss()
+        self._sampler = threading.Thread(target=self._sample, daemon=True)
+        self._sampler.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._done.set()
+        self._sampler.join()
+        self.peak = max(self.peak, current_rss())
+
+
+class StepMetrics:
+    """
+    What a profiled step measured; the step itself sets the number of records.
+    peak_rss_bytes is the process's, while cpu_seconds and the bytes are the step's own.
+    """
+
+    def __init__(self) -> None:
+        self.records = 0
+        self.peak_rss_bytes = 0
+        self.cpu_seconds = 0.0
+        self.bytes_downloaded = 0
+        self.bytes_uploaded = 0
+
+    def metadata(self) -> Dict[str, Any]:
+        return {
+            "peak_rss_bytes": self.peak_rss_bytes,
+            "cpu_seconds": round(self.cpu_seconds, 3),
+            "bytes_downloaded": self.bytes_downloaded,
+            "bytes_uploaded": self.bytes_uploaded,
+            "records_processed": self.records,
+        }
+
+
+class ProfilingResource(ConfigurableResource):
+    # track allocations with memray and upload the capture; memray is a dev dependency
+    memray: bool = False
+    # also record native (C/C++) frames, e.g. inside protobuf or pyarrow
+    native_traces: bool = False
+    bucket: str = PROFILES_BUCKET
+    prefix: str = "profiles/memray"
+
+    def profile_key(self, context: AssetExecutionContext, extension: str) -> str:
+        step = context.asset_key.to_user_string().replace("/", "__")
+        # e.g. septa__alerts|2023-07-05-01:00 becomes septa__alerts__2023-07-05-0100
+        partition = (
+            re.sub(r"[|/]", "__", context.partition_key).replace(":", "")
+            if context.has_partition_key
+            else "unpartitioned"
+        )
+        return f"{self.prefix}/{context.run_id}/{step}/{partition}{extension}"
+
+    @contextmanager
+    def step(self, context: AssetExecutionContext) -> Iterator[StepMetrics]:
+        """
+        Measures the body of the with block and adds the results to the asset's output
+        metadata; nothing is added if the body raises, but a memray capture is still
+        uploaded.
+        """
+        metrics = StepMetrics()
+        cpu_start = time.thread_time()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            capture = Path(tmp_dir) / "capture.bin"
+            try:
+                with PeakRss() as rss, get_storage().counting() as transferred:
+                    if self.memray:
+                        # imported here since only dev environments install it
+                        from memray import Tracker
+
+                        with Tracker(capture, native_traces=self.native_traces):
+                            yield metrics
+                    else:
+                        yield metrics
+            finally:
+                # measured before the capture is uploaded, which would skew them
+                metrics.peak_rss_bytes = rss.peak
+                metrics.cpu_seconds = time.thread_time() - cpu_start
+                metrics.bytes_downloaded = transferred["read"]
+                metrics.bytes_uploaded = transferred["write"]
+                uploaded = self.upload_capture(context, capture) if self.memray else {}
+            context.add_output_metadata({**metrics.metadata(), **uploaded})
+
+    def upload_capture(
+        self, context: AssetExecutionContext, capture: Path
+    ) -> Dict[str, MetadataValue]:
+        logger = get_dagster_logger()
+        if not capture.exists():
+            return {}
+        storage = get_storage()
+        uploads = {"memray_capture": (capture, ".bin", "application/octet-stream")}
+        flamegraph = capture.with_suffix(".html")
+        rendered = subprocess.run(
+            [sys.executable, "-m", "memray", "flamegraph", "-o", flamegraph, capture],
+            capture_output=True,
+        )
+        if rendered.returncode == 0:
+            uploads["memray_flamegraph"] = (flamegraph, ".html", "text/html")
+        else:
+            logger.warning(f"Could not render a flame graph: {rendered.stderr!r}")
+
+        metadata: Dict[str, MetadataValue] = {}
+        for name, (path, extension, content_type) in uploads.items():
+            key = self.profile_key(context, extension)
+            storage.write_bytes(
+                self.bucket, key, path.read_bytes(), content_type=content_type
+            )
+            logger.info(f"Uploaded {name} to {self.bucket}/{key}")
+            metadata[name] = MetadataValue.path(f"{self.bucket}/{key}")
+        return metadata
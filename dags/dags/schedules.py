@@ -0,0 +1,474 @@
+"""
+Array-backed snapshots of GTFS schedules, cached on disk by the hash of the zip.
+
+A snapshot holds the trips, stop_times, stops, shapes and service dates of a schedule
+as NumPy arrays. Ids are replaced by their index in a sorted array of the table's ids,
+and times by seconds after midnight (as in the gtfs_time_to_seconds macro, so they may
+exceed 86400). stop_times and shape points are sorted by trip or shape, and then by
+sequence. CSR-style offsets index trip -> stop_times, stop -> trips, shape -> points
+and service -> dates; e.g. trip i's stop times are st_*[trip_stop_times[i]:
+trip_stop_times[i + 1]].
+
+    from dags.schedules import load_snapshot
+
+    snapshot = load_snapshot(raw_file)
+    rows = snapshot.stop_times("1234567")
+    snapshot.st_arrival[rows], snapshot.stop_ids[snapshot.st_stop[rows]]
+
+load_schedule_snapshot finds the raw file by the base64url and hour partitions of the
+schedule's parsed tables, which is how the DuckDB warehouse refers to a schedule.
+
+Each array is saved as its own .npy file under
+SCHEDULE_CACHE_DIR/v<SNAPSHOT_VERSION>/<md5 of the zip>/, and opened with mmap_mode="r",
+so every process that loads the same schedule shares the pages of one copy and only
+the first pays for building it.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import uuid
+import zipfile
+from io import BytesIO
+from pathlib import Path
+from typing import List, NamedTuple, Optional
+
+import numpy as np
+import pandas as pd
+import pendulum
+
+from .assets import download_blob, fetched_ts, hour_key, list_raw_hour
+from .common import FeedType, RawFetchedFile
+
+SCHEDULE_CACHE_DIR = os.getenv("SCHEDULE_CACHE_DIR", "./.schedule-cache")
+# bump when the arrays change, so old snapshots are rebuilt rather than misread
+SNAPSHOT_VERSION = 2
+
+WEEKDAYS = [
+    "monday",
+    "tuesday",
+    "wednesday",
+    "thursday",
+    "friday",
+    "saturday",
+    "sunday",
+]
+
+
+def find(ids: np.ndarray, value: str) -> int:
+    """
+    The index of value in sorted ids, or -1.
+    """
+    i = int(np.searchsorted(ids, value))
+    return i if i < len(ids) and ids[i] == value else -1
+
+
+def encode(ids: np.ndarray, values: np.ndarray) -> np.ndarray:
+    """
+    The index of each value in sorted ids, or -1.
+    """
+    if not len(ids):
+        return np.full(len(values), -1, dtype=np.int32)
+    codes = np.searchsorted(ids, values)
+    clipped = np.minimum(codes, len(ids) - 1)
+    return np.where(ids[clipped] == values, clipped, -1).astype(np.int32)
+
+
+def offsets(groups: np.ndarray, num_groups: int) -> np.ndarray:
+    """
+    CSR offsets of values sorted by group.
+    """
+    result = np.zeros(num_groups + 1, dtype=np.int64)
+    np.cumsum(np.bincount(groups, minlength=num_groups), out=result[1:])
+    return result
+
+
+def gtfs_times_to_seconds(values: pd.Series) -> np.ndarray:
+    """
+    Seconds after midnight of HH:MM:SS times, which may be past 24:00:00; -1 if blank.
+    """
+    values = values.str.strip()
+    blank = (values == "").to_numpy()
+    if blank.all():
+        return np.full(len(values), -1, dtype=np.int32)
+    parts = values.where(~blank, "0:0:0").str.split(":", n=2, expand=True)
+    seconds = (
+        parts[0].astype(np.int32) * 3600
+        + parts[1].astype(np.int32) * 60
+        + parts[2].astype(np.int32)
+    ).to_numpy(dtype=np.int32)
+    seconds[blank] = -1
+    return seconds
+
+
+def read_table(zipf: zipfile.ZipFile, name: str, columns: List[str]) -> pd.DataFrame:
+    """
+    Reads the columns of a file in the zip as strings; missing files and columns are
+    empty.
+    """
+    if name not in zipf.namelist():
+        return pd.DataFrame({column: pd.Series(dtype=str) for column in columns})
+    with zipf.open(name) as f:
+        df = pd.read_csv(
+            f,
+            dtype=str,
+            keep_default_na=False,
+            encoding="utf-8-sig",
+            skipinitialspace=True,
+        )
+    df.columns = df.columns.str.strip()
+    for column in columns:
+        if column not in df:
+            df[column] = ""
+    return df[columns]
+
+
+def unique_ids(*values: pd.Series) -> np.ndarray:
+    ids = np.unique(np.concatenate([series.to_numpy(dtype=str) for series in values]))
+    return ids[ids != ""]
+
+
+def floats(values: pd.Series) -> np.ndarray:
+    return pd.to_numeric(values, errors="coerce").to_numpy(dtype=np.float64)
+
+
+class ScheduleSnapshot(NamedTuple):
+    # sorted ids; everything else refers to these by index
+    trip_ids: np.ndarray
+    stop_ids: np.ndarray
+    route_ids: np.ndarray
+    service_ids: np.ndarray
+    shape_ids: np.ndarray
+    # per trip; -1 where missing
+    trip_route: np.ndarray
+    trip_service: np.ndarray
+    trip_shape: np.ndarray
+    trip_direction: np.ndarray
+    # trip i's stop times are [trip_stop_times[i], trip_stop_times[i + 1])
+    trip_stop_times: np.ndarray
+    # per stop time, sorted by trip and stop_sequence
+    st_trip: np.ndarray
+    st_stop: np.ndarray
+    st_sequence: np.ndarray
+    st_arrival: np.ndarray
+    st_departure: np.ndarray
+    st_shape_dist: np.ndarray
+    # per stop
+    stop_names: np.ndarray
+    stop_lat: np.ndarray
+    stop_lon: np.ndarray
+    # stop i's trips are stop_trips[stop_trips_offsets[i]:stop_trips_offsets[i + 1]]
+    stop_trips_offsets: np.ndarray
+    stop_trips: np.ndarray
+    # service i's dates are service_dates_list[service_dates_offsets[i]:...[i + 1]]
+    service_dates_offsets: np.ndarray
+    service_dates_list: np.ndarray
+    # shape i's points are shape_pt_*[shape_points_offsets[i]:...[i + 1]]
+    shape_points_offsets: np.ndarray
+    shape_pt_lat: np.ndarray
+    shape_pt_lon: np.ndarray
+    shape_pt_dist: np.ndarray
+
+    def stop_times(self, trip_id: str) -> slice:
+        i = find(self.trip_ids, trip_id)
+        if i < 0:
+            return slice(0, 0)
+        return slice(self.trip_stop_times[i], self.trip_stop_times[i + 1])
+
+    def trips_at_stop(self, stop_id: str) -> np.ndarray:
+        i = find(self.stop_ids, stop_id)
+        if i < 0:
+            return self.trip_ids[:0]
+        trips = self.stop_trips[
+            self.stop_trips_offsets[i] : self.stop_trips_offsets[i + 1]
+        ]
+        return self.trip_ids[trips]
+
+    def service_dates(self, service_id: str) -> np.ndarray:
+        i = find(self.service_ids, service_id)
+        if i < 0:
+            return self.service_dates_list[:0]
+        return self.service_dates_list[
+            self.service_dates_offsets[i] : self.service_dates_offsets[i + 1]
+        ]
+
+    def trips_on(self, date: pendulum.Date) -> np.ndarray:
+        """
+        The indices of the trips whose service runs on date.
+        """
+        day = np.datetime64(date.isoformat(), "D")
+        services = np.nonzero(
+            [
+                day in self.service_dates_list[start:end]
+                for start, end in zip(
+                    self.service_dates_offsets[:-1], self.service_dates_offsets[1:]
+                )
+            ]
+        )[0]
+        return np.nonzero(np.isin(self.trip_service, services))[0]
+
+    def shape_points(self, shape_id: str) -> slice:
+        i = find(self.shape_ids, shape_id)
+        if i < 0:
+            return slice(0, 0)
+        return slice(self.shape_points_offsets[i], self.shape_points_offsets[i + 1])
+
+
+def build_snapshot(contents: bytes) -> ScheduleSnapshot:
+    with zipfile.ZipFile(BytesIO(contents)) as zipf:
+        trips = read_table(
+            zipf,
+            "trips.txt",
+            ["trip_id", "route_id", "service_id", "shape_id", "direction_id"],
+        )
+        stop_times = read_table(
+            zipf,
+            "stop_times.txt",
+            [
+                "trip_id",
+                "stop_id",
+                "stop_sequence",
+                "arrival_time",
+                "departure_time",
+                "shape_dist_traveled",
+            ],
+        )
+        stops = read_table(
+            zipf, "stops.txt", ["stop_id", "stop_name", "stop_lat", "stop_lon"]
+        )
+        routes = read_table(zipf, "routes.txt", ["route_id"])
+        calendar = read_table(
+            zipf, "calendar.txt", ["service_id", "start_date", "end_date", *WEEKDAYS]
+        )
+        calendar_dates = read_table(
+            zipf, "calendar_dates.txt", ["service_id", "date", "exception_type"]
+        )
+        shapes = read_table(
+            zipf,
+            "shapes.txt",
+            [
+                "shape_id",
+                "shape_pt_lat",
+                "shape_pt_lon",
+                "shape_pt_sequence",
+                "shape_dist_traveled",
+            ],
+        )
+
+    trips = trips[trips.trip_id != ""].drop_duplicates("trip_id").sort_values("trip_id")
+    stops = stops.drop_duplicates("stop_id").set_index("stop_id")
+    trip_ids = trips.trip_id.to_numpy(dtype=str)
+    stop_ids = unique_ids(stops.index.to_series(), stop_times.stop_id)
+    route_ids = unique_ids(routes.route_id, trips.route_id)
+    service_ids = unique_ids(
+        trips.service_id, calendar.service_id, calendar_dates.service_id
+    )
+    shape_ids = unique_ids(shapes.shape_id, trips.shape_id)
+
+    # stop times, by trip and then sequence
+    st_trip = encode(trip_ids, stop_times.trip_id.to_numpy(dtype=str))
+    stop_times = stop_times[st_trip >= 0]
+    st_trip = st_trip[st_trip >= 0]
+    st_sequence = (
+        pd.to_numeric(stop_times.stop_sequence, errors="coerce")
+        .fillna(-1)
+        .to_numpy(dtype=np.int32)
+    )
+    order = np.lexsort((st_sequence, st_trip))
+    stop_times = stop_times.iloc[order]
+    st_trip, st_sequence = st_trip[order], st_sequence[order]
+    st_stop = encode(stop_ids, stop_times.stop_id.to_numpy(dtype=str))
+
+    # each stop's distinct trips
+    pairs = np.unique(
+        st_stop[st_stop >= 0].astype(np.int64) * max(len(trip_ids), 1)
+        + st_trip[st_stop >= 0]
+    )
+    pair_stops = (pairs // max(len(trip_ids), 1)).astype(np.int64)
+
+    # service dates from the calendar, then calendar_dates' exceptions
+    service_days = []
+    for row in calendar.itertuples(index=False):
+        # without a date range, a service only runs on calendar_dates' additions
+        if not row.start_date.strip() or not row.end_date.strip():
+            continue
+        start = np.datetime64(
+            pendulum.from_format(row.start_date.strip(), "YYYYMMDD").date().isoformat(),
+            "D",
+        )
+        end = np.datetime64(
+            pendulum.from_format(row.end_date.strip(), "YYYYMMDD").date().isoformat(),
+            "D",
+        )
+        days = np.arange(start, end + 1)
+        # the epoch was a Thursday
+        weekdays = (days.astype(np.int64) + 3) % 7
+        running = [
+            i
+            for i, weekday in enumerate(WEEKDAYS)
+            if getattr(row, weekday).strip() == "1"
+        ]
+        days = days[np.isin(weekdays, running)]
+        service_days.append(pd.DataFrame({"service_id": row.service_id, "date": days}))
+    calendar_dates = calendar_dates[calendar_dates.date.str.strip() != ""]
+    exceptions = calendar_dates.assign(
+        date=pd.to_datetime(calendar_dates.date.str.strip(), format="%Y%m%d").to_numpy(
+            dtype="datetime64[D]"
+        )
+    )
+    added = exceptions[exceptions.exception_type.str.strip() == "1"][
+        ["service_id", "date"]
+    ]
+    removed = exceptions[exceptions.exception_type.str.strip() == "2"][
+        ["service_id", "date"]
+    ]
+    dates = pd.concat(
+        [
+            *service_days,
+            added,
+            pd.DataFrame(
+                {
+                    "service_id": pd.Series(dtype=str),
+                    "date": pd.Series(dtype="datetime64[s]"),
+                }
+            ),
+        ]
+    ).drop_duplicates()
+    dates = dates.merge(removed, how="left", indicator=True)
+    dates = dates[dates._merge == "left_only"]
+    date_services = encode(service_ids, dates.service_id.to_numpy(dtype=str))
+    date_values = dates.date.to_numpy(dtype="datetime64[D]")
+    order = np.lexsort((date_values, date_services))
+    date_services, date_values = date_services[order], date_values[order]
+
+    # shape points, by shape and then sequence
+    shape_index = encode(shape_ids, shapes.shape_id.to_numpy(dtype=str))
+    shape_sequence = (
+        pd.to_numeric(shapes.shape_pt_sequence, errors="coerce")
+        .fillna(-1)
+        .to_numpy(dtype=np.int64)
+    )
+    order = np.lexsort((shape_sequence, shape_index))
+    order = order[shape_index[order] >= 0]
+    shapes, shape_index = shapes.iloc[order], shape_index[order]
+
+    return ScheduleSnapshot(
+        trip_ids=trip_ids,
+        stop_ids=stop_ids,
+        route_ids=route_ids,
+        service_ids=service_ids,
+        shape_ids=shape_ids,
+        trip_route=encode(route_ids, trips.route_id.to_numpy(dtype=str)),
+        trip_service=encode(service_ids, trips.service_id.to_numpy(dtype=str)),
+        trip_shape=encode(shape_ids, trips.shape_id.to_numpy(dtype=str)),
+        trip_direction=pd.to_numeric(trips.direction_id, errors="coerce")
+        .fillna(-1)
+        .to_numpy(dtype=np.int8),
+        trip_stop_times=offsets(st_trip, len(trip_ids)),
+        st_trip=st_trip,
+        st_stop=st_stop,
+        st_sequence=st_sequence,
+        st_arrival=gtfs_times_to_seconds(stop_times.arrival_time),
+        st_departure=gtfs_times_to_seconds(stop_times.departure_time),
+        st_shape_dist=floats(stop_times.shape_dist_traveled),
+        stop_names=stops.stop_name.reindex(stop_ids).fillna("").to_numpy(dtype=str),
+        stop_lat=floats(stops.stop_lat.reindex(stop_ids).fillna("")),
+        stop_lon=floats(stops.stop_lon.reindex(stop_ids).fillna("")),
+        stop_trips_offsets=offsets(pair_stops, len(stop_ids)),
+        stop_trips=(pairs % max(len(trip_ids), 1)).astype(np.int32),
+        service_dates_offsets=offsets(
+            date_services[date_services >= 0], len(service_ids)
+        ),
+        service_dates_list=date_values[date_services >= 0],
+        shape_points_offsets=offsets(shape_index, len(shape_ids)),
+        shape_pt_lat=floats(shapes.shape_pt_lat),
+        shape_pt_lon=floats(shapes.shape_pt_lon),
+        shape_pt_dist=floats(shapes.shape_dist_traveled),
+    )
+
+
+def snapshot_key(contents: bytes) -> str:
+    return hashlib.md5(contents).hexdigest()
+
+
+def snapshot_path(key: str, cache_dir: Optional[str] = None) -> Path:
+    return Path(cache_dir or SCHEDULE_CACHE_DIR) / f"v{SNAPSHOT_VERSION}" / key
+
+
+def save_snapshot(snapshot: ScheduleSnapshot, path: Path) -> None:
+    """
+    Writes the arrays to a temporary directory that is then renamed into place, so
+    readers never see a partial snapshot; if another process got there first, its
+    snapshot is kept.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}-{uuid.uuid4().hex}")
+    tmp.mkdir()
+    try:
+        for name, array in snapshot._asdict().items():
+            np.save(tmp / f"{name}.npy", array, allow_pickle=False)
+        (tmp / "meta.json").write_text(
+            json.dumps(
+                {
+                    "version": SNAPSHOT_VERSION,
+                    "built_at": pendulum.now(tz="UTC").to_iso8601_string(),
+                    "trips": len(snapshot.trip_ids),
+                    "stop_times": len(snapshot.st_trip),
+                    "stops": len(snapshot.stop_ids),
+                    "shapes": len(snapshot.shape_ids),
+                }
+            )
+        )
+        tmp.rename(path)
+    except OSError:
+        if not path.exists():
+            raise
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def open_snapshot(
+    key: str, cache_dir: Optional[str] = None
+) -> Optional[ScheduleSnapshot]:
+    path = snapshot_path(key, cache_dir)
+    if not path.exists():
+        return None
+    return ScheduleSnapshot(
+        **{
+            name: np.load(path / f"{name}.npy", mmap_mode="r")
+            for name in ScheduleSnapshot._fields
+        }
+    )
+
+
+def load_snapshot(
+    file: RawFetchedFile, cache_dir: Optional[str] = None
+) -> ScheduleSnapshot:
+    """
+    Opens the cached snapshot of a gtfs_schedule raw file, building it first if this
+    is the first time the zip has been seen.
+    """
+    if file.config.feed_type != FeedType.gtfs_schedule:
+        raise ValueError(f"{file.config.feed_type} is not a GTFS schedule")
+    key = snapshot_key(file.contents)
+    snapshot = open_snapshot(key, cache_dir)
+    if snapshot is None:
+        save_snapshot(build_snapshot(file.contents), snapshot_path(key, cache_dir))
+        snapshot = open_snapshot(key, cache_dir)
+        assert snapshot is not None
+    return snapshot
+
+
+def load_schedule_snapshot(
+    base64url: str, hour: pendulum.DateTime, cache_dir: Optional[str] = None
+) -> Optional[ScheduleSnapshot]:
+    """
+    The snapshot of the schedule fetched from a URL in the given hour, or None if its
+    raw file can't be found; of several fetches in the hour, the latest.
+    """
+    files, _ = list_raw_hour(FeedType.gtfs_schedule.value, hour)
+    matches = [file for file in files if hour_key(file).base64url == base64url]
+    if not matches:
+        return None
+    return load_snapshot(download_blob(max(matches, key=fetched_ts)), cache_dir)
@@ -0,0 +1,180 @@
+"""
+Vectorized projection of vehicle positions onto their trips' shapes.
+
+The NumPy equivalent of the st_closestpoint/st_linelocatepoint pair in the
+fct_observed_shape_times dbt mart. Shapes are flattened into one set of segment arrays,
+with each shape's segments contiguous, and each segment keeps the distance along its
+shape at which it starts. Positions are then projected a shape at a time, against every
+segment of the shape at once, in chunks of at most max_elements position-segment pairs.
+
+Each shape is projected onto a plane tangent to the earth at its centroid, so distances
+are within a fraction of a percent of BigQuery's geodesic ones for shapes the size of a
+city, and the closest point and its fraction of the shape's length match to within
+about a meter.
+"""
+
+from typing import NamedTuple, Tuple
+
+import numpy as np
+
+EARTH_RADIUS_METERS = 6_371_008.8
+# position-segment pairs per chunk; a few arrays of this many float64s at a time
+DEFAULT_MAX_ELEMENTS = 2**22
+
+
+class ShapeSegments(NamedTuple):
+    # shape i's segments are [offsets[i], offsets[i + 1])
+    offsets: np.ndarray
+    # each shape's projection origin
+    origin_lat: np.ndarray
+    origin_lon: np.ndarray
+    # per segment, in meters on its shape's plane
+    x0: np.ndarray
+    y0: np.ndarray
+    dx: np.ndarray
+    dy: np.ndarray
+    length: np.ndarray
+    # distance along the shape at the start of the segment
+    start_distance: np.ndarray
+    # per shape
+    total_length: np.ndarray
+
+    @property
+    def num_shapes(self) -> int:
+        return len(self.offsets) - 1
+
+
+def to_plane(
+    lat: np.ndarray, lon: np.ndarray, origin_lat: np.ndarray, origin_lon: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray]:
+    x = (
+        EARTH_RADIUS_METERS
+        * np.radians(lon - origin_lon)
+        * np.cos(np.radians(origin_lat))
+    )
+    y = EARTH_RADIUS_METERS * np.radians(lat - origin_lat)
+    return x, y
+
+
+def from_plane(
+    x: np.ndarray, y: np.ndarray, origin_lat: np.ndarray, origin_lon: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray]:
+    lat = origin_lat + np.degrees(y / EARTH_RADIUS_METERS)
+    lon = origin_lon + np.degrees(
+        x / (EARTH_RADIUS_METERS * np.cos(np.radians(origin_lat)))
+    )
+    return lat, lon
+
+
+def build_shape_segments(
+    shape_index: np.ndarray, lat: np.ndarray, lon: np.ndarray, num_shapes: int
+) -> ShapeSegments:
+    """
+    Builds the segments of shapes given as points ordered by shape and then by
+    shape_pt_sequence; shape_index numbers the shapes from 0 to num_shapes - 1.
+    """
+    shape_index = np.asarray(shape_index, dtype=np.int64)
+    lat = np.asarray(lat, dtype=np.float64)
+    lon = np.asarray(lon, dtype=np.float64)
+    if len(shape_index) and np.any(np.diff(shape_index) < 0):
+        raise ValueError("Shape points must be ordered by shape")
+
+    points = np.bincount(shape_index, minlength=num_shapes)
+    with np.errstate(invalid="ignore"):
+        origin_lat = (
+            np.bincount(shape_index, weights=lat, minlength=num_shapes) / points
+        )
+        origin_lon = (
+            np.bincount(shape_index, weights=lon, minlength=num_shapes) / points
+        )
+    x, y = to_plane(lat, lon, origin_lat[shape_index], origin_lon[shape_index])
+
+    # consecutive points of the same shape
+    starts = np.nonzero(shape_index[:-1] == shape_index[1:])[0]
+    segment_shape = shape_index[starts]
+    dx = x[starts + 1] - x[starts]
+    dy = y[starts + 1] - y[starts]
+    length = np.hypot(dx, dy)
+
+    offsets = np.zeros(num_shapes + 1, dtype=np.int64)
+    np.cumsum(np.bincount(segment_shape, minlength=num_shapes), out=offsets[1:])
+    cumulative = np.concatenate([[0.0], np.cumsum(length)])
+    return ShapeSegments(
+        offsets=offsets,
+        origin_lat=origin_lat,
+        origin_lon=origin_lon,
+        x0=x[starts],
+        y0=y[starts],
+        dx=dx,
+        dy=dy,
+        length=length,
+        start_distance=cumulative[:-1] - cumulative[offsets[:-1]][segment_shape],
+        total_length=cumulative[offsets[1:]] - cumulative[offsets[:-1]],
+    )
+
+
+class Projection(NamedTuple):
+    # NaN for positions without a shape, or whose shape has no segments
+    lat: np.ndarray
+    lon: np.ndarray
+    # of the shape's length, from 0 to 1
+    fraction: np.ndarray
+    # from the position to the closest point, in meters
+    distance: np.ndarray
+
+
+def project(
+    segments: ShapeSegments,
+    shape_index: np.ndarray,
+    lat: np.ndarray,
+    lon: np.ndarray,
+    max_elements: int = DEFAULT_MAX_ELEMENTS,
+) -> Projection:
+    """
+    Finds the closest point on each position's shape; shape_index is -1 for positions
+    without one.
+    """
+    shape_index = np.asarray(shape_index, dtype=np.int64)
+    lat = np.asarray(lat, dtype=np.float64)
+    lon = np.asarray(lon, dtype=np.float64)
+    out = Projection(*(np.full(len(shape_index), np.nan) for _ in range(4)))
+
+    counts = np.diff(segments.offsets)
+    valid = np.nonzero(shape_index >= 0)[0]
+    valid = valid[counts[shape_index[valid]] > 0]
+    order = valid[np.argsort(shape_index[valid], kind="stable")]
+    shapes, firsts = np.unique(shape_index[order], return_index=True)
+
+    for shape, first, last in zip(shapes, firsts, np.append(firsts[1:], len(order))):
+        start, end = segments.offsets[shape], segments.offsets[shape + 1]
+        x0, y0 = segments.x0[start:end], segments.y0[start:end]
+        dx, dy = segments.dx[start:end], segments.dy[start:end]
+        length2 = dx * dx + dy * dy
+        origin_lat, origin_lon = segments.origin_lat[shape], segments.origin_lon[shape]
+        chunk = max(1, max_elements // (end - start))
+        for chunk_start in range(first, last, chunk):
+            rows = order[chunk_start : min(chunk_start + chunk, last)]
+            px, py = to_plane(lat[rows], lon[rows], origin_lat, origin_lon)
+            rx = px[:, None] - x0
+            ry = py[:, None] - y0
+            # where along each segment the perpendicular falls, clamped to the segment
+            t = np.divide(
+                rx * dx + ry * dy,
+                length2,
+                out=np.zeros_like(rx),
+                where=length2 > 0,
+            )
+            np.clip(t, 0, 1, out=t)
+            distance2 = (rx - t * dx) ** 2 + (ry - t * dy) ** 2
+            best = np.argmin(distance2, axis=1)
+            arange = np.arange(len(rows))
+            best_t = t[arange, best]
+            segment = start + best
+            cx = segments.x0[segment] + best_t * segments.dx[segment]
+            cy = segments.y0[segment] + best_t * segments.dy[segment]
+            out.lat[rows], out.lon[rows] = from_plane(cx, cy, origin_lat, origin_lon)
+            along = segments.start_distance[segment] + best_t * segments.length[segment]
+            total = segments.total_length[shape]
+            out.fraction[rows] = np.clip(along / total, 0, 1) if total > 0 else 0.0
+            out.distance[rows] = np.sqrt(distance2[arange, best])
+    return out
@@ -0,0 +1,436 @@
+"""
+Sidecar indexes of parsed files, for point lookups such as "where was vehicle X between
+8 and 9" without downloading every file of the day.
+
+With PARSED_SIDECAR_INDEXES=true, save_hour_agg writes a small JSON sidecar for each
+parsed file of a table in INDEXED_FIELDS, under <table>__index with the same hive layout
+(the external tables read everything beneath <table>/, so the sidecars can't live
+there). A sidecar holds the generation of the file it describes, the min and max of its
+records' timestamps, the distinct values of each indexed field (up to SIDECAR_MAX_VALUES
+per field) and a Bloom filter of all of them, for fields with more distinct values than
+that. Daily compaction rebuilds the sidecar of each file it writes, then gathers the
+current sidecars of the day's files into one <table>__index/dt=.../day.jsonl, so that
+a lookup over a compacted month reads about 30 objects rather than a sidecar per file.
+
+    from dags.common import FeedType
+    from dags.sidecars import lookup
+
+    for match in lookup(
+        FeedType.gtfs_rt__vehicle_positions,
+        "vehicle_id",
+        "3021",
+        start=pendulum.datetime(2023, 7, 5, 8),
+        end=pendulum.datetime(2023, 7, 5, 9),
+    ):
+        ...
+
+lookup() lists a table's files for the window and reads each day's index, falling back
+to the sidecars of files the index doesn't cover (e.g. days not compacted yet, or hours
+parsed again since), then downloads only the files whose sidecar can match, along with
+any file that has no sidecar for its current generation.
+"""
+
+import base64
+import gzip
+import hashlib
+import io
+import json
+import math
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import (
+    Any,
+    Collection,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Set,
+    Union,
+)
+
+import pendulum
+from dagster import get_dagster_logger
+from pydantic import BaseModel
+
+from .common import (
+    SERIALIZERS,
+    FeedType,
+    GtfsScheduleFileType,
+    HourAgg,
+    ParsedFileFormat,
+    ParsedRecord,
+    hive_table,
+)
+from .reader import (
+    ParsedObject,
+    compacted_hour_filter,
+    download_ahead,
+    hourly_keys,
+    list_parsed_objects,
+)
+from .storage import ObjectNotFound, get_storage
+
+PARSED_SIDECAR_INDEXES = os.getenv("PARSED_SIDECAR_INDEXES", "false").lower() == "true"
+SIDECAR_MAX_VALUES = int(os.getenv("SIDECAR_MAX_VALUES", 1_000))
+SIDECAR_FALSE_POSITIVE_RATE = float(os.getenv("SIDECAR_FALSE_POSITIVE_RATE", 0.01))
+
+# dotted paths into each record, descending into every element of a list
+INDEXED_FIELDS: Dict[Union[FeedType, GtfsScheduleFileType], Dict[str, List[str]]] = {
+    FeedType.gtfs_rt__vehicle_positions: {
+        "vehicle_id": ["entity.vehicle.vehicle.id"],
+        "trip_id": ["entity.vehicle.trip.tripId"],
+        "stop_id": ["entity.vehicle.stopId"],
+    },
+    FeedType.gtfs_rt__trip_updates: {
+        "vehicle_id": ["entity.tripUpdate.vehicle.id"],
+        "trip_id": ["entity.tripUpdate.trip.tripId"],
+        "stop_id": ["entity.tripUpdate.stopTimeUpdate.stopId"],
+    },
+    FeedType.gtfs_rt__service_alerts: {
+        "trip_id": ["entity.alert.informedEntity.trip.tripId"],
+        "stop_id": ["entity.alert.informedEntity.stopId"],
+    },
+    FeedType.septa__transit_view_all: {
+        "vehicle_id": ["VehicleID"],
+        "trip_id": ["trip"],
+    },
+    FeedType.septa__train_view: {
+        "vehicle_id": ["trainno"],
+    },
+    GtfsScheduleFileType.trips_txt: {
+        "trip_id": ["trip_id"],
+    },
+    GtfsScheduleFileType.stop_times_txt: {
+        "trip_id": ["trip_id"],
+        "stop_id": ["stop_id"],
+    },
+    GtfsScheduleFileType.stops_txt: {
+        "stop_id": ["stop_id"],
+    },
+}
+
+# epoch seconds; the first path with a value is a record's timestamp
+TIMESTAMP_FIELDS: Dict[Union[FeedType, GtfsScheduleFileType], List[str]] = {
+    FeedType.gtfs_rt__vehicle_positions: [
+        "entity.vehicle.timestamp",
+        "header.timestamp",
+    ],
+    FeedType.gtfs_rt__trip_updates: ["entity.tripUpdate.timestamp", "header.timestamp"],
+    FeedType.gtfs_rt__service_alerts: ["header.timestamp"],
+}
+
+# vehicles report positions from before the fetch, so they can land in the next hour
+LOOKUP_SLACK = pendulum.duration(hours=1)
+
+
+def values_at(value: Any, path: str) -> Iterator[Any]:
+    head, _, rest = path.partition(".")
+    if isinstance(value, list):
+        for item in value:
+            yield from values_at(item, path)
+    elif isinstance(value, dict) and head in value:
+        if rest:
+            yield from values_at(value[head], rest)
+        elif value[head] is not None:
+            yield value[head]
+
+
+def field_values(
+    table: Union[FeedType, GtfsScheduleFileType], record: Dict[str, Any], field: str
+) -> Set[str]:
+    return {
+        str(value)
+        for path in INDEXED_FIELDS[table][field]
+        for value in values_at(record, path)
+    }
+
+
+def record_timestamp(
+    table: Union[FeedType, GtfsScheduleFileType], record: Dict[str, Any]
+) -> Optional[pendulum.DateTime]:
+    for path in TIMESTAMP_FIELDS.get(table, []):
+        for value in values_at(record, path):
+            try:
+                seconds = int(value)
+            except (TypeError, ValueError):
+                continue
+            if seconds:
+                return pendulum.from_timestamp(seconds)
+    return None
+
+
+def bloom_positions(value: str, num_bits: int, num_hashes: int) -> Iterator[int]:
+    # double hashing, from the two halves of one digest
+    digest = hashlib.blake2b(value.encode("utf-8"), digest_size=16).digest()
+    h1, h2 = int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little")
+    for i in range(num_hashes):
+        yield (h1 + i * h2) % num_bits
+
+
+class BloomFilter(BaseModel):
+    num_bits: int
+    num_hashes: int
+    # base64
+    bits: str
+
+    @classmethod
+    def build(
+        cls,
+        values: Collection[str],
+        false_positive_rate: float = SIDECAR_FALSE_POSITIVE_RATE,
+    ) -> "BloomFilter":
+        n = max(len(values), 1)
+        num_bits = max(
+            64, math.ceil(-n * math.log(false_positive_rate) / math.log(2) ** 2)
+        )
+        num_hashes = max(1, round(num_bits / n * math.log(2)))
+        bits = bytearray(math.ceil(num_bits / 8))
+        for value in values:
+            for position in bloom_positions(value, num_bits, num_hashes):
+                bits[position // 8] |= 1 << (position % 8)
+        return cls(
+            num_bits=num_bits,
+            num_hashes=num_hashes,
+            bits=base64.b64encode(bits).decode("ascii"),
+        )
+
+    def __contains__(self, value: str) -> bool:
+        bits = base64.b64decode(self.bits)
+        return all(
+            bits[position // 8] & (1 << (position % 8))
+            for position in bloom_positions(value, self.num_bits, self.num_hashes)
+        )
+
+
+class FileIndex(BaseModel):
+    key: str
+    generation: Optional[int]
+    records: int
+    min_ts: Optional[pendulum.DateTime]
+    max_ts: Optional[pendulum.DateTime]
+    # None for a field with more than SIDECAR_MAX_VALUES distinct values
+    values: Dict[str, Optional[List[str]]]
+    # of "<field>=<value>" for every field
+    bloom: BloomFilter
+
+    class Config:
+        json_encoders = {
+            pendulum.DateTime: lambda ts: ts.to_iso8601_string(),
+        }
+
+    def may_contain(self, field: str, value: str) -> bool:
+        exact = self.values.get(field)
+        if exact is not None:
+            return value in exact
+        return f"{field}={value}" in self.bloom
+
+    def may_overlap(self, start: pendulum.DateTime, end: pendulum.DateTime) -> bool:
+        if self.min_ts is None or self.max_ts is None:
+            return True
+        return self.min_ts < end and self.max_ts >= start
+
+
+def index_key(key: str) -> str:
+    table, _, rest = key.partition("/")
+    return f"{table}__index/{rest}.json"
+
+
+def day_index_key(
+    table: Union[FeedType, GtfsScheduleFileType],
+    format: ParsedFileFormat,
+    day: pendulum.Date,
+) -> str:
+    return f"{hive_table(table, format)}__index/dt={SERIALIZERS[pendulum.Date](day)}/day.jsonl"
+
+
+def build_index(
+    table: Union[FeedType, GtfsScheduleFileType],
+    key: str,
+    generation: Optional[int],
+    records: Iterable[Dict[str, Any]],
+) -> FileIndex:
+    distinct: Dict[str, Set[str]] = {field: set() for field in INDEXED_FIELDS[table]}
+    timestamps = []
+    count = 0
+    for record in records:
+        for field in distinct:
+            distinct[field] |= field_values(table, record, field)
+        ts = record_timestamp(table, record)
+        if ts:
+            timestamps.append(ts)
+        count += 1
+    return FileIndex(
+        key=key,
+        generation=generation,
+        records=count,
+        min_ts=min(timestamps) if timestamps else None,
+        max_ts=max(timestamps) if timestamps else None,
+        values={
+            field: sorted(values) if len(values) <= SIDECAR_MAX_VALUES else None
+            for field, values in distinct.items()
+        },
+        bloom=BloomFilter.build(
+            [
+                f"{field}={value}"
+                for field, values in distinct.items()
+                for value in values
+            ]
+        ),
+    )
+
+
+def save_index(bucket: str, index: FileIndex) -> None:
+    get_storage().write_bytes(
+        bucket, index_key(index.key), index.json(), content_type="application/json"
+    )
+
+
+def delete_index(bucket: str, key: str) -> None:
+    try:
+        get_storage().delete(bucket, index_key(key))
+    except ObjectNotFound:
+        pass
+
+
+def load_indexes(
+    table: Union[FeedType, GtfsScheduleFileType],
+    objects: List[ParsedObject],
+    format: ParsedFileFormat,
+    max_workers: int = 16,
+) -> Dict[str, FileIndex]:
+    """
+    Reads the sidecars of the given objects that have one for their current
+    generation, by the key of the object they describe: from their days' indexes, and
+    for the objects those don't cover, from their own sidecars.
+    """
+    storage = get_storage()
+    generations = {parsed.object.name: parsed.object.generation for parsed in objects}
+
+    def read_day(day: pendulum.Date) -> List[FileIndex]:
+        try:
+            contents = storage.read_text(
+                HourAgg.bucket, day_index_key(table, format, day)
+            )
+        except ObjectNotFound:
+            return []
+        return [FileIndex.parse_raw(line) for line in contents.splitlines() if line]
+
+    def list_prefix(prefix: str) -> List[str]:
+        return [obj.name for obj in storage.list(HourAgg.bucket, prefix=prefix)]
+
+    def read(name: str) -> FileIndex:
+        return FileIndex.parse_raw(storage.read_bytes(HourAgg.bucket, name))
+
+    def current(index: FileIndex) -> bool:
+        return index.generation == generations.get(index.key)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        found = {
+            index.key: index
+            for indexes in pool.map(
+                read_day, sorted({parsed.hour.date() for parsed in objects})
+            )
+            for index in indexes
+            if current(index)
+        }
+        uncovered = [parsed for parsed in objects if parsed.object.name not in found]
+        prefixes = [
+            f"{hive_table(table, format)}__index/dt={SERIALIZERS[pendulum.Date](day)}/"
+            for day in sorted({parsed.hour.date() for parsed in uncovered})
+        ]
+        names = {name for names in pool.map(list_prefix, prefixes) for name in names}
+        wanted = [
+            index_key(parsed.object.name)
+            for parsed in uncovered
+            if index_key(parsed.object.name) in names
+        ]
+        found.update(
+            (index.key, index) for index in pool.map(read, wanted) if current(index)
+        )
+    return found
+
+
+def save_day_index(
+    table: Union[FeedType, GtfsScheduleFileType], day: pendulum.Date
+) -> int:
+    """
+    Gathers the current sidecars of a day's files into the day's index; returns the
+    number of files it covers.
+    """
+    format = ParsedFileFormat.jsonl_gz
+    start = pendulum.datetime(day.year, day.month, day.day)
+    objects = list_parsed_objects(table, start, start.add(days=1), format=format)
+    indexes = load_indexes(table, objects, format)
+    get_storage().write_bytes(
+        HourAgg.bucket,
+        day_index_key(table, format, day),
+        "\n".join(index.json() for index in indexes.values()),
+        content_type="application/x-ndjson",
+    )
+    return len(indexes)
+
+
+class LookupMatch(NamedTuple):
+    object: ParsedObject
+    record: ParsedRecord
+
+
+def lookup(
+    table: Union[FeedType, GtfsScheduleFileType],
+    field: str,
+    value: str,
+    start: pendulum.DateTime,
+    end: pendulum.DateTime,
+    max_workers: int = 16,
+) -> Iterator[LookupMatch]:
+    """
+    Yields the records of a parsed JSONL table whose field has the given value, from
+    files for hours in [start, end); records are filtered by their own timestamp where
+    the table has one, and otherwise by their hour. Rows of compacted days are filtered
+    by their own hour, and skipped where an hourly file of the same hour exists.
+    """
+    if field not in INDEXED_FIELDS.get(table, {}):
+        raise ValueError(f"{field} is not indexed for {table.value}")
+    logger = get_dagster_logger()
+    start, end = start.in_tz("UTC"), end.in_tz("UTC")
+    format = ParsedFileFormat.jsonl_gz
+    list_start = start.start_of("hour")
+    list_end = end + LOOKUP_SLACK if table in TIMESTAMP_FIELDS else end
+    objects = list_parsed_objects(table, list_start, list_end, format=format)
+    hourly = hourly_keys(objects)
+    indexes = load_indexes(table, objects, format, max_workers=max_workers)
+    candidates = [
+        parsed
+        for parsed in objects
+        if parsed.object.name not in indexes
+        or (
+            indexes[parsed.object.name].may_overlap(start, end)
+            and indexes[parsed.object.name].may_contain(field, value)
+        )
+    ]
+    logger.info(
+        f"Downloading {len(candidates)} of {len(objects)} {hive_table(table, format)} files; "
+        f"{len(indexes)} had sidecars"
+    )
+    for parsed, contents in download_ahead(candidates, max_workers):
+        keep_hour = (
+            compacted_hour_filter(parsed, hourly, list_start, list_end)
+            if parsed.compacted
+            else None
+        )
+        with gzip.GzipFile(fileobj=io.BytesIO(contents)) as lines:
+            for line in lines:
+                if not line.strip():
+                    continue
+                row = json.loads(line)
+                if value not in field_values(table, row["record"], field):
+                    continue
+                if keep_hour and not keep_hour(row["metadata"]["hour"]):
+                    continue
+                ts = record_timestamp(table, row["record"])
+                if ts and not start <= ts < end:
+                    continue
+                yield LookupMatch(parsed, ParsedRecord.construct(**row))
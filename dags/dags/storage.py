@@ -0,0 +1,557 @@
+# This is copy-pasted from fetcher, but maybe fetcher should be a module in here?
+# fetcher/fetcher/storage.py is the canonical copy of this module. dags/dags/storage.py
+# repeats it verbatim after its first line; change the fetcher's, then copy it over.
+"""
+Object storage shared by everything that reads or writes the raw and parsed buckets.
+
+STORAGE_BACKEND selects between Google Cloud Storage (the default) and a local
+filesystem directory that mirrors the same bucket/key layout, which lets the whole
+pipeline run offline, e.g. for benchmarks. Buckets may be given with or without their
+gs:// prefix.
+"""
+
+import abc
+import os
+import random
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import cache
+from pathlib import Path
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterator,
+    NamedTuple,
+    Optional,
+    Tuple,
+    TypeVar,
+    Union,
+)
+
+import requests.adapters
+from google.api_core import exceptions as gcs_exceptions
+from google.cloud import storage  # type: ignore
+
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "gcs")
+LOCAL_STORAGE_ROOT = os.getenv("LOCAL_STORAGE_ROOT", "./.storage")
+# connections kept open per process; should be at least the number of threads using it
+GCS_MAX_CONNECTIONS = int(os.getenv("GCS_MAX_CONNECTIONS", 32))
+# bounds of the adaptive limit on concurrent reads and writes within a process
+STORAGE_INITIAL_CONCURRENCY = int(os.getenv("STORAGE_INITIAL_CONCURRENCY", 8))
+STORAGE_MIN_CONCURRENCY = int(os.getenv("STORAGE_MIN_CONCURRENCY", 1))
+STORAGE_MAX_CONCURRENCY = int(os.getenv("STORAGE_MAX_CONCURRENCY", GCS_MAX_CONNECTIONS))
+STORAGE_MAX_RETRIES = int(os.getenv("STORAGE_MAX_RETRIES", 5))
+
+# the client's own retries are disabled so that the limiter sees throttling
+THROTTLING_EXCEPTIONS = (
+    gcs_exceptions.TooManyRequests,
+    gcs_exceptions.ServiceUnavailable,
+)
+TRANSIENT_EXCEPTIONS = (
+    gcs_exceptions.InternalServerError,
+    gcs_exceptions.BadGateway,
+    gcs_exceptions.GatewayTimeout,
+    requests.exceptions.ConnectionError,
+)
+
+T = TypeVar("T")
+
+
+class ObjectNotFound(FileNotFoundError):
+    pass
+
+
+class PreconditionFailed(Exception):
+    pass
+
+
+class StorageObject(NamedTuple):
+    bucket: str
+    name: str
+    size: Optional[int] = None
+    md5_hash: Optional[str] = None
+    generation: Optional[int] = None
+
+
+def bucket_name(bucket: str) -> str:
+    return bucket.removeprefix("gs://")
+
+
+class AIMDLimiter:
+    """
+    Caps concurrent requests with additive-increase/multiplicative-decrease: each
+    success raises the limit by 1/limit, i.e. by about one per round of requests, while
+    throttling halves it and a latency spike trims it. Decreases apply at most once per
+    cooldown, so a round of requests failing together only counts once.
+    """
+
+    def __init__(
+        self,
+        initial: int = STORAGE_INITIAL_CONCURRENCY,
+        minimum: int = STORAGE_MIN_CONCURRENCY,
+        maximum: int = STORAGE_MAX_CONCURRENCY,
+        throttle_factor: float = 0.5,
+        spike_factor: float = 0.9,
+        # a request this many times slower than the running average is a spike
+        spike_ratio: float = 4.0,
+        # but requests faster than this never are
+        spike_floor_seconds: float = 1.0,
+        cooldown_seconds: float = 1.0,
+    ):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.throttle_factor = throttle_factor
+        self.spike_factor = spike_factor
+        self.spike_ratio = spike_ratio
+        self.spike_floor_seconds = spike_floor_seconds
+        self.cooldown_seconds = cooldown_seconds
+        self.limit = float(max(minimum, min(initial, maximum)))
+        self.in_flight = 0
+        self.throttles = 0
+        self.latency_spikes = 0
+        self._latency: Dict[str, float] = {}
+        self._last_decrease = 0.0
+        self._condition = threading.Condition()
+
+    @contextmanager
+    def slot(self) -> Iterator[None]:
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                self._condition.wait()
+            self.in_flight += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self.in_flight -= 1
+                self._condition.notify()
+
+    def on_success(self, operation: str, seconds: float) -> None:
+        with self._condition:
+            average = self._latency.get(operation)
+            self._latency[operation] = (
+                seconds if average is None else 0.9 * average + 0.1 * seconds
+            )
+            if (
+                average is not None
+                and seconds > self.spike_floor_seconds
+                and seconds > average * self.spike_ratio
+            ):
+                self.latency_spikes += 1
+                self._decrease(self.spike_factor)
+            else:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self._condition.notify_all()
+
+    def on_throttle(self) -> None:
+        with self._condition:
+            self.throttles += 1
+            self._decrease(self.throttle_factor)
+
+    def _decrease(self, factor: float) -> None:
+        now = time.monotonic()
+        if now - self._last_decrease >= self.cooldown_seconds:
+            self.limit = max(self.minimum, self.limit * factor)
+            self._last_decrease = now
+
+    def stats(self) -> Dict[str, float]:
+        with self._condition:
+            return {
+                "limit": self.limit,
+                "in_flight": self.in_flight,
+                "throttles": self.throttles,
+                "latency_spikes": self.latency_spikes,
+            }
+
+
+# the counters of the enclosing Storage.counting blocks in this context, innermost last
+_counters: ContextVar[Tuple[Dict[str, int], ...]] = ContextVar(
+    "storage_counters", default=()
+)
+
+
+class Storage(abc.ABC):
+    def __init__(self, limiter: Optional[AIMDLimiter] = None):
+        self.limiter = limiter or AIMDLimiter()
+        # bytes successfully transferred by this process, by operation
+        self._transferred: Dict[str, int] = {"read": 0, "write": 0}
+        self._transferred_lock = threading.Lock()
+
+    def transferred(self) -> Dict[str, int]:
+        with self._transferred_lock:
+            return dict(self._transferred)
+
+    @contextmanager
+    def counting(self) -> Iterator[Dict[str, int]]:
+        """
+        Counts the bytes transferred by operations in the current context (thread or
+        task) while entered, unlike transferred(), which counts the whole process.
+        Other threads' operations are only counted if they run in a copy of the context.
+        """
+        counter = {"read": 0, "write": 0}
+        token = _counters.set((*_counters.get(), counter))
+        try:
+            yield counter
+        finally:
+            _counters.reset(token)
+
+    def limited(
+        self, operation: str, fn: Callable[[], T], size: Optional[int] = None
+    ) -> T:
+        """
+        Calls fn once the limiter allows it, retrying throttled and transient failures
+        with jittered exponential backoff. The bytes transferred are counted as size,
+        or as the length of fn's result if that is bytes.
+        """
+        for attempt in range(STORAGE_MAX_RETRIES + 1):
+            with self.limiter.slot():
+                start = time.monotonic()
+                try:
+                    result = fn()
+                except THROTTLING_EXCEPTIONS:
+                    self.limiter.on_throttle()
+                    if attempt == STORAGE_MAX_RETRIES:
+                        raise
+                except TRANSIENT_EXCEPTIONS:
+                    if attempt == STORAGE_MAX_RETRIES:
+                        raise
+                else:
+                    self.limiter.on_success(operation, time.monotonic() - start)
+                    transferred = size
+                    if transferred is None and isinstance(result, bytes):
+                        transferred = len(result)
+                    with self._transferred_lock:
+                        for counter in (self._transferred, *_counters.get()):
+                            counter[operation] = counter.get(operation, 0) + (
+                                transferred or 0
+                            )
+                    return result
+            # sleep outside the slot so others can use it
+            time.sleep(min(30.0, 2.0**attempt) * random.uniform(0.5, 1.0))
+        raise AssertionError("unreachable")
+
+    @abc.abstractmethod
+    def read_bytes(
+        self, bucket: str, key: str, generation: Optional[int] = None
+    ) -> bytes: ...
+
+    def read_text(self, bucket: str, key: str, generation: Optional[int] = None) -> str:
+        return self.read_bytes(bucket, key, generation=generation).decode("utf-8")
+
+    @abc.abstractmethod
+    def read_range(self, bucket: str, key: str, start: int, length: int) -> bytes:
+        """
+        Reads length bytes starting at offset start, e.g. one member of a bundle.
+        """
+
+    @abc.abstractmethod
+    def write_bytes(
+        self,
+        bucket: str,
+        key: str,
+        data: Union[bytes, str],
+        content_type: Optional[str] = None,
+        if_generation_match: Optional[int] = None,
+        timeout: Optional[int] = None,
+    ) -> StorageObject:
+        """
+        if_generation_match=0 means the object must not exist yet.
+        """
+
+    @abc.abstractmethod
+    def list(
+        self, bucket: str, prefix: str = "", start_offset: Optional[str] = None
+    ) -> Iterator[StorageObject]:
+        """
+        Yields objects in lexicographic order of their names.
+        """
+
+    @abc.abstractmethod
+    def exists(self, bucket: str, key: str) -> bool: ...
+
+    @abc.abstractmethod
+    def delete(
+        self, bucket: str, key: str, if_generation_match: Optional[int] = None
+    ) -> None: ...
+
+
+class GCSStorage(Storage):
+    def __init__(
+        self,
+        max_connections: int = GCS_MAX_CONNECTIONS,
+        limiter: Optional[AIMDLimiter] = None,
+    ):
+        super().__init__(limiter=limiter)
+        self.max_connections = max_connections
+        self._clients: Dict[int, storage.Client] = {}
+        self._clients_lock = threading.Lock()
+
+    @property
+    def client(self) -> storage.Client:
+        # connection pools can't be shared across a fork, e.g. by a process pool
+        pid = os.getpid()
+        if pid not in self._clients:
+            # so that threads making their first calls at once share one client
+            with self._clients_lock:
+                if pid not in self._clients:
+                    client = storage.Client()
+                    adapter = requests.adapters.HTTPAdapter(
+                        pool_connections=self.max_connections,
+                        pool_maxsize=self.max_connections,
+                    )
+                    client._http.mount("https://", adapter)
+                    self._clients[pid] = client
+        return self._clients[pid]
+
+    def blob(
+        self, bucket: str, key: str, generation: Optional[int] = None
+    ) -> storage.Blob:
+        return self.client.bucket(bucket_name(bucket)).blob(key, generation=generation)
+
+    @staticmethod
+    def to_object(blob: storage.Blob) -> StorageObject:
+        return StorageObject(
+            bucket=blob.bucket.name,
+            name=blob.name,
+            size=blob.size,
+            md5_hash=blob.md5_hash,
+            generation=blob.generation,
+        )
+
+    def read_bytes(
+        self, bucket: str, key: str, generation: Optional[int] = None
+    ) -> bytes:
+        blob = self.blob(bucket, key, generation)
+        try:
+            return self.limited(
+                "read",
+                lambda: blob.download_as_bytes(client=self.client, retry=None),
+            )
+        except gcs_exceptions.NotFound as e:
+            raise ObjectNotFound(f"{bucket}/{key}") from e
+
+    def read_range(self, bucket: str, key: str, start: int, length: int) -> bytes:
+        blob = self.blob(bucket, key)
+        try:
+            return self.limited(
+                "read",
+                lambda: blob.download_as_bytes(
+                    client=self.client,
+                    start=start,
+                    # inclusive
+                    end=start + length - 1,
+                    # only whole objects can be checked against their hash
+                    checksum=None,
+                    retry=None,
+                ),
+            )
+        except gcs_exceptions.NotFound as e:
+            raise ObjectNotFound(f"{bucket}/{key}") from e
+
+    def write_bytes(
+        self,
+        bucket: str,
+        key: str,
+        data: Union[bytes, str],
+        content_type: Optional[str] = None,
+        if_generation_match: Optional[int] = None,
+        timeout: Optional[int] = None,
+    ) -> StorageObject:
+        blob = self.blob(bucket, key)
+        contents = data.encode("utf-8") if isinstance(data, str) else data
+        kwargs: Dict[str, Any] = {}
+        if content_type:
+            kwargs["content_type"] = content_type
+        if timeout:
+            kwargs["timeout"] = timeout
+        try:
+            self.limited(
+                "write",
+                lambda: blob.upload_from_string(
+                    contents,
+                    if_generation_match=if_generation_match,
+                    client=self.client,
+                    retry=None,
+                    **kwargs,
+                ),
+                size=len(contents),
+            )
+        except gcs_exceptions.PreconditionFailed as e:
+            raise PreconditionFailed(f"{bucket}/{key}") from e
+        return self.to_object(blob)
+
+    def list(
+        self, bucket: str, prefix: str = "", start_offset: Optional[str] = None
+    ) -> Iterator[StorageObject]:
+        for blob in self.client.list_blobs(
+            bucket_name(bucket), prefix=prefix, start_offset=start_offset
+        ):
+            yield self.to_object(blob)
+
+    def exists(self, bucket: str, key: str) -> bool:
+        return self.blob(bucket, key).exists(client=self.client)
+
+    def delete(
+        self, bucket: str, key: str, if_generation_match: Optional[int] = None
+    ) -> None:
+        try:
+            self.blob(bucket, key).delete(
+                client=self.client, if_generation_match=if_generation_match
+            )
+        except gcs_exceptions.NotFound as e:
+            raise ObjectNotFound(f"{bucket}/{key}") from e
+        except gcs_exceptions.PreconditionFailed as e:
+            raise PreconditionFailed(f"{bucket}/{key}") from e
+
+
+class LocalStorage(Storage):
+    """
+    Stores each object at <root>/<bucket>/<key>, using the file's modification time in
+    nanoseconds as its generation. Generation preconditions are only enforced between
+    threads of a single process.
+    """
+
+    def __init__(
+        self,
+        root: Union[str, Path] = LOCAL_STORAGE_ROOT,
+        limiter: Optional[AIMDLimiter] = None,
+    ):
+        super().__init__(limiter=limiter)
+        self.root = Path(root)
+        self._lock = threading.Lock()
+        self._last_generation = 0
+
+    def path(self, bucket: str, key: str) -> Path:
+        path = self.root / bucket_name(bucket) / key
+        assert ".." not in path.relative_to(self.root).parts, key
+        return path
+
+    def _generation(self, path: Path) -> int:
+        try:
+            return path.stat().st_mtime_ns
+        except FileNotFoundError:
+            return 0
+
+    def read_bytes(
+        self, bucket: str, key: str, generation: Optional[int] = None
+    ) -> bytes:
+        path = self.path(bucket, key)
+        if generation is not None and self._generation(path) != generation:
+            raise ObjectNotFound(f"{bucket}/{key}#{generation}")
+        try:
+            return self.limited("read", path.read_bytes)
+        except FileNotFoundError as e:
+            raise ObjectNotFound(f"{bucket}/{key}") from e
+
+    def read_range(self, bucket: str, key: str, start: int, length: int) -> bytes:
+        path = self.path(bucket, key)
+
+        def read() -> bytes:
+            with path.open("rb") as f:
+                f.seek(start)
+                return f.read(length)
+
+        try:
+            return self.limited("read", read)
+        except FileNotFoundError as e:
+            raise ObjectNotFound(f"{bucket}/{key}") from e
+
+    def write_bytes(
+        self,
+        bucket: str,
+        key: str,
+        data: Union[bytes, str],
+        content_type: Optional[str] = None,
+        if_generation_match: Optional[int] = None,
+        timeout: Optional[int] = None,
+    ) -> StorageObject:
+        path = self.path(bucket, key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        contents = data.encode("utf-8") if isinstance(data, str) else data
+        # write then rename, so readers and listings never see partial objects
+        tmp = path.with_name(f".{path.name}.{uuid.uuid4().hex}.tmp")
+        self.limited("write", lambda: tmp.write_bytes(contents), size=len(contents))
+        with self._lock:
+            if (
+                if_generation_match is not None
+                and self._generation(path) != if_generation_match
+            ):
+                tmp.unlink()
+                raise PreconditionFailed(f"{bucket}/{key}")
+            os.replace(tmp, path)
+            # coarse filesystem timestamps could otherwise repeat a generation
+            generation = max(time.time_ns(), self._last_generation + 1)
+            os.utime(path, ns=(generation, generation))
+            self._last_generation = generation
+        return StorageObject(
+            bucket=bucket_name(bucket),
+            name=key,
+            size=len(contents),
+            generation=generation,
+        )
+
+    def list(
+        self, bucket: str, prefix: str = "", start_offset: Optional[str] = None
+    ) -> Iterator[StorageObject]:
+        bucket_root = self.root / bucket_name(bucket)
+        # start walking at the deepest directory the prefix fully names
+        top = bucket_root / prefix.rpartition("/")[0]
+        if not top.is_dir():
+            return
+        names = sorted(
+            path.relative_to(bucket_root).as_posix()
+            for path in top.rglob("*")
+            if path.is_file() and not path.name.startswith(".")
+        )
+        for name in names:
+            if not name.startswith(prefix):
+                continue
+            if start_offset is not None and name < start_offset:
+                continue
+            path = bucket_root / name
+            stat = path.stat()
+            yield StorageObject(
+                bucket=bucket_name(bucket),
+                name=name,
+                size=stat.st_size,
+                generation=stat.st_mtime_ns,
+            )
+
+    def exists(self, bucket: str, key: str) -> bool:
+        return self.path(bucket, key).is_file()
+
+    def delete(
+        self, bucket: str, key: str, if_generation_match: Optional[int] = None
+    ) -> None:
+        path = self.path(bucket, key)
+        with self._lock:
+            generation = self._generation(path)
+            if not generation:
+                raise ObjectNotFound(f"{bucket}/{key}")
+            if if_generation_match is not None and generation != if_generation_match:
+                raise PreconditionFailed(f"{bucket}/{key}")
+            path.unlink()
+
+
+def get_storage() -> Storage:
+    """
+    The process's storage. STORAGE_BACKEND and LOCAL_STORAGE_ROOT are read on every
+    call, so a process can switch backends by setting them, e.g. the benchmark.
+    """
+    return _storage(
+        os.getenv("STORAGE_BACKEND", STORAGE_BACKEND),
+        os.getenv("LOCAL_STORAGE_ROOT", LOCAL_STORAGE_ROOT),
+    )
+
+
+@cache
+def _storage(backend: str, root: str) -> Storage:
+    if backend == "gcs":
+        return GCSStorage()
+    if backend == "local":
+        return LocalStorage(root)
+    raise ValueError(f"Unknown STORAGE_BACKEND {backend!r}")
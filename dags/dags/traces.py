@@ -0,0 +1,153 @@
+"""
+Per-stage latency distributions of a feed's traces over a time window.
+
+    python -m dags.traces gtfs_rt__vehicle_positions 2023-07-05T00 2023-07-05T06
+
+reads the spans written by the bucket exporter (or by the file exporter, with --spans)
+and reports how long each stage of a fetch took, from the ticker enqueueing it through
+parsing its records. Besides the spans' own stages, awaiting_parse is the time between
+a raw file's upload ending and the listing that found it starting, and end_to_end the
+time from the tick to the parsed records being saved. A stage that ran more than once
+in a trace, e.g. when an hour was re-parsed, counts its first run.
+"""
+
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+import numpy as np
+import pendulum
+import typer
+from tabulate import tabulate
+
+from .common import FeedType
+from .storage import get_storage
+from .tracing import TRACE_BUCKET, TRACE_PREFIX, Span, read_spans
+
+STAGES = [
+    "enqueue",
+    "queue_wait",
+    "fetch",
+    "upload",
+    "awaiting_parse",
+    "list",
+    "download",
+    "parse",
+    "save",
+    "end_to_end",
+]
+# spans are written in batches some time after they end
+EXPORT_SLACK = pendulum.duration(hours=1)
+
+
+def bucket_spans(
+    bucket: str, start: pendulum.DateTime, end: pendulum.DateTime
+) -> Iterator[Span]:
+    storage = get_storage()
+    for day in pendulum.period(
+        start.start_of("day"), (end + EXPORT_SLACK).start_of("day")
+    ).range("days"):
+        for obj in storage.list(
+            bucket, prefix=f"{TRACE_PREFIX}/dt={day.to_date_string()}/"
+        ):
+            yield from read_spans(storage.read_text(obj.bucket, obj.name).splitlines())
+
+
+def file_spans(paths: List[Path]) -> Iterator[Span]:
+    for path in paths:
+        with path.open() as f:
+            yield from read_spans(f)
+
+
+def group_traces(
+    spans: Iterator[Span],
+    feed_type: FeedType,
+    start: pendulum.DateTime,
+    end: pendulum.DateTime,
+) -> Dict[str, Dict[str, Span]]:
+    """
+    Groups a feed type's spans by trace and stage, keeping each stage's first span;
+    traces are kept if they were enqueued within [start, end).
+    """
+    traces: Dict[str, Dict[str, Span]] = {}
+    for span in spans:
+        if span.feed_type != feed_type.value:
+            continue
+        stages = traces.setdefault(span.trace_id, {})
+        if span.name not in stages or span.start < stages[span.name].start:
+            stages[span.name] = span
+    return {
+        trace_id: stages
+        for trace_id, stages in traces.items()
+        if "enqueue" in stages and start <= stages["enqueue"].start < end
+    }
+
+
+def stage_latencies(traces: Dict[str, Dict[str, Span]]) -> Dict[str, List[float]]:
+    latencies: Dict[str, List[float]] = {stage: [] for stage in STAGES}
+    for stages in traces.values():
+        for name, span in stages.items():
+            if name in latencies:
+                latencies[name].append(span.seconds)
+        if "upload" in stages and "list" in stages:
+            latencies["awaiting_parse"].append(
+                (stages["list"].start - stages["upload"].end).total_seconds()
+            )
+        if "save" in stages:
+            latencies["end_to_end"].append(
+                (stages["save"].end - stages["enqueue"].start).total_seconds()
+            )
+    return latencies
+
+
+def latency_table(latencies: Dict[str, List[float]]) -> str:
+    rows = []
+    for stage in STAGES:
+        seconds = np.array(latencies[stage])
+        if not len(seconds):
+            continue
+        p50, p90, p99 = np.percentile(seconds, [50, 90, 99])
+        rows.append(
+            {
+                "stage": stage,
+                "count": len(seconds),
+                "p50_seconds": round(p50, 3),
+                "p90_seconds": round(p90, 3),
+                "p99_seconds": round(p99, 3),
+                "max_seconds": round(seconds.max(), 3),
+            }
+        )
+    return tabulate(rows, headers="keys", tablefmt="github")
+
+
+def main(
+    feed_type: FeedType = typer.Argument(...),
+    start: str = typer.Argument(..., help="Start of the window, inclusive."),
+    end: str = typer.Argument(..., help="End of the window, exclusive."),
+    spans: List[Path] = typer.Option(
+        [],
+        help="JSONL files written by the file exporter; defaults to reading the spans in TRACE_BUCKET.",
+    ),
+    bucket: Optional[str] = typer.Option(None, help="Defaults to TRACE_BUCKET."),
+):
+    start_ts = pendulum.parse(start).in_tz("UTC")  # type: ignore[union-attr]
+    end_ts = pendulum.parse(end).in_tz("UTC")  # type: ignore[union-attr]
+    traces = group_traces(
+        (
+            file_spans(spans)
+            if spans
+            else bucket_spans(bucket or TRACE_BUCKET, start_ts, end_ts)
+        ),
+        feed_type,
+        start_ts,
+        end_ts,
+    )
+    typer.secho(
+        f"Found {len(traces)} traces of {feed_type.value} enqueued from {start_ts} to {end_ts}",
+        fg=typer.colors.MAGENTA,
+        err=True,
+    )
+    typer.echo(latency_table(stage_latencies(traces)))
+
+
+if __name__ == "__main__":
+    typer.run(main)
@@ -0,0 +1,240 @@
+# This is copy-pasted from fetcher, but maybe fetcher should be a module in here?
+"""
+Traces that follow a single fetch from the ticker to its parsed records.
+
+The ticker starts a trace for every fetch it enqueues. The trace's context then rides
+along in the fetch task's kwargs, and in the raw file (and manifest entry) the task
+saves, so that parsing can add its own spans to the same trace. Every span is a child
+of the trace's root and names one stage: enqueue, queue_wait, fetch, upload, list,
+download, parse or save.
+
+Spans are handed to the exporter chosen by TRACE_EXPORTER: "file" appends them to the
+local TRACE_FILE, for offline use; "bucket" writes them in batches under traces/ in
+TRACE_BUCKET; anything else drops them. Exporters can also be set directly with
+set_exporter().
+"""
+
+import abc
+import atexit
+import logging
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+
+import pendulum
+from pydantic import BaseModel
+
+TRACE_EXPORTER = os.getenv("TRACE_EXPORTER", "")
+TRACE_FILE = os.getenv("TRACE_FILE", "traces.jsonl")
+TRACE_BUCKET = os.getenv("TRACE_BUCKET", os.getenv("PARSED_BUCKET", ""))
+TRACE_PREFIX = "traces"
+# the bucket exporter writes a batch once it has this many spans, or is this old
+TRACE_FLUSH_SPANS = int(os.getenv("TRACE_FLUSH_SPANS", 1000))
+TRACE_FLUSH_SECONDS = int(os.getenv("TRACE_FLUSH_SECONDS", 60))
+
+logger = logging.getLogger(__name__)
+
+
+def new_id() -> str:
+    return uuid.uuid4().hex[:16]
+
+
+class TraceContext(BaseModel):
+    trace_id: str
+    # the span that new spans are children of
+    span_id: str
+    feed_type: str
+    # when the context was last handed on, e.g. to the task queue
+    sent_at: Optional[pendulum.DateTime] = None
+
+    class Config:
+        json_encoders = {
+            pendulum.DateTime: lambda ts: ts.to_iso8601_string(),
+        }
+
+    @classmethod
+    def start(cls, feed_type: str) -> "TraceContext":
+        return cls(trace_id=uuid.uuid4().hex, span_id=new_id(), feed_type=feed_type)
+
+    def sent(self) -> "TraceContext":
+        return self.copy(update={"sent_at": pendulum.now(tz="UTC")})
+
+
+class Span(BaseModel):
+    trace_id: str
+    span_id: str
+    parent_id: Optional[str]
+    name: str
+    feed_type: str
+    start: pendulum.DateTime
+    end: pendulum.DateTime
+    attributes: Dict[str, Any] = {}
+
+    class Config:
+        json_encoders = {
+            pendulum.DateTime: lambda ts: ts.to_iso8601_string(),
+        }
+
+    @property
+    def seconds(self) -> float:
+        return (self.end - self.start).total_seconds()
+
+
+class SpanExporter(abc.ABC):
+    @abc.abstractmethod
+    def export(self, span: Span) -> None: ...
+
+    def flush(self) -> None:
+        pass
+
+
+class NullSpanExporter(SpanExporter):
+    def export(self, span: Span) -> None:
+        pass
+
+
+class FileSpanExporter(SpanExporter):
+    """
+    Appends spans to a local JSONL file as they end.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def export(self, span: Span) -> None:
+        line = span.json() + "\n"
+        with self._lock, self.path.open("a") as f:
+            f.write(line)
+
+
+class BucketSpanExporter(SpanExporter):
+    """
+    Buffers spans and writes each batch as a JSONL object under
+    <prefix>/dt=<date>/ in a bucket; storage_factory returns the storage to write to.
+    """
+
+    def __init__(
+        self,
+        storage_factory: Callable[[], Any],
+        bucket: str,
+        prefix: str = TRACE_PREFIX,
+    ):
+        self.storage_factory = storage_factory
+        self.bucket = bucket
+        self.prefix = prefix
+        self._spans: List[Span] = []
+        self._first = 0.0
+        self._lock = threading.Lock()
+
+    def export(self, span: Span) -> None:
+        with self._lock:
+            if not self._spans:
+                self._first = time.monotonic()
+            self._spans.append(span)
+            full = len(self._spans) >= TRACE_FLUSH_SPANS
+            stale = time.monotonic() - self._first >= TRACE_FLUSH_SECONDS
+        if full or stale:
+            self.flush()
+
+    def flush(self) -> None:
+        with self._lock:
+            spans, self._spans = self._spans, []
+        if not spans:
+            return
+        now = pendulum.now(tz="UTC")
+        key = f"{self.prefix}/dt={now.to_date_string()}/{now.format('YYYYMMDDTHHmmss')}-{new_id()}.jsonl"
+        try:
+            self.storage_factory().write_bytes(
+                self.bucket,
+                key,
+                "\n".join(span.json() for span in spans),
+                content_type="application/x-ndjson",
+            )
+        except Exception as e:
+            # tracing must never fail the fetch or parse it describes
+            logger.warning(f"Dropped {len(spans)} spans, failed to write {key}: {e}")
+
+
+_exporter: SpanExporter = NullSpanExporter()
+
+
+def set_exporter(exporter: SpanExporter) -> SpanExporter:
+    global _exporter
+    previous, _exporter = _exporter, exporter
+    return previous
+
+
+def get_exporter() -> SpanExporter:
+    return _exporter
+
+
+def configure_tracing(storage_factory: Callable[[], Any]) -> SpanExporter:
+    """
+    Sets the exporter chosen by TRACE_EXPORTER, flushing it when the process exits.
+    """
+    exporter: SpanExporter
+    if TRACE_EXPORTER == "file":
+        exporter = FileSpanExporter(Path(TRACE_FILE))
+    elif TRACE_EXPORTER == "bucket":
+        exporter = BucketSpanExporter(storage_factory, TRACE_BUCKET)
+    else:
+        exporter = NullSpanExporter()
+    set_exporter(exporter)
+    atexit.register(exporter.flush)
+    return exporter
+
+
+def export_span(
+    context: Optional[TraceContext],
+    name: str,
+    start: pendulum.DateTime,
+    end: pendulum.DateTime,
+    **attributes: Any,
+) -> Optional[Span]:
+    """
+    Exports a span that already happened; does nothing without a trace context, e.g.
+    for raw files fetched before tracing existed.
+    """
+    if context is None:
+        return None
+    span = Span(
+        trace_id=context.trace_id,
+        span_id=new_id(),
+        parent_id=context.span_id,
+        name=name,
+        feed_type=context.feed_type,
+        start=start,
+        end=end,
+        attributes=attributes,
+    )
+    _exporter.export(span)
+    return span
+
+
+@contextmanager
+def span(
+    context: Optional[TraceContext], name: str, **attributes: Any
+) -> Iterator[Dict[str, Any]]:
+    """
+    Exports a span covering the with block; attributes may be added to the yielded
+    dict. Spans are exported even if the block raises, with the exception's type.
+    """
+    start = pendulum.now(tz="UTC")
+    try:
+        yield attributes
+    except Exception as e:
+        attributes["error"] = type(e).__name__
+        raise
+    finally:
+        export_span(context, name, start, pendulum.now(tz="UTC"), **attributes)
+
+
+def read_spans(lines: Iterable[str]) -> Iterator[Span]:
+    for line in lines:
+        if line.strip():
+            yield Span.parse_raw(line)
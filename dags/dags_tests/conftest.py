@@ -0,0 +1,19 @@
+from pathlib import Path
+from typing import Iterator
+
+import pytest
+
+from dags.storage import LocalStorage, get_storage
+
+
+@pytest.fixture
+def storage(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Iterator[LocalStorage]:
+    """
+    Selects a LocalStorage under tmp_path through STORAGE_BACKEND, so that every
+    module's get_storage returns it.
+    """
+    monkeypatch.setenv("STORAGE_BACKEND", "local")
+    monkeypatch.setenv("LOCAL_STORAGE_ROOT", str(tmp_path))
+    storage = get_storage()
+    assert isinstance(storage, LocalStorage)
+    yield storage
@@ -0,0 +1,144 @@
+import random
+from unittest import mock
+
+import pendulum
+import pytest
+
+from dags.assets import (
+    HourKey,
+    iter_parse_outcomes,
+    load_parse_memo,
+    load_parse_outcomes,
+    parse_fingerprint,
+    parse_group,
+    save_parse_outcomes,
+    serialize_parse_outcomes,
+)
+from dags.benchmark import septa_json
+from dags.common import (
+    FeedConfig,
+    FeedType,
+    ParseMemo,
+    ParseOutcome,
+    RawFetchedFile,
+    RawFileRef,
+)
+from dags.storage import LocalStorage
+
+HOUR = pendulum.datetime(2023, 7, 5, 1)
+CONFIG = FeedConfig(
+    name="alerts",
+    url="https://www3.septa.org/api/Alerts/index.php",
+    feed_type=FeedType.septa__alerts,
+)
+
+
+def file_ref(name: str, generation: int) -> RawFileRef:
+    return RawFileRef(name=name, size=10, md5_hash="abc", generation=generation)
+
+
+def test_parse_fingerprint_ignores_order():
+    files = [file_ref("a", 1), file_ref("b", 2)]
+    assert parse_fingerprint(FeedType.septa__alerts, files) == parse_fingerprint(
+        FeedType.septa__alerts, list(reversed(files))
+    )
+
+
+def test_parse_fingerprint_changes_with_inputs_and_parser_version():
+    files = [file_ref("a", 1)]
+    fingerprint = parse_fingerprint(FeedType.septa__alerts, files)
+
+    assert fingerprint != parse_fingerprint(FeedType.septa__alerts, [file_ref("a", 2)])
+    assert fingerprint != parse_fingerprint(
+        FeedType.septa__alerts, files + [file_ref("b", 1)]
+    )
+    with mock.patch.dict("dags.assets.PARSER_VERSIONS", {FeedType.septa__alerts: 2}):
+        assert fingerprint != parse_fingerprint(FeedType.septa__alerts, files)
+
+
+def test_parse_fingerprint_requires_generation_or_hash():
+    files = [RawFileRef(name="a", size=None, md5_hash=None, generation=None)]
+    assert parse_fingerprint(FeedType.septa__alerts, files) is None
+
+
+def parse_outcome(name: str, success: bool = True) -> ParseOutcome:
+    return ParseOutcome(
+        file={"ts": "2023-07-05T01:00:00+00:00", "name": name},
+        metadata={"hash": name},
+        success=success,
+    )
+
+
+def test_save_parse_outcomes_round_trips_and_skips_unchanged(tmp_path):
+    outcomes = [parse_outcome("a"), parse_outcome("b", success=False)]
+    storage = LocalStorage(tmp_path)
+    with mock.patch("dags.assets.get_storage", return_value=storage):
+        storage.write_bytes("parsed", "outcomes/h.jsonl", "{}")
+
+        assert save_parse_outcomes("parsed", "outcomes/h.jsonl.gz", outcomes)
+        assert not storage.exists("parsed", "outcomes/h.jsonl")
+        assert not save_parse_outcomes("parsed", "outcomes/h.jsonl.gz", outcomes)
+        assert list(load_parse_outcomes("parsed", "outcomes/h.jsonl.gz")) == outcomes
+
+        assert save_parse_outcomes("parsed", "outcomes/h.jsonl.gz", [])
+        assert not storage.exists("parsed", "outcomes/h.jsonl.gz")
+
+
+def test_iter_parse_outcomes_projects_fields_and_reads_legacy_jsonl():
+    outcomes = [parse_outcome("a"), parse_outcome("b", success=False)]
+    legacy = "\n".join(outcome.json() for outcome in outcomes).encode("utf-8")
+
+    for contents in (serialize_parse_outcomes(outcomes), legacy):
+        projected = list(iter_parse_outcomes(contents, fields=["success", "file.name"]))
+        assert [outcome.success for outcome in projected] == [True, False]
+        assert [outcome.file for outcome in projected] == [{"name": "a"}, {"name": "b"}]
+
+
+def raw_file(minute: int) -> RawFetchedFile:
+    return RawFetchedFile(
+        ts=HOUR.add(minutes=minute),
+        config=CONFIG,
+        response_code=200,
+        response_headers={},
+        contents=septa_json(FeedType.septa__alerts, random.Random(minute), 0.1, HOUR),
+    )
+
+
+def save_raw(storage: LocalStorage, minute: int) -> RawFileRef:
+    raw = raw_file(minute)
+    return RawFileRef.from_object(
+        storage.write_bytes(raw.bucket, raw.gcs_key, raw.json())
+    )
+
+
+def test_parse_group_skips_unchanged_groups(tmp_path):
+    storage = LocalStorage(tmp_path)
+    key = HourKey(
+        feed_type=FeedType.septa__alerts.value,
+        hour=HOUR,
+        base64url=raw_file(0).base64url,
+    )
+    memo = ParseMemo(fingerprint="", **key._asdict())
+    with (
+        mock.patch("dags.assets.get_storage", return_value=storage),
+        mock.patch("dags.sidecars.get_storage", return_value=storage),
+    ):
+        files = [save_raw(storage, 5)]
+        outcomes, skipped = parse_group(key, files)
+        assert not skipped and [o.success for o in outcomes] == [True]
+        memoized, skipped = parse_group(key, files)
+        assert skipped
+        assert [o.metadata for o in memoized] == [o.metadata for o in outcomes]
+        assert not parse_group(key, files, force=True)[1]
+
+        # a failed save leaves the previous memo, so the group is parsed again
+        fingerprint = load_parse_memo(memo).fingerprint
+        files.append(save_raw(storage, 10))
+        with mock.patch(
+            "dags.assets.save_hour_agg", side_effect=RuntimeError("upload failed")
+        ):
+            with pytest.raises(RuntimeError):
+                parse_group(key, files)
+        assert load_parse_memo(memo).fingerprint == fingerprint
+        outcomes, skipped = parse_group(key, files)
+        assert not skipped and len(outcomes) == 2
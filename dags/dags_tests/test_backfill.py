@@ -0,0 +1,108 @@
+import random
+from unittest import mock
+
+import pendulum
+import pytest
+from dagster import MultiPartitionKey, materialize
+
+from dags import GzippedPydanticGCSIOManager
+from dags.assets import load_parse_outcomes, raw_files_list
+from dags.backfill import (
+    PartitionResult,
+    load_ledger,
+    parse_partition,
+    raw_files_list_path,
+)
+from dags.benchmark import septa_json
+from dags.common import (
+    PARSED_BUCKET,
+    FeedConfig,
+    FeedType,
+    RawFetchedFile,
+    parse_outcomes_path,
+)
+from dags.incremental import PARSE_OUTCOMES_ASSET
+from dags.resources.profiling import ProfilingResource
+from dags.storage import LocalStorage
+
+HOUR = pendulum.datetime(2023, 7, 5, 1)
+CONFIG = FeedConfig(
+    name="alerts",
+    url="https://www3.septa.org/api/Alerts/index.php",
+    feed_type=FeedType.septa__alerts,
+)
+
+
+@pytest.fixture(autouse=True)
+def healthcheck(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr("dags.assets.ping_healthcheck", mock.Mock())
+
+
+def save_raw(storage: LocalStorage, minute: int) -> None:
+    raw = RawFetchedFile(
+        ts=HOUR.add(minutes=minute),
+        config=CONFIG,
+        response_code=200,
+        response_headers={},
+        contents=septa_json(FeedType.septa__alerts, random.Random(minute), 0.1, HOUR),
+    )
+    storage.write_bytes(raw.bucket, raw.gcs_key, raw.json())
+
+
+def test_parse_partition_parses_and_skips_unchanged_groups(storage):
+    save_raw(storage, 5)
+    save_raw(storage, 10)
+
+    result = parse_partition(FeedType.septa__alerts, HOUR)
+    assert result.success, result.error
+    assert (result.files, result.groups, result.skipped_groups) == (2, 1, 0)
+    outcomes = list(
+        load_parse_outcomes(
+            PARSED_BUCKET,
+            f"{PARSE_OUTCOMES_ASSET}/{parse_outcomes_path(FeedType.septa__alerts, HOUR)}",
+        )
+    )
+    assert [outcome.success for outcome in outcomes] == [True, True]
+
+    assert parse_partition(FeedType.septa__alerts, HOUR).skipped_groups == 1
+    assert parse_partition(FeedType.septa__alerts, HOUR, force=True).skipped_groups == 0
+
+    with mock.patch("dags.backfill.list_raw_hour", side_effect=OSError("denied")):
+        failed = parse_partition(FeedType.septa__alerts, HOUR)
+    assert not failed.success
+    assert failed.error == "OSError: denied"
+
+
+def test_load_ledger_resumes_only_completed_partitions(tmp_path):
+    ledger = tmp_path / "ledger.jsonl"
+    assert load_ledger(ledger) == set()
+
+    results = [
+        PartitionResult(feed_type=FeedType.septa__alerts, hour=HOUR, success=True),
+        PartitionResult(
+            feed_type=FeedType.septa__alerts,
+            hour=HOUR.add(hours=1),
+            success=False,
+            error="OSError: denied",
+        ),
+    ]
+    ledger.write_text("".join(result.json() + "\n" for result in results) + "\n")
+    assert load_ledger(ledger) == {(FeedType.septa__alerts, HOUR)}
+
+
+def test_raw_files_list_path_matches_the_io_manager(storage):
+    save_raw(storage, 5)
+    result = materialize(
+        [raw_files_list],
+        partition_key=MultiPartitionKey(
+            {"feed_type": FeedType.septa__alerts.value, "hour": "2023-07-05-01:00"}
+        ),
+        resources={
+            "compact_gcs_io_manager": GzippedPydanticGCSIOManager(bucket=PARSED_BUCKET),
+            "profiling": ProfilingResource(),
+        },
+    )
+    assert result.success
+
+    (saved,) = storage.list(PARSED_BUCKET, prefix="raw_files_list/")
+    assert saved.name == raw_files_list_path(FeedType.septa__alerts, HOUR)
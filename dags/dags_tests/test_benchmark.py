@@ -0,0 +1,35 @@
+from dags.benchmark import (
+    STAGES,
+    BenchmarkReport,
+    regressions,
+    run_benchmarks,
+)
+from dags.common import FeedType
+
+
+def test_benchmark_reports_every_stage():
+    report = run_benchmarks(
+        [FeedType.gtfs_schedule, FeedType.gtfs_rt__vehicle_positions],
+        scale=0.01,
+        isolate=False,
+    )
+    schedule, positions = report.results
+    assert list(schedule.stages) == STAGES
+    assert schedule.files == 1
+    # one record per row of every file in the zip
+    assert schedule.records > 4_000
+    assert positions.files == 2
+    assert positions.records == 2 * 15
+    for result in report.results:
+        for stats in result.stages.values():
+            assert stats.records == result.records
+            assert stats.peak_rss_bytes > 0
+
+    # round trips through JSON, and compares with itself
+    baseline = BenchmarkReport.parse_raw(report.json())
+    assert regressions(report, baseline, max_regression=0.2) == []
+    slower = baseline.copy(deep=True)
+    slower.results[0].stages["decode"].records_per_second *= 10
+    assert [(r["feed_type"], r["stage"]) for r in regressions(report, slower, 0.2)] == [
+        ("gtfs_schedule", "decode")
+    ]
@@ -0,0 +1,70 @@
+import json
+
+import pendulum
+
+from dags.assets import download_blob, list_raw_hour
+from dags.bundles import bundle_day, read_bundle_index
+from dags.common import FeedConfig, FeedType, RawFetchedFile
+from dags.manifests import reconcile_manifest
+from dags.storage import LocalStorage
+
+DAY = pendulum.date(2023, 7, 5)
+CONFIG = FeedConfig(
+    name="alerts",
+    url="https://www3.septa.org/api/Alerts/index.php",
+    feed_type=FeedType.septa__alerts,
+)
+
+
+def save_raw(storage: LocalStorage, ts: pendulum.DateTime) -> RawFetchedFile:
+    raw = RawFetchedFile(
+        ts=ts,
+        config=CONFIG,
+        response_code=200,
+        response_headers={},
+        contents=json.dumps({"ts": ts.to_iso8601_string()}).encode("utf-8"),
+    )
+    storage.write_bytes(raw.bucket, raw.gcs_key, raw.json())
+    return raw
+
+
+def test_bundled_raw_files_are_read_through_manifests(storage):
+    hour = pendulum.datetime(2023, 7, 5, 1)
+    raws = [save_raw(storage, hour.add(minutes=minute)) for minute in range(3)]
+    save_raw(storage, hour.add(hours=1))
+    before, source = list_raw_hour(FeedType.septa__alerts, hour)
+    assert source == "listing"
+
+    assert bundle_day(FeedType.septa__alerts, DAY)["objects"] == 4
+    assert not storage.exists(raws[0].bucket, raws[0].gcs_key)
+
+    files, source = list_raw_hour(FeedType.septa__alerts, hour)
+    assert source == "manifest"
+    assert [(f.name, f.generation) for f in files] == [
+        (f.name, f.generation) for f in before
+    ]
+    assert [download_blob(file).contents for file in files] == [
+        raw.contents for raw in raws
+    ]
+    assert reconcile_manifest(FeedType.septa__alerts, hour).ok
+
+    (bundle,) = [
+        obj for obj in storage.list(raws[0].bucket) if obj.name.endswith(".bundle")
+    ]
+    assert [
+        member.key
+        for member in read_bundle_index(bundle.bucket, bundle.name, bundle.size)
+    ] == [raw.gcs_key for raw in raws] + [
+        f.name for f in list_raw_hour(FeedType.septa__alerts, hour.add(hours=1))[0]
+    ]
+
+    # a late arrival goes into a bundle of its own
+    late = save_raw(storage, hour.add(minutes=30))
+    assert bundle_day(FeedType.septa__alerts, DAY) == {
+        "objects": 1,
+        "bundles": 1,
+        "bytes": len(late.json()),
+    }
+    files, _ = list_raw_hour(FeedType.septa__alerts, hour)
+    assert len(files) == 4
+    assert download_blob(files[-1]).contents == late.contents
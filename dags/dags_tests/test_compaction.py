@@ -0,0 +1,130 @@
+import gzip
+import json
+from typing import List, Tuple
+from unittest import mock
+
+import pendulum
+from dagster import SkipReason, build_sensor_context
+
+from dags.assets import save_hour_agg
+from dags.common import DayAgg, FeedType, HourAgg, ParsedFileFormat, ParsedRecord
+from dags.compaction import (
+    archive_key,
+    compact_day,
+    day_partition_def,
+    recompaction_sensor,
+)
+from dags.reader import read_parsed
+from dags.storage import LocalStorage
+
+DAY = pendulum.date(2023, 7, 5)
+DAY_AGG = DayAgg(table=FeedType.septa__alerts, base64url="aaa", dt=DAY)
+
+
+def agg(hour: int) -> HourAgg:
+    return HourAgg(
+        table=FeedType.septa__alerts,
+        base64url="aaa",
+        hour=pendulum.datetime(DAY.year, DAY.month, DAY.day, hour),
+        format=ParsedFileFormat.jsonl_gz,
+    )
+
+
+def save(storage: LocalStorage, hour: int, values: List[str]) -> None:
+    rows = [
+        {"record": {"value": value}, "metadata": {"line_number": i}}
+        for i, value in enumerate(values)
+    ]
+    storage.write_bytes(
+        HourAgg.bucket,
+        agg(hour).gcs_key,
+        gzip.compress("\n".join(map(json.dumps, rows)).encode("utf-8")),
+    )
+
+
+def load(storage: LocalStorage, key: str) -> List[dict]:
+    return [
+        json.loads(line)
+        for line in gzip.decompress(
+            storage.read_bytes(HourAgg.bucket, key)
+        ).splitlines()
+    ]
+
+
+def test_compact_day_merges_archives_and_replaces_reparsed_hours(storage):
+    save(storage, 2, ["c"])
+    save(storage, 0, ["a1", "a2"])
+    save(storage, 1, ["b"])
+
+    assert compact_day(FeedType.septa__alerts, DAY) == {
+        "urls": 1,
+        "compacted_urls": 1,
+        "merged_files": 3,
+    }
+    rows = load(storage, DAY_AGG.gcs_key)
+    assert DAY_AGG.gcs_key.endswith("/hour=2023-07-05T00:00:00Z/aaa.day.jsonl.gz")
+    assert [row["record"]["value"] for row in rows] == ["a1", "a2", "b", "c"]
+    assert rows[2]["metadata"] == {"line_number": 0, "hour": "2023-07-05T01:00:00Z"}
+    for hour in range(3):
+        assert not storage.exists(HourAgg.bucket, agg(hour).gcs_key)
+    assert load(storage, archive_key(agg(1).gcs_key))[0]["record"] == {"value": "b"}
+
+    # nothing left to merge
+    assert compact_day(FeedType.septa__alerts, DAY)["merged_files"] == 0
+
+    save(storage, 1, ["b2", "b3"])
+    assert compact_day(FeedType.septa__alerts, DAY)["merged_files"] == 1
+    assert [row["record"]["value"] for row in load(storage, DAY_AGG.gcs_key)] == [
+        "a1",
+        "a2",
+        "b2",
+        "b3",
+        "c",
+    ]
+
+
+def values(storage: LocalStorage) -> List[Tuple[str, str]]:
+    return [
+        (hour.strftime("%H"), json.loads(record)["value"])
+        for batch in read_parsed(
+            FeedType.septa__alerts,
+            pendulum.datetime(DAY.year, DAY.month, DAY.day),
+            pendulum.datetime(DAY.year, DAY.month, DAY.day).add(days=1),
+            columns=["record"],
+        )
+        for hour, record in zip(
+            batch.column("hour").to_pylist(), batch.column("record").to_pylist()
+        )
+    ]
+
+
+def test_reparsing_the_first_hour_after_compaction(storage):
+    save(storage, 0, ["a"])
+    save(storage, 1, ["b"])
+    compact_day(FeedType.septa__alerts, DAY)
+    assert values(storage) == [("00", "a"), ("01", "b")]
+
+    save_hour_agg(
+        agg(0), [ParsedRecord(record={"value": "a2"}, metadata={"line_number": 0})]
+    )
+
+    # parsing never touches the day, and the new hour wins over the day's rows for it
+    assert [row["record"]["value"] for row in load(storage, DAY_AGG.gcs_key)] == [
+        "a",
+        "b",
+    ]
+    assert sorted(values(storage)) == [("00", "a2"), ("01", "b")]
+    assert storage.exists(HourAgg.bucket, DAY_AGG.pending_key)
+
+    context = build_sensor_context()
+    with mock.patch.object(
+        day_partition_def, "get_partition_keys", return_value=[str(DAY)]
+    ):
+        requests = recompaction_sensor(context)
+    assert [request.partition_key for request in requests] == [str(DAY)]
+
+    assert compact_day(FeedType.septa__alerts, DAY)["merged_files"] == 1
+    assert not storage.exists(HourAgg.bucket, agg(0).gcs_key)
+    assert not storage.exists(HourAgg.bucket, DAY_AGG.pending_key)
+    assert values(storage) == [("00", "a2"), ("01", "b")]
+    assert isinstance(recompaction_sensor(context), SkipReason)
@@ -0,0 +1,201 @@
+import zipfile
+from io import BytesIO
+from typing import Dict, List
+
+import duckdb
+import numpy as np
+import pendulum
+import pytest
+from dagster import materialize
+from dagster_duckdb import DuckDBResource
+
+from dags.common import FeedConfig, FeedType, RawFetchedFile
+from dags.headways import (
+    duckdb__stop_headways,
+    headway_stats,
+    headways,
+    observed_arrivals,
+)
+from dags.storage import LocalStorage
+
+
+def test_observed_arrivals_interpolate_between_pings():
+    arrivals = observed_arrivals(
+        ping_trip=[0, 0, 0, 0, 1, 1],
+        ping_time=[0, 100, 150, 200, 0, 100],
+        # the vehicle on trip 0 jitters backwards at 150
+        ping_fraction=[0.0, 0.5, 0.4, 1.0, 0.2, np.nan],
+        stop_trip=[0, 0, 0, 0, 1, 2],
+        stop_fraction=[0.0, 0.25, 0.45, 0.75, 0.5, 0.5],
+    )
+    # the first stop has no ping before it, trip 1 never reaches its stop, and trip 2
+    # wasn't observed
+    assert np.isnan(arrivals[[0, 4, 5]]).all()
+    assert arrivals[1:4] == pytest.approx([50, 90, 175])
+
+
+def test_headways_and_bunching():
+    result = headways(
+        group=[0, 0, 0, 1],
+        arrival=[100, 400, 130, 50],
+        scheduled_arrival=[0, 600, 300, 0],
+        bunching_ratio=0.25,
+    )
+    assert list(result.previous) == [-1, 2, 0, -1]
+    assert np.isnan(result.headway[[0, 3]]).all()
+    assert list(result.headway[[1, 2]]) == [270, 30]
+    assert list(result.scheduled_headway[[1, 2]]) == [300, 300]
+    assert list(result.bunched) == [False, False, True, False]
+
+    stats = headway_stats(
+        [0, 0, 0, 1],
+        result.headway,
+        result.scheduled_headway,
+        result.bunched,
+        num_groups=2,
+    )
+    assert list(stats.observations) == [2, 0]
+    assert stats.mean[0] == 150
+    assert stats.cv[0] == pytest.approx(0.8)
+    assert stats.scheduled_mean[0] == 300
+    assert list(stats.bunched) == [1, 0]
+    assert np.isnan(stats.mean[1])
+
+
+def save_schedule(storage: LocalStorage, files: Dict[str, List[str]]) -> RawFetchedFile:
+    buffer = BytesIO()
+    with zipfile.ZipFile(buffer, "w") as zipf:
+        for name, lines in files.items():
+            zipf.writestr(name, "\n".join(lines))
+    raw = RawFetchedFile(
+        ts=pendulum.datetime(2023, 7, 5, 0, 5),
+        config=FeedConfig(
+            name="schedule",
+            url="https://example.com/gtfs.zip",
+            feed_type=FeedType.gtfs_schedule,
+        ),
+        response_code=200,
+        response_headers={},
+        contents=buffer.getvalue(),
+    )
+    storage.write_bytes(raw.bucket, raw.gcs_key, raw.json())
+    return raw
+
+
+def test_stop_headways_asset(storage, tmp_path, monkeypatch):
+    monkeypatch.setattr("dags.schedules.SCHEDULE_CACHE_DIR", str(tmp_path / "cache"))
+    schedule = save_schedule(
+        storage,
+        {
+            "trips.txt": [
+                "route_id,service_id,trip_id,direction_id,shape_id",
+                "r1,WK,t1,0,s1",
+                "r1,WK,t2,0,s1",
+            ],
+            "shapes.txt": [
+                "shape_id,shape_pt_lat,shape_pt_lon,shape_pt_sequence",
+                "s1,39.95,-75.16,1",
+                "s1,39.95,-75.15,2",
+            ],
+            "stops.txt": [
+                "stop_id,stop_name,stop_lat,stop_lon",
+                "A,First,39.95,-75.1575",
+                "B,Second,39.95,-75.1525",
+            ],
+            "stop_times.txt": [
+                "trip_id,stop_id,stop_sequence,arrival_time,departure_time",
+                "t1,A,1,08:00:00,08:00:00",
+                "t1,B,2,08:10:00,08:10:00",
+                "t2,B,2,08:20:00,08:20:00",
+                "t2,A,1,08:10:00,08:10:00",
+            ],
+        },
+    )
+    database = str(tmp_path / "test.duckdb")
+    with duckdb.connect(database) as conn:
+        # trip t2 leaves a minute after t1 and catches up with it
+        conn.execute(
+            """
+            CREATE TABLE fct_observed_shape_times AS
+            SELECT * FROM (VALUES
+                ('t1', 'v1', TIMESTAMPTZ '2023-07-05 12:00:00+00', 0.0),
+                ('t1', 'v1', TIMESTAMPTZ '2023-07-05 12:10:00+00', 0.5),
+                ('t1', 'v1', TIMESTAMPTZ '2023-07-05 12:20:00+00', 1.0),
+                ('t2', 'v2', TIMESTAMPTZ '2023-07-05 12:06:00+00', 0.0),
+                ('t2', 'v2', TIMESTAMPTZ '2023-07-05 12:08:00+00', 0.5),
+                ('t2', 'v2', TIMESTAMPTZ '2023-07-05 12:24:00+00', 1.0),
+                ('t1', 'v1', TIMESTAMPTZ '2023-07-06 12:00:00+00', 0.0)
+            ) AS t(trip_id, vehicle_id, vehicle_timestamp, shape_closest_point_to_vehicle_position_as_pct)
+            """
+        )
+        conn.execute(
+            """
+            ALTER TABLE fct_observed_shape_times ADD COLUMN schedule_b64_url VARCHAR;
+            ALTER TABLE fct_observed_shape_times ADD COLUMN service_date DATE;
+            UPDATE fct_observed_shape_times
+                SET service_date = CAST(vehicle_timestamp AS DATE);
+            """
+        )
+        conn.execute(
+            "UPDATE fct_observed_shape_times SET schedule_b64_url = ?",
+            [schedule.base64url],
+        )
+        conn.execute(
+            """
+            CREATE TABLE gtfs_schedule__trips_txt AS
+            SELECT * FROM (VALUES
+                (?, TIMESTAMPTZ '2023-07-05 00:00:00+00', 't1', 'r1', 0, 's1'),
+                (?, TIMESTAMPTZ '2023-07-05 00:00:00+00', 't2', 'r1', 0, 's1')
+            ) AS t(base64url, hour, trip_id, route_id, direction_id, shape_id)
+            """,
+            [schedule.base64url] * 2,
+        )
+
+    for _ in range(2):
+        result = materialize(
+            [duckdb__stop_headways],
+            partition_key="2023-07-05",
+            resources={"duckdb": DuckDBResource(database=database)},
+        )
+        assert result.success
+
+    # a day with no positions loaded (e.g. beyond the lookback) keeps its rows
+    with duckdb.connect(database) as conn:
+        conn.execute(
+            "DELETE FROM fct_observed_shape_times WHERE service_date = '2023-07-05'"
+        )
+    result = materialize(
+        [duckdb__stop_headways],
+        partition_key="2023-07-05",
+        resources={"duckdb": DuckDBResource(database=database)},
+        raise_on_error=False,
+    )
+    assert not result.success
+
+    with duckdb.connect(database) as conn:
+        rows = conn.execute(
+            """
+            SELECT stop_id, trip_id, hour_type, strftime(observed_stop_arrival AT TIME ZONE 'UTC', '%H:%M'),
+                round(headway_sec), scheduled_headway_sec, previous_vehicle_id, is_bunched
+            FROM fct_stop_headways
+            ORDER BY stop_id, observed_stop_arrival
+            """
+        ).fetchall()
+        metrics = conn.execute(
+            """
+            SELECT stop_id, stop_name, hour_type, ct_observations, round(avg_headway_sec),
+                headway_cv, ct_bunching, pct_bunching
+            FROM metric_stop_headways
+            ORDER BY stop_id
+            """
+        ).fetchall()
+    assert rows == [
+        ("A", "t1", "am_peak", "12:05", None, None, None, False),
+        ("A", "t2", "am_peak", "12:07", 120, 600, "v1", True),
+        ("B", "t1", "am_peak", "12:15", None, None, None, False),
+        ("B", "t2", "am_peak", "12:16", 60, 600, "v1", True),
+    ]
+    assert metrics == [
+        ("A", "First", "am_peak", 1, 120, 0.0, 1, 100.0),
+        ("B", "Second", "am_peak", 1, 60, 0.0, 1, 100.0),
+    ]
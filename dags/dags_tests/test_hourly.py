@@ -0,0 +1,115 @@
+import random
+from unittest import mock
+
+import pendulum
+import pytest
+from dagster import AssetKey, DagsterInstance
+
+from dags.benchmark import septa_json
+from dags.common import (
+    PARSED_BUCKET,
+    FeedConfig,
+    FeedType,
+    IncrementalParseCheckpoint,
+    RawFetchedFile,
+)
+from dags.hourly import parse_hour_job
+from dags.incremental import save_checkpoint
+from dags.storage import LocalStorage
+
+HOUR = pendulum.datetime(2023, 7, 5, 1)
+
+
+@pytest.fixture(autouse=True)
+def healthcheck(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr("dags.hourly.ping_healthcheck", mock.Mock())
+
+
+def save_raw(storage: LocalStorage, feed_type: FeedType, contents: bytes) -> None:
+    raw = RawFetchedFile(
+        ts=HOUR.add(minutes=5),
+        config=FeedConfig(
+            name=feed_type.value,
+            url=f"https://www3.septa.org/api/{feed_type.value}",
+            feed_type=feed_type,
+        ),
+        response_code=200,
+        response_headers={},
+        contents=contents,
+    )
+    storage.write_bytes(raw.bucket, raw.gcs_key, raw.json())
+
+
+def test_parse_hour_reports_each_feed_type_and_fails_on_any_failure(storage):
+    save_raw(
+        storage,
+        FeedType.septa__alerts,
+        septa_json(FeedType.septa__alerts, random.Random(0), 0.1, HOUR),
+    )
+    save_raw(storage, FeedType.septa__elevator_outages, b"<html>not json</html>")
+
+    instance = DagsterInstance.ephemeral()
+    result = parse_hour_job.execute_in_process(
+        partition_key="2023-07-05-01:00",
+        instance=instance,
+        run_config={
+            "ops": {
+                "parse_hour": {
+                    "config": {
+                        "feed_types": [
+                            FeedType.septa__alerts.value,
+                            FeedType.septa__elevator_outages.value,
+                        ]
+                    }
+                }
+            }
+        },
+        raise_on_error=False,
+    )
+
+    assert not result.success
+    # only the feed type that parsed is reported, for both of its assets
+    for asset in ("raw_files_list", "parsed_and_grouped_files"):
+        assert instance.get_materialized_partitions(AssetKey(asset)) == {
+            f"{FeedType.septa__alerts.value}|2023-07-05-01:00"
+        }
+    saved = [obj.name for obj in storage.list(PARSED_BUCKET, prefix="")]
+    assert any(name.startswith(f"{FeedType.septa__alerts.value}/") for name in saved)
+    assert not any(
+        name.startswith(f"{FeedType.septa__elevator_outages.value}/") for name in saved
+    )
+
+
+def test_parse_hour_leaves_checkpointed_hours_to_incremental_parse(
+    storage, monkeypatch
+):
+    monkeypatch.setattr("dags.hourly.PARSE_MODE", "incremental")
+    for feed_type in (FeedType.septa__alerts, FeedType.septa__elevator_outages):
+        save_raw(storage, feed_type, septa_json(feed_type, random.Random(0), 0.1, HOUR))
+    checkpoint = IncrementalParseCheckpoint(feed_type=FeedType.septa__alerts, hour=HOUR)
+    save_checkpoint(checkpoint, 0)
+
+    result = parse_hour_job.execute_in_process(
+        partition_key="2023-07-05-01:00",
+        run_config={
+            "ops": {
+                "parse_hour": {
+                    "config": {
+                        "feed_types": [
+                            FeedType.septa__alerts.value,
+                            FeedType.septa__elevator_outages.value,
+                        ]
+                    }
+                }
+            }
+        },
+    )
+
+    assert result.success
+    saved = [obj.name for obj in storage.list(PARSED_BUCKET, prefix="")]
+    assert not any(
+        name.startswith(f"{FeedType.septa__alerts.value}/") for name in saved
+    )
+    assert any(
+        name.startswith(f"{FeedType.septa__elevator_outages.value}/") for name in saved
+    )
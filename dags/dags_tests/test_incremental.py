@@ -0,0 +1,153 @@
+import gzip
+import random
+
+import pendulum
+
+from dags.benchmark import septa_json
+from dags.common import (
+    FeedConfig,
+    FeedType,
+    HourAgg,
+    MicroBatchAgg,
+    ParsedFileFormat,
+    RawFetchedFile,
+)
+from dags.incremental import (
+    compact_hour,
+    incremental_parse_job,
+    load_microbatch,
+    load_checkpoint,
+    microbatch_hour_prefix,
+    parse_microbatch,
+    pending_hours,
+)
+from dags.reader import read_parsed
+from dags.storage import LocalStorage
+
+HOUR = pendulum.datetime(2023, 7, 5, 1)
+CONFIG = FeedConfig(
+    name="alerts",
+    url="https://www3.septa.org/api/Alerts/index.php",
+    feed_type=FeedType.septa__alerts,
+)
+
+
+def save_raw(storage: LocalStorage, minute: int) -> RawFetchedFile:
+    rng = random.Random(minute)
+    raw = RawFetchedFile(
+        ts=HOUR.add(minutes=minute),
+        config=CONFIG,
+        response_code=200,
+        response_headers={},
+        contents=septa_json(FeedType.septa__alerts, rng, 0.1, HOUR),
+    )
+    storage.write_bytes(raw.bucket, raw.gcs_key, raw.json())
+    return raw
+
+
+def parse(now: pendulum.DateTime) -> None:
+    checkpoint, generation = load_checkpoint(FeedType.septa__alerts, HOUR)
+    parse_microbatch(checkpoint, generation, now)
+
+
+def test_files_landing_behind_the_watermark_are_still_parsed(storage):
+    save_raw(storage, 5)
+    save_raw(storage, 10)
+    # not settled yet
+    save_raw(storage, 29)
+    parse(HOUR.add(minutes=30))
+
+    checkpoint, _ = load_checkpoint(FeedType.septa__alerts, HOUR)
+    assert checkpoint.watermark == HOUR.add(minutes=10)
+    assert len(checkpoint.microbatches) == 1
+
+    # a fetch that started before the last parsed one, but finished uploading after it
+    late = save_raw(storage, 7)
+    parse(HOUR.add(minutes=35))
+
+    checkpoint, generation = load_checkpoint(FeedType.septa__alerts, HOUR)
+    assert checkpoint.watermark == HOUR.add(minutes=29)
+    (processed,) = checkpoint.processed.values()
+    assert late.gcs_key in processed
+    assert len(processed) == 4
+    assert len(checkpoint.microbatches) == 2
+
+    # nothing new
+    parse(HOUR.add(minutes=40))
+    assert load_checkpoint(FeedType.septa__alerts, HOUR)[1] == generation
+
+
+def test_compacting_an_hour_merges_its_microbatches(storage):
+    save_raw(storage, 5)
+    parse(HOUR.add(minutes=10))
+    save_raw(storage, 15)
+    parse(HOUR.add(minutes=20))
+
+    checkpoint, generation = load_checkpoint(FeedType.septa__alerts, HOUR)
+    assert len(checkpoint.microbatches) == 2
+    records = sum(len(load_microbatch(m)) for m in checkpoint.microbatches)
+    compact_hour(checkpoint, generation, HOUR.add(hours=1, minutes=5))
+
+    checkpoint, _ = load_checkpoint(FeedType.septa__alerts, HOUR)
+    assert checkpoint.compacted
+    assert len(checkpoint.outcomes) == 2
+    agg = HourAgg(
+        table=FeedType.septa__alerts,
+        base64url=next(iter(checkpoint.processed)),
+        hour=HOUR,
+        format=ParsedFileFormat.jsonl_gz,
+    )
+    lines = gzip.decompress(storage.read_bytes(agg.bucket, agg.gcs_key)).splitlines()
+    assert len(lines) == records
+    assert not list(
+        storage.list(
+            agg.bucket, prefix=microbatch_hour_prefix(FeedType.septa__alerts, HOUR)
+        )
+    )
+
+
+def read_rows() -> int:
+    return sum(
+        batch.num_rows
+        for batch in read_parsed(FeedType.septa__alerts, HOUR, HOUR.add(hours=1))
+    )
+
+
+def test_readers_see_checkpointed_microbatches_until_compaction(storage):
+    save_raw(storage, 5)
+    parse(HOUR.add(minutes=10))
+    checkpoint, generation = load_checkpoint(FeedType.septa__alerts, HOUR)
+    (microbatch,) = checkpoint.microbatches
+    records = len(load_microbatch(microbatch))
+    assert read_rows() == records
+
+    # left by a run that failed before saving its checkpoint
+    orphan = MicroBatchAgg(**{**microbatch.dict(), "batch": HOUR.add(minutes=15)})
+    storage.write_bytes(
+        orphan.bucket,
+        orphan.gcs_key,
+        storage.read_bytes(microbatch.bucket, microbatch.gcs_key),
+    )
+    assert read_rows() == records
+
+    compact_hour(checkpoint, generation, HOUR.add(hours=1, minutes=5))
+    assert read_rows() == records
+
+
+def test_incremental_parse_compacts_every_pending_hour(storage):
+    save_raw(storage, 5)
+    parse(HOUR.add(minutes=10))
+    assert pending_hours(FeedType.septa__alerts) == [HOUR]
+
+    result = incremental_parse_job.execute_in_process(
+        run_config={
+            "ops": {
+                "incremental_parse": {
+                    "config": {"feed_types": [FeedType.septa__alerts.value]}
+                }
+            }
+        }
+    )
+    assert result.success
+    assert load_checkpoint(FeedType.septa__alerts, HOUR)[0].compacted
+    assert pending_hours(FeedType.septa__alerts) == []
@@ -0,0 +1,46 @@
+from typing import List
+from unittest import mock
+
+from dagster import asset, materialize
+from pydantic import BaseModel
+
+from dags import GzippedPydanticGCSIOManager
+from dags.storage import LocalStorage
+
+
+class Summary(BaseModel):
+    names: List[str]
+    count: int
+
+
+@asset
+def summary() -> Summary:
+    return Summary(names=["a", "b"] * 100, count=200)
+
+
+@asset
+def summary_count(summary: Summary) -> None:
+    assert isinstance(summary, Summary)
+    assert summary.count == len(summary.names)
+
+
+def test_gzipped_pydantic_io_manager_round_trips(tmp_path):
+    storage = LocalStorage(tmp_path)
+    with mock.patch("dags.get_storage", return_value=storage):
+        io_manager = GzippedPydanticGCSIOManager(bucket="parsed")
+
+    result = materialize([summary, summary_count], resources={"io_manager": io_manager})
+    assert result.success
+
+    (saved,) = storage.list("parsed", prefix="summary")
+    assert saved.name == "summary.json.gz"
+    (materialization,) = result.asset_materializations_for_node("summary")
+    assert materialization.metadata["stored_bytes"].value == saved.size
+
+    (loaded,) = [
+        event.event_specific_data.metadata
+        for event in result.all_node_events
+        if event.is_loaded_input
+    ]
+    assert loaded["stored_bytes"].value == saved.size
+    assert loaded["load_seconds"].value >= 0
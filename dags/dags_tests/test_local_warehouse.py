@@ -0,0 +1,217 @@
+import gzip
+import zipfile
+from io import BytesIO
+from typing import Dict, List
+from unittest import mock
+
+import duckdb
+import pendulum
+from dagster import materialize
+from dagster_duckdb import DuckDBResource
+
+from dags.common import FeedConfig, FeedType, HourAgg, ParsedFileFormat, RawFetchedFile
+from dags.compaction import compact_day
+from dags.local_warehouse import (
+    duckdb__fct_observed_shape_times,
+    duckdb__fct_vehicle_positions,
+    duckdb_table_assets,
+)
+from dags.storage import LocalStorage
+from dags_tests.test_parquet import vehicle_position
+
+
+def save_vehicle_positions(
+    storage: LocalStorage, hour: pendulum.DateTime, vehicle_ids
+) -> None:
+    agg = HourAgg(
+        table=FeedType.gtfs_rt__vehicle_positions,
+        base64url="aaa",
+        hour=hour,
+        format=ParsedFileFormat.jsonl_gz,
+    )
+    records = [vehicle_position(vehicle_id, 1690000000) for vehicle_id in vehicle_ids]
+    storage.write_bytes(
+        agg.bucket,
+        agg.gcs_key,
+        gzip.compress("\n".join(record.json() for record in records).encode("utf-8")),
+    )
+
+
+def test_duckdb_assets_load_only_new_and_changed_hours(tmp_path):
+    storage = LocalStorage(tmp_path / "storage")
+    database = str(tmp_path / "test.duckdb")
+    current_hour = pendulum.now(tz="UTC").start_of("hour")
+    save_vehicle_positions(storage, current_hour.subtract(hours=2), ["a", "b"])
+    save_vehicle_positions(storage, current_hour.subtract(hours=1), ["a"])
+    # not closed yet
+    save_vehicle_positions(storage, current_hour, ["a"])
+
+    def run() -> dict:
+        result = materialize(
+            [*duckdb_table_assets, duckdb__fct_vehicle_positions],
+            selection=[
+                "duckdb__gtfs_rt__vehicle_positions",
+                "duckdb__fct_vehicle_positions",
+            ],
+            resources={"duckdb": DuckDBResource(database=database)},
+        )
+        assert result.success
+        return {
+            key: value.value
+            for key, value in result.asset_materializations_for_node(
+                "duckdb__gtfs_rt__vehicle_positions"
+            )[0].metadata.items()
+        }
+
+    with (
+        mock.patch("dags.reader.get_storage", return_value=storage),
+        mock.patch("dags.local_warehouse.get_storage", return_value=storage),
+    ):
+        assert run() == {
+            "hours_loaded": 2,
+            "hours_removed": 0,
+            "rows_loaded": 3,
+            "total_rows": 3,
+        }
+        assert run() == {
+            "hours_loaded": 0,
+            "hours_removed": 0,
+            "rows_loaded": 0,
+            "total_rows": 3,
+        }
+        save_vehicle_positions(storage, current_hour.subtract(hours=1), ["a", "c"])
+        assert run() == {
+            "hours_loaded": 1,
+            "hours_removed": 0,
+            "rows_loaded": 2,
+            "total_rows": 4,
+        }
+
+    with duckdb.connect(database) as conn:
+        assert conn.execute(
+            "SELECT vehicle_id, count(*) FROM fct_vehicle_positions GROUP BY 1 ORDER BY 1"
+        ).fetchall() == [("a", 1), ("b", 1), ("c", 1)]
+
+
+def test_duckdb_assets_load_compacted_days_with_their_rows_hours(tmp_path):
+    storage = LocalStorage(tmp_path / "storage")
+    database = str(tmp_path / "test.duckdb")
+    day = pendulum.now(tz="UTC").start_of("day").subtract(days=2)
+    save_vehicle_positions(storage, day, ["a", "b"])
+    save_vehicle_positions(storage, day.add(hours=1), ["a"])
+
+    def run() -> dict:
+        result = materialize(
+            duckdb_table_assets,
+            selection=["duckdb__gtfs_rt__vehicle_positions"],
+            resources={"duckdb": DuckDBResource(database=database)},
+        )
+        assert result.success
+        with duckdb.connect(database) as conn:
+            return dict(
+                conn.execute(
+                    "SELECT hour - ?, count(*) FROM gtfs_rt__vehicle_positions GROUP BY 1",
+                    [day],
+                ).fetchall()
+            )
+
+    with (
+        mock.patch("dags.reader.get_storage", return_value=storage),
+        mock.patch("dags.local_warehouse.get_storage", return_value=storage),
+        mock.patch("dags.compaction.get_storage", return_value=storage),
+    ):
+        hours = {pendulum.duration(hours=0): 2, pendulum.duration(hours=1): 1}
+        assert run() == hours
+        compact_day(FeedType.gtfs_rt__vehicle_positions, day.date())
+        assert run() == hours
+
+        # parsed again after compaction, and preferred to the day's rows
+        save_vehicle_positions(storage, day.add(hours=1), ["a", "c", "d"])
+        assert run() == {**hours, pendulum.duration(hours=1): 3}
+
+
+def save_schedule(storage: LocalStorage, files: Dict[str, List[str]]) -> RawFetchedFile:
+    buffer = BytesIO()
+    with zipfile.ZipFile(buffer, "w") as zipf:
+        for name, lines in files.items():
+            zipf.writestr(name, "\n".join(lines))
+    raw = RawFetchedFile(
+        ts=pendulum.datetime(2023, 7, 5, 0, 5),
+        config=FeedConfig(
+            name="schedule",
+            url="https://example.com/gtfs.zip",
+            feed_type=FeedType.gtfs_schedule,
+        ),
+        response_code=200,
+        response_headers={},
+        contents=buffer.getvalue(),
+    )
+    storage.write_bytes(raw.bucket, raw.gcs_key, raw.json())
+    return raw
+
+
+def test_observed_shape_times_projects_positions_onto_shapes(
+    storage, tmp_path, monkeypatch
+):
+    monkeypatch.setattr("dags.schedules.SCHEDULE_CACHE_DIR", str(tmp_path / "cache"))
+    schedule = save_schedule(
+        storage,
+        {
+            "trips.txt": ["route_id,service_id,trip_id,shape_id", "r1,WK,t1,s1"],
+            "shapes.txt": [
+                "shape_id,shape_pt_lat,shape_pt_lon,shape_pt_sequence",
+                "s1,39.95,-75.15,2",
+                "s1,39.95,-75.16,1",
+            ],
+        },
+    )
+    database = str(tmp_path / "test.duckdb")
+    feed_map = tmp_path / "feed_map.csv"
+    feed_map.write_text(
+        f"label,rt_b64_url,schedule_b64_url\nbus,rt,{schedule.base64url}\n"
+    )
+    with duckdb.connect(database) as conn:
+        conn.execute(
+            """
+            CREATE TABLE fct_vehicle_positions AS
+            SELECT * FROM (VALUES
+                ('rt', DATE '2023-07-05', DATE '2023-07-05', TIMESTAMPTZ '2023-07-05 12:00:00+00', 39.9505, -75.155, 3, 't1', 'v1', 'SCHEDULED'),
+                ('rt', DATE '2023-07-05', DATE '2023-07-05', TIMESTAMPTZ '2023-07-05 12:00:00+00', 39.95, -75.15, 3, 'unknown', 'v2', 'SCHEDULED'),
+                ('rt', DATE '2023-07-05', DATE '2023-07-05', TIMESTAMPTZ '2023-07-05 12:00:00+00', 39.95, -75.15, 3, NULL, 'v3', 'SCHEDULED')
+            ) AS t(_b64_url, dt, service_date, vehicle_timestamp, latitude, longitude, current_stop_sequence, trip_id, vehicle_id, trip_schedule_relationship)
+            """
+        )
+        conn.execute(
+            """
+            CREATE TABLE gtfs_schedule__trips_txt AS
+            SELECT * FROM (VALUES
+                (?, TIMESTAMPTZ '2023-07-05 00:00:00+00', 't1', 'r1', 's1')
+            ) AS t(base64url, hour, trip_id, route_id, shape_id)
+            """,
+            [schedule.base64url],
+        )
+
+    with mock.patch("dags.local_warehouse.FEED_MAP_CSV", str(feed_map)):
+        result = materialize(
+            [duckdb__fct_observed_shape_times],
+            resources={"duckdb": DuckDBResource(database=database)},
+        )
+    assert result.success
+
+    with duckdb.connect(database) as conn:
+        rows = conn.execute(
+            """
+            SELECT vehicle_id, schedule_b64_url, shape_id, trip_route_id,
+                shape_closest_point_to_vehicle_position,
+                round(shape_closest_point_to_vehicle_position_as_pct, 3)
+            FROM fct_observed_shape_times
+            ORDER BY vehicle_id
+            """
+        ).fetchall()
+    assert [row[:4] for row in rows] == [
+        ("v1", schedule.base64url, "s1", "r1"),
+        ("v2", schedule.base64url, None, None),
+    ]
+    assert rows[0][4].startswith("POINT(-75.155")
+    assert rows[0][5] == 0.5
+    assert rows[1][4:] == (None, None)
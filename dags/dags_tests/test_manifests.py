@@ -0,0 +1,115 @@
+import random
+from unittest import mock
+
+import pendulum
+
+from dags.assets import list_raw_hour, load_raw_manifest
+from dags.benchmark import septa_json
+from dags.common import (
+    FeedConfig,
+    FeedType,
+    RawFetchedFile,
+    RawHourManifest,
+    RawManifestEntry,
+)
+from dags.manifests import reconcile_manifests_job
+from dags.storage import LocalStorage
+
+HOUR = pendulum.now(tz="UTC").start_of("hour").subtract(hours=1)
+CONFIG = FeedConfig(
+    name="alerts",
+    url="https://www3.septa.org/api/Alerts/index.php",
+    feed_type=FeedType.septa__alerts,
+)
+
+
+def save_raw(storage: LocalStorage, minute: int) -> RawManifestEntry:
+    raw = RawFetchedFile(
+        ts=HOUR.add(minutes=minute),
+        config=CONFIG,
+        response_code=200,
+        response_headers={},
+        contents=septa_json(FeedType.septa__alerts, random.Random(minute), 0.1, HOUR),
+    )
+    obj = storage.write_bytes(raw.bucket, raw.gcs_key, raw.json())
+    return RawManifestEntry(
+        key=obj.name,
+        size=obj.size,
+        md5_hash=obj.md5_hash,
+        generation=obj.generation,
+        tick=raw.ts,
+    )
+
+
+def save_manifest(storage: LocalStorage, entries) -> None:
+    manifest = RawHourManifest(feed_type=FeedType.septa__alerts, hour=HOUR)
+    storage.write_bytes(
+        manifest.bucket,
+        manifest.gcs_key,
+        "\n".join(entry.json() for entry in entries),
+    )
+
+
+def run_reconcile(repair: bool):
+    return reconcile_manifests_job.execute_in_process(
+        run_config={
+            "ops": {
+                "reconcile_manifests": {
+                    "config": {
+                        "feed_types": [FeedType.septa__alerts.value],
+                        "hours": 1,
+                        "repair": repair,
+                    }
+                }
+            }
+        },
+        raise_on_error=False,
+    )
+
+
+def test_list_raw_hour_reads_the_manifest_without_listing(storage):
+    flushed = save_raw(storage, 5)
+    # left for reconcile_manifests to find
+    save_raw(storage, 10)
+    bundled = RawManifestEntry(
+        key="septa__alerts/dt=bundled/some-file",
+        size=10,
+        md5_hash=None,
+        generation=1,
+        tick=HOUR,
+        bundle="septa__alerts__bundles/some-bundle",
+        offset=0,
+    )
+    save_manifest(storage, [flushed, bundled])
+
+    with mock.patch.object(storage, "list", side_effect=AssertionError("listed")):
+        files, source = list_raw_hour(FeedType.septa__alerts.value, HOUR)
+
+    assert source == "manifest"
+    assert [f.name for f in files] == [flushed.key, bundled.key]
+    assert files[1].bundle == bundled.bundle and files[1].offset == 0
+
+
+def test_list_raw_hour_without_a_manifest_lists(storage):
+    entry = save_raw(storage, 5)
+    files, source = list_raw_hour(FeedType.septa__alerts.value, HOUR)
+    assert source == "listing"
+    assert [f.name for f in files] == [entry.key]
+
+
+def test_reconcile_fails_on_gaps_and_repairs_them(storage):
+    flushed = save_raw(storage, 5)
+    unflushed = save_raw(storage, 10)
+    save_manifest(storage, [flushed])
+
+    result = run_reconcile(repair=False)
+    assert not result.success
+    assert [e.key for e in load_raw_manifest(FeedType.septa__alerts, HOUR)] == [
+        flushed.key
+    ]
+
+    assert run_reconcile(repair=True).success
+    assert sorted(
+        e.key for e in load_raw_manifest(FeedType.septa__alerts, HOUR)
+    ) == sorted([flushed.key, unflushed.key])
+    assert run_reconcile(repair=False).success
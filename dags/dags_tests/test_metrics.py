@@ -0,0 +1,112 @@
+import random
+from unittest import mock
+
+import pendulum
+import pytest
+
+from dags.assets import HourKey, group_by_url, list_raw_hour, parse_group
+from dags.benchmark import septa_json
+from dags.common import FeedConfig, FeedType, RawFetchedFile
+from dags.metrics import REGISTRY, pushed_metrics
+from dags.storage import LocalStorage
+
+HOUR = pendulum.datetime(2023, 7, 5, 1)
+CONFIG = FeedConfig(
+    name="alerts",
+    url="https://www3.septa.org/api/Alerts/index.php",
+    feed_type=FeedType.septa__alerts,
+)
+
+
+def save_raw(storage: LocalStorage, minute: int, contents: bytes) -> None:
+    raw = RawFetchedFile(
+        ts=HOUR.add(minutes=minute),
+        config=CONFIG,
+        response_code=200,
+        response_headers={},
+        contents=contents,
+    )
+    storage.write_bytes(raw.bucket, raw.gcs_key, raw.json())
+
+
+def sample(name: str, **labels) -> float:
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+def parse_hour() -> None:
+    files, _ = list_raw_hour(FeedType.septa__alerts, HOUR)
+    for base64url, group in group_by_url(files).files.items():
+        parse_group(
+            HourKey(feed_type=FeedType.septa__alerts, hour=HOUR, base64url=base64url),
+            files=group,
+            force=True,
+        )
+
+
+def test_parsing_records_metrics(storage):
+    labels = {"feed_type": "septa__alerts"}
+    before = {
+        "listed": sample("parse_blobs_listed_total", **labels, source="listing"),
+        "records": sample("parse_records_total", **labels, table="septa__alerts"),
+        "parses": sample("parse_duration_seconds_count", **labels),
+        "uploads": sample(
+            "parse_upload_duration_seconds_count",
+            table="septa__alerts",
+            format="jsonl.gz",
+        ),
+        "failures": sample(
+            "parse_failures_total", **labels, exc_type="JSONDecodeError"
+        ),
+    }
+    rng = random.Random(0)
+    for minute in range(2):
+        save_raw(storage, minute, septa_json(FeedType.septa__alerts, rng, 0.1, HOUR))
+
+    parse_hour()
+    assert sample("parse_blobs_listed_total", **labels, source="listing") == (
+        before["listed"] + 2
+    )
+    assert sample("parse_records_total", **labels, table="septa__alerts") == (
+        before["records"] + 36
+    )
+    assert sample("parse_duration_seconds_count", **labels) == before["parses"] + 2
+    assert sample("parse_downloaded_bytes_total", **labels) > 0
+    assert (
+        sample(
+            "parse_upload_duration_seconds_count",
+            table="septa__alerts",
+            format="jsonl.gz",
+        )
+        == before["uploads"] + 1
+    )
+    assert sample("parse_lag_seconds", **labels) > 0
+
+    save_raw(storage, 2, b"not json")
+    with pytest.raises(ValueError):
+        parse_hour()
+    assert (
+        sample("parse_failures_total", **labels, exc_type="JSONDecodeError")
+        == before["failures"] + 1
+    )
+
+
+def test_metrics_are_pushed_even_if_the_step_fails(tmp_path):
+    textfile = tmp_path / "dags.prom"
+    with (
+        mock.patch("dags.metrics.PROMETHEUS_TEXTFILE", str(textfile)),
+        pytest.raises(RuntimeError),
+        pushed_metrics("parsed_and_grouped_files", "septa__alerts"),
+    ):
+        raise RuntimeError("parse failed")
+    assert "# TYPE parse_records_total counter" in textfile.read_text()
+
+
+def test_storage_limiter_state_is_pushed(storage, tmp_path):
+    textfile = tmp_path / "dags.prom"
+    with mock.patch("dags.metrics.PROMETHEUS_TEXTFILE", str(textfile)):
+        with pushed_metrics("parse_hour"):
+            storage.write_bytes("raw", "input", b"x")
+    pushed = textfile.read_text()
+    limit = storage.limiter.stats()["limit"]
+    assert f'storage_limiter{{stat="limit"}} {limit:.1f}' in pushed
+    assert 'storage_limiter{stat="throttles"} 0.0' in pushed
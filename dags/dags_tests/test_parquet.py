@@ -0,0 +1,79 @@
+import io
+import json
+
+import pyarrow.parquet as pq  # type: ignore[import]
+
+from dags.common import FeedType, GtfsScheduleFileType, ParsedRecord
+from dags.parquet import records_to_parquet
+
+
+def vehicle_position(vehicle_id: str, ts: int) -> ParsedRecord:
+    return ParsedRecord(
+        record={
+            "header": {"gtfsRealtimeVersion": "2.0", "timestamp": str(ts)},
+            "entity": {
+                "id": vehicle_id,
+                "vehicle": {
+                    "trip": {"tripId": "trip-1", "directionId": 1},
+                    "position": {"latitude": 39.95, "longitude": -75.16},
+                    "currentStopSequence": 3,
+                    "timestamp": str(ts),
+                    "vehicle": {"id": vehicle_id},
+                },
+            },
+        },
+        metadata={"line_number": 0},
+    )
+
+
+def test_vehicle_positions_are_typed_and_sorted():
+    records = [
+        vehicle_position("b", 1690000060),
+        vehicle_position("a", 1690000060),
+        vehicle_position("a", 1690000000),
+    ]
+    table = pq.read_table(
+        io.BytesIO(records_to_parquet(FeedType.gtfs_rt__vehicle_positions, records))
+    )
+
+    rows = table.to_pylist()
+    assert [
+        (row["vehicle_id"], row["vehicle_timestamp"].timestamp()) for row in rows
+    ] == [
+        ("a", 1690000000),
+        ("a", 1690000060),
+        ("b", 1690000060),
+    ]
+    assert rows[0]["trip_direction_id"] == 1
+    assert rows[0]["latitude"] == 39.95
+    assert json.loads(rows[0]["record"])["entity"]["id"] == "a"
+
+
+def test_stop_times_convert_gtfs_times():
+    records = [
+        ParsedRecord(
+            record={
+                "trip_id": "t",
+                "arrival_time": "25:01:02",
+                "stop_sequence": "2",
+                "timepoint": "",
+            },
+            metadata={},
+        )
+    ]
+    (row,) = pq.read_table(
+        io.BytesIO(records_to_parquet(GtfsScheduleFileType.stop_times_txt, records))
+    ).to_pylist()
+
+    assert row["arrival_time_seconds"] == 25 * 3600 + 62
+    assert row["stop_sequence"] == 2
+    assert row["timepoint"] is None
+
+
+def test_untyped_tables_keep_json():
+    records = [ParsedRecord(record={"foo": "bar"}, metadata={"line_number": 1})]
+    (row,) = pq.read_table(
+        io.BytesIO(records_to_parquet(FeedType.septa__alerts, records))
+    ).to_pylist()
+
+    assert row == {"record": '{"foo": "bar"}', "metadata": '{"line_number": 1}'}
@@ -0,0 +1,67 @@
+import threading
+
+import pytest
+from dagster import AssetExecutionContext, asset, materialize
+
+from dags.resources.profiling import ProfilingResource
+from dags.storage import get_storage
+
+
+@asset
+def copied(context: AssetExecutionContext, profiling: ProfilingResource) -> None:
+    storage = get_storage()
+    with profiling.step(context) as metrics:
+        contents = storage.read_bytes("raw", "input")
+        storage.write_bytes("parsed", "output", contents * 2)
+        # e.g. another step's upload under parse_hour's thread pool, which isn't counted
+        other = threading.Thread(
+            target=storage.write_bytes, args=("parsed", "other", contents)
+        )
+        other.start()
+        other.join()
+        metrics.records = 3
+
+
+def profile(memray: bool) -> dict:
+    result = materialize(
+        [copied],
+        resources={"profiling": ProfilingResource.configure_at_launch()},
+        run_config={
+            "resources": {
+                "profiling": {"config": {"memray": memray, "bucket": "profiles"}}
+            }
+        },
+    )
+    assert result.success
+    return {
+        key: value.value
+        for key, value in result.asset_materializations_for_node("copied")[
+            0
+        ].metadata.items()
+    }
+
+
+def test_every_run_records_resource_metadata(storage):
+    storage.write_bytes("raw", "input", b"x" * 1000)
+
+    metadata = profile(memray=False)
+    assert metadata["bytes_downloaded"] == 1000
+    assert metadata["bytes_uploaded"] == 2000
+    assert metadata["records_processed"] == 3
+    assert metadata["peak_rss_bytes"] > 0
+    assert metadata["cpu_seconds"] >= 0
+    assert "memray_capture" not in metadata
+    assert not list(storage.list("profiles"))
+
+
+def test_memray_capture_is_uploaded_when_enabled_in_run_config(storage):
+    pytest.importorskip("memray")
+    storage.write_bytes("raw", "input", b"x" * 1000)
+
+    metadata = profile(memray=True)
+    # the capture's own upload isn't counted
+    assert metadata["bytes_uploaded"] == 2000
+    assert metadata["memray_capture"].startswith("profiles/profiles/memray/")
+    assert metadata["memray_capture"].endswith("/copied/unpartitioned.bin")
+    bucket, _, key = metadata["memray_capture"].partition("/")
+    assert storage.read_bytes(bucket, key)
@@ -0,0 +1,76 @@
+import gzip
+import json
+
+import pendulum
+import pytest
+
+from dags.common import FeedType, HourAgg, ParsedFileFormat
+from dags.reader import read_parsed, read_parsed_pandas
+from dags.storage import LocalStorage
+
+
+@pytest.fixture
+def storage(storage: LocalStorage) -> LocalStorage:
+    for hour in range(22, 27):
+        for base64url in ["aaa", "bbb"]:
+            agg = HourAgg(
+                table=FeedType.gtfs_rt__vehicle_positions,
+                base64url=base64url,
+                hour=pendulum.datetime(2023, 7, 5).add(hours=hour),
+                format=ParsedFileFormat.jsonl_gz,
+            )
+            records = [
+                {"file": {}, "record": {"id": i, "position": {"lat": 1.5}}}
+                for i in range(3)
+            ]
+            storage.write_bytes(
+                agg.bucket,
+                agg.gcs_key,
+                gzip.compress("\n".join(map(json.dumps, records)).encode("utf-8")),
+            )
+    return storage
+
+
+def test_read_parsed_prunes_partitions_and_projects_columns(storage):
+    batches = list(
+        read_parsed(
+            FeedType.gtfs_rt__vehicle_positions,
+            start=pendulum.datetime(2023, 7, 5, 23),
+            end=pendulum.datetime(2023, 7, 6, 2),
+            base64urls=["bbb"],
+            columns=["record.id", "record.position"],
+            batch_size=2,
+            max_workers=2,
+        )
+    )
+
+    # three hours spanning two days, three rows each, in batches of at most two
+    assert [batch.num_rows for batch in batches] == [2, 1] * 3
+    assert batches[0].column_names == [
+        "record.id",
+        "record.position",
+        "dt",
+        "hour",
+        "base64url",
+    ]
+    rows = [row for batch in batches for row in batch.to_pylist()]
+    assert {row["base64url"] for row in rows} == {"bbb"}
+    assert [row["hour"].hour for row in rows[::3]] == [23, 0, 1]
+    assert rows[0]["record.position"] == '{"lat": 1.5}'
+
+
+def test_read_parsed_pandas(storage):
+    frames = list(
+        read_parsed_pandas(
+            FeedType.gtfs_rt__vehicle_positions,
+            start=pendulum.datetime(2023, 7, 5, 22),
+            end=pendulum.datetime(2023, 7, 5, 23),
+        )
+    )
+
+    assert len(frames) == 2
+    assert list(frames[0].columns) == ["file", "record", "metadata"] + [
+        "dt",
+        "hour",
+        "base64url",
+    ]
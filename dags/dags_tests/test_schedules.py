@@ -0,0 +1,174 @@
+import zipfile
+from io import BytesIO
+from unittest import mock
+
+import numpy as np
+import pendulum
+import pytest
+
+from dags.common import FeedConfig, FeedType, RawFetchedFile
+from dags.schedules import (
+    SNAPSHOT_VERSION,
+    build_snapshot,
+    load_schedule_snapshot,
+    load_snapshot,
+)
+
+FILES = {
+    "trips.txt": [
+        "route_id,service_id,trip_id,direction_id,shape_id",
+        "17,WK,t2,1,s1",
+        "17,WK,t1,0,s1",
+        "G1,SAT,t3,0,",
+    ],
+    # with a byte order mark, and out of order
+    "stop_times.txt": [
+        "﻿trip_id,arrival_time,departure_time,stop_id,stop_sequence",
+        "t1,08:05:00,08:06:00,B,2",
+        "t1,08:00:00,08:00:00,A,1",
+        "t1,,,C,3",
+        "t2,25:10:00,25:10:30,C,1",
+        "t2,25:20:00,25:20:00,A,2",
+        "t3,12:00:00,12:00:00,A,1",
+        "nope,12:00:00,12:00:00,A,1",
+    ],
+    "stops.txt": [
+        "stop_id,stop_name,stop_lat,stop_lon",
+        "A,A,39.95,-75.16",
+        "B,B,39.96,-75.16",
+        "C,C,39.97,-75.16",
+    ],
+    "calendar.txt": [
+        "service_id,monday,tuesday,wednesday,thursday,friday,saturday,sunday,start_date,end_date",
+        "WK,1,1,1,1,1,0,0,20230703,20230709",
+        "SAT,0,0,0,0,0,1,0,20230703,20230709",
+    ],
+    "calendar_dates.txt": [
+        "service_id,date,exception_type",
+        "WK,20230704,2",
+        "SAT,20230704,1",
+    ],
+    "shapes.txt": [
+        "shape_id,shape_pt_lat,shape_pt_lon,shape_pt_sequence",
+        "s1,39.97,-75.16,3",
+        "s1,39.95,-75.16,1",
+        "s1,39.96,-75.16,2",
+    ],
+}
+
+
+def schedule_zip() -> bytes:
+    buffer = BytesIO()
+    with zipfile.ZipFile(buffer, "w") as zipf:
+        for name, lines in FILES.items():
+            zipf.writestr(name, "\n".join(lines).encode("utf-8"))
+    return buffer.getvalue()
+
+
+def raw_schedule() -> RawFetchedFile:
+    return RawFetchedFile(
+        ts=pendulum.datetime(2023, 7, 5),
+        config=FeedConfig(
+            name="SEPTA Bus Schedule",
+            url="https://whatever.com",
+            feed_type=FeedType.gtfs_schedule,
+        ),
+        response_code=200,
+        response_headers={},
+        contents=schedule_zip(),
+    )
+
+
+def test_snapshot_indexes():
+    snapshot = build_snapshot(schedule_zip())
+    assert list(snapshot.trip_ids) == ["t1", "t2", "t3"]
+
+    rows = snapshot.stop_times("t1")
+    assert list(snapshot.stop_ids[snapshot.st_stop[rows]]) == ["A", "B", "C"]
+    assert list(snapshot.st_arrival[rows]) == [8 * 3600, 8 * 3600 + 300, -1]
+    rows = snapshot.stop_times("t2")
+    assert list(snapshot.st_departure[rows]) == [25 * 3600 + 630, 25 * 3600 + 1200]
+    assert snapshot.stop_times("nope") == slice(0, 0)
+
+    assert list(snapshot.trips_at_stop("A")) == ["t1", "t2", "t3"]
+    assert list(snapshot.trips_at_stop("C")) == ["t1", "t2"]
+
+    assert [str(d) for d in snapshot.service_dates("WK")] == [
+        "2023-07-03",
+        "2023-07-05",
+        "2023-07-06",
+        "2023-07-07",
+    ]
+    assert [str(d) for d in snapshot.service_dates("SAT")] == [
+        "2023-07-04",
+        "2023-07-08",
+    ]
+    on_the_4th = snapshot.trips_on(pendulum.date(2023, 7, 4))
+    assert list(snapshot.trip_ids[on_the_4th]) == ["t3"]
+
+    assert snapshot.route_ids[snapshot.trip_route[2]] == "G1"
+    assert list(snapshot.trip_shape) == [0, 0, -1]
+    assert list(snapshot.shape_pt_lat[snapshot.shape_points("s1")]) == [
+        39.95,
+        39.96,
+        39.97,
+    ]
+    assert snapshot.stop_lat[1] == pytest.approx(39.96)
+    assert snapshot.stop_names[1] == "B"
+
+
+def test_snapshots_are_built_once_and_memory_mapped(tmp_path):
+    raw = raw_schedule()
+    first = load_snapshot(raw, cache_dir=str(tmp_path))
+    assert isinstance(first.st_arrival, np.memmap)
+
+    with mock.patch("dags.schedules.build_snapshot") as build:
+        second = load_snapshot(raw, cache_dir=str(tmp_path))
+    build.assert_not_called()
+    assert list(second.trips_at_stop("C")) == ["t1", "t2"]
+    assert len(list((tmp_path / f"v{SNAPSHOT_VERSION}").iterdir())) == 1
+
+    with pytest.raises(ValueError):
+        load_snapshot(
+            raw.copy(
+                update={
+                    "config": raw.config.copy(
+                        update={"feed_type": FeedType.septa__alerts}
+                    )
+                }
+            ),
+            cache_dir=str(tmp_path),
+        )
+
+
+def test_services_without_a_date_range_only_run_on_added_dates():
+    files = {
+        **FILES,
+        "calendar.txt": [
+            *FILES["calendar.txt"],
+            "EXTRA,1,1,1,1,1,1,1,,",
+        ],
+        "calendar_dates.txt": [
+            *FILES["calendar_dates.txt"],
+            "EXTRA,20230706,1",
+            "EXTRA,,1",
+        ],
+    }
+    buffer = BytesIO()
+    with zipfile.ZipFile(buffer, "w") as zipf:
+        for name, lines in files.items():
+            zipf.writestr(name, "\n".join(lines).encode("utf-8"))
+
+    snapshot = build_snapshot(buffer.getvalue())
+    assert [str(d) for d in snapshot.service_dates("EXTRA")] == ["2023-07-06"]
+    assert len(snapshot.service_dates("WK")) == 4
+
+
+def test_load_schedule_snapshot_finds_the_raw_file_by_partition(storage, tmp_path):
+    raw = raw_schedule()
+    storage.write_bytes(raw.bucket, raw.gcs_key, raw.json())
+
+    snapshot = load_schedule_snapshot(raw.base64url, raw.hour, cache_dir=str(tmp_path))
+    assert snapshot is not None
+    assert list(snapshot.trip_ids) == ["t1", "t2", "t3"]
+    assert load_schedule_snapshot("other", raw.hour, cache_dir=str(tmp_path)) is None
@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+
+from dags.shapes import build_shape_segments, from_plane, project, to_plane
+
+ORIGIN_LAT, ORIGIN_LON = 39.95, -75.16
+
+
+def shape_points(*xy_meters):
+    """
+    Points on a plane around ORIGIN, in meters east and north.
+    """
+    x, y = np.array(xy_meters, dtype=float).T
+    return from_plane(x, y, ORIGIN_LAT, ORIGIN_LON)
+
+
+def test_projects_onto_the_closest_segment():
+    # an L: 1000m east, then 1000m north
+    lat, lon = shape_points((0, 0), (1000, 0), (1000, 1000))
+    segments = build_shape_segments(np.zeros(3, dtype=int), lat, lon, num_shapes=1)
+    assert segments.total_length[0] == pytest.approx(2000, rel=1e-3)
+
+    plat, plon = shape_points((250, 30), (1040, 500), (-100, -100), (1200, 1500))
+    projection = project(segments, np.zeros(4, dtype=int), plat, plon)
+    assert projection.fraction == pytest.approx([0.125, 0.75, 0, 1], abs=1e-3)
+    assert projection.distance == pytest.approx(
+        [30, 40, np.hypot(100, 100), np.hypot(200, 500)], rel=1e-3
+    )
+    x, y = to_plane(projection.lat, projection.lon, ORIGIN_LAT, ORIGIN_LON)
+    assert x == pytest.approx([250, 1000, 0, 1000], abs=1)
+    assert y == pytest.approx([0, 500, 0, 1000], abs=1)
+
+
+def test_positions_are_projected_onto_their_own_shape():
+    east_lat, east_lon = shape_points((0, 0), (1000, 0))
+    north_lat, north_lon = shape_points((0, 0), (0, 1000))
+    point_lat, point_lon = shape_points((0, 0))
+    segments = build_shape_segments(
+        np.array([0, 0, 1, 1, 2]),
+        np.concatenate([east_lat, north_lat, point_lat]),
+        np.concatenate([east_lon, north_lon, point_lon]),
+        num_shapes=3,
+    )
+    plat, plon = shape_points((500, 500), (500, 500), (500, 500), (500, 500))
+    projection = project(segments, np.array([1, 0, -1, 2]), plat, plon)
+    assert projection.fraction[:2] == pytest.approx([0.5, 0.5], abs=1e-3)
+    # no shape, and a shape without segments
+    assert np.isnan(projection.fraction[2:]).all()
+
+
+def test_chunking_does_not_change_projections():
+    rng = np.random.default_rng(0)
+    lat = ORIGIN_LAT + np.cumsum(rng.normal(0, 0.001, 200))
+    lon = ORIGIN_LON + np.cumsum(rng.normal(0, 0.001, 200))
+    shape_index = np.repeat([0, 1], 100)
+    segments = build_shape_segments(shape_index, lat, lon, num_shapes=2)
+    plat = ORIGIN_LAT + rng.normal(0, 0.01, 1_000)
+    plon = ORIGIN_LON + rng.normal(0, 0.01, 1_000)
+    pshape = rng.integers(0, 2, 1_000)
+
+    whole = project(segments, pshape, plat, plon)
+    chunked = project(segments, pshape, plat, plon, max_elements=500)
+    np.testing.assert_array_equal(whole.fraction, chunked.fraction)
+    np.testing.assert_array_equal(whole.lat, chunked.lat)
@@ -0,0 +1,160 @@
+from typing import List, Tuple
+from unittest import mock
+
+import pendulum
+import pytest
+
+from dags.assets import save_hour_agg
+from dags.common import DayAgg, FeedType, HourAgg, ParsedFileFormat, ParsedRecord
+from dags.compaction import compact_day
+from dags.sidecars import BloomFilter, FileIndex, day_index_key, index_key, lookup
+from dags.storage import LocalStorage
+
+DAY = pendulum.datetime(2023, 7, 5)
+
+
+def vehicle(vehicle_id: str, ts: pendulum.DateTime) -> ParsedRecord:
+    return ParsedRecord(
+        record={
+            "header": {"timestamp": str(ts.int_timestamp)},
+            "entity": {
+                "id": vehicle_id,
+                "vehicle": {
+                    "trip": {"tripId": f"trip-{vehicle_id}"},
+                    "vehicle": {"id": vehicle_id},
+                    "timestamp": str(ts.int_timestamp),
+                },
+            },
+        },
+        metadata={"line_number": 0},
+    )
+
+
+def agg(hour: int, base64url: str = "aaa") -> HourAgg:
+    return HourAgg(
+        table=FeedType.gtfs_rt__vehicle_positions,
+        base64url=base64url,
+        hour=DAY.add(hours=hour),
+        format=ParsedFileFormat.jsonl_gz,
+    )
+
+
+@pytest.fixture(autouse=True)
+def sidecar_indexes(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr("dags.assets.PARSED_SIDECAR_INDEXES", True)
+    monkeypatch.setattr("dags.compaction.PARSED_SIDECAR_INDEXES", True)
+
+
+def downloaded(storage: LocalStorage, start: int, end: int) -> Tuple[List[str], int]:
+    keys = []
+    read_bytes = storage.read_bytes
+
+    def spy(bucket, key, generation=None):
+        keys.append(key)
+        return read_bytes(bucket, key, generation=generation)
+
+    with mock.patch.object(storage, "read_bytes", side_effect=spy):
+        matches = list(
+            lookup(
+                FeedType.gtfs_rt__vehicle_positions,
+                "vehicle_id",
+                "7",
+                DAY.add(hours=start),
+                DAY.add(hours=end),
+            )
+        )
+    assert all(
+        match.record.record["entity"]["vehicle"]["vehicle"]["id"] == "7"
+        for match in matches
+    )
+    return [key for key in keys if "__index/" not in key], len(matches)
+
+
+def test_bloom_filter_has_no_false_negatives():
+    values = [f"vehicle_id={i}" for i in range(2_000)]
+    bloom = BloomFilter.build(values, false_positive_rate=0.01)
+    assert all(value in bloom for value in values)
+    false_positives = sum(f"vehicle_id={i}" in bloom for i in range(2_000, 12_000))
+    assert false_positives < 200
+
+
+def test_lookup_only_downloads_files_that_can_match(storage):
+    for hour in range(7, 10):
+        save_hour_agg(
+            agg(hour),
+            [vehicle(str(hour), DAY.add(hours=hour, minutes=m)) for m in range(3)],
+        )
+    index = FileIndex.parse_raw(
+        storage.read_bytes(HourAgg.bucket, index_key(agg(7).gcs_key))
+    )
+    assert index.values == {"vehicle_id": ["7"], "trip_id": ["trip-7"], "stop_id": []}
+    assert index.min_ts == DAY.add(hours=7)
+    assert index.max_ts == DAY.add(hours=7, minutes=2)
+
+    keys, matches = downloaded(storage, 7, 8)
+    assert (keys, matches) == ([agg(7).gcs_key], 3)
+    # vehicle 7 isn't in the hours after
+    assert downloaded(storage, 8, 10) == ([], 0)
+
+    # files without a sidecar for their current generation are always downloaded
+    with mock.patch("dags.assets.PARSED_SIDECAR_INDEXES", False):
+        save_hour_agg(agg(8, base64url="bbb"), [vehicle("8", DAY.add(hours=8))])
+        save_hour_agg(agg(9), [vehicle("7", DAY.add(hours=9))])
+    keys, matches = downloaded(storage, 8, 10)
+    assert (sorted(keys), matches) == (
+        sorted([agg(8, "bbb").gcs_key, agg(9).gcs_key]),
+        1,
+    )
+
+
+def test_compaction_rebuilds_sidecars(storage):
+    for hour in range(0, 3):
+        save_hour_agg(agg(hour), [vehicle(str(hour), DAY.add(hours=hour))])
+    compact_day(FeedType.gtfs_rt__vehicle_positions, DAY.date())
+
+    day = DayAgg(table=FeedType.gtfs_rt__vehicle_positions, base64url="aaa", dt=DAY)
+    index = FileIndex.parse_raw(
+        storage.read_bytes(HourAgg.bucket, index_key(day.gcs_key))
+    )
+    assert index.values["vehicle_id"] == ["0", "1", "2"]
+    assert not storage.exists(HourAgg.bucket, index_key(agg(0).gcs_key))
+    assert not storage.exists(HourAgg.bucket, index_key(agg(1).gcs_key))
+
+    with mock.patch("dags.sidecars.SIDECAR_MAX_VALUES", 0):
+        save_hour_agg(agg(5), [vehicle("5", DAY.add(hours=5))])
+    keys, _ = downloaded(storage, 1, 6)
+    assert keys == []
+
+
+def test_lookup_reads_a_single_index_for_a_compacted_day(storage):
+    for hour in range(0, 3):
+        save_hour_agg(agg(hour), [vehicle(str(hour), DAY.add(hours=hour))])
+    save_hour_agg(agg(1, base64url="bbb"), [vehicle("7", DAY.add(hours=1))])
+    compact_day(FeedType.gtfs_rt__vehicle_positions, DAY.date())
+
+    reads = []
+    read_bytes = storage.read_bytes
+
+    def spy(bucket, key, generation=None):
+        reads.append(key)
+        return read_bytes(bucket, key, generation=generation)
+
+    with (
+        mock.patch.object(storage, "read_bytes", side_effect=spy),
+        mock.patch.object(storage, "list", wraps=storage.list) as listed,
+    ):
+        (match,) = lookup(
+            FeedType.gtfs_rt__vehicle_positions,
+            "vehicle_id",
+            "1",
+            DAY,
+            DAY.add(days=1),
+        )
+
+    assert match.object.base64url == "aaa"
+    assert [key for key in reads if "__index/" in key] == [
+        day_index_key(
+            FeedType.gtfs_rt__vehicle_positions, ParsedFileFormat.jsonl_gz, DAY.date()
+        )
+    ]
+    assert not any("__index/" in call.kwargs["prefix"] for call in listed.mock_calls)
@@ -0,0 +1,149 @@
+import threading
+import time
+from pathlib import Path
+from unittest import mock
+
+import pytest
+from google.api_core.exceptions import TooManyRequests
+
+from dags.storage import (
+    AIMDLimiter,
+    GCSStorage,
+    LocalStorage,
+    ObjectNotFound,
+    PreconditionFailed,
+)
+
+
+@pytest.fixture
+def storage(tmp_path) -> LocalStorage:
+    return LocalStorage(root=tmp_path)
+
+
+def test_round_trip_strips_bucket_prefix(storage):
+    saved = storage.write_bytes("gs://raw", "a/b/c.json", "{}")
+
+    assert storage.read_bytes("raw", "a/b/c.json") == b"{}"
+    assert storage.read_text("gs://raw", "a/b/c.json", generation=saved.generation)
+    assert saved.size == 2
+
+
+def test_missing_objects(storage):
+    with pytest.raises(ObjectNotFound):
+        storage.read_bytes("raw", "missing")
+    with pytest.raises(ObjectNotFound):
+        storage.delete("raw", "missing")
+    assert not storage.exists("raw", "missing")
+
+
+def test_list_matches_partial_prefixes_in_order(storage):
+    for key in ["t/dt=1/ts=2/x", "t/dt=1/ts=1/x", "t/dt=10/ts=1/x", "u/dt=1/ts=1/x"]:
+        storage.write_bytes("raw", key, key)
+
+    assert [obj.name for obj in storage.list("raw", prefix="t/dt=1")] == [
+        "t/dt=1/ts=1/x",
+        "t/dt=1/ts=2/x",
+        "t/dt=10/ts=1/x",
+    ]
+    assert [
+        obj.name
+        for obj in storage.list("raw", prefix="t/dt=1/", start_offset="t/dt=1/ts=2")
+    ] == ["t/dt=1/ts=2/x"]
+    assert list(storage.list("raw", prefix="v/")) == []
+
+
+def test_generation_preconditions(storage):
+    first = storage.write_bytes("parsed", "checkpoint.json", "1", if_generation_match=0)
+    with pytest.raises(PreconditionFailed):
+        storage.write_bytes("parsed", "checkpoint.json", "2", if_generation_match=0)
+
+    second = storage.write_bytes(
+        "parsed", "checkpoint.json", "2", if_generation_match=first.generation
+    )
+    assert second.generation != first.generation
+    with pytest.raises(ObjectNotFound):
+        storage.read_bytes("parsed", "checkpoint.json", generation=first.generation)
+
+
+def test_limiter_increases_on_success_and_backs_off_on_throttling():
+    limiter = AIMDLimiter(initial=4, minimum=1, maximum=5, cooldown_seconds=60)
+    for _ in range(4):
+        limiter.on_success("read", 0.1)
+    assert limiter.limit == pytest.approx(5, abs=0.1)
+
+    limiter.on_throttle()
+    limiter.on_throttle()  # within the cooldown, so only counted
+    assert limiter.limit == pytest.approx(2.5, abs=0.1)
+    assert limiter.stats()["throttles"] == 2
+
+
+def test_limiter_backs_off_on_latency_spikes():
+    limiter = AIMDLimiter(initial=10, maximum=10, cooldown_seconds=0)
+    limiter.on_success("write", 0.5)
+    limiter.on_success("write", 5.0)
+    assert limiter.limit == pytest.approx(9)
+    assert limiter.stats()["latency_spikes"] == 1
+
+
+def test_limited_retries_throttled_calls(storage, monkeypatch):
+    monkeypatch.setattr("dags.storage.time.sleep", lambda seconds: None)
+    calls = []
+
+    def flaky():
+        calls.append(1)
+        if len(calls) < 3:
+            raise TooManyRequests("slow down")
+        return "ok"
+
+    assert storage.limited("write", flaky) == "ok"
+    assert storage.limiter.throttles == 2
+
+
+def test_counting_only_counts_its_own_context(storage):
+    storage.write_bytes("raw", "input", b"x" * 10)
+    with storage.counting() as outer:
+        storage.read_bytes("raw", "input")
+        with storage.counting() as inner:
+            storage.write_bytes("raw", "output", b"y" * 5)
+        # e.g. another step's transfers on a different thread
+        other = threading.Thread(
+            target=storage.write_bytes, args=("raw", "other", b"z" * 100)
+        )
+        other.start()
+        other.join()
+
+    assert inner == {"read": 0, "write": 5}
+    assert outer == {"read": 10, "write": 5}
+    assert storage.transferred() == {"read": 10, "write": 115}
+
+
+def test_gcs_threads_share_one_client_per_process(monkeypatch):
+    created = []
+
+    def slow_client():
+        time.sleep(0.01)
+        client = mock.Mock()
+        created.append(client)
+        return client
+
+    monkeypatch.setattr("dags.storage.storage.Client", slow_client)
+    gcs = GCSStorage()
+    clients = []
+    threads = [
+        threading.Thread(target=lambda: clients.append(gcs.client)) for _ in range(8)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(created) == 1
+    assert all(client is created[0] for client in clients)
+
+
+def test_matches_the_fetcher_copy():
+    fetcher_copy = Path(__file__).parents[2] / "fetcher" / "fetcher" / "storage.py"
+    if not fetcher_copy.exists():
+        pytest.skip("fetcher isn't checked out alongside")
+    ours = (Path(__file__).parents[1] / "dags" / "storage.py").read_text()
+    assert ours.split("\n", 1)[1] == fetcher_copy.read_text()
@@ -0,0 +1,86 @@
+import random
+from unittest import mock
+
+import pendulum
+import pytest
+
+from dags.assets import HourKey, group_by_url, list_raw_hour, parse_group
+from dags.benchmark import septa_json
+from dags.common import FeedConfig, FeedType, RawFetchedFile
+from dags.storage import LocalStorage
+from dags.traces import group_traces, stage_latencies
+from dags.tracing import (
+    FileSpanExporter,
+    TraceContext,
+    export_span,
+    read_spans,
+    set_exporter,
+)
+
+HOUR = pendulum.datetime(2023, 7, 5, 1)
+CONFIG = FeedConfig(
+    name="alerts",
+    url="https://www3.septa.org/api/Alerts/index.php",
+    feed_type=FeedType.septa__alerts,
+)
+
+
+@pytest.fixture
+def spans_file(tmp_path):
+    path = tmp_path / "spans.jsonl"
+    previous = set_exporter(FileSpanExporter(path))
+    yield path
+    set_exporter(previous)
+
+
+def test_parsing_continues_the_fetch_trace(tmp_path, spans_file):
+    storage = LocalStorage(tmp_path / "storage")
+    tick = HOUR.add(minutes=1)
+    trace = TraceContext.start(feed_type=FeedType.septa__alerts.value)
+    # what the ticker and fetch_feed export
+    export_span(trace, "enqueue", tick, tick.add(seconds=1))
+    export_span(trace, "fetch", tick.add(seconds=2), tick.add(seconds=3))
+    export_span(trace, "upload", tick.add(seconds=3), tick.add(seconds=4))
+    raw = RawFetchedFile(
+        ts=tick,
+        config=CONFIG,
+        response_code=200,
+        response_headers={},
+        contents=septa_json(FeedType.septa__alerts, random.Random(0), 0.1, tick),
+        trace=trace,
+    )
+    storage.write_bytes(raw.bucket, raw.gcs_key, raw.json())
+
+    with mock.patch("dags.assets.get_storage", return_value=storage):
+        files, _ = list_raw_hour(FeedType.septa__alerts, HOUR)
+        for base64url, group in group_by_url(files).files.items():
+            parse_group(
+                HourKey(
+                    feed_type=FeedType.septa__alerts, hour=HOUR, base64url=base64url
+                ),
+                files=group,
+            )
+
+    spans = list(read_spans(spans_file.read_text().splitlines()))
+    assert {span.trace_id for span in spans} == {trace.trace_id}
+    assert [span.name for span in spans] == [
+        "enqueue",
+        "fetch",
+        "upload",
+        "list",
+        "download",
+        "parse",
+        "save",
+    ]
+    assert spans[5].attributes == {"records": 18}
+
+    traces = group_traces(iter(spans), FeedType.septa__alerts, HOUR, HOUR.add(hours=1))
+    latencies = stage_latencies(traces)
+    assert latencies["fetch"] == [1.0]
+    assert latencies["queue_wait"] == []
+    # the raw file sat in the bucket until this test parsed it
+    assert latencies["awaiting_parse"][0] > 0
+    assert latencies["end_to_end"][0] > latencies["awaiting_parse"][0]
+    assert not group_traces(
+        iter(spans), FeedType.septa__alerts, HOUR.add(hours=1), HOUR.add(hours=2)
+    )
@@ -8,6 +8,7 @@ import pendulum
 import requests
 from pydantic import BaseModel, HttpUrl, validator, root_validator, Extra
 
+from fetcher.tracing import TraceContext
 from fetcher.metrics import (
     COMMON_LABELNAMES,
 )
@@ -83,6 +84,8 @@ class RawFetchedFile(BaseModel):
     response_headers: Dict
     contents: bytes
     exception: Optional[Exception]
+    # the trace this fetch belongs to, see tracing.py
+    trace: Optional[TraceContext] = None
 
     class Config:
         arbitrary_types_allowed = True
@@ -155,3 +158,59 @@ class RawFetchedFile(BaseModel):
     def exception_must_exist_if_no_contents(cls, v, values):
         assert v or values["contents"]
         return v
+
+
+class RawManifestEntry(BaseModel):
+    """
+    A compact record of one successfully saved RawFetchedFile.
+    """
+
+    key: str
+    size: int
+    md5_hash: Optional[str]
+    generation: Optional[int]
+    tick: pendulum.DateTime
+    # set once the object has been packed into a raw bundle and removed
+    bundle: Optional[str] = None
+    offset: Optional[int] = None
+    # the trace of the fetch that saved the object, see tracing.py
+    trace_id: Optional[str] = None
+
+    class Config:
+        json_encoders = {
+            pendulum.DateTime: lambda ts: ts.to_iso8601_string(),
+        }
+
+
+class RawHourManifest(BaseModel):
+    bucket: ClassVar[str] = RAW_BUCKET
+    partitions: ClassVar[List[str]] = ["dt", "hour"]
+    feed_type: FeedType
+    hour: pendulum.DateTime
+
+    @validator("hour")
+    def convert_hour(cls, v) -> pendulum.DateTime:
+        assert isinstance(v, datetime.datetime)
+        return pendulum.instance(v).in_tz("UTC")
+
+    @property
+    def table(self) -> str:
+        return f"{self.feed_type.value}__manifests"
+
+    @property
+    def dt(self) -> pendulum.Date:
+        return self.hour.date()
+
+    @property
+    def filename(self) -> str:
+        return "manifest.jsonl"
+
+    @property
+    def gcs_key(self) -> str:
+        hive_str = "/".join(
+            [
+                f"{key}={SERIALIZERS[type(getattr(self, key))](getattr(self, key))}"
+                for key in self.partitions
+            ]
+        )
+        return f"{self.table}/{hive_str}/{self.filename}"
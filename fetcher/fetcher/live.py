@@ -0,0 +1,410 @@
+"""
+A live cache of every vehicle's latest position, kept in Redis next to the task queue.
+
+With LIVE_VEHICLE_CACHE=true, fetch_feed decodes each GTFS-RT vehicle positions and
+SEPTA TransitViewAll response as soon as it's fetched, and upserts, per feed (the
+slugified feed config name):
+
+- live:<feed>:vehicle:<id>, the vehicle's latest state as JSON;
+- live:<feed>:history:<id>, its last LIVE_HISTORY_LENGTH states, newest first;
+- live:<feed>:route:<route>, the route's vehicles scored by when they were last seen;
+- live:<feed>:geo, every vehicle's latest position, for bounding box searches;
+- live:<feed>:seen, every vehicle scored by when it was last seen.
+
+Every key expires LIVE_TTL_SECONDS after its last upsert, and vehicles not seen for
+that long are removed from the feed's sets, so memory is bounded by the vehicles
+seen within the TTL. A vehicle that can't be decoded, or whose cached state can't be
+read back, is skipped on its own rather than failing the rest.
+
+    python -m fetcher.live --port 8080
+
+serves the cache as JSON: /feeds, /vehicles?feed=<feed>&route=<route_id>,
+/vehicles?feed=<feed>&bbox=<min_lon>,<min_lat>,<max_lon>,<max_lat>, and
+/history?feed=<feed>&vehicle=<vehicle_id>.
+"""
+
+import json
+import math
+import os
+import time
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+import pendulum
+import typer
+from google.transit import gtfs_realtime_pb2  # type: ignore
+from pydantic import BaseModel, ValidationError
+from redis import Redis
+from slugify import slugify
+
+from fetcher.common import FeedConfig, FeedType
+from fetcher.metrics import LIVE_UPSERT_DURATION_SECONDS, LIVE_VEHICLES_UPSERTED
+
+LIVE_VEHICLE_CACHE = os.getenv("LIVE_VEHICLE_CACHE", "false").lower() == "true"
+LIVE_TTL_SECONDS = int(os.getenv("LIVE_TTL_SECONDS", 10 * 60))
+LIVE_HISTORY_LENGTH = int(os.getenv("LIVE_HISTORY_LENGTH", 20))
+
+LIVE_FEED_TYPES = (
+    FeedType.gtfs_rt__vehicle_positions,
+    FeedType.septa__transit_view_all,
+)
+FEEDS_KEY = "live:feeds"
+KM_PER_DEGREE = 111.32
+
+
+class VehicleState(BaseModel):
+    feed: str
+    vehicle_id: str
+    route_id: Optional[str]
+    trip_id: Optional[str]
+    lat: float
+    lon: float
+    bearing: Optional[float]
+    speed: Optional[float]
+    # when the vehicle reported its position, if the feed says; otherwise the tick
+    timestamp: pendulum.DateTime
+    fetched_at: pendulum.DateTime
+
+    class Config:
+        json_encoders = {
+            pendulum.DateTime: lambda ts: ts.to_iso8601_string(),
+        }
+
+
+class BoundingBox(BaseModel):
+    min_lon: float
+    min_lat: float
+    max_lon: float
+    max_lat: float
+
+    @classmethod
+    def parse(cls, value: str) -> "BoundingBox":
+        min_lon, min_lat, max_lon, max_lat = (float(part) for part in value.split(","))
+        if min_lon > max_lon or min_lat > max_lat:
+            raise ValueError(f"{value} is not min_lon,min_lat,max_lon,max_lat")
+        return cls(min_lon=min_lon, min_lat=min_lat, max_lon=max_lon, max_lat=max_lat)
+
+    def contains(self, lat: float, lon: float) -> bool:
+        return (
+            self.min_lat <= lat <= self.max_lat and self.min_lon <= lon <= self.max_lon
+        )
+
+    def search_box(self) -> Tuple[float, float, float, float]:
+        """
+        The center, width and height (in km) of a GEOSEARCH BYBOX that covers this box;
+        the width is taken at the latitude furthest from the poles, so the search may
+        return extra vehicles that contains() filters out.
+        """
+        widest = (
+            min(abs(self.min_lat), abs(self.max_lat))
+            if self.min_lat * self.max_lat > 0
+            else 0
+        )
+        return (
+            (self.min_lon + self.max_lon) / 2,
+            (self.min_lat + self.max_lat) / 2,
+            (self.max_lon - self.min_lon)
+            * KM_PER_DEGREE
+            * math.cos(math.radians(widest)),
+            (self.max_lat - self.min_lat) * KM_PER_DEGREE,
+        )
+
+
+def feed_name(config: FeedConfig) -> str:
+    return slugify(config.name)
+
+
+def vehicle_key(feed: str, vehicle_id: str) -> str:
+    return f"live:{feed}:vehicle:{vehicle_id}"
+
+
+def history_key(feed: str, vehicle_id: str) -> str:
+    return f"live:{feed}:history:{vehicle_id}"
+
+
+def route_key(feed: str, route_id: str) -> str:
+    return f"live:{feed}:route:{route_id}"
+
+
+def geo_key(feed: str) -> str:
+    return f"live:{feed}:geo"
+
+
+def seen_key(feed: str) -> str:
+    return f"live:{feed}:seen"
+
+
+def valid_position(lat: float, lon: float) -> bool:
+    # Redis only indexes latitudes within ±85.05°, and (0, 0) is a GPS fix that failed
+    return abs(lat) <= 85.05 and abs(lon) <= 180 and (lat, lon) != (0, 0)
+
+
+def skipped_vehicle(feed: str, vehicle: str, e: Exception) -> None:
+    typer.secho(
+        f"Skipping {vehicle} of {feed}: {type(e).__name__}: {e}",
+        fg=typer.colors.YELLOW,
+    )
+
+
+def gtfs_rt_vehicles(
+    feed: str, contents: bytes, tick: pendulum.DateTime
+) -> Iterator[VehicleState]:
+    message = gtfs_realtime_pb2.FeedMessage()
+    message.ParseFromString(contents)
+    for entity in message.entity:
+        if not entity.HasField("vehicle") or not entity.vehicle.HasField("position"):
+            continue
+        vehicle = entity.vehicle
+        position = vehicle.position
+        if not valid_position(position.latitude, position.longitude):
+            continue
+        try:
+            yield VehicleState(
+                feed=feed,
+                vehicle_id=vehicle.vehicle.id or vehicle.vehicle.label or entity.id,
+                route_id=vehicle.trip.route_id or None,
+                trip_id=vehicle.trip.trip_id or None,
+                lat=position.latitude,
+                lon=position.longitude,
+                bearing=position.bearing if position.HasField("bearing") else None,
+                speed=position.speed if position.HasField("speed") else None,
+                timestamp=(
+                    pendulum.from_timestamp(vehicle.timestamp)
+                    if vehicle.timestamp
+                    else tick
+                ),
+                fetched_at=tick,
+            )
+        except (ValidationError, ValueError, OverflowError) as e:
+            skipped_vehicle(feed, f"vehicle {entity.id}", e)
+
+
+def septa_transit_view_vehicles(
+    feed: str, contents: bytes, tick: pendulum.DateTime
+) -> Iterator[VehicleState]:
+    for routes in json.loads(contents)["routes"]:
+        for route_id, vehicles in routes.items():
+            for vehicle in vehicles:
+                try:
+                    lat, lon = float(vehicle["lat"]), float(vehicle["lng"])
+                except (KeyError, TypeError, ValueError):
+                    continue
+                if not vehicle.get("VehicleID") or not valid_position(lat, lon):
+                    continue
+                # Offset is how many minutes ago the vehicle last reported
+                try:
+                    timestamp = tick.subtract(minutes=int(vehicle.get("Offset") or 0))
+                except (TypeError, ValueError):
+                    timestamp = tick
+                try:
+                    yield VehicleState(
+                        feed=feed,
+                        vehicle_id=str(vehicle["VehicleID"]),
+                        route_id=route_id,
+                        trip_id=str(vehicle["trip"]) if vehicle.get("trip") else None,
+                        lat=lat,
+                        lon=lon,
+                        bearing=vehicle.get("heading"),
+                        speed=None,
+                        timestamp=timestamp,
+                        fetched_at=tick,
+                    )
+                except ValidationError as e:
+                    skipped_vehicle(feed, f"vehicle {vehicle['VehicleID']}", e)
+
+
+def decode_vehicles(
+    config: FeedConfig, contents: bytes, tick: pendulum.DateTime
+) -> List[VehicleState]:
+    feed = feed_name(config)
+    if config.feed_type == FeedType.gtfs_rt__vehicle_positions:
+        return list(gtfs_rt_vehicles(feed, contents, tick))
+    if config.feed_type == FeedType.septa__transit_view_all:
+        return list(septa_transit_view_vehicles(feed, contents, tick))
+    raise ValueError(f"{config.feed_type} has no live vehicle positions")
+
+
+def upsert_vehicles(
+    conn: Redis,
+    feed: str,
+    vehicles: Iterable[VehicleState],
+    now: Optional[float] = None,
+) -> int:
+    """
+    Upserts the vehicles' latest states in one round trip, then evicts the feed's
+    vehicles that haven't been seen within the TTL from its sets in another.
+    """
+    now = now or time.time()
+    pipeline = conn.pipeline(transaction=False)
+    pipeline.sadd(FEEDS_KEY, feed)
+    pipeline.expire(FEEDS_KEY, LIVE_TTL_SECONDS)
+    routes = set()
+    count = 0
+    for vehicle in vehicles:
+        state = vehicle.json()
+        pipeline.set(vehicle_key(feed, vehicle.vehicle_id), state, ex=LIVE_TTL_SECONDS)
+        history = history_key(feed, vehicle.vehicle_id)
+        pipeline.lpush(history, state)
+        pipeline.ltrim(history, 0, LIVE_HISTORY_LENGTH - 1)
+        pipeline.expire(history, LIVE_TTL_SECONDS)
+        if vehicle.route_id:
+            routes.add(vehicle.route_id)
+            pipeline.zadd(route_key(feed, vehicle.route_id), {vehicle.vehicle_id: now})
+        pipeline.geoadd(geo_key(feed), (vehicle.lon, vehicle.lat, vehicle.vehicle_id))
+        pipeline.zadd(seen_key(feed), {vehicle.vehicle_id: now})
+        count += 1
+    stale = now - LIVE_TTL_SECONDS
+    for route_id in routes:
+        pipeline.zremrangebyscore(route_key(feed, route_id), "-inf", stale)
+        pipeline.expire(route_key(feed, route_id), LIVE_TTL_SECONDS)
+    pipeline.expire(geo_key(feed), LIVE_TTL_SECONDS)
+    pipeline.expire(seen_key(feed), LIVE_TTL_SECONDS)
+    pipeline.execute()
+
+    stale_ids = conn.zrangebyscore(seen_key(feed), "-inf", stale)
+    if stale_ids:
+        pipeline = conn.pipeline(transaction=False)
+        pipeline.zrem(geo_key(feed), *stale_ids)
+        pipeline.zrem(seen_key(feed), *stale_ids)
+        pipeline.execute()
+    return count
+
+
+def cache_vehicles(
+    conn: Redis, config: FeedConfig, tick: pendulum.DateTime, contents: bytes
+) -> None:
+    # the cache is a convenience for live consumers, so never fail the fetch over it
+    try:
+        with LIVE_UPSERT_DURATION_SECONDS.labels(**config.labels).time():
+            count = upsert_vehicles(
+                conn, feed_name(config), decode_vehicles(config, contents, tick)
+            )
+        LIVE_VEHICLES_UPSERTED.labels(**config.labels).inc(count)
+    except Exception as e:
+        typer.secho(
+            f"Failed to cache live vehicles from {config.name}: {type(e).__name__}: {e}",
+            fg=typer.colors.RED,
+        )
+
+
+def member_ids(members: Iterable[Any]) -> List[str]:
+    """
+    The vehicle ids of a set's members; redis-py types replies loosely, and they are
+    only strings when the connection decodes responses.
+    """
+    return [
+        member.decode() if isinstance(member, bytes) else str(member)
+        for member in members
+    ]
+
+
+def parse_states(feed: str, states: Iterable[Any]) -> List[VehicleState]:
+    vehicles = []
+    for state in states:
+        # a vehicle's state may have expired after it was found in a set
+        if not state:
+            continue
+        try:
+            vehicles.append(VehicleState.parse_raw(state))
+        except ValidationError as e:
+            skipped_vehicle(feed, "a cached vehicle state", e)
+    return vehicles
+
+
+def load_vehicles(conn: Redis, feed: str, vehicle_ids: List[str]) -> List[VehicleState]:
+    if not vehicle_ids:
+        return []
+    return parse_states(
+        feed, conn.mget([vehicle_key(feed, vehicle_id) for vehicle_id in vehicle_ids])
+    )
+
+
+def route_vehicles(conn: Redis, feed: str, route_id: str) -> List[VehicleState]:
+    vehicle_ids = member_ids(
+        conn.zrangebyscore(
+            route_key(feed, route_id), time.time() - LIVE_TTL_SECONDS, "+inf"
+        )
+    )
+    # vehicles that have since switched routes are still in the old route's set
+    return [
+        vehicle
+        for vehicle in load_vehicles(conn, feed, vehicle_ids)
+        if vehicle.route_id == route_id
+    ]
+
+
+def bbox_vehicles(conn: Redis, feed: str, bbox: BoundingBox) -> List[VehicleState]:
+    lon, lat, width, height = bbox.search_box()
+    vehicle_ids = member_ids(
+        conn.geosearch(
+            geo_key(feed),
+            longitude=lon,
+            latitude=lat,
+            width=width,
+            height=height,
+            unit="km",
+        )
+    )
+    return [
+        vehicle
+        for vehicle in load_vehicles(conn, feed, vehicle_ids)
+        if bbox.contains(vehicle.lat, vehicle.lon)
+    ]
+
+
+def vehicle_history(conn: Redis, feed: str, vehicle_id: str) -> List[VehicleState]:
+    return parse_states(feed, conn.lrange(history_key(feed, vehicle_id), 0, -1))
+
+
+class LiveHandler(BaseHTTPRequestHandler):
+    conn: Redis
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params: Dict[str, str] = {
+            key: values[-1] for key, values in parse_qs(url.query).items()
+        }
+        try:
+            if url.path == "/feeds":
+                return self.respond(sorted(self.conn.smembers(FEEDS_KEY)))
+            feed = params["feed"]
+            if url.path == "/vehicles" and "route" in params:
+                vehicles = route_vehicles(self.conn, feed, params["route"])
+            elif url.path == "/vehicles" and "bbox" in params:
+                vehicles = bbox_vehicles(
+                    self.conn, feed, BoundingBox.parse(params["bbox"])
+                )
+            elif url.path == "/history":
+                vehicles = vehicle_history(self.conn, feed, params["vehicle"])
+            else:
+                return self.respond(
+                    {"error": f"Unknown request {self.path}"}, HTTPStatus.NOT_FOUND
+                )
+        except (KeyError, ValueError) as e:
+            return self.respond(
+                {"error": f"Bad request {self.path}: {e}"}, HTTPStatus.BAD_REQUEST
+            )
+        self.respond([json.loads(vehicle.json()) for vehicle in vehicles])
+
+    def respond(self, body, status: HTTPStatus = HTTPStatus.OK) -> None:
+        contents = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(contents)))
+        self.end_headers()
+        self.wfile.write(contents)
+
+
+def main(port: int = typer.Option(8080)):
+    LiveHandler.conn = Redis(host=os.environ["HUEY_REDIS_HOST"], decode_responses=True)
+    server = ThreadingHTTPServer(("", port), LiveHandler)
+    typer.secho(
+        f"Serving live vehicles from {os.environ['HUEY_REDIS_HOST']} on :{port}"
+    )
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    typer.run(main)
@@ -1,4 +1,8 @@
-from prometheus_client import Counter, Summary
+from typing import Callable
+
+from prometheus_client import Counter, Gauge, Summary
+
+from fetcher.storage import get_storage
 
 COMMON_LABELNAMES = (
     "name",
@@ -29,3 +33,33 @@ FETCH_SAVE_DURATION_SECONDS = Summary(
     documentation="Duration of just the save for a fetch.",
     labelnames=COMMON_LABELNAMES,
 )
+
+# the storage limiter keeps its own counts, so these are read at scrape time
+STORAGE_LIMITER_STATS = Gauge(
+    name="storage_limiter",
+    documentation="Adaptive storage concurrency limiter state; throttles and latency_spikes are cumulative.",
+    labelnames=("stat",),
+)
+
+
+def storage_limiter_stat(stat: str) -> Callable[[], float]:
+    def read() -> float:
+        return get_storage().limiter.stats()[stat]
+
+    return read
+
+
+for _stat in ("limit", "in_flight", "throttles", "latency_spikes"):
+    STORAGE_LIMITER_STATS.labels(stat=_stat).set_function(storage_limiter_stat(_stat))
+
+LIVE_VEHICLES_UPSERTED = Counter(
+    name="live_vehicles_upserted",
+    documentation="Vehicle states upserted into the live cache.",
+    labelnames=COMMON_LABELNAMES,
+)
+
+LIVE_UPSERT_DURATION_SECONDS = Summary(
+    name="live_upsert_duration_seconds",
+    documentation="Duration of decoding a fetch's vehicles and upserting them into the live cache.",
+    labelnames=COMMON_LABELNAMES,
+)
@@ -1,39 +1,61 @@
 import os
-from typing import List
+from typing import Dict, List, Optional
 
 import humanize
 import pendulum
 import requests
 import typer
-from google.cloud import storage  # type: ignore
 from huey import RedisHuey  # type: ignore
+from redis import RedisError
 
-from fetcher.common import FeedConfig, KeyValue, RawFetchedFile
+from fetcher.common import (
+    FeedConfig,
+    FeedType,
+    KeyValue,
+    RawFetchedFile,
+    RawHourManifest,
+    RawManifestEntry,
+)
+from fetcher.live import LIVE_FEED_TYPES, LIVE_VEHICLE_CACHE, cache_vehicles
 from fetcher.metrics import (
+    COMMON_LABELNAMES,
     HUEY_TASK_SIGNALS,
     FETCH_REQUEST_DELAY_SECONDS,
     FETCH_REQUEST_DURATION_SECONDS,
     FETCH_SAVE_DURATION_SECONDS,
 )
+from fetcher.storage import PreconditionFailed, get_storage
+from fetcher.tracing import TraceContext, configure_tracing, export_span, span
 
 huey = RedisHuey(
     host=os.environ["HUEY_REDIS_HOST"],
 )
 
-client = storage.Client()
+# long enough to re-flush an hour's manifest after an outage
+MANIFEST_TTL_SECONDS = int(os.getenv("MANIFEST_TTL_SECONDS", 2 * 24 * 60 * 60))
+
+
+def manifest_redis_key(manifest: RawHourManifest) -> str:
+    return f"manifest:{manifest.gcs_key}"
 
 
 @huey.on_startup()
 def on_startup():
-    pass
+    configure_tracing(get_storage)
 
 
 @huey.signal()
 def all_signal_handler(signal, task, exc=None):
+    # housekeeping tasks such as flush_manifests aren't tied to a feed config
+    labels = (
+        task.kwargs["config"].labels
+        if "config" in task.kwargs
+        else {labelname: "" for labelname in COMMON_LABELNAMES}
+    )
     HUEY_TASK_SIGNALS.labels(
         signal=signal,
         exc_type=type(exc).__name__,
-        **task.kwargs["config"].labels,
+        **labels,
     ).inc()
 
 
@@ -45,12 +67,18 @@ def fetch_feed(
     config: FeedConfig,
     page: List[KeyValue] = [],
     dry: bool = False,
+    trace: Optional[TraceContext] = None,
 ):
     FETCH_REQUEST_DELAY_SECONDS.labels(**config.labels).observe(
         (pendulum.now() - tick).total_seconds()
     )
+    if trace and trace.sent_at:
+        export_span(trace, "queue_wait", trace.sent_at, pendulum.now(tz="UTC"))
 
-    with FETCH_REQUEST_DURATION_SECONDS.labels(**config.labels).time():
+    with (
+        FETCH_REQUEST_DURATION_SECONDS.labels(**config.labels).time(),
+        span(trace, "fetch") as attributes,
+    ):
         # TODO: the FeedConfig should manage the URL creation generically
         response = requests.get(
             config.url,
@@ -59,6 +87,7 @@ def fetch_feed(
                 **{kv.key: kv.value for kv in page},
             },
         )
+        attributes["status_code"] = response.status_code
     response.raise_for_status()
 
     raw = RawFetchedFile(
@@ -68,6 +97,7 @@ def fetch_feed(
         response_code=response.status_code,
         response_headers=response.headers,
         contents=response.content,
+        trace=trace,
     )
 
     msg = (
@@ -76,8 +106,108 @@ def fetch_feed(
     if dry:
         typer.secho(f"DRY RUN: {msg}")
     else:
-        with FETCH_SAVE_DURATION_SECONDS.labels(**config.labels).time():
-            client.bucket(raw.bucket.removeprefix("gs://")).blob(
-                raw.gcs_key
-            ).upload_from_string(raw.json(), client=client)
+        with (
+            FETCH_SAVE_DURATION_SECONDS.labels(**config.labels).time(),
+            span(trace, "upload", key=raw.gcs_key, bytes=len(raw.contents)),
+        ):
+            saved = get_storage().write_bytes(raw.bucket, raw.gcs_key, raw.json())
         typer.secho(msg)
+        append_to_manifest(
+            manifest=RawHourManifest(feed_type=config.feed_type, hour=raw.hour),
+            entry=RawManifestEntry(
+                key=raw.gcs_key,
+                size=saved.size,
+                md5_hash=saved.md5_hash,
+                generation=saved.generation,
+                tick=tick,
+                trace_id=trace.trace_id if trace else None,
+            ),
+        )
+        # only once the raw file is saved; cache_vehicles never raises
+        if LIVE_VEHICLE_CACHE and config.feed_type in LIVE_FEED_TYPES:
+            cache_vehicles(huey.storage.conn, config, tick, raw.contents)
+
+
+def append_to_manifest(manifest: RawHourManifest, entry: RawManifestEntry) -> None:
+    # the manifest is an optimization for listing, so never fail the fetch over it
+    key = manifest_redis_key(manifest)
+    try:
+        pipeline = huey.storage.conn.pipeline()
+        pipeline.rpush(key, entry.json())
+        pipeline.expire(key, MANIFEST_TTL_SECONDS)
+        pipeline.execute()
+    except RedisError as e:
+        typer.secho(f"Failed to append {entry.key} to {key}: {e}", fg=typer.colors.RED)
+
+
+@huey.task()
+def flush_manifests(
+    hour: pendulum.DateTime,
+    feed_types: List[FeedType],
+    dry: bool = False,
+):
+    """
+    Writes each feed type's accumulated manifest entries for an hour to the raw bucket;
+    safe to re-run, since entries already in the bucket are merged rather than replaced.
+    """
+    for feed_type in feed_types:
+        manifest = RawHourManifest(feed_type=feed_type, hour=hour)
+        entries: Dict[str, RawManifestEntry] = {}
+        for line in huey.storage.conn.lrange(manifest_redis_key(manifest), 0, -1):
+            entry = RawManifestEntry.parse_raw(line)
+            entries[entry.key] = entry  # last write wins if a fetch was retried
+
+        if not entries:
+            continue
+
+        msg = f"Saved {len(entries)} manifest entries to {manifest.bucket}/{manifest.gcs_key}"
+        if dry:
+            typer.secho(f"DRY RUN: {msg}")
+        else:
+            write_manifest(manifest, entries)
+            typer.secho(msg)
+
+
+def write_manifest(
+    manifest: RawHourManifest, entries: Dict[str, RawManifestEntry], attempts: int = 3
+) -> None:
+    """
+    Merges entries into the stored manifest. Stored entries that point at a raw bundle
+    are kept as they are, since Redis never learns of bundling (see the dags'
+    bundles.py); the generation precondition keeps a concurrent rewrite from being lost.
+    """
+    storage = get_storage()
+    for attempt in range(attempts):
+        stored = next(
+            (
+                obj
+                for obj in storage.list(manifest.bucket, prefix=manifest.gcs_key)
+                if obj.name == manifest.gcs_key
+            ),
+            None,
+        )
+        merged = dict(entries)
+        if stored:
+            for line in storage.read_text(
+                manifest.bucket, manifest.gcs_key, generation=stored.generation
+            ).splitlines():
+                if not line:
+                    continue
+                entry = RawManifestEntry.parse_raw(line)
+                if entry.bundle or entry.key not in merged:
+                    merged[entry.key] = entry
+        try:
+            storage.write_bytes(
+                manifest.bucket,
+                manifest.gcs_key,
+                "\n".join(
+                    entry.json()
+                    for entry in sorted(merged.values(), key=lambda e: e.key)
+                ),
+                content_type="application/x-ndjson",
+                if_generation_match=stored.generation if stored else 0,
+            )
+            return
+        except PreconditionFailed:
+            if attempt == attempts - 1:
+                raise
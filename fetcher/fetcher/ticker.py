@@ -11,7 +11,9 @@ from prometheus_client import start_http_server
 from pydantic import parse_obj_as
 
 from fetcher.common import KeyValue, FeedConfig, FeedType
-from fetcher.tasks import fetch_feed
+from fetcher.storage import get_storage
+from fetcher.tasks import fetch_feed, flush_manifests
+from fetcher.tracing import TraceContext, configure_tracing, export_span
 
 
 def configs_to_urls(
@@ -47,14 +49,24 @@ def tick(seconds: int, dry: bool, feed_types: List[FeedType]):
     fetches = configs_to_urls(configs)
 
     for config, page in fetches:
-        fetch_feed(tick=ts, config=config, page=page, dry=dry)
+        trace = TraceContext.start(feed_type=config.feed_type.value)
+        fetch_feed(tick=ts, config=config, page=page, dry=dry, trace=trace.sent())
+        # from the tick itself, so this includes any lag in the scheduler
+        export_span(trace, "enqueue", ts, pendulum.now(tz=pendulum.UTC))
     print(
         f"Took {humanize.naturaltime(pendulum.now() - ts)} to enqueue {len(fetches)} fetches."
     )
 
 
+def flush_previous_hour(dry: bool):
+    hour = pendulum.now(tz=pendulum.UTC).start_of("hour").subtract(hours=1)
+    typer.secho(f"Flushing manifests for {hour.to_iso8601_string()}")
+    flush_manifests(hour=hour, feed_types=list(FeedType), dry=dry)
+
+
 def main(dry: bool = False):
     start_http_server(8000)
+    configure_tracing(get_storage)
 
     typer.secho(f"Found {len(get_configs())=} feed configs.", fg=typer.colors.MAGENTA)
 
@@ -83,6 +95,8 @@ def main(dry: bool = False):
             FeedType.gtfs_schedule,
         ],
     )
+    # give in-flight fetches for the previous hour time to land before flushing
+    schedule.every().hour.at(":05").do(flush_previous_hour, dry=dry)
 
     while True:
         schedule.run_pending()
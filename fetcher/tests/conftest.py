@@ -0,0 +1,4 @@
+import os
+
+# fetcher.tasks builds its RedisHuey at import; tests swap in fakeredis before using it
+os.environ.setdefault("HUEY_REDIS_HOST", "localhost")
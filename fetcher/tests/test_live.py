@@ -0,0 +1,196 @@
+import json
+import time
+from unittest import mock
+
+import fakeredis
+import pendulum
+import pytest
+from google.transit import gtfs_realtime_pb2  # type: ignore
+
+from fetcher.common import FeedConfig, FeedType
+from fetcher.live import (
+    LIVE_TTL_SECONDS,
+    BoundingBox,
+    VehicleState,
+    cache_vehicles,
+    decode_vehicles,
+    geo_key,
+    load_vehicles,
+    route_vehicles,
+    seen_key,
+    upsert_vehicles,
+    vehicle_history,
+    vehicle_key,
+)
+
+TICK = pendulum.datetime(2023, 7, 5, 1, 2)
+SEPTA_TRANSIT_VIEW = FeedConfig(
+    name="SEPTA TransitViewAll",
+    url="https://whatever.com",
+    feed_type=FeedType.septa__transit_view_all,
+)
+
+
+def state(vehicle_id: str, route_id: str = "17", lat: float = 39.95) -> VehicleState:
+    return VehicleState(
+        feed="feed",
+        vehicle_id=vehicle_id,
+        route_id=route_id,
+        trip_id=None,
+        lat=lat,
+        lon=-75.16,
+        bearing=None,
+        speed=None,
+        timestamp=TICK,
+        fetched_at=TICK,
+    )
+
+
+@pytest.fixture
+def conn() -> fakeredis.FakeRedis:
+    return fakeredis.FakeRedis(decode_responses=True)
+
+
+def test_decodes_gtfs_rt_vehicle_positions():
+    message = gtfs_realtime_pb2.FeedMessage()
+    message.header.gtfs_realtime_version = "2.0"
+    entity = message.entity.add(id="1")
+    entity.vehicle.vehicle.id = "3021"
+    entity.vehicle.trip.route_id = "17"
+    entity.vehicle.trip.trip_id = "t1"
+    entity.vehicle.position.latitude = 39.95
+    entity.vehicle.position.longitude = -75.16
+    entity.vehicle.position.bearing = 90
+    entity.vehicle.timestamp = TICK.subtract(seconds=30).int_timestamp
+    # no position, and a failed GPS fix
+    message.entity.add(id="2").vehicle.vehicle.id = "3022"
+    lost = message.entity.add(id="3").vehicle
+    lost.vehicle.id = "3023"
+    lost.position.latitude = 0
+    lost.position.longitude = 0
+
+    (vehicle,) = decode_vehicles(
+        FeedConfig(
+            name="SEPTA Bus Vehicle Positions",
+            url="https://whatever.com",
+            feed_type=FeedType.gtfs_rt__vehicle_positions,
+        ),
+        message.SerializeToString(),
+        TICK,
+    )
+    assert vehicle.feed == "septa-bus-vehicle-positions"
+    assert (vehicle.vehicle_id, vehicle.route_id, vehicle.trip_id) == (
+        "3021",
+        "17",
+        "t1",
+    )
+    assert vehicle.lat == pytest.approx(39.95)
+    assert vehicle.bearing == 90
+    assert vehicle.speed is None
+    assert vehicle.timestamp == TICK.subtract(seconds=30)
+
+
+def test_decodes_septa_transit_view():
+    contents = json.dumps(
+        {
+            "routes": [
+                {
+                    "17": [
+                        {
+                            "lat": "39.95",
+                            "lng": "-75.16",
+                            "VehicleID": "3021",
+                            "Offset": "2",
+                            "heading": 180,
+                            "trip": "123",
+                        },
+                        {"lat": None, "lng": None, "VehicleID": "3022"},
+                        # skipped on its own
+                        {
+                            "lat": "39.9",
+                            "lng": "-75.1",
+                            "VehicleID": "3023",
+                            "heading": "N",
+                        },
+                    ],
+                    "G1": [
+                        {
+                            "lat": "40.01",
+                            "lng": "-75.1",
+                            "VehicleID": "8001",
+                            "Offset": "",
+                        }
+                    ],
+                }
+            ]
+        }
+    ).encode()
+    vehicles = decode_vehicles(SEPTA_TRANSIT_VIEW, contents, TICK)
+    assert [(v.vehicle_id, v.route_id, v.trip_id) for v in vehicles] == [
+        ("3021", "17", "123"),
+        ("8001", "G1", None),
+    ]
+    assert vehicles[0].timestamp == TICK.subtract(minutes=2)
+    assert vehicles[1].timestamp == TICK
+
+
+def test_bounding_box_search_covers_the_box():
+    bbox = BoundingBox.parse("-75.2,39.9,-75.1,40.0")
+    assert bbox.contains(39.95, -75.15)
+    assert not bbox.contains(39.95, -75.05)
+    lon, lat, width, height = bbox.search_box()
+    assert (lon, lat) == (pytest.approx(-75.15), pytest.approx(39.95))
+    # ~8.5km wide at 39.9°N, ~11.1km tall
+    assert width == pytest.approx(8.54, abs=0.01)
+    assert height == pytest.approx(11.13, abs=0.01)
+    with pytest.raises(ValueError):
+        BoundingBox.parse("-75.1,39.9,-75.2,40.0")
+
+
+def test_upserts_vehicles_and_serves_them(conn):
+    assert upsert_vehicles(conn, "feed", [state("1"), state("2", route_id="G1")]) == 2
+    assert [v.vehicle_id for v in route_vehicles(conn, "feed", "17")] == ["1"]
+    assert 0 < conn.ttl(vehicle_key("feed", "1")) <= LIVE_TTL_SECONDS
+
+    # a vehicle that switched routes is only served for its new one
+    upsert_vehicles(conn, "feed", [state("1", route_id="G1")])
+    assert route_vehicles(conn, "feed", "17") == []
+    assert sorted(v.vehicle_id for v in route_vehicles(conn, "feed", "G1")) == [
+        "1",
+        "2",
+    ]
+    # fakeredis has no GEOSEARCH BYBOX, so bbox_vehicles isn't covered here
+    assert sorted(conn.zrange(geo_key("feed"), 0, -1)) == ["1", "2"]
+
+    # a state that can't be read back is skipped on its own
+    conn.set(vehicle_key("feed", "2"), "{}")
+    assert [v.vehicle_id for v in load_vehicles(conn, "feed", ["1", "2"])] == ["1"]
+
+
+def test_history_keeps_the_newest_states(conn):
+    with mock.patch("fetcher.live.LIVE_HISTORY_LENGTH", 3):
+        for lat in [39.91, 39.92, 39.93, 39.94, 39.95]:
+            upsert_vehicles(conn, "feed", [state("1", lat=lat)])
+    assert [v.lat for v in vehicle_history(conn, "feed", "1")] == [
+        39.95,
+        39.94,
+        39.93,
+    ]
+
+
+def test_evicts_vehicles_not_seen_within_the_ttl(conn):
+    now = time.time()
+    upsert_vehicles(
+        conn, "feed", [state("1"), state("2")], now=now - LIVE_TTL_SECONDS - 1
+    )
+    upsert_vehicles(conn, "feed", [state("2")], now=now)
+
+    assert conn.zrange(seen_key("feed"), 0, -1) == ["2"]
+    assert conn.zrange(geo_key("feed"), 0, -1) == ["2"]
+    assert [v.vehicle_id for v in route_vehicles(conn, "feed", "17")] == ["2"]
+
+
+def test_caching_never_raises(conn):
+    cache_vehicles(conn, SEPTA_TRANSIT_VIEW, TICK, b"not json")
+    with mock.patch.object(conn, "pipeline", side_effect=ConnectionError):
+        cache_vehicles(conn, SEPTA_TRANSIT_VIEW, TICK, b'{"routes": []}')
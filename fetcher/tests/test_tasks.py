@@ -1,9 +1,22 @@
 from typing import Dict, Type, Any
+from unittest import mock
 
+import fakeredis
 import pendulum
 from polyfactory.factories.pydantic_factory import ModelFactory
 
-from fetcher.common import RawFetchedFile, FeedConfig, FeedType
+from fetcher.common import (
+    RawFetchedFile,
+    FeedConfig,
+    FeedType,
+    RawHourManifest,
+    RawManifestEntry,
+)
+from fetcher.storage import LocalStorage
+from fetcher.tasks import append_to_manifest, flush_manifests, huey
+from fetcher.tracing import TraceContext
+
+HOUR = pendulum.datetime(2023, 7, 5, 1)
 
 
 # TODO: get this working
@@ -32,3 +45,57 @@ def test_fetched_raw_file_serializes():
         response_headers={},
         contents=b"test test 123",
     ).json()
+
+
+def test_fetched_raw_file_carries_its_trace():
+    trace = TraceContext.start(feed_type=FeedType.gtfs_rt__vehicle_positions).sent()
+    raw = RawFetchedFile(
+        ts=pendulum.now(),
+        config=FeedConfig(
+            name="whatever",
+            feed_type=FeedType.gtfs_rt__vehicle_positions,
+            url="https://whatever.com",
+        ),
+        response_code=200,
+        response_headers={},
+        contents=b"test test 123",
+        trace=trace,
+    )
+    assert RawFetchedFile.parse_raw(raw.json()).trace == trace
+
+
+def entry(key: str, **kwargs) -> RawManifestEntry:
+    return RawManifestEntry(
+        key=key, size=10, md5_hash="md5", generation=1, tick=HOUR, **kwargs
+    )
+
+
+def read_manifest(storage: LocalStorage, manifest: RawHourManifest):
+    return [
+        RawManifestEntry.parse_raw(line)
+        for line in storage.read_text(manifest.bucket, manifest.gcs_key).splitlines()
+    ]
+
+
+def test_flush_keeps_bundled_entries(tmp_path):
+    storage = LocalStorage(tmp_path)
+    manifest = RawHourManifest(feed_type=FeedType.septa__alerts, hour=HOUR)
+    # as rewritten by the dags' raw bundling
+    bundled = entry("a", bundle="septa__alerts__bundles/bundle", offset=0)
+    storage.write_bytes(
+        manifest.bucket,
+        manifest.gcs_key,
+        "\n".join(e.json() for e in [bundled, entry("c")]),
+    )
+
+    with (
+        mock.patch.object(huey.storage, "conn", fakeredis.FakeRedis()),
+        mock.patch("fetcher.tasks.get_storage", return_value=storage),
+    ):
+        for key in ["a", "b", "b"]:
+            append_to_manifest(manifest, entry(key))
+        flush_manifests.call_local(HOUR, [FeedType.septa__alerts])
+        # flushing again is a no-op
+        flush_manifests.call_local(HOUR, [FeedType.septa__alerts])
+
+    assert read_manifest(storage, manifest) == [bundled, entry("b"), entry("c")]
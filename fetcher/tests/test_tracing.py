@@ -0,0 +1,40 @@
+from unittest import mock
+
+from fetcher.common import FeedType
+from fetcher.storage import LocalStorage
+from fetcher.tracing import (
+    BucketSpanExporter,
+    TraceContext,
+    read_spans,
+    set_exporter,
+    span,
+)
+
+
+def test_bucket_exporter_never_fails_the_traced_work(tmp_path):
+    storage = LocalStorage(tmp_path)
+    failing = mock.Mock(side_effect=RuntimeError("no credentials"))
+    exporter = BucketSpanExporter(failing, "traces-bucket")
+    trace = TraceContext.start(feed_type=FeedType.gtfs_rt__vehicle_positions)
+
+    previous = set_exporter(exporter)
+    try:
+        with mock.patch("fetcher.tracing.TRACE_FLUSH_SPANS", 1):
+            with span(trace, "fetch"):
+                pass
+            failing.assert_called_once()
+
+            # the failed batch is dropped rather than retried
+            exporter.storage_factory = lambda: storage
+            with span(trace, "upload"):
+                pass
+    finally:
+        set_exporter(previous)
+
+    (saved,) = storage.list("traces-bucket", prefix="traces/")
+    spans = list(
+        read_spans(
+            storage.read_bytes("traces-bucket", saved.name).decode().splitlines()
+        )
+    )
+    assert [s.name for s in spans] == ["upload"]
@@ -1,39 +1,38 @@
 -- BigQuery External Tables for GCS File Metadata Analysis
--- Assumes CSVs are uploaded to gs://transit-data-demo-metadata/
+-- Assumes the file inventories (Parquet) and coverage summaries (CSV) are uploaded
+-- to gs://transit-data-demo-metadata/
 
 -- =============================================================================
 -- External Table: Test Bucket Raw File Metadata
 -- =============================================================================
+-- The schema comes from the Parquet files written by
+-- `scripts/analyze-bucket-coverage.py test-jarvus-transit-data-demo-raw --inventory ...`:
+--   feed_type (STRING): Feed type (top-level folder name)
+--   timestamp (TIMESTAMP): Timestamp from ts= partition
+--   feed_url (STRING): Decoded feed URL from base64url filename
+--   file_size_bytes (INT64): File size in bytes
+--   created_time (TIMESTAMP): GCS file creation timestamp
 CREATE OR REPLACE EXTERNAL TABLE `{PROJECT_ID}.{DATASET}.test_raw_files_metadata`
-(
-  feed_type STRING OPTIONS(description="Feed type (top-level folder name)"),
-  timestamp TIMESTAMP OPTIONS(description="Timestamp from ts= partition"),
-  feed_url STRING OPTIONS(description="Decoded feed URL from base64url filename"),
-  file_size_bytes INT64 OPTIONS(description="File size in bytes"),
-  created_time TIMESTAMP OPTIONS(description="GCS file creation timestamp")
-)
 OPTIONS (
-  format = 'CSV',
-  uris = ['gs://transit-data-demo-metadata/test-jarvus-transit-data-demo-raw-files.csv'],
-  skip_leading_rows = 1,
+  format = 'PARQUET',
+  uris = ['gs://transit-data-demo-metadata/test-jarvus-transit-data-demo-raw-files/*.parquet'],
   description = 'Metadata for all files in test-jarvus-transit-data-demo-raw bucket'
 );
 
 -- =============================================================================
 -- External Table: Production Bucket Raw File Metadata
 -- =============================================================================
+-- The schema comes from the Parquet files written by
+-- `scripts/analyze-bucket-coverage.py jarvus-transit-data-demo-raw --inventory ...`:
+--   feed_type (STRING): Feed type (top-level folder name)
+--   timestamp (TIMESTAMP): Timestamp from ts= partition
+--   feed_url (STRING): Decoded feed URL from base64url filename
+--   file_size_bytes (INT64): File size in bytes
+--   created_time (TIMESTAMP): GCS file creation timestamp
 CREATE OR REPLACE EXTERNAL TABLE `{PROJECT_ID}.{DATASET}.prod_raw_files_metadata`
-(
-  feed_type STRING OPTIONS(description="Feed type (top-level folder name)"),
-  timestamp TIMESTAMP OPTIONS(description="Timestamp from ts= partition"),
-  feed_url STRING OPTIONS(description="Decoded feed URL from base64url filename"),
-  file_size_bytes INT64 OPTIONS(description="File size in bytes"),
-  created_time TIMESTAMP OPTIONS(description="GCS file creation timestamp")
-)
 OPTIONS (
-  format = 'CSV',
-  uris = ['gs://transit-data-demo-metadata/jarvus-transit-data-demo-raw-files.csv'],
-  skip_leading_rows = 1,
+  format = 'PARQUET',
+  uris = ['gs://transit-data-demo-metadata/jarvus-transit-data-demo-raw-files/*.parquet'],
   description = 'Metadata for all files in jarvus-transit-data-demo-raw bucket'
 );
 
@@ -233,42 +232,40 @@ ORDER BY t.feed_type;
 -- =============================================================================
 -- External Table: Test Bucket Parsed File Metadata
 -- =============================================================================
+-- The schema comes from the Parquet files written by
+-- `scripts/analyze-bucket-coverage.py test-jarvus-transit-data-demo-parsed --inventory ...`:
+--   table_name (STRING): Table name (e.g., gtfs_rt__vehicle_positions, gtfs_schedule__stops_txt)
+--   date (DATE): Date from dt= partition
+--   hour (TIMESTAMP): Hour from hour= partition
+--   feed_url (STRING): Decoded feed URL from base64url filename
+--   file_path (STRING): Full gs:// path
+--   file_size_bytes (INT64): File size in bytes
+--   created_time (TIMESTAMP): GCS file creation timestamp
+--   file_type (STRING): File type: data (.jsonl.gz), outcomes (.jsonl), or other
 CREATE OR REPLACE EXTERNAL TABLE `{PROJECT_ID}.{DATASET}.test_parsed_files_metadata`
-(
-  table_name STRING OPTIONS(description="Table name (e.g., gtfs_rt__vehicle_positions, gtfs_schedule__stops_txt)"),
-  date DATE OPTIONS(description="Date from dt= partition"),
-  hour TIMESTAMP OPTIONS(description="Hour from hour= partition"),
-  feed_url STRING OPTIONS(description="Decoded feed URL from base64url filename"),
-  file_path STRING OPTIONS(description="Full gs:// path"),
-  file_size_bytes INT64 OPTIONS(description="File size in bytes"),
-  created_time TIMESTAMP OPTIONS(description="GCS file creation timestamp"),
-  file_type STRING OPTIONS(description="File type: data (.jsonl.gz), outcomes (.jsonl), or other")
-)
 OPTIONS (
-  format = 'CSV',
-  uris = ['gs://transit-data-demo-metadata/test-jarvus-transit-data-demo-parsed-files.csv'],
-  skip_leading_rows = 1,
+  format = 'PARQUET',
+  uris = ['gs://transit-data-demo-metadata/test-jarvus-transit-data-demo-parsed-files/*.parquet'],
   description = 'Metadata for all files in test-jarvus-transit-data-demo-parsed bucket'
 );
 
 -- =============================================================================
 -- External Table: Production Bucket Parsed File Metadata
 -- =============================================================================
+-- The schema comes from the Parquet files written by
+-- `scripts/analyze-bucket-coverage.py jarvus-transit-data-demo-parsed --inventory ...`:
+--   table_name (STRING): Table name (e.g., gtfs_rt__vehicle_positions, gtfs_schedule__stops_txt)
+--   date (DATE): Date from dt= partition
+--   hour (TIMESTAMP): Hour from hour= partition
+--   feed_url (STRING): Decoded feed URL from base64url filename
+--   file_path (STRING): Full gs:// path
+--   file_size_bytes (INT64): File size in bytes
+--   created_time (TIMESTAMP): GCS file creation timestamp
+--   file_type (STRING): File type: data (.jsonl.gz), outcomes (.jsonl), or other
 CREATE OR REPLACE EXTERNAL TABLE `{PROJECT_ID}.{DATASET}.prod_parsed_files_metadata`
-(
-  table_name STRING OPTIONS(description="Table name (e.g., gtfs_rt__vehicle_positions, gtfs_schedule__stops_txt)"),
-  date DATE OPTIONS(description="Date from dt= partition"),
-  hour TIMESTAMP OPTIONS(description="Hour from hour= partition"),
-  feed_url STRING OPTIONS(description="Decoded feed URL from base64url filename"),
-  file_path STRING OPTIONS(description="Full gs:// path"),
-  file_size_bytes INT64 OPTIONS(description="File size in bytes"),
-  created_time TIMESTAMP OPTIONS(description="GCS file creation timestamp"),
-  file_type STRING OPTIONS(description="File type: data (.jsonl.gz), outcomes (.jsonl), or other")
-)
 OPTIONS (
-  format = 'CSV',
-  uris = ['gs://transit-data-demo-metadata/jarvus-transit-data-demo-parsed-files.csv'],
-  skip_leading_rows = 1,
+  format = 'PARQUET',
+  uris = ['gs://transit-data-demo-metadata/jarvus-transit-data-demo-parsed-files/*.parquet'],
   description = 'Metadata for all files in jarvus-transit-data-demo-parsed bucket'
 );
 
@@ -489,8 +486,15 @@ CREATE OR REPLACE EXTERNAL TABLE `{PROJECT_ID}.{DATASET}.test_raw_bucket_coverag
   total_size_gb FLOAT64 OPTIONS(description="Total size in GB"),
   days_covered INT64 OPTIONS(description="Number of days with data"),
   hours_covered INT64 OPTIONS(description="Number of hours with data"),
-  has_gaps BOOL OPTIONS(description="Whether there are gaps in hourly coverage"),
-  gap_count INT64 OPTIONS(description="Number of missing hours")
+  has_gaps BOOL OPTIONS(description="Whether there are gaps at the feed's cadence"),
+  gap_count INT64 OPTIONS(description="Number of missing hours"),
+  cadence_minutes INT64 OPTIONS(description="Expected minutes between files"),
+  gap_ranges INT64 OPTIONS(description="Number of gaps at the feed's cadence"),
+  missing_minutes INT64 OPTIONS(description="Total minutes within gaps"),
+  longest_gap_minutes INT64 OPTIONS(description="Length of the longest gap in minutes"),
+  longest_gap_start TIMESTAMP OPTIONS(description="Start of the longest gap"),
+  longest_gap_end TIMESTAMP OPTIONS(description="End (exclusive) of the longest gap"),
+  completeness_pct FLOAT64 OPTIONS(description="Percent of expected files present between the first and last")
 )
 OPTIONS (
   format = 'CSV',
@@ -518,8 +522,15 @@ CREATE OR REPLACE EXTERNAL TABLE `{PROJECT_ID}.{DATASET}.prod_raw_bucket_coverag
   total_size_gb FLOAT64 OPTIONS(description="Total size in GB"),
   days_covered INT64 OPTIONS(description="Number of days with data"),
   hours_covered INT64 OPTIONS(description="Number of hours with data"),
-  has_gaps BOOL OPTIONS(description="Whether there are gaps in hourly coverage"),
-  gap_count INT64 OPTIONS(description="Number of missing hours")
+  has_gaps BOOL OPTIONS(description="Whether there are gaps at the feed's cadence"),
+  gap_count INT64 OPTIONS(description="Number of missing hours"),
+  cadence_minutes INT64 OPTIONS(description="Expected minutes between files"),
+  gap_ranges INT64 OPTIONS(description="Number of gaps at the feed's cadence"),
+  missing_minutes INT64 OPTIONS(description="Total minutes within gaps"),
+  longest_gap_minutes INT64 OPTIONS(description="Length of the longest gap in minutes"),
+  longest_gap_start TIMESTAMP OPTIONS(description="Start of the longest gap"),
+  longest_gap_end TIMESTAMP OPTIONS(description="End (exclusive) of the longest gap"),
+  completeness_pct FLOAT64 OPTIONS(description="Percent of expected files present between the first and last")
 )
 OPTIONS (
   format = 'CSV',
@@ -547,8 +558,15 @@ CREATE OR REPLACE EXTERNAL TABLE `{PROJECT_ID}.{DATASET}.test_parsed_bucket_cove
   total_size_gb FLOAT64 OPTIONS(description="Total size in GB"),
   days_covered INT64 OPTIONS(description="Number of days with data"),
   hours_covered INT64 OPTIONS(description="Number of hours with data"),
-  has_gaps BOOL OPTIONS(description="Whether there are gaps in hourly coverage"),
-  gap_count INT64 OPTIONS(description="Number of missing hours")
+  has_gaps BOOL OPTIONS(description="Whether there are gaps at the feed's cadence"),
+  gap_count INT64 OPTIONS(description="Number of missing hours"),
+  cadence_minutes INT64 OPTIONS(description="Expected minutes between files"),
+  gap_ranges INT64 OPTIONS(description="Number of gaps at the feed's cadence"),
+  missing_minutes INT64 OPTIONS(description="Total minutes within gaps"),
+  longest_gap_minutes INT64 OPTIONS(description="Length of the longest gap in minutes"),
+  longest_gap_start TIMESTAMP OPTIONS(description="Start of the longest gap"),
+  longest_gap_end TIMESTAMP OPTIONS(description="End (exclusive) of the longest gap"),
+  completeness_pct FLOAT64 OPTIONS(description="Percent of expected files present between the first and last")
 )
 OPTIONS (
   format = 'CSV',
@@ -576,8 +594,15 @@ CREATE OR REPLACE EXTERNAL TABLE `{PROJECT_ID}.{DATASET}.prod_parsed_bucket_cove
   total_size_gb FLOAT64 OPTIONS(description="Total size in GB"),
   days_covered INT64 OPTIONS(description="Number of days with data"),
   hours_covered INT64 OPTIONS(description="Number of hours with data"),
-  has_gaps BOOL OPTIONS(description="Whether there are gaps in hourly coverage"),
-  gap_count INT64 OPTIONS(description="Number of missing hours")
+  has_gaps BOOL OPTIONS(description="Whether there are gaps at the feed's cadence"),
+  gap_count INT64 OPTIONS(description="Number of missing hours"),
+  cadence_minutes INT64 OPTIONS(description="Expected minutes between files"),
+  gap_ranges INT64 OPTIONS(description="Number of gaps at the feed's cadence"),
+  missing_minutes INT64 OPTIONS(description="Total minutes within gaps"),
+  longest_gap_minutes INT64 OPTIONS(description="Length of the longest gap in minutes"),
+  longest_gap_start TIMESTAMP OPTIONS(description="Start of the longest gap"),
+  longest_gap_end TIMESTAMP OPTIONS(description="End (exclusive) of the longest gap"),
+  completeness_pct FLOAT64 OPTIONS(description="Percent of expected files present between the first and last")
 )
 OPTIONS (
   format = 'CSV',
@@ -3,22 +3,36 @@
 Analyze GCS bucket coverage for transit data.
 
 Efficiently aggregates file metadata to identify date/time ranges and gaps
-for each feed without listing every individual file.
+for each feed. Coverage is kept as a bitset of the minutes in which each feed
+URL has files, from which exact gap ranges at the feed's cadence and daily
+completeness are derived.
+
+The bucket is listed concurrently, one feed_type/dt=DATE/ prefix at a time,
+and per-prefix results are kept in a state file so that later runs only list
+dates that were still open (or new) last time. Optionally, every listed file
+is also written to a Parquet inventory, one file per prefix.
 
 Usage:
     python analyze-bucket-coverage.py test-jarvus-transit-data-demo-raw --output coverage.csv
     python analyze-bucket-coverage.py --bucket jarvus-transit-data-demo-parsed --bucket-type parsed
+    python analyze-bucket-coverage.py jarvus-transit-data-demo-raw --inventory .scratch/raw-files
 """
 
 import argparse
 import base64
 import csv
+import json
+import os
 import re
 import sys
+import threading
+import zlib
 from collections import defaultdict
-from datetime import datetime
-from typing import Dict, Set, Tuple, Optional
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, Iterable, Iterator, List, Set, Tuple, Optional
 
+import numpy as np
 from google.cloud import storage
 
 
@@ -77,20 +91,346 @@ def parse_parsed_bucket_path(path: str) -> Optional[Tuple[str, str, str, str]]:
     return None
 
 
+MINUTES_PER_DAY = 24 * 60
+BYTES_PER_DAY = MINUTES_PER_DAY // 8
+UNIX_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def parse_timestamp(value: str) -> datetime:
+    return datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+
+def epoch_minute(timestamp: str) -> int:
+    return int((parse_timestamp(timestamp) - UNIX_EPOCH).total_seconds() // 60)
+
+
+def minute_timestamp(minute: int) -> str:
+    return (UNIX_EPOCH + timedelta(minutes=int(minute))).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+class MinuteBitset:
+    """
+    The minutes (since the Unix epoch) in which a feed has files, one bit each.
+
+    Bits are kept for whole UTC days from the first to the last day seen, so a
+    day costs 180 bytes regardless of how many files it has, and day ranges stay
+    byte-aligned for merging.
+    """
+
+    def __init__(self, start_day: Optional[int] = None, bits: Optional[bytes] = None):
+        self.start_day = start_day
+        self.bits = bytearray(bits or b"")
+
+    @property
+    def days(self) -> int:
+        return len(self.bits) // BYTES_PER_DAY
+
+    def _cover(self, first_day: int, last_day: int):
+        if self.start_day is None:
+            self.start_day = first_day
+            self.bits = bytearray((last_day - first_day + 1) * BYTES_PER_DAY)
+            return
+        if first_day < self.start_day:
+            self.bits[:0] = bytes((self.start_day - first_day) * BYTES_PER_DAY)
+            self.start_day = first_day
+        end_day = self.start_day + self.days
+        if last_day >= end_day:
+            self.bits.extend(bytes((last_day - end_day + 1) * BYTES_PER_DAY))
+
+    def add(self, minute: int):
+        day = minute // MINUTES_PER_DAY
+        self._cover(day, day)
+        assert self.start_day is not None
+        offset = minute - self.start_day * MINUTES_PER_DAY
+        self.bits[offset >> 3] |= 1 << (offset & 7)
+
+    def merge(self, other: "MinuteBitset"):
+        if other.start_day is None:
+            return
+        self._cover(other.start_day, other.start_day + other.days - 1)
+        assert self.start_day is not None
+        start = (other.start_day - self.start_day) * BYTES_PER_DAY
+        end = start + len(other.bits)
+        merged = int.from_bytes(self.bits[start:end], "little") | int.from_bytes(
+            other.bits, "little"
+        )
+        self.bits[start:end] = merged.to_bytes(end - start, "little")
+
+    def minutes(self) -> np.ndarray:
+        """The set minutes, in order."""
+        if self.start_day is None:
+            return np.array([], dtype=np.int64)
+        bits = np.unpackbits(
+            np.frombuffer(bytes(self.bits), np.uint8), bitorder="little"
+        )
+        return np.flatnonzero(bits) + self.start_day * MINUTES_PER_DAY
+
+    def to_json(self) -> Dict:
+        return {
+            "start_day": self.start_day,
+            "bits": base64.b64encode(zlib.compress(bytes(self.bits))).decode("ascii"),
+        }
+
+    @classmethod
+    def from_json(cls, value: Dict) -> "MinuteBitset":
+        return cls(value["start_day"], zlib.decompress(base64.b64decode(value["bits"])))
+
+
+def new_stats() -> Dict:
+    return {
+        "minutes": MinuteBitset(),
+        "first_timestamp": None,
+        "last_timestamp": None,
+        "file_count": 0,
+        "total_size": 0,
+    }
+
+
+def add_file(stats: Dict, timestamp: str, size: int):
+    """Add one file to a (feed_type, base64_encoded_url) aggregate."""
+    stats["minutes"].add(epoch_minute(timestamp))
+    if stats["first_timestamp"] is None or timestamp < stats["first_timestamp"]:
+        stats["first_timestamp"] = timestamp
+    if stats["last_timestamp"] is None or timestamp > stats["last_timestamp"]:
+        stats["last_timestamp"] = timestamp
+    stats["file_count"] += 1
+    stats["total_size"] += size
+
+
+def merge_stats(into: Dict, stats: Dict):
+    """Merge an aggregate, as kept in the state file, into another."""
+    into["minutes"].merge(MinuteBitset.from_json(stats["minutes"]))
+    for key, pick in (("first_timestamp", min), ("last_timestamp", max)):
+        values = [v for v in (into[key], stats[key]) if v is not None]
+        into[key] = pick(values) if values else None
+    into["file_count"] += stats["file_count"]
+    into["total_size"] += stats["total_size"]
+
+
+_clients = threading.local()
+
+
+def get_bucket(bucket_name: str) -> storage.Bucket:
+    """One client per thread, since shards are listed concurrently."""
+    if not hasattr(_clients, "client"):
+        _clients.client = storage.Client()
+    return _clients.client.bucket(bucket_name)
+
+
+def list_subprefixes(bucket_name: str, prefix: str = "") -> List[str]:
+    """List the "directories" directly under a prefix."""
+    iterator = get_bucket(bucket_name).list_blobs(
+        prefix=prefix, delimiter="/", timeout=600
+    )
+    prefixes: Set[str] = set()
+    for page in iterator.pages:
+        prefixes.update(page.prefixes)
+    return sorted(prefixes)
+
+
+def list_shards(bucket_name: str, max_workers: int) -> List[str]:
+    """
+    List the feed_type/dt=DATE/ prefixes of a bucket, without listing any files.
+
+    Top-level folders without dt= partitions (e.g. manifests or archives that
+    are not hive-partitioned) are skipped.
+    """
+    feed_prefixes = list_subprefixes(bucket_name)
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        listed = pool.map(lambda p: list_subprefixes(bucket_name, p), feed_prefixes)
+        return sorted(
+            shard
+            for shards in listed
+            for shard in shards
+            if shard.rsplit("/", 2)[-2].startswith("dt=")
+        )
+
+
+def shard_date(shard: str) -> str:
+    return shard.rstrip("/").rsplit("dt=", 1)[-1]
+
+
+BUNDLES_SUFFIX = "__bundles"
+MANIFESTS_SUFFIX = "__manifests"
+
+
+def shard_feed_type(shard: str) -> str:
+    return shard.split("/", 1)[0].removesuffix(BUNDLES_SUFFIX)
+
+
+def is_bundle_shard(shard: str) -> bool:
+    return shard.split("/", 1)[0].endswith(BUNDLES_SUFFIX)
+
+
+def list_bundled_files(
+    bucket_name: str, shard: str
+) -> Iterator[Tuple[str, int, Optional[str]]]:
+    """
+    List the raw files of a day that have been packed into bundles (and so deleted),
+    from the bundle locations recorded in the day's hourly raw manifests.
+    """
+    bucket = get_bucket(bucket_name)
+    manifests = f"{shard_feed_type(shard)}{MANIFESTS_SUFFIX}/dt={shard_date(shard)}/"
+    for blob in bucket.list_blobs(prefix=manifests, timeout=600):
+        for line in blob.download_as_bytes().splitlines():
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            if entry.get("bundle"):
+                yield entry["key"], entry["size"], entry["tick"]
+
+
+def list_shard(
+    bucket_name: str,
+    shard: str,
+    bucket_type: str,
+    limit: Optional[int] = None,
+    with_files: bool = False,
+    previous: Optional[Dict] = None,
+) -> Dict:
+    """
+    List one feed_type/dt=DATE/ prefix and aggregate it by base64_encoded_url.
+
+    For a raw <feed_type>__bundles/dt=DATE/ prefix, the bundled files are counted
+    instead, unless the bundles are the same as in the previous result.
+
+    Returns a JSON-serializable dict, which is what is kept in the state file;
+    if with_files is set, it also includes one inventory row per file.
+    """
+    coverage: Dict[str, Dict] = defaultdict(new_stats)
+    files: List[Dict] = []
+    file_count = 0
+
+    blobs = get_bucket(bucket_name).list_blobs(
+        prefix=shard, max_results=limit, timeout=600
+    )
+    bundles: List[str] = []
+    listed: Iterable[Tuple[str, int, Optional[str]]] = (
+        (
+            blob.name,
+            blob.size or 0,
+            blob.time_created.isoformat() if blob.time_created else None,
+        )
+        for blob in blobs
+    )
+    if bucket_type == "raw" and is_bundle_shard(shard):
+        bundles = sorted(f"{blob.name}#{blob.generation}" for blob in blobs)
+        if previous and previous.get("bundles") == bundles:
+            return {**previous, "files": None}
+        listed = list_bundled_files(bucket_name, shard)
+
+    for name, size, created in listed:
+        if bucket_type == "raw":
+            parsed = parse_raw_bucket_path(name)
+            if not parsed:
+                continue
+            feed_type, dt, hour, timestamp, base64_url = parsed
+        else:
+            parsed_path = parse_parsed_bucket_path(name)
+            if not parsed_path:
+                continue
+            feed_type, dt, hour, base64_url = parsed_path
+            # For parsed buckets, use hour as timestamp
+            timestamp = hour
+
+        add_file(coverage[base64_url], timestamp, size)
+        file_count += 1
+        if with_files:
+            files.append(
+                {
+                    "bucket": bucket_name,
+                    "name": name,
+                    "feed_type": feed_type,
+                    "date": dt,
+                    "hour": hour,
+                    "timestamp": timestamp,
+                    "base64_url": base64_url,
+                    "size": size,
+                    "created": created,
+                }
+            )
+
+    return {
+        "listed_at": datetime.now(timezone.utc).isoformat(),
+        "file_count": file_count,
+        "coverage": {
+            base64_url: {**stats, "minutes": stats["minutes"].to_json()}
+            for base64_url, stats in coverage.items()
+        },
+        "bundles": bundles,
+        "files": files,
+    }
+
+
+def is_settled(shard: str, result: Dict, settle_days: int) -> bool:
+    """
+    Whether a shard's date had ended settle_days before it was listed, so that
+    listing it again would find nothing new.
+    """
+    try:
+        shard_day = date.fromisoformat(shard_date(shard))
+    except ValueError:
+        return False
+    listed_at = datetime.fromisoformat(result["listed_at"]).date()
+    return shard_day + timedelta(days=settle_days) < listed_at
+
+
+# bumped whenever the per-shard results change shape, so old state files are ignored
+STATE_VERSION = 2
+
+
+def load_state(state_file: Optional[str]) -> Dict[str, Dict]:
+    if not state_file or not os.path.exists(state_file):
+        return {}
+    with open(state_file) as f:
+        state = json.load(f)
+    if state.get("version", 1) != STATE_VERSION:
+        print(f"Ignoring outdated state file {state_file}", file=sys.stderr)
+        return {}
+    return state["shards"]
+
+
+def save_state(state_file: str, bucket_name: str, shards: Dict[str, Dict]):
+    os.makedirs(os.path.dirname(os.path.abspath(state_file)), exist_ok=True)
+    tmp = f"{state_file}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(
+            {"version": STATE_VERSION, "bucket": bucket_name, "shards": shards}, f
+        )
+    os.replace(tmp, state_file)
+
+
 def analyze_bucket(
     bucket_name: str,
     bucket_type: str = "raw",
     environment: str = "unknown",
     limit: Optional[int] = None,
+    state_file: Optional[str] = None,
+    inventory_dir: Optional[str] = None,
+    max_workers: int = 16,
+    settle_days: int = 1,
+    refresh: bool = False,
 ) -> Dict[Tuple[str, str], Dict]:
     """
     Analyze GCS bucket and aggregate coverage by feed.
 
+    The bucket is listed as one shard per feed_type/dt=DATE/ prefix, concurrently.
+    Shard results are kept in state_file; on later runs, shards whose date had
+    settled when they were listed are taken from there instead of being listed
+    again.
+
     Args:
         bucket_name: GCS bucket name (with or without gs:// prefix)
         bucket_type: 'raw' or 'parsed'
         environment: 'test' or 'prod'
-        limit: Optional limit on number of files to process (for testing)
+        limit: Optional limit on number of files to list per shard (for testing);
+            the state file is neither read nor written when set
+        state_file: Optional JSON file of per-shard results
+        inventory_dir: Optional directory for a Parquet file of every listed file,
+            per shard
+        max_workers: Number of shards listed at once
+        settle_days: Days after its date before a shard is no longer re-listed
+        refresh: List every shard again, ignoring the state file
 
     Returns:
         Dict keyed by (feed_type, base64_encoded_url) with coverage stats
@@ -101,108 +441,257 @@ def analyze_bucket(
     print(f"Analyzing {bucket_type} bucket: gs://{bucket_name}", file=sys.stderr)
     print(f"Environment: {environment}", file=sys.stderr)
 
-    client = storage.Client()
-    bucket = client.bucket(bucket_name)
-
-    # Aggregate data by (feed_type, base64_encoded_url)
-    coverage: Dict[Tuple[str, str], Dict] = defaultdict(
-        lambda: {
-            "dates": set(),
-            "hours": set(),
-            "timestamps": set(),
-            "file_count": 0,
-            "total_size": 0,
-        }
+    state = {} if limit or refresh else load_state(state_file)
+
+    print("Listing feed_type/dt= prefixes...", file=sys.stderr)
+    shards = list_shards(bucket_name, max_workers)
+
+    # e.g. a raw day whose files have since been packed into bundles
+    for shard in set(state) - set(shards):
+        del state[shard]
+        if inventory_dir and os.path.exists(inventory_path(inventory_dir, shard)):
+            os.remove(inventory_path(inventory_dir, shard))
+
+    def has_inventory(shard: str) -> bool:
+        return not inventory_dir or os.path.exists(inventory_path(inventory_dir, shard))
+
+    to_list = [
+        shard
+        for shard in shards
+        if shard not in state or not is_settled(shard, state[shard], settle_days)
+        # bundles are checked every time, since listing them is cheap
+        or (bucket_type == "raw" and is_bundle_shard(shard))
+        # the inventory is written per shard, so only missing ones need listing
+        or not has_inventory(shard)
+    ]
+    print(
+        f"Found {len(shards)} prefixes, {len(shards) - len(to_list)} settled "
+        f"in the state file, listing {len(to_list)}",
+        file=sys.stderr,
     )
 
     files_processed = 0
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {
+            pool.submit(
+                list_shard,
+                bucket_name,
+                shard,
+                bucket_type,
+                limit=limit,
+                with_files=bool(inventory_dir),
+                previous=state.get(shard) if has_inventory(shard) else None,
+            ): shard
+            for shard in to_list
+        }
+        for i, future in enumerate(as_completed(futures), start=1):
+            shard = futures[future]
+            result = future.result()
+            if inventory_dir and result["files"] is not None:
+                write_inventory(inventory_dir, shard, bucket_type, result.pop("files"))
+            else:
+                del result["files"]
+            state[shard] = result
+            files_processed += result["file_count"]
+            if i % 100 == 0 or i == len(futures):
+                print(
+                    f"Listed {i}/{len(futures)} prefixes, {files_processed} files...",
+                    file=sys.stderr,
+                )
+                if state_file and not limit:
+                    save_state(state_file, bucket_name, state)
 
-    # Iterate through bucket with pagination
-    print("Fetching file list...", file=sys.stderr)
-    blobs_iterator = bucket.list_blobs(timeout=600)
-
-    for page in blobs_iterator.pages:
-        for blob in page:
-            # Parse path based on bucket type
-            if bucket_type == "raw":
-                parsed = parse_raw_bucket_path(blob.name)
-                if parsed:
-                    feed_type, date, hour, timestamp, base64_url = parsed
-                else:
-                    continue
-            else:  # parsed
-                parsed = parse_parsed_bucket_path(blob.name)
-                if parsed:
-                    feed_type, date, hour, base64_url = parsed
-                    # For parsed buckets, use hour as timestamp
-                    timestamp = hour
-                else:
-                    continue
-
-            # Aggregate stats
-            key = (feed_type, base64_url)
-            stats = coverage[key]
-
-            stats["dates"].add(date)
-            stats["hours"].add(hour)
-            stats["timestamps"].add(timestamp)
-            stats["file_count"] += 1
-            stats["total_size"] += blob.size or 0
-
-            files_processed += 1
-
-            if files_processed % 1000 == 0:
-                print(f"Processed {files_processed} files...", file=sys.stderr)
-
-            if limit and files_processed >= limit:
-                print(f"Reached limit of {limit} files", file=sys.stderr)
-                break
-
-        if limit and files_processed >= limit:
-            break
-
-    print(f"Completed processing {files_processed} files", file=sys.stderr)
+    # Aggregate data by (feed_type, base64_encoded_url)
+    coverage: Dict[Tuple[str, str], Dict] = defaultdict(new_stats)
+    for shard in shards:
+        feed_type = shard_feed_type(shard)
+        for base64_url, stats in state.get(shard, {}).get("coverage", {}).items():
+            merge_stats(coverage[(feed_type, base64_url)], stats)
+
+    print(f"Completed listing {files_processed} files", file=sys.stderr)
     print(f"Found {len(coverage)} unique feed combinations", file=sys.stderr)
 
     return coverage
 
 
-def detect_gaps(hours: Set[str]) -> Tuple[bool, int]:
+def inventory_path(inventory_dir: str, shard: str) -> str:
+    """One Parquet file per shard, e.g. <dir>/feed_type/dt=DATE.parquet."""
+    return os.path.join(inventory_dir, f"{shard.rstrip('/')}.parquet")
+
+
+INVENTORY_COLUMNS = {
+    "raw": [
+        "feed_type",
+        "timestamp",
+        "feed_url",
+        "file_size_bytes",
+        "created_time",
+    ],
+    "parsed": [
+        "table_name",
+        "date",
+        "hour",
+        "feed_url",
+        "file_path",
+        "file_size_bytes",
+        "created_time",
+        "file_type",
+    ],
+}
+
+
+def file_type(name: str) -> str:
+    if name.endswith(".jsonl.gz"):
+        return "data"
+    if name.endswith(".jsonl"):
+        return "outcomes"
+    return "other"
+
+
+def write_inventory(
+    inventory_dir: str, shard: str, bucket_type: str, files: List[Dict]
+):
     """
-    Detect gaps in hourly coverage.
+    Write a shard's files as Parquet, with the columns of the raw or parsed
+    *_files_metadata external tables in metadata/METADATA-TABLES.md.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    def ts(value: Optional[str]) -> Optional[datetime]:
+        return datetime.fromisoformat(value.replace("Z", "+00:00")) if value else None
+
+    # decode each unique URL only once
+    urls = {
+        base64_url: decode_base64url(base64_url)
+        for base64_url in {file["base64_url"] for file in files}
+    }
+    timestamp_type = pa.timestamp("us", tz="UTC")
+    columns = {
+        "feed_type": pa.array([f["feed_type"] for f in files], pa.string()),
+        "table_name": pa.array([f["feed_type"] for f in files], pa.string()),
+        "date": pa.array([date.fromisoformat(f["date"]) for f in files], pa.date32()),
+        "hour": pa.array([ts(f["hour"]) for f in files], timestamp_type),
+        "timestamp": pa.array([ts(f["timestamp"]) for f in files], timestamp_type),
+        "feed_url": pa.array([urls[f["base64_url"]] for f in files], pa.string()),
+        "file_path": pa.array(
+            [f"gs://{f['bucket']}/{f['name']}" for f in files], pa.string()
+        ),
+        "file_size_bytes": pa.array([f["size"] for f in files], pa.int64()),
+        "created_time": pa.array([ts(f["created"]) for f in files], timestamp_type),
+        "file_type": pa.array([file_type(f["name"]) for f in files], pa.string()),
+    }
+    path = inventory_path(inventory_dir, shard)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    pq.write_table(
+        pa.table({name: columns[name] for name in INVENTORY_COLUMNS[bucket_type]}),
+        path,
+    )
 
-    Args:
-        hours: Set of hour strings (ISO 8601 format)
 
-    Returns:
-        (has_gaps, gap_count) tuple
+# an interval between files of more than this many times the cadence is a gap
+GAP_TOLERANCE = 1.5
+
+
+def infer_cadence(minutes: np.ndarray) -> int:
+    """
+    The expected minutes between files, as the median interval between covered
+    minutes; e.g. 1 for realtime feeds, 60 for hourly parsed files.
     """
-    if not hours:
-        return (False, 0)
+    if len(minutes) < 2:
+        return 1
+    return max(1, int(np.median(np.diff(minutes))))
 
-    # Parse hours to datetime objects
-    try:
-        hour_dts = sorted(
-            [datetime.fromisoformat(h.replace("Z", "+00:00")) for h in hours]
-        )
-    except Exception:
-        return (False, 0)
 
-    if len(hour_dts) < 2:
-        return (False, 0)
+def find_gaps(minutes: np.ndarray, cadence: int) -> List[Tuple[int, int]]:
+    """
+    Find the [start, end) minute ranges in which files were expected at the
+    cadence but are missing.
+    """
+    intervals = np.diff(minutes)
+    return [
+        (int(minutes[i]) + cadence, int(minutes[i + 1]))
+        for i in np.flatnonzero(intervals > cadence * GAP_TOLERANCE)
+    ]
 
-    # Count expected hours between first and last
-    first_hour = hour_dts[0]
-    last_hour = hour_dts[-1]
 
-    hours_diff = int((last_hour - first_hour).total_seconds() / 3600)
-    expected_hours = hours_diff + 1
-    actual_hours = len(hour_dts)
+def daily_completeness(
+    minutes: np.ndarray, cadence: int
+) -> List[Tuple[date, float, int]]:
+    """
+    For every day from the first to the last covered minute, the number of files
+    expected at the cadence and the number of cadence slots actually covered.
 
-    gap_count = expected_hours - actual_hours
-    has_gaps = gap_count > 0
+    The first and last days only expect files from the first and up to the last
+    covered minute.
+    """
+    if not len(minutes):
+        return []
+    first, last = int(minutes[0]), int(minutes[-1])
+    slot_starts = np.unique(minutes // cadence) * cadence
+    covered_days, covered = np.unique(
+        slot_starts // MINUTES_PER_DAY, return_counts=True
+    )
+    covered_by_day = dict(zip(covered_days.tolist(), covered.tolist()))
+
+    days = []
+    for day in range(first // MINUTES_PER_DAY, last // MINUTES_PER_DAY + 1):
+        start = max(day * MINUTES_PER_DAY, first)
+        end = min((day + 1) * MINUTES_PER_DAY, last + cadence)
+        days.append(
+            (
+                (UNIX_EPOCH + timedelta(days=day)).date(),
+                max((end - start) / cadence, 1),
+                covered_by_day.get(day, 0),
+            )
+        )
+    return days
+
+
+def summarize_coverage(minutes: np.ndarray, cadence: int) -> Dict:
+    """Coverage stats of one feed, from its covered minutes."""
+    hours = np.unique(minutes // 60)
+    slots = np.unique(minutes // cadence)
+    gaps = find_gaps(minutes, cadence)
+    longest = max(gaps, key=lambda gap: gap[1] - gap[0]) if gaps else None
+    return {
+        "days_covered": len(np.unique(minutes // MINUTES_PER_DAY)),
+        "hours_covered": len(hours),
+        "has_gaps": bool(gaps),
+        # missing hours between the first and last, as before gap ranges existed
+        "gap_count": int(hours[-1] - hours[0] + 1 - len(hours)) if len(hours) else 0,
+        "cadence_minutes": cadence,
+        "gap_ranges": len(gaps),
+        "missing_minutes": sum(end - start for start, end in gaps),
+        "longest_gap_minutes": longest[1] - longest[0] if longest else 0,
+        "longest_gap_start": minute_timestamp(longest[0]) if longest else "",
+        "longest_gap_end": minute_timestamp(longest[1]) if longest else "",
+        "completeness_pct": (
+            round(len(slots) / int(slots[-1] - slots[0] + 1) * 100, 2)
+            if len(slots)
+            else 0.0
+        ),
+        "gaps": gaps,
+    }
+
+
+def write_csv(rows: List[Dict], output_file: str, what: str):
+    if not rows:
+        print(f"No {what} to write", file=sys.stderr)
+        return
+
+    fieldnames = rows[0].keys()
+    if output_file == "-":
+        writer = csv.DictWriter(sys.stdout, fieldnames=fieldnames)
+        writer.writeheader()
+        writer.writerows(rows)
+    else:
+        with open(output_file, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=fieldnames)
+            writer.writeheader()
+            writer.writerows(rows)
 
-    return (has_gaps, gap_count)
+        print(f"✓ Wrote {len(rows)} {what} rows to {output_file}", file=sys.stderr)
 
 
 def write_coverage_csv(
@@ -211,64 +700,82 @@ def write_coverage_csv(
     bucket_name: str,
     environment: str,
     bucket_type: str,
+    gaps_file: Optional[str] = None,
+    daily_file: Optional[str] = None,
+    cadence: Optional[int] = None,
 ):
-    """Write coverage analysis to CSV file."""
+    """
+    Write coverage analysis to CSV file, and optionally every gap range and the
+    daily completeness of every feed to their own CSV files.
+
+    Args:
+        cadence: Expected minutes between files (default: inferred per feed)
+    """
     print(f"\nWriting results to {output_file}", file=sys.stderr)
 
-    # Prepare rows with decoded URLs (decode each unique URL only once)
     rows = []
+    gap_rows = []
+    daily_rows = []
 
     for (feed_type, base64_url), stats in coverage.items():
         # Decode the base64 URL once per unique combination
         feed_url = decode_base64url(base64_url)
-
-        # Sort timestamps and dates
-        sorted_dates = sorted(stats["dates"])
-        sorted_timestamps = sorted(stats["timestamps"])
-
-        # Detect gaps
-        has_gaps, gap_count = detect_gaps(stats["hours"])
-
-        row = {
+        minutes = stats["minutes"].minutes()
+        feed_cadence = cadence or infer_cadence(minutes)
+        summary = summarize_coverage(minutes, feed_cadence)
+        feed = {
             "environment": environment,
             "bucket": bucket_name,
             "bucket_type": bucket_type,
             "feed_type": feed_type,
             "feed_url": feed_url,
-            "first_date": sorted_dates[0] if sorted_dates else "",
-            "last_date": sorted_dates[-1] if sorted_dates else "",
-            "first_timestamp": sorted_timestamps[0] if sorted_timestamps else "",
-            "last_timestamp": sorted_timestamps[-1] if sorted_timestamps else "",
-            "total_files": stats["file_count"],
-            "total_size_bytes": stats["total_size"],
-            "total_size_gb": round(stats["total_size"] / (1024**3), 4),
-            "days_covered": len(stats["dates"]),
-            "hours_covered": len(stats["hours"]),
-            "has_gaps": has_gaps,
-            "gap_count": gap_count,
         }
-        rows.append(row)
+
+        first_timestamp = stats["first_timestamp"] or ""
+        last_timestamp = stats["last_timestamp"] or ""
+        rows.append(
+            {
+                **feed,
+                "first_date": first_timestamp[:10],
+                "last_date": last_timestamp[:10],
+                "first_timestamp": first_timestamp,
+                "last_timestamp": last_timestamp,
+                "total_files": stats["file_count"],
+                "total_size_bytes": stats["total_size"],
+                "total_size_gb": round(stats["total_size"] / (1024**3), 4),
+                **{k: v for k, v in summary.items() if k != "gaps"},
+            }
+        )
+        gap_rows.extend(
+            {
+                **feed,
+                "gap_start": minute_timestamp(start),
+                "gap_end": minute_timestamp(end),
+                "gap_minutes": end - start,
+                "missing_files": (end - start) // feed_cadence,
+            }
+            for start, end in summary["gaps"]
+        )
+        daily_rows.extend(
+            {
+                **feed,
+                "date": day.isoformat(),
+                "expected_files": round(expected, 2),
+                "covered_slots": covered,
+                "completeness_pct": round(min(covered / expected, 1) * 100, 2),
+            }
+            for day, expected, covered in daily_completeness(minutes, feed_cadence)
+        )
 
     # Sort by feed_type, then by file count
     rows.sort(key=lambda x: (x["feed_type"], -x["total_files"]))
-
-    # Write CSV
-    if rows:
-        fieldnames = rows[0].keys()
-
-        if output_file == "-":
-            writer = csv.DictWriter(sys.stdout, fieldnames=fieldnames)
-            writer.writeheader()
-            writer.writerows(rows)
-        else:
-            with open(output_file, "w", newline="") as f:
-                writer = csv.DictWriter(f, fieldnames=fieldnames)
-                writer.writeheader()
-                writer.writerows(rows)
-
-            print(f"✓ Wrote {len(rows)} rows to {output_file}", file=sys.stderr)
-    else:
-        print("No data to write", file=sys.stderr)
+    write_csv(rows, output_file, "coverage")
+    if gaps_file:
+        gap_rows.sort(key=lambda x: (x["feed_type"], x["feed_url"], x["gap_start"]))
+        write_csv(gap_rows, gaps_file, "gap")
+    if daily_file:
+        daily_rows.sort(key=lambda x: (x["feed_type"], x["feed_url"], x["date"]))
+        write_csv(daily_rows, daily_file, "daily completeness")
 
 
 def infer_environment(bucket_name: str) -> str:
@@ -308,6 +815,13 @@ Examples:
   python analyze-bucket-coverage.py test-jarvus-transit-data-demo-raw \\
     --limit 1000
 
+  # Also write every file to .scratch/raw-files/<feed_type>/dt=<date>.parquet
+  python analyze-bucket-coverage.py jarvus-transit-data-demo-raw \\
+    --inventory .scratch/raw-files
+
+  # Ignore the state file and list everything again
+  python analyze-bucket-coverage.py jarvus-transit-data-demo-raw --refresh
+
   # Specify bucket type explicitly
   python analyze-bucket-coverage.py my-bucket \\
     --bucket-type parsed \\
@@ -341,7 +855,53 @@ Examples:
         "--limit",
         type=int,
         default=None,
-        help="Limit number of files to process (for testing)",
+        help="Limit number of files listed per prefix (for testing; skips the state file)",
+    )
+    parser.add_argument(
+        "-s",
+        "--state",
+        default=None,
+        help="State file of per-prefix results (default: <output>.state.json)",
+    )
+    parser.add_argument(
+        "--refresh",
+        action="store_true",
+        help="List every prefix again, ignoring the state file",
+    )
+    parser.add_argument(
+        "-i",
+        "--inventory",
+        default=None,
+        help="Directory to write a per-file Parquet inventory to, one file per prefix",
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=16,
+        help="Number of prefixes listed concurrently (default: 16)",
+    )
+    parser.add_argument(
+        "--settle-days",
+        type=int,
+        default=1,
+        help="Days after a date before its prefix is no longer re-listed (default: 1)",
+    )
+    parser.add_argument(
+        "--cadence",
+        type=int,
+        default=None,
+        help="Expected minutes between files (default: inferred per feed)",
+    )
+    parser.add_argument(
+        "--gaps",
+        default=None,
+        help="Output CSV file of every gap range (default: <output>-gaps.csv)",
+    )
+    parser.add_argument(
+        "--daily",
+        default=None,
+        help="Output CSV file of daily completeness (default: <output>-daily.csv)",
     )
 
     args = parser.parse_args()
@@ -359,13 +919,38 @@ Examples:
     else:
         output_file = f"{bucket_name}-coverage.csv"
 
+    state_file = args.state or (
+        f"{bucket_name}-coverage.state.json"
+        if output_file == "-"
+        else f"{os.path.splitext(output_file)[0]}.state.json"
+    )
     # Analyze bucket
     coverage = analyze_bucket(
-        bucket_name, bucket_type=bucket_type, environment=environment, limit=args.limit
+        bucket_name,
+        bucket_type=bucket_type,
+        environment=environment,
+        limit=args.limit,
+        state_file=state_file,
+        inventory_dir=args.inventory,
+        max_workers=args.workers,
+        settle_days=args.settle_days,
+        refresh=args.refresh,
     )
 
     # Write results
-    write_coverage_csv(coverage, output_file, bucket_name, environment, bucket_type)
+    output_stem = os.path.splitext(output_file)[0]
+    write_coverage_csv(
+        coverage,
+        output_file,
+        bucket_name,
+        environment,
+        bucket_type,
+        gaps_file=args.gaps
+        or (None if output_file == "-" else f"{output_stem}-gaps.csv"),
+        daily_file=args.daily
+        or (None if output_file == "-" else f"{output_stem}-daily.csv"),
+        cadence=args.cadence,
+    )
 
 
 if __name__ == "__main__":
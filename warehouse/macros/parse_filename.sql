@@ -1,3 +1,6 @@
+-- the base64url of a parsed file, from the last segment of its path, so that hourly
+-- (<b64>.jsonl.gz), compacted (<b64>.day.jsonl.gz) and micro-batch files, a level deeper
+-- under batch=, all work
 {% macro extract_b64_url_from_filename(colname) %}
-    LEFT(SPLIT({{ colname }}, '/')[6],LENGTH(SPLIT({{ colname }}, '/')[6]) - 9)
+    SPLIT(ARRAY_REVERSE(SPLIT({{ colname }}, '/'))[0], '.')[0]
 {% endmacro %}
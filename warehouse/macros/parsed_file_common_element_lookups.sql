@@ -83,3 +83,65 @@
     license_plate,
     vehicle_wheelchair_accessible
 {% endmacro %}
+
+-------------- COMPACTION --------------
+
+-- the rows of a parsed RT table and their _file_name; rows of a day compacted into a single
+-- <b64>.day.jsonl.gz file get back their own hour from metadata, and an hourly file of the
+-- same url and hour (e.g. an hour parsed again after compaction) takes precedence over them
+--
+-- with microbatches and checkpoints, the rows of hours incremental parsing has yet to compact
+-- are read from the micro-batches their checkpoint lists (others are left by failed runs),
+-- for the urls and hours without a file of their own
+{% macro select_parsed_rows(relation, microbatches=none, checkpoints=none) %}
+
+    SELECT * EXCEPT (_is_compacted)
+    FROM (
+        SELECT
+            * REPLACE (
+                IF(
+                    ENDS_WITH(_FILE_NAME, '.day.jsonl.gz'),
+                    TIMESTAMP(JSON_VALUE(metadata, '$.hour')),
+                    hour
+                ) AS hour
+            ),
+            _FILE_NAME AS _file_name,
+            ENDS_WITH(_FILE_NAME, '.day.jsonl.gz') AS _is_compacted
+        FROM {{ relation }}
+    )
+    QUALIFY NOT _is_compacted
+        OR COUNTIF(NOT _is_compacted) OVER (
+            PARTITION BY dt, hour, {{ extract_b64_url_from_filename('_file_name') }}
+        ) = 0
+
+    {% if microbatches %}
+    UNION ALL
+
+    SELECT * EXCEPT (batch, _b64_url)
+    FROM (
+        SELECT
+            *,
+            _FILE_NAME AS _file_name,
+            {{ extract_b64_url_from_filename('_FILE_NAME') }} AS _b64_url
+        FROM {{ microbatches }}
+    ) AS microbatch
+    WHERE EXISTS (
+        SELECT 1
+        FROM {{ checkpoints }} AS checkpoint,
+            UNNEST(JSON_QUERY_ARRAY(checkpoint.microbatches)) AS listed
+        WHERE NOT checkpoint.compacted
+            AND checkpoint.dt = microbatch.dt
+            AND checkpoint.hour = microbatch.hour
+            AND TIMESTAMP(JSON_VALUE(listed, '$.batch')) = microbatch.batch
+            AND JSON_VALUE(listed, '$.base64url') = microbatch._b64_url
+    )
+    AND NOT EXISTS (
+        SELECT 1
+        FROM {{ relation }} AS parsed
+        WHERE parsed.dt = microbatch.dt
+            AND parsed.hour = microbatch.hour
+            AND {{ extract_b64_url_from_filename('parsed._FILE_NAME') }} = microbatch._b64_url
+    )
+    {% endif %}
+
+{% endmacro %}
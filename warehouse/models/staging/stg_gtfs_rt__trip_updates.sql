@@ -1,8 +1,9 @@
 WITH src AS (
-    SELECT
-        *,
-        _file_name
-    FROM {{ source('transit_data', 'gtfs_rt__trip_updates') }}
+    {{ select_parsed_rows(
+        source('transit_data', 'gtfs_rt__trip_updates'),
+        source('transit_data', 'gtfs_rt__trip_updates__microbatches'),
+        source('transit_data', 'gtfs_rt__trip_updates__parse_checkpoints'),
+    ) }}
 ),
 
 unpack_json AS (
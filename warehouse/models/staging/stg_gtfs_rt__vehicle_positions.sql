@@ -1,8 +1,9 @@
 WITH src AS (
-    SELECT
-        *,
-        _file_name
-    FROM {{ source('transit_data', 'gtfs_rt__vehicle_positions') }}
+    {{ select_parsed_rows(
+        source('transit_data', 'gtfs_rt__vehicle_positions'),
+        source('transit_data', 'gtfs_rt__vehicle_positions__microbatches'),
+        source('transit_data', 'gtfs_rt__vehicle_positions__parse_checkpoints'),
+    ) }}
 ),
 
 unpack_json AS (
@@ -0,0 +1,22 @@
+-- the base64url of each shape of parsed file path that the RT staging models read: hourly
+-- files, days merged by compaction into <b64>.day.jsonl.gz, and micro-batches a level deeper
+WITH paths AS (
+    SELECT
+        'gs://bucket/gtfs_rt__vehicle_positions/dt=2023-07-05/hour=2023-07-05T01:00:00Z/aHR0cHM6Ly9leGFtcGxlLmNvbS92cC5wYg==.jsonl.gz' AS file_name, --noqa: LT05
+        'aHR0cHM6Ly9leGFtcGxlLmNvbS92cC5wYg==' AS expected
+    UNION ALL
+    SELECT
+        'gs://bucket/gtfs_rt__vehicle_positions/dt=2023-07-05/hour=2023-07-05T00:00:00Z/aHR0cHM6Ly9leGFtcGxlLmNvbS92cC5wYg==.day.jsonl.gz', --noqa: LT05
+        'aHR0cHM6Ly9leGFtcGxlLmNvbS92cC5wYg=='
+    UNION ALL
+    SELECT
+        'gs://bucket/gtfs_rt__vehicle_positions__microbatches/dt=2023-07-05/hour=2023-07-05T01:00:00Z/batch=2023-07-05T01:05:00Z/aHR0cHM6Ly9leGFtcGxlLmNvbS92cC5wYg==.jsonl.gz', --noqa: LT05
+        'aHR0cHM6Ly9leGFtcGxlLmNvbS92cC5wYg=='
+)
+
+SELECT
+    file_name,
+    expected,
+    {{ extract_b64_url_from_filename('file_name') }} AS actual
+FROM paths
+WHERE {{ extract_b64_url_from_filename('file_name') }} != expected